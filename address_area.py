@@ -0,0 +1,140 @@
+"""Postal code, city and district of an order address, stored in indexed order columns.
+
+Until every order has coordinates, the planner groups candidates by area:
+orders.postal_code / city / district are extracted from the address text and
+kept next to it, so "group by district, then postal code" is an index-ordered
+SQL query (idx_orders_area) instead of eyeballing addresses. Estonian postal
+codes are assigned geographically, so the postal code order inside a district
+is a usable rough driving order.
+
+    parse("Pärnu mnt 10-5\\n10141 Tallinn")                       # ('10141', 'Tallinn', 'Tallinn')
+    parse("Harju maakond, Tallinn, Lasnamäe linnaosa, Punane 5")  # ('', 'Tallinn', 'Lasnamäe')
+    parse("Tamme tee 5, Peetri alevik, Rae vald, 75312")          # ('75312', 'Peetri alevik', 'Rae vald')
+    parse("Punane 5 Tallinn 13619, Eesti")                        # ('13619', 'Tallinn', 'Tallinn')
+
+district is the Tallinn linnaosa when the address names one, else the vald
+(rural municipality), else the city. NULL columns mean "not extracted yet":
+ensure_schema() extracts every order the first time, backfill() the ones
+still missing (or all of them with only_missing=False):
+
+    python address_area.py backfill [--all]
+
+repository.update_order re-extracts when an address changes. Derived
+columns only: no version bump, no change-log entry. Plain module (no
+Streamlit import).
+"""
+import argparse
+import os
+import re
+
+COLUMNS = ("postal_code", "city", "district")
+BATCH = 500
+
+TALLINN_DISTRICTS = {
+    "haabersti": "Haabersti", "kesklinn": "Kesklinn", "kesklinna": "Kesklinn", "kristiine": "Kristiine",
+    "lasnamäe": "Lasnamäe", "mustamäe": "Mustamäe", "nõmme": "Nõmme", "pirita": "Pirita",
+    "põhja-tallinn": "Põhja-Tallinn", "põhja-tallinna": "Põhja-Tallinn",
+}
+_POSTAL_RE = re.compile(r"(?<!\d)(\d{5})(?!\d)")
+# "Tallinna linn" (genitive) -> "Tallinn"; other towns are written "Tartu linn"
+_CITY_NAMES = {"tallinna": "Tallinn"}
+# Skipped like the maakond: a trailing country is not the city
+_COUNTRIES = {"eesti", "estonia", "estland", "eesti vabariik"}
+
+
+def ensure_schema(cur):
+    """Add the area columns + index; extract them for every order the first time (called from repository.init_schema)."""
+    cur.execute("PRAGMA table_info(orders)")
+    have = {r[1] for r in cur.fetchall()}
+    new = [c for c in COLUMNS if c not in have]
+    for c in new:
+        cur.execute(f"ALTER TABLE orders ADD COLUMN {c} TEXT")
+    # Planner quick-add: WHERE status=? ORDER BY district, postal_code
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_area ON orders(status, district, postal_code)")
+    if new:
+        backfill(cur)
+
+
+def _tidy(text: str) -> str:
+    text = " ".join((text or "").split()).strip(" ,.;")
+    return text.title() if text.isupper() else text
+
+
+def parse(address: str) -> tuple:
+    """(postal_code, city, district) of a free-text address; '' where not found."""
+    parts = [p.strip() for p in re.split(r"[\n,]", address or "") if p.strip()]
+    postal, city, linnaosa, vald = "", "", "", ""
+    for part in parts:
+        low = part.lower()
+        m = _POSTAL_RE.search(part)
+        if m and not postal:
+            postal = m.group(1)
+            part = _tidy(_POSTAL_RE.sub(" ", part))
+            low = part.lower()
+            if not part:
+                continue
+        if any(ch.isdigit() for ch in part):
+            # Street + house number; on one line the place may follow it ("Punane 5 Tallinn")
+            words = part.split()
+            last = max(i for i, w in enumerate(words) if any(ch.isdigit() for ch in w))
+            part = " ".join(words[last + 1:])
+            low = part.lower()
+            if len(part) < 3 or not part.replace("-", "").replace(" ", "").isalpha():
+                continue
+        if low.endswith(" maakond") or low in _COUNTRIES:
+            continue
+        if low.endswith(" linnaosa"):
+            stem = low[:-len(" linnaosa")].strip()
+            linnaosa = TALLINN_DISTRICTS.get(stem, _tidy(part))
+        elif low in TALLINN_DISTRICTS:
+            linnaosa = TALLINN_DISTRICTS[low]
+        elif low.endswith(" vald"):
+            vald = _tidy(part)
+        else:
+            # Last plain part wins: streets without a number come first ("Tamme tee, Tallinn")
+            city = _tidy(part[:-len(" linn")] if low.endswith(" linn") else part)
+            city = _CITY_NAMES.get(city.lower(), city)
+    if not city and linnaosa:
+        city = "Tallinn"
+    return postal, city, linnaosa or vald or city
+
+
+def order_address(row) -> str:
+    """The address the order is delivered to: the edited address, else the PDF ship-to."""
+    return (row.get("address") or "").strip() or (row.get("ship_address") or "").strip()
+
+
+def backfill(cur, only_missing: bool = True, batch: int = BATCH) -> int:
+    """Extract the columns for orders (caller owns the transaction); returns how many were written."""
+    where = "WHERE district IS NULL" if only_missing else ""
+    cur.execute(f"SELECT id, address, ship_address FROM orders {where}")
+    rows = cur.fetchall()
+    for i in range(0, len(rows), batch):
+        cur.executemany(
+            "UPDATE orders SET postal_code=?, city=?, district=? WHERE id=?",
+            [(*parse(order_address({"address": r[1], "ship_address": r[2]})), int(r[0])) for r in rows[i:i + batch]],
+        )
+    return len(rows)
+
+
+def main():
+    import repository
+
+    ap = argparse.ArgumentParser(description="Postal code / city / district extraction for orders.")
+    ap.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "Logistic", "data", "db.sqlite"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("backfill", help="extract the columns for orders that have none")
+    p.add_argument("--all", action="store_true", help="re-extract every order")
+    p = sub.add_parser("parse", help="show what one address gives")
+    p.add_argument("address")
+    args = ap.parse_args()
+
+    if args.cmd == "parse":
+        print(dict(zip(COLUMNS, parse(args.address))))
+        return
+    repo = repository.open_sqlite(args.db)
+    print(f"extracted {repo.backfill_order_areas(only_missing=not args.all)} orders")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,9 @@ STATUS_MAP = {
     "READY FOR WORK": "READY FOR WORK",
 }
 
-import os, re, json, time, zipfile, sqlite3, hashlib, hmac
+import os, re, json, time, zipfile, sqlite3
 import html
+import io
 from datetime import datetime, date, timedelta, time as dtime
 from urllib.parse import quote
 
@@ -18,6 +19,24 @@ import streamlit as st
 import streamlit.components.v1 as components
 from pypdf import PdfReader
 
+import address_area
+import archive
+import auth
+import auto_assign
+import backup
+import geocode
+import live
+import nav_plan
+import nearby
+import readcache
+import repository
+import ring_clusters
+import ring_eta
+import ring_optimizer
+import route_draft
+import settings_store
+import travel_matrix
+
 
 def _extract_customer_phone_from_bottom(lines):
     """Return the customer phone from the very bottom of the PDF.
@@ -280,8 +299,11 @@ div[data-testid="stExpander"] summary:hover { color: inherit !important; }
 APP_DIR = os.path.abspath(os.path.dirname(__file__))
 DATA_DIR = os.path.join(APP_DIR, "Logistic")
 DB_PATH = os.path.join(DATA_DIR, "data", "db.sqlite")
+ARCHIVE_PATH = os.path.join(DATA_DIR, "data", "archive.sqlite")
 ORDERS_DIR = os.path.join(DATA_DIR, "orders")
+BACKUP_DIR = os.path.join(DATA_DIR, "backups")
 EXPORTS_DIR = os.path.join(DATA_DIR, "exports")
+SESSION_KEY_PATH = os.path.join(DATA_DIR, "data", "session.key")
 
 
 def ensure_dirs():
@@ -312,17 +334,21 @@ def db():
                 pass
             st.session_state.pop("_db_conn", None)
 
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=1.0, isolation_level=None)
-    conn.row_factory = sqlite3.Row
-    try:
-        conn.execute("PRAGMA foreign_keys=OFF;")
-        conn.execute("PRAGMA busy_timeout=1200;")
-    except Exception:
-        pass
+    conn = repository.connect(DB_PATH, timeout=1.0)
     st.session_state._db_conn = conn
     return conn
 
 
+def repo() -> repository.SqliteRepository:
+    """Data access for this session (SQLite over db(); see repository.py)."""
+    return repository.SqliteRepository(db, DB_PATH, on_write=_live_own_write)
+
+
+def _live_own_write(r, own):
+    """After our own write: live views already show it, skip its changes in their polls."""
+    live.note_own(st.session_state.setdefault("_live_own", []), own)
+
+
 
 # -------------------------
 # UI styles
@@ -470,264 +496,93 @@ def render_header():
     )
 
 
-def _pbkdf2_hash_password(password: str, iterations: int = 200_000) -> str:
-    password = (password or "").encode("utf-8")
-    salt = os.urandom(16)
-    dk = hashlib.pbkdf2_hmac("sha256", password, salt, iterations)
-    return f"pbkdf2_sha256${iterations}${salt.hex()}${dk.hex()}"
-
-
-def _pbkdf2_verify_password(password: str, stored: str) -> bool:
-    try:
-        algo, iters, salt_hex, hash_hex = stored.split("$", 3)
-        if algo != "pbkdf2_sha256":
-            return False
-        iterations = int(iters)
-        salt = bytes.fromhex(salt_hex)
-        expected = bytes.fromhex(hash_hex)
-        dk = hashlib.pbkdf2_hmac("sha256", (password or "").encode("utf-8"), salt, iterations)
-        return hmac.compare_digest(dk, expected)
-    except Exception:
-        return False
-
-
-def _new_token() -> str:
-    return os.urandom(24).hex()
-
-
 # -------------------------
 # DB schema
 # -------------------------
 def init_db():
-    """Initialize / migrate DB schema.
-
-    Team-based schema has been removed. Route items are assigned directly to workers via
-    route_item_users (many-to-many). The route_items table no longer stores team_id.
-
-    Migration:
-      - If old route_items contains team_id, we rename it to route_items_legacy and recreate
-        a new route_items table without team_id, preserving ids so route_item_users stays valid.
-    """
+    """Initialize / migrate the DB schema (see repository.init_schema) and wire the read cache."""
     conn = db()
+    repo().init_schema()
+    readcache.CACHE.bind(DB_PATH)
+    live.WATCHER.bind(DB_PATH)
+    _attach_archive(conn)
 
-    # One-time DB-level pragmas (don't run these on every connection)
-    try:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-    except Exception:
-        pass
-    cur = conn.cursor()
-
-    # --- USERS (keep legacy team_id column if it exists in an old DB; new installs don't need it) ---
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        phone TEXT DEFAULT '',
-        is_active INTEGER NOT NULL DEFAULT 1,
-        created_at TEXT NOT NULL,
-        password_hash TEXT DEFAULT '',
-        auth_token TEXT DEFAULT ''
-    )""")
-
-    # --- ORDERS ---
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        original_filename TEXT NOT NULL,
-        stored_path TEXT NOT NULL,
-        created_at TEXT NOT NULL,
-        status TEXT NOT NULL DEFAULT 'NEW',
-
-        client_name TEXT DEFAULT '',
-        phone TEXT DEFAULT '',
-        address TEXT DEFAULT '',
-        delivery_date TEXT DEFAULT '',
-        delivery_window TEXT DEFAULT '',
-        notes TEXT DEFAULT '',
-
-        order_ref TEXT DEFAULT '',
-        recipient_name TEXT DEFAULT '',
-        ship_address TEXT DEFAULT '',
-        service_tag TEXT DEFAULT '',
-        doc_author TEXT DEFAULT '',
-        doc_email TEXT DEFAULT '',
-        doc_phone TEXT DEFAULT '',
-        items_compact TEXT DEFAULT ''
-    )""")
-
-    # --- ROUTES ---
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS routes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        route_date TEXT NOT NULL
-    )""")
-
-    # --- ROUTE ITEMS (new schema, no team_id) ---
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS route_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        route_id INTEGER NOT NULL,
-        order_id INTEGER NOT NULL,
-        seq INTEGER NOT NULL,
-        ring_no INTEGER NOT NULL DEFAULT 1,
-
-        worker_status TEXT NOT NULL DEFAULT 'OPEN',
-        worker_status_reason TEXT DEFAULT '',
-        worker_status_note TEXT DEFAULT '',
-        worker_status_updated_at TEXT DEFAULT '',
-        worker_status_updated_by INTEGER,
-        worker_started_at TEXT DEFAULT '',
-        worker_finished_at TEXT DEFAULT '',
-
-        FOREIGN KEY(route_id) REFERENCES routes(id),
-        FOREIGN KEY(order_id) REFERENCES orders(id),
-        FOREIGN KEY(worker_status_updated_by) REFERENCES users(id),
-
-        UNIQUE(route_id, order_id),
-        UNIQUE(route_id, seq)
-    )""")
-
-    # Worker assignment for route items (many-to-many)
-    cur.execute("""CREATE TABLE IF NOT EXISTS route_item_users (
-        ri_id INTEGER NOT NULL,
-        user_id INTEGER NOT NULL,
-        created_at TEXT,
-        FOREIGN KEY(ri_id) REFERENCES route_items(id) ON DELETE CASCADE,
-        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
-        UNIQUE(ri_id, user_id)
-    )""")
-    cur.execute("""CREATE INDEX IF NOT EXISTS idx_route_item_users_user ON route_item_users(user_id)""")
-    cur.execute("""CREATE INDEX IF NOT EXISTS idx_route_item_users_ri ON route_item_users(ri_id)""")
-
-
-    # Backward-compat: older DBs may miss created_at on route_item_users
+
+def _attach_archive(conn):
+    """ATTACH archive.sqlite (once it exists) and create the hist_* views on this connection."""
+    state = (id(conn), os.path.exists(ARCHIVE_PATH))
+    if st.session_state.get("_db_archive_state") == state:
+        return
     try:
-        cur.execute("ALTER TABLE route_item_users ADD COLUMN created_at TEXT DEFAULT ''")
-    except Exception:
+        archive.attach(conn, ARCHIVE_PATH)
+        st.session_state._db_archive_state = state
+    except sqlite3.Error:
         pass
 
-    # simple key/value settings
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS settings (
-        key TEXT PRIMARY KEY,
-        value TEXT NOT NULL DEFAULT ''
-    )""")
 
-    def try_add_column(table, coldef):
-        try:
-            cur.execute(f"ALTER TABLE {table} ADD COLUMN {coldef}")
-        except (sqlite3.OperationalError, sqlite3.IntegrityError):
-            pass
+# -------------------------
+# Live updates (see live.py)
+# -------------------------
+def live_every():
+    """Fragment run_every for live lists (None = live updates off)."""
+    sec = settings_snapshot().get_int("live_refresh_sec", live.DEFAULT_EVERY_SEC)
+    return sec if sec > 0 else None
 
-    # Orders: tolerate legacy DBs
-    for coldef in [
-        "order_ref TEXT DEFAULT ''",
-        "recipient_name TEXT DEFAULT ''",
-        "ship_address TEXT DEFAULT ''",
-        "service_tag TEXT DEFAULT ''",
-        "doc_author TEXT DEFAULT ''",
-        "doc_email TEXT DEFAULT ''",
-        "doc_phone TEXT DEFAULT ''",
-        "items_compact TEXT DEFAULT ''",
-        "delivery_date TEXT DEFAULT ''",
-        "delivery_window TEXT DEFAULT ''",
-    ]:
-        try_add_column("orders", coldef)
-
-    # Users: tolerate legacy DBs
-    for coldef in ["password_hash TEXT DEFAULT ''", "auth_token TEXT DEFAULT ''"]:
-        try_add_column("users", coldef)
-
-    # --- Migration: old route_items with team_id -> new route_items without team_id ---
+
+def live_poll(scope: str, route_id: int | None = None, user_id: int | None = None) -> list:
+    """New changes for one live list of this session; marks the changed rows and shows a toast."""
+    cursors = st.session_state.setdefault("_live_cursors", {})
     try:
-        cur.execute("PRAGMA table_info(route_items)")
-        cols = [r[1] for r in cur.fetchall()]
-        if 'team_id' in cols:
-            # rename old and recreate new
-            cur.execute("ALTER TABLE route_items RENAME TO route_items_legacy")
-            # recreate new route_items (same as above)
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS route_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                route_id INTEGER NOT NULL,
-                order_id INTEGER NOT NULL,
-                seq INTEGER NOT NULL,
-                ring_no INTEGER NOT NULL DEFAULT 1,
-
-                worker_status TEXT NOT NULL DEFAULT 'OPEN',
-                worker_status_reason TEXT DEFAULT '',
-                worker_status_note TEXT DEFAULT '',
-                worker_status_updated_at TEXT DEFAULT '',
-                worker_status_updated_by INTEGER,
-                worker_started_at TEXT DEFAULT '',
-                worker_finished_at TEXT DEFAULT '',
-
-                FOREIGN KEY(route_id) REFERENCES routes(id),
-                FOREIGN KEY(order_id) REFERENCES orders(id),
-                FOREIGN KEY(worker_status_updated_by) REFERENCES users(id),
-
-                UNIQUE(route_id, order_id),
-                UNIQUE(route_id, seq)
-            )""")
-            # copy common columns (preserve ids)
-            cur.execute("""
-            INSERT INTO route_items (
-                id, route_id, order_id, seq, ring_no,
-                worker_status, worker_status_reason, worker_status_note,
-                worker_status_updated_at, worker_status_updated_by,
-                worker_started_at, worker_finished_at
-            )
-            SELECT
-                id, route_id, order_id, seq,
-                COALESCE(NULLIF(ring_no,0),1),
-                COALESCE(NULLIF(worker_status,''),'OPEN'),
-                COALESCE(worker_status_reason,''),
-                COALESCE(worker_status_note,''),
-                COALESCE(worker_status_updated_at,''),
-                worker_status_updated_by,
-                COALESCE(worker_started_at,''),
-                COALESCE(worker_finished_at,'')
-            FROM route_items_legacy
-            """)
-            # indexes
-            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_route_items_route_order ON route_items(route_id, order_id)")
-    except Exception:
-        # migration is best-effort; do not block app start
-        pass
+        changes = live.poll(cursors.setdefault(scope, {}), repo(), route_id=route_id, user_id=user_id,
+                            own=st.session_state.get("_live_own", ()))
+    except sqlite3.Error:
+        return []
+    marks = st.session_state.setdefault("_live_marks", {})
+    now = time.time()
+    for key in [k for k, t in marks.items() if now - t > live.HIGHLIGHT_SEC]:
+        del marks[key]
+    for ch in changes:
+        for key in live.row_keys(ch):
+            marks[key] = now
+    if changes:
+        st.toast(live.describe(changes), icon="🔄")
+    return changes
 
-    conn.commit()
 
+def live_mark(it) -> str:
+    """Prefix for a listed row that changed recently (elsewhere)."""
+    marks = st.session_state.get("_live_marks") or {}
+    hit = ("ri", int(it.get("ri_id") or 0)) in marks or ("order", int(it.get("order_id") or 0)) in marks
+    return "🆕 " if hit else ""
 
 
 # -------------------------
 # Helpers
 # -------------------------
 
-def get_setting(key: str, default: str = "") -> str:
+def settings_snapshot() -> settings_store.SettingsSnapshot:
+    """All settings, loaded with one query and shared by every session until a write."""
     try:
-        conn = db()
-        cur = conn.cursor()
-        cur.execute("SELECT value FROM settings WHERE key=?", (key,))
-        row = cur.fetchone()
-        return (row["value"] if row else default) or default
-    except Exception:
-        return default
+        return repo().load_settings()
+    except sqlite3.Error:
+        return settings_store.SettingsSnapshot({})
 
 
-def set_setting(key: str, value: str):
+def get_setting(key: str, default: str = "") -> str:
+    return settings_snapshot().get(key, default)
+
+
+def set_settings(values: dict):
+    """Write several keys in one transaction; the snapshot is refreshed for all sessions."""
     try:
-        conn = db()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO settings (key, value) VALUES (?, ?) "
-            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            ((key or "").strip(), (value or "").strip()),
-        )
-        conn.commit()
+        repo().write_settings(values)
     except Exception:
         pass
 
+
+def set_setting(key: str, value: str):
+    set_settings({key: value})
+
 def safe_filename(name: str) -> str:
     name = (name or "").strip()
     name = re.sub(r"[^\w\-. ]+", "_", name, flags=re.UNICODE)
@@ -1091,42 +946,11 @@ def service_icons_for(row) -> str:
     return _service_icons(svc)
 
 
-def _maps_dir_link(stops: list[str], start_point: str, return_to_start: bool = False) -> str:
-    """Google Maps Directions URL in the same order, showing the route line immediately.
-    Uses the 'api=1' directions endpoint and adds dir_action=navigate.
-    """
-    sp = (start_point or "").strip() or "Liivalao 11, Tallinn"
-    pts = [s.strip() for s in (stops or []) if (s or "").strip() and (s or "").strip() != "—"]
-
-    if not pts:
-        return ""
-
-    origin = sp
-
-    if return_to_start:
-        # route: start -> stop1 -> stop2 -> ... -> stopN -> start
-        destination = sp
-        waypoints = pts
-    else:
-        # route: start -> stop1 -> ... -> stopN
-        destination = pts[-1]
-        waypoints = pts[:-1]
-
-    # waypoint cap to keep URL usable
-    if len(waypoints) > 20:
-        waypoints = waypoints[:20]
-
-    url = (
-        f"https://www.google.com/maps/dir/?api=1"
-        f"&origin={quote(origin)}"
-        f"&destination={quote(destination)}"
-        f"&travelmode=driving"
-        f"&dir_action=navigate"
-    )
-    if waypoints:
-        wp = "|".join([quote(x) for x in waypoints])
-        url += f"&waypoints={wp}"
-    return url
+def ring_nav(ring_rows, start_point: str, start_coords=None, return_to_start: bool = False) -> dict:
+    """Google Maps legs (<= nav_plan.MAX_WAYPOINTS stops each) + GPX / KML of a ring, cached per ring version."""
+    sp = (start_point or "").strip() or settings_store.DEFAULT_MAPS_START
+    return nav_plan.build(nav_plan.ring_stops(ring_rows), sp, tuple(start_coords) if start_coords else None,
+                          bool(return_to_start))
 
 
 
@@ -1339,6 +1163,7 @@ def parse_aatrium_pdf_text(text: str) -> dict:
         recipient_name = re.sub(r"\s*[\(\+]?\d[\d\s\-\(\)\+]{5,}\s*$", "", recipient_name).strip()
 
     ship_address = _extract_ship_address_lines(lines)
+    postal_code, city, district = address_area.parse(ship_address)
     pdf_notes = _extract_notes_after_ship(lines)
 
     # -------------------------
@@ -1850,6 +1675,9 @@ def parse_aatrium_pdf_text(text: str) -> dict:
         "order_ref": order_ref,
         "recipient_name": recipient_name,
         "ship_address": ship_address,
+        "postal_code": postal_code,
+        "city": city,
+        "district": district,
         "service_tag": service_tag,
         "doc_author": doc_author,
         "doc_email": doc_email,
@@ -1876,52 +1704,29 @@ def save_uploaded_pdf(uploaded_file) -> str:
 
 
 def insert_order(original_filename: str, stored_path: str) -> int:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO orders (original_filename, stored_path, created_at) VALUES (?, ?, ?)",
-        (original_filename, stored_path, datetime.now().isoformat(timespec="seconds")),
-    )
-    conn.commit()
-    return cur.lastrowid
+    return repo().insert_order(original_filename, stored_path)
 
 
-def list_orders(status_filter=None):
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM orders ORDER BY id DESC")
-    rows = cur.fetchall()
-    if status_filter and status_filter != "ALL":
-        rows = [r for r in rows if r["status"] == status_filter]
-    return rows
+def list_orders(status_filter=None, by_area: bool = False):
+    """Order summaries (OrderRow); full order via get_order(), heavy fields via get_order_details().
+
+    by_area: grouped by district, then postal code (see address_area.py).
+    """
+    return list(repo().list_orders(status_filter, by_area))
 
 
 def get_order(order_id: int) -> dict:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM orders WHERE id=?", (order_id,))
-    row = cur.fetchone()
-    return dict(row) if row else {}
+    return dict(repo().get_order(order_id))
 
 
-def update_order(order_id: int, **fields):
-    allowed = {
-        "status","client_name","phone","address","delivery_date","delivery_window","notes",
-        "order_ref","recipient_name","ship_address","service_tag",
-        "doc_author","doc_email","doc_phone","items_compact",
-    }
-    cols, vals = [], []
-    for k, v in fields.items():
-        if k in allowed:
-            cols.append(f"{k}=?")
-            vals.append(v)
-    if not cols:
-        return
-    vals.append(order_id)
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(f"UPDATE orders SET {', '.join(cols)} WHERE id=?", vals)
-    conn.commit()
+def update_order(order_id: int, expected_version: int | None = None, **fields) -> bool:
+    """False if the order changed since expected_version was read (nothing saved, see show_conflicts)."""
+    try:
+        repo().update_order(order_id, fields, expected_version=expected_version)
+    except repository.VersionConflict as e:
+        flash_conflict(e)
+        return False
+    return True
 
 
 def delete_order(order_id: int):
@@ -1931,239 +1736,152 @@ def delete_order(order_id: int):
             os.remove(o["stored_path"])
         except Exception:
             pass
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM route_items WHERE order_id=?", (order_id,))
-    cur.execute("DELETE FROM orders WHERE id=?", (order_id,))
-    conn.commit()
+    repo().delete_order(order_id)
 
 
 # -------------------------
 # Users
 # -------------------------
 def list_users(active_only: bool = True):
-    conn = db()
-    cur = conn.cursor()
-    if active_only:
-        cur.execute("""SELECT u.*
-                       FROM users u
-                       WHERE u.is_active=1 ORDER BY u.name ASC""")
-    else:
-        cur.execute("""SELECT u.*
-                       FROM users u
-                       ORDER BY u.name ASC""")
-    return [dict(r) for r in cur.fetchall()]
-
+    return [dict(u) for u in repo().list_users(active_only)]
 
 
 def upsert_user(user_id, name: str, phone: str = "", is_active: int = 1):
-    name = (name or "").strip()
-    phone = (phone or "").strip()
-    conn = db()
-    cur = conn.cursor()
-    if user_id:
-        cur.execute("""UPDATE users SET name=?, phone=?, is_active=? WHERE id=?""",
-                    (name, phone, int(is_active), int(user_id)))
-    else:
-        cur.execute("""INSERT INTO users (name, phone, is_active, created_at)
-                       VALUES (?, ?, ?, ?)""",
-                    (name, phone, int(is_active), datetime.now().isoformat(timespec="seconds")))
-    conn.commit()
+    repo().save_user(user_id, name, phone, is_active)
 
 
 def delete_user(user_id: int):
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE id=?", (int(user_id),))
-    conn.commit()
+    repo().delete_user(user_id)
 
 
 def set_user_password(user_id: int, password: str):
-    ph = _pbkdf2_hash_password(password)
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET password_hash=? WHERE id=?", (ph, int(user_id)))
-    conn.commit()
+    repo().set_password_hash(user_id, auth.hash_password(password))
 
 
-def verify_user_password(user_id: int, password: str) -> bool:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT password_hash FROM users WHERE id=?", (int(user_id),))
-    row = cur.fetchone()
-    stored = (row["password_hash"] or "").strip() if row else ""
-    return bool(stored) and _pbkdf2_verify_password(password, stored)
+def login_user(user_id: int, password: str) -> auth.LoginResult:
+    """Password check in the shared PBKDF2 pool (rate limited); upgrades an outdated stored hash."""
+    res = auth.VERIFIER.login(user_id, password, repo().get_password_hash(user_id))
+    if res.new_hash:
+        repo().set_password_hash(user_id, res.new_hash, end_sessions=False)
+    return res
 
 
-def ensure_user_token(user_id: int) -> str:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT auth_token FROM users WHERE id=?", (int(user_id),))
-    row = cur.fetchone()
-    tok = (row["auth_token"] or "").strip() if row else ""
-    if tok:
-        return tok
-    tok = _new_token()
-    cur.execute("UPDATE users SET auth_token=? WHERE id=?", (tok, int(user_id)))
-    conn.commit()
-    return tok
+def _active_user(user_id: int) -> dict:
+    for u in list_users(active_only=True):
+        if int(u["id"]) == int(user_id):
+            return dict(u)
+    return {}
+
+
+def issue_session_ticket(user_id: int) -> str:
+    user = _active_user(user_id)
+    return auth.issue_ticket(auth.load_key(SESSION_KEY_PATH), user_id, user.get("session_epoch") or 0)
+
+
+def get_worker_user(credential: str) -> dict:
+    """User behind a session ticket (after password login) or a worker link token."""
+    if not auth.is_ticket(credential):
+        return get_user_by_token(credential)
+    claim = auth.read_ticket(auth.load_key(SESSION_KEY_PATH), credential)
+    if not claim:
+        return {}
+    user = _active_user(claim[0])
+    return user if user and int(user.get("session_epoch") or 0) == claim[1] else {}
+
+
+def issue_user_token(user_id: int, label: str = "") -> str:
+    """New login token (only its hash is stored, so show / use it right away)."""
+    return repo().issue_token(user_id, label)
 
 
 def reset_user_token(user_id: int) -> str:
-    tok = _new_token()
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET auth_token=? WHERE id=?", (tok, int(user_id)))
-    conn.commit()
-    return tok
+    repo().revoke_tokens(user_id)
+    return issue_user_token(user_id, "link")
+
+
+def count_user_tokens(user_id: int) -> int:
+    return repo().count_tokens(user_id)
 
 
 def get_user_by_token(token: str) -> dict:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("""SELECT u.*
-                   FROM users u
-                   WHERE u.auth_token=? AND u.is_active=1""", ((token or "").strip(),))
-    row = cur.fetchone()
-    return dict(row) if row else {}
+    return dict(repo().get_user_by_token(token))
 
 
 # -------------------------
 # Routes + items
 # -------------------------
 def get_or_create_route(route_date: str) -> int:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM routes WHERE route_date=?", (route_date,))
-    row = cur.fetchone()
-    if row:
-        return row["id"]
-    cur.execute("INSERT INTO routes (route_date) VALUES (?)", (route_date,))
-    conn.commit()
-    return cur.lastrowid
+    return repo().get_or_create_route(route_date)
 
 
 def get_route_id_if_exists(route_date: str):
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM routes WHERE route_date=?", (route_date,))
-    row = cur.fetchone()
-    return row["id"] if row else None
+    return repo().get_route_id(route_date)
+
+
+def search_orders(text: str, since: str = "", limit: int = 50) -> list:
+    """Ranked full-text search over orders with their latest route (see order_search.py)."""
+    return [dict(h) for h in repo().search_orders(text, since=since, limit=limit)]
+
+
+def geocode_orders(order_ids=None) -> int:
+    """Coordinates for orders that have none, from the local gazetteer (see geocode.py)."""
+    return repo().geocode_orders(order_ids)
+
+
+def import_gazetteer(uploaded_file, city: str = "") -> int:
+    text = uploaded_file.getvalue().decode("utf-8-sig", errors="replace")
+    return repo().import_gazetteer(geocode.parse_gazetteer(io.StringIO(text, newline=""), city))
+
+
+def get_order_history(order_id: int) -> list:
+    """Route items of one order, newest first (job history)."""
+    return [dict(r) for r in repo().order_history(order_id)]
+
+
+def list_job_days(statuses=("DONE", "CANCELLED")) -> list:
+    """[(route_date, {status: n})] from daily_job_stats (hot + archive), newest first."""
+    return repo().list_job_days(statuses)
+
+
+def list_job_day_workers(route_date: str, statuses=("DONE", "CANCELLED")) -> list:
+    return repo().list_job_day_workers(route_date, statuses)
+
+
+def list_day_jobs(route_date: str, statuses=("DONE", "CANCELLED")) -> list:
+    return repo().list_day_jobs(route_date, statuses)
 
 
 def list_route_items(route_id: int):
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT
-            ri.id as ri_id, ri.seq, ri.ring_no,
-            ri.worker_status, ri.worker_status_reason, ri.worker_status_note,
-            ri.worker_status_updated_at, ri.worker_status_updated_by,
-            o.*,
-            COALESCE(GROUP_CONCAT(u.name, ', '), '') AS worker_names
-        FROM route_items ri
-        JOIN orders o ON o.id=ri.order_id
-        LEFT JOIN route_item_users riu ON riu.ri_id = ri.id
-        LEFT JOIN users u ON u.id = riu.user_id
-        WHERE ri.route_id=? AND UPPER(COALESCE(ri.worker_status,'OPEN'))='OPEN'
-        GROUP BY ri.id
-        ORDER BY ri.seq ASC
-    """, (route_id,))
-    return [dict(r) for r in cur.fetchall()]
+    """OPEN items of a route as lean RouteItemRow objects (summary columns only)."""
+    return list(repo().list_route_items(route_id))
 
 def list_worker_route_items(route_id: int, user_id: int):
     """Items for a specific worker (via route_item_users)."""
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT
-            ri.id as ri_id, ri.seq, ri.ring_no,
-            ri.worker_status, ri.worker_status_reason, ri.worker_status_note,
-            ri.worker_status_updated_at, ri.worker_status_updated_by,
-            o.*,
-            COALESCE(GROUP_CONCAT(u2.name, ', '), '') AS worker_names
-        FROM route_item_users riu
-        JOIN route_items ri ON ri.id = riu.ri_id
-        JOIN orders o ON o.id = ri.order_id
-        LEFT JOIN route_item_users riu2 ON riu2.ri_id = ri.id
-        LEFT JOIN users u2 ON u2.id = riu2.user_id
-        WHERE ri.route_id=? AND riu.user_id=?
-        GROUP BY ri.id
-        ORDER BY ri.seq ASC
-    """, (int(route_id), int(user_id)))
-    return [dict(r) for r in cur.fetchall()]
+    return list(repo().list_worker_route_items(route_id, user_id))
 
 def list_user_route_items(user_id: int, status: str | None = None):
-    """Route items assigned to a user via route_item_users."""
-    status = (status or "").strip().upper()
-    params = [int(user_id)]
-    where = "WHERE riu.user_id=?"
-    if status:
-        where += " AND UPPER(COALESCE(ri.worker_status,'OPEN'))=?"
-        params.append(status)
+    """Route items assigned to a user via route_item_users (DONE/CANCELLED include the archive)."""
+    return list(repo().list_user_route_items(user_id, status))
 
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(f"""
-        SELECT
-            ri.id as ri_id,
-            ri.route_id,
-            r.route_date,
-            ri.order_id,
-            ri.seq,
-            ri.ring_no,
-            ri.worker_status,
-            ri.worker_status_reason,
-            ri.worker_status_note,
-            ri.worker_status_updated_at,
-            ri.worker_status_updated_by,
-            o.*,
-            COALESCE(GROUP_CONCAT(u2.name, ', '), '') AS worker_names
-        FROM route_item_users riu
-        JOIN route_items ri ON ri.id = riu.ri_id
-        JOIN routes r ON r.id = ri.route_id
-        JOIN orders o ON o.id = ri.order_id
-        LEFT JOIN route_item_users riu2 ON riu2.ri_id = ri.id
-        LEFT JOIN users u2 ON u2.id = riu2.user_id
-        {where}
-        GROUP BY ri.id
-        ORDER BY r.route_date DESC, ri.ring_no ASC, ri.seq ASC
-    """, params)
-    return [dict(r) for r in cur.fetchall()]
-
-
-def update_route_item_status(ri_id: int, status: str, user_id: int, reason: str = "", note: str = ""):
-    status = (status or "OPEN").strip().upper()
-    if status not in ("OPEN", "DONE", "CANCELLED"):
-        status = "OPEN"
-    now = datetime.now().isoformat(timespec="seconds")
-    conn = db()
-    cur = conn.cursor()
 
-    finished_at = ""
-    if status in ("DONE", "CANCELLED"):
-        finished_at = now
-
-    cur.execute(
-        """
-        UPDATE route_items
-        SET worker_status=?, worker_status_reason=?, worker_status_note=?,
-            worker_status_updated_at=?, worker_status_updated_by=?,
-            worker_finished_at=CASE WHEN ?!='' THEN ? ELSE COALESCE(worker_finished_at,'') END
-        WHERE id=?
-        """,
-        (
-            status, (reason or '').strip(), (note or '').strip(),
-            now, int(user_id),
-            finished_at, finished_at,
-            int(ri_id),
-        ),
-    )
-    conn.commit()
+def list_worker_jobs(user_id: int, status: str, start_date: str):
+    """Worker view: a worker's jobs in one status from start_date on."""
+    return list(repo().list_worker_jobs(user_id, status, start_date))
 
 
+def get_order_details(order_id: int, history: bool = False) -> dict:
+    """Heavy order fields (items, notes, PDF path, ...) for one expanded job row."""
+    return dict(repo().get_order_details(order_id, history=history))
 
 
+def update_route_item_status(ri_id: int, status: str, user_id: int, reason: str = "", note: str = "",
+                             expected_version: int | None = None) -> bool:
+    try:
+        repo().set_item_status(ri_id, status, user_id, reason=reason, note=note, expected_version=expected_version)
+    except repository.VersionConflict as e:
+        flash_conflict(e)
+        return False
+    return True
 
 
 def add_order_to_route(route_id: int, order_id: int, user_ids, ring_no: int = 1):
@@ -2174,7 +1892,7 @@ def add_order_to_route(route_id: int, order_id: int, user_ids, ring_no: int = 1)
       - route_item_users: links route_item -> users (many-to-many)
 
     Lock handling:
-      - Use a dedicated short-lived write connection (autocommit off via explicit BEGIN).
+      - Use a dedicated short-lived write connection (repo().short_lived(), BEGIN IMMEDIATE).
       - Retry quickly for ~2 seconds total to get past transient locks.
     """
     ring_no = int(ring_no or 1)
@@ -2185,159 +1903,383 @@ def add_order_to_route(route_id: int, order_id: int, user_ids, ring_no: int = 1)
 
     ensure_dirs()
 
-    max_attempts = 15
-    sleep_s = 0.06  # ~2s total worst case
+    def assign():
+        with repo().short_lived(timeout=1.0) as r:
+            r.assign_order(route_id, order_id, user_ids, ring_no=ring_no)
 
-    for attempt in range(max_attempts):
-        conn = None
-        try:
-            conn = sqlite3.connect(DB_PATH, timeout=1.0, check_same_thread=False)
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-            try:
-                cur.execute("PRAGMA foreign_keys=OFF;")
-                cur.execute("PRAGMA busy_timeout=1200;")
-            except Exception:
-                pass
+    try:
+        repository.retry_locked(assign)  # ~2s total worst case
+        return True, "Added to route."
+    except sqlite3.OperationalError as e:
+        if repository.is_lock_error(e):
+            return False, "Andmebaas on hetkeks hõivatud. Proovi uuesti."
+        return False, f"Andmebaasi viga: {e}"
+    except Exception as e:
+        return False, f"Viga: {e}"
 
-            # Reserve write lock (retry if busy)
-            cur.execute("BEGIN;")
 
-            # If already on this route, keep its seq; otherwise allocate next seq for the route
-            cur.execute(
-                "SELECT id, seq FROM route_items WHERE route_id=? AND order_id=?",
-                (int(route_id), int(order_id)),
-            )
-            existing = cur.fetchone()
-
-            if existing:
-                ri_id = int(existing["id"])
-                seq = int(existing["seq"] or 1)
-                cur.execute(
-                    "UPDATE route_items SET ring_no=? WHERE id=?",
-                    (int(ring_no), ri_id),
-                )
-            else:
-                cur.execute(
-                    "SELECT COALESCE(MAX(seq),0)+1 AS next_seq FROM route_items WHERE route_id=?",
-                    (int(route_id),),
-                )
-                seq = int(cur.fetchone()["next_seq"] or 1)
+def list_assign_jobs(route_id: int, statuses=auto_assign.STATUSES) -> tuple:
+    """(open orders not on the route, OPEN items on it) with estimated workloads (see auto_assign.py)."""
+    return repo().list_assign_jobs(route_id, tuple(statuses))
 
-                cur.execute(
-                    "INSERT INTO route_items (route_id, order_id, seq, ring_no) VALUES (?, ?, ?, ?)",
-                    (int(route_id), int(order_id), int(seq), int(ring_no)),
-                )
-                ri_id = int(cur.lastrowid)
 
-            # Replace worker links
-            cur.execute("DELETE FROM route_item_users WHERE ri_id=?", (ri_id,))
+def assign_orders(route_id: int, assignments):
+    """Apply an auto-assign plan [(order_id, user_ids, ring_no)] in one transaction; (ok, message)."""
+    def assign():
+        with repo().short_lived(timeout=1.0) as r:
+            r.assign_orders(route_id, assignments)
 
-            # Backward-compat: route_item_users may not have created_at in older DBs
-            try:
-                cur.execute("PRAGMA table_info(route_item_users)")
-                _cols = [r["name"] for r in cur.fetchall()]
-            except Exception:
-                _cols = []
+    try:
+        repository.retry_locked(assign)
+        return True, f"Lisatud: {len(assignments)} tööd."
+    except sqlite3.OperationalError as e:
+        if repository.is_lock_error(e):
+            return False, "Andmebaas on hetkeks hõivatud. Proovi uuesti."
+        return False, f"Andmebaasi viga: {e}"
 
-            now = datetime.now().isoformat(timespec="seconds")
-            has_created_at = ("created_at" in _cols)
 
-            for uid in user_ids:
-                if has_created_at:
-                    cur.execute(
-                        "INSERT OR IGNORE INTO route_item_users (ri_id, user_id, created_at) VALUES (?, ?, ?)",
-                        (ri_id, int(uid), now),
-                    )
-                else:
-                    cur.execute(
-                        "INSERT OR IGNORE INTO route_item_users (ri_id, user_id) VALUES (?, ?)",
-                        (ri_id, int(uid)),
-                    )
+def insert_ring(route_id: int, order_ids, user_ids, ring_no: int = 1):
+    """Accept a proposed ring: orders appended to ring_no in one bulk insert; (ok, message)."""
+    user_ids = sorted({int(u) for u in user_ids or []})
+    if not user_ids:
+        return False, "Vali vähemalt 1 töötaja."
+    added = []
 
-            conn.commit()
-            return True, "Added to route."
+    def insert():
+        with repo().short_lived(timeout=1.0) as r:
+            added[:] = r.insert_ring(route_id, order_ids, user_ids, ring_no=ring_no)
+
+    try:
+        repository.retry_locked(insert)
+        return True, f"Lisatud: {len(added)} tööd ringi {int(ring_no)}."
+    except sqlite3.OperationalError as e:
+        if repository.is_lock_error(e):
+            return False, "Andmebaas on hetkeks hõivatud. Proovi uuesti."
+        return False, f"Andmebaasi viga: {e}"
 
-        except sqlite3.OperationalError as e:
-            msg = str(e).lower()
-            try:
-                if conn:
-                    conn.rollback()
-            except Exception:
-                pass
-            # Retry on locking/busy
-            if ("locked" in msg) or ("busy" in msg) or ("database is locked" in msg):
-                time.sleep(sleep_s)
-                continue
-            return False, f"Andmebaasi viga: {e}"
-        except Exception as e:
-            try:
-                if conn:
-                    conn.rollback()
-            except Exception:
-                pass
-            return False, f"Viga: {e}"
-        finally:
-            try:
-                if conn:
-                    conn.close()
-            except Exception:
-                pass
 
-    return False, "Andmebaas on hetkeks hõivatud. Proovi uuesti."
+def suggest_nearby(route_id: int, ring_rows, start=None, return_to_start: bool = False,
+                   radius_km: float = nearby.DEFAULT_RADIUS_KM) -> list:
+    """Open orders within radius_km of a ring's stops, cheapest added detour first (see nearby.py).
+
+    Each suggestion carries anchor (ri_id it goes after, None = before the first stop).
+    """
+    located = [x for x in ring_rows if ring_optimizer.row_coords(x)]
+    if not located:
+        return []
+    stops = [ring_optimizer.row_coords(x) for x in located]
+    index = repo().nearby_index()
+    near = index.near(stops, radius_km, exclude=repo().route_order_ids(route_id))
+    path = ([start] if start else []) + stops
+    ranked = nearby.detours(index, near, path, closed=bool(return_to_start and start),
+                            model=travel_matrix.SpeedModel.from_settings(settings_snapshot()))
+    offset = 1 if start else 0
+    for r in ranked:
+        pos = r["after"] - offset
+        r["anchor"] = int(located[pos]["ri_id"]) if pos >= 0 else None
+        r["before"] = int(located[0]["ri_id"]) if pos < 0 else None
+    return ranked
+
+
+def add_nearby_order(route_id: int, order_id: int, user_ids, ring_no: int, suggestion: dict):
+    """Add a suggested order to the ring at its cheapest place (suggest_nearby); (ok, message)."""
+    user_ids = sorted({int(u) for u in user_ids or []})
+    if not user_ids:
+        return False, "Vali vähemalt 1 töötaja."
+    added = []
+
+    def insert():
+        with repo().short_lived(timeout=1.0) as r:
+            added[:] = r.insert_ring(route_id, [order_id], user_ids, ring_no=ring_no)
+
+    try:
+        repository.retry_locked(insert)
+    except sqlite3.OperationalError as e:
+        if repository.is_lock_error(e):
+            return False, "Andmebaas on hetkeks hõivatud. Proovi uuesti."
+        return False, f"Andmebaasi viga: {e}"
+    if not added:
+        return False, "Tellimus on juba marsruudil."
+    if suggestion.get("before"):
+        move_route_item_next_to(added[0], suggestion["before"])
+    elif suggestion.get("anchor"):
+        move_route_item_next_to(added[0], suggestion["anchor"], after=True)
+    return True, f"Lisatud ringi {int(ring_no)} (+{suggestion.get('detour_km', 0):.1f} km)."
 
 
 def remove_route_item(ri_id: int):
     """Remove a route item. Also deletes any accidental duplicates for the same (route_id, order_id)."""
-    conn = db()
-    cur = conn.cursor()
     try:
-        cur.execute("BEGIN;")
-        cur.execute("SELECT route_id, order_id FROM route_items WHERE id=?", (ri_id,))
-        row = cur.fetchone()
-        if row:
-            cur.execute("DELETE FROM route_items WHERE route_id=? AND order_id=?", (row["route_id"], row["order_id"]))
-        else:
-            cur.execute("DELETE FROM route_items WHERE id=?", (ri_id,))
-        conn.commit()
+        repo().remove_route_item(ri_id)
     except (sqlite3.OperationalError, sqlite3.IntegrityError):
-        conn.rollback()
+        pass
 
 
-def move_route_item(ri_id: int, direction: int):
-    """Swap seq with the previous/next item inside the same route (teamless)."""
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT id, route_id, seq FROM route_items WHERE id=?", (int(ri_id),))
-    item = cur.fetchone()
+def move_route_item_to(ri_id: int, position: int, expected_version: int | None = None) -> bool:
+    """Move a stop to a 1-based position inside its ring (see route_order.py)."""
+    try:
+        return repo().move_item_to(ri_id, position, expected_version=expected_version)
+    except repository.VersionConflict as e:
+        flash_conflict(e)
+        return False
+    except (sqlite3.OperationalError, sqlite3.IntegrityError):
+        return False
+
+
+def move_route_item(ri_id: int, direction: int, expected_version: int | None = None) -> bool:
+    """Move a stop one place up (-1) / down (+1) inside its ring."""
+    item = repo().item_position(ri_id)
     if not item:
-        return
-    route_id, seq = int(item["route_id"]), int(item["seq"] or 0)
-    target_seq = seq + int(direction)
-    if target_seq < 1:
-        return
+        return False
+    position = item[2] + int(direction)
+    if position < 1:
+        return False
+    return move_route_item_to(ri_id, position, expected_version=expected_version)
 
-    cur.execute("SELECT id FROM route_items WHERE route_id=? AND seq=?", (route_id, target_seq))
-    other = cur.fetchone()
-    if not other:
-        return
-    other_id = int(other["id"])
 
-    tmp_seq = 999999999
+def move_route_item_next_to(ri_id: int, anchor_ri_id: int, after: bool = False,
+                            expected_version: int | None = None) -> bool:
+    """Move a stop right before/after another stop of its ring (one UPDATE)."""
     try:
-        cur.execute("BEGIN;")
-        cur.execute("UPDATE route_items SET seq=? WHERE id=?", (tmp_seq, int(ri_id)))
-        cur.execute("UPDATE route_items SET seq=? WHERE id=?", (seq, other_id))
-        cur.execute("UPDATE route_items SET seq=? WHERE id=?", (target_seq, int(ri_id)))
-        conn.commit()
-    except Exception:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
+        return repo().move_item_next_to(ri_id, anchor_ri_id, after=after, expected_version=expected_version)
+    except repository.VersionConflict as e:
+        flash_conflict(e)
+        return False
+    except (sqlite3.OperationalError, sqlite3.IntegrityError):
+        return False
+
+
+def apply_ring_order(route_id: int, ring_no: int, ri_ids, expected_versions: dict | None = None) -> int:
+    """Rewrite a whole ring's stop order in one transaction; returns the number of moved stops."""
+    try:
+        return repo().apply_ring_order(route_id, ring_no, ri_ids, expected_versions=expected_versions)
+    except repository.VersionConflict as e:
+        flash_conflict(e)
+        return 0
+    except (sqlite3.OperationalError, sqlite3.IntegrityError):
+        return 0
 
-    except Exception:
-        conn.rollback()
+
+def day_matrix(route_date: str, rows, starts=()) -> travel_matrix.Matrix:
+    """Distance / time matrix of a route date's geocoded stops plus start points (cached, see travel_matrix.py)."""
+    stops = travel_matrix.row_stops(rows) + [(travel_matrix.start_key(c), c) for c in starts if c]
+    return travel_matrix.CACHE.get(route_date, stops, travel_matrix.SpeedModel.from_settings(settings_snapshot()))
+
+
+def ring_etas(ring_key, ring_rows, route_id: int, matrix: travel_matrix.Matrix, start=None, return_to_start=False) -> dict:
+    """Projected arrivals / window violations of a ring in its current order (cached, see ring_eta.py)."""
+    service = {j.ri_id: j.minutes for j in list_assign_jobs(route_id)[1]}
+    day_start = ring_eta.parse_time(settings_snapshot().get(ring_eta.DAY_START_KEY, ring_eta.DEFAULT_DAY_START))
+    return ring_eta.ring_eta(ring_key, ring_rows, matrix, start=start, service_min=service,
+                             day_start=day_start, return_to_start=return_to_start)
+
+
+def eta_label(s) -> str:
+    """' • 🕒 10:25' plus ⚠️ minutes late / ⏳ wait for a ring row header."""
+    if s is None:
+        return ""
+    out = f" • 🕒 {ring_eta.fmt(s.arrival)}" + ("" if s.located else "?")
+    if s.late > 0:
+        out += f" ⚠️ +{s.late:.0f} min"
+    elif s.wait >= 1:
+        out += f" ⏳ {s.wait:.0f} min"
+    return out
+
+
+# -------------------------
+# Route drafts (what-if planning in memory, see route_draft.py)
+# -------------------------
+def start_route_draft(route_id: int, route_date: str) -> route_draft.Draft:
+    """A draft of the route's OPEN stops as they are now."""
+    users = {j.ri_id: j.user_ids for j in list_assign_jobs(route_id)[1]}
+    return route_draft.Draft.from_rows(route_id, list_route_items(route_id), users, route_date)
+
+
+def route_draft_for(route_id: int):
+    """This session's draft of route_id, or None."""
+    d = st.session_state.get("route_draft")
+    return d if d is not None and d.route_id == int(route_id) else None
+
+
+def commit_route_draft(draft: route_draft.Draft):
+    """Write every edit of a draft in one transaction; (ok, message). On a conflict nothing is written."""
+    result = {}
+
+    def commit():
+        with repo().short_lived(timeout=1.0) as r:
+            result.update(r.commit_route_draft(draft.route_id, draft.plan()))
+
+    try:
+        repository.retry_locked(commit)
+    except repository.VersionConflict as e:
+        flash_conflict(e)
+        return False, "Mustandit ei salvestatud: marsruut muutus vahepeal. Loobu mustandist ja alusta uuesti."
+    except sqlite3.OperationalError as e:
+        if repository.is_lock_error(e):
+            return False, "Andmebaas on hetkeks hõivatud. Proovi uuesti."
+        return False, f"Andmebaasi viga: {e}"
+    return True, (f"Mustand salvestatud: {result['removed']} eemaldatud, {result['assigned']} lisatud/muudetud, "
+                  f"{result['moved']} ümber tõstetud.")
+
+
+def draft_team(user_ids, names: dict) -> str:
+    return ", ".join(names.get(u, f"#{u}") for u in user_ids) or "—"
+
+
+def draft_eta_impact(draft: route_draft.Draft, route_date: str, names: dict) -> list:
+    """(group, base ETA, draft ETA) of every ring the draft changes (see route_draft.eta_impact)."""
+    cfg = settings_snapshot()
+    jobs, on_route = list_assign_jobs(draft.route_id)
+    service = {j.ri_id: j.minutes for j in on_route}
+    service.update({-j.order_id: j.minutes for j in jobs})   # added orders are keyed -order_id
+    day_start = ring_eta.parse_time(cfg.get(ring_eta.DAY_START_KEY, ring_eta.DEFAULT_DAY_START))
+
+    def start_of(group):
+        d, users, rn = group
+        ring_cfg = cfg.ring_config(cfg.ring_key(d, draft_team(users, names), rn))
+        sp = (ring_cfg.get('start') or cfg.maps_start).strip() or cfg.maps_start
+        coords = ring_optimizer.parse_coords(sp) or (
+            ring_optimizer.parse_coords(cfg.maps_start_coords) if sp == cfg.maps_start else None)
+        return coords, bool(ring_cfg.get('return', cfg.maps_return))
+
+    starts = {g: start_of(g) for g in draft.changed_groups()}
+    rows = route_draft.Draft.rows({**draft.base, **draft.stops}.values())
+    # Own matrix entry: draft-only stops would otherwise evict the live date's matrix
+    matrix = travel_matrix.CACHE.get(
+        f"{route_date} (draft)",
+        travel_matrix.row_stops(rows) + [(travel_matrix.start_key(c), c) for c, _ret in starts.values() if c],
+        travel_matrix.SpeedModel.from_settings(cfg),
+    )
+
+    def etas(key, group, ring_rows):
+        start, ret = starts[group]
+        return ring_eta.ring_eta(key, ring_rows, matrix, start=start, service_min=service, day_start=day_start,
+                                 return_to_start=ret, cache=route_draft.ETA_CACHE)
+
+    return route_draft.eta_impact(draft, etas)
+
+
+def render_route_draft(draft: route_draft.Draft, route_date: str):
+    """Planner view of a draft: diff + ETA impact, Commit / Discard, rings as drafted with ⬆ / ✖ / move."""
+    names = {int(u['id']): u['name'] for u in (list_users(active_only=False) or [])}
+    user_opts = {u['name']: int(u['id']) for u in (list_users(active_only=True) or [])}
+    stops = {**draft.base, **draft.stops}
+
+    def label(order_id):
+        r = stops[order_id].row
+        return f"{(r.get('client_name') or r.get('recipient_name') or '—').strip()} • {(r.get('address') or r.get('ship_address') or '—').strip()}"
+
+    def ring_label(group):
+        return f"{group[0]} • {draft_team(group[1], names)} • {group[2]} ring"
+
+    changes = draft.diff()
+    impact = draft_eta_impact(draft, route_date, names) if changes else []
+    with st.container(border=True):
+        st.markdown(f"**🧪 Mustand** • {len(changes)} muudatust")
+        st.caption("Muudatused on ainult selles sessioonis; 💾 Commit salvestab kõik korraga ühe tehinguna.")
+        for c in changes:
+            if c['op'] == 'add':
+                st.caption(f"➕ {label(c['order_id'])} → {ring_label(c['to'])}")
+            elif c['op'] == 'remove':
+                st.caption(f"✖ {label(c['order_id'])} ({ring_label(c['from'])})")
+            elif c['op'] == 'ring':
+                st.caption(f"↪ {label(c['order_id'])}: ring {c['from']} → {c['to']}")
+            elif c['op'] == 'workers':
+                st.caption(f"👷 {label(c['order_id'])}: {draft_team(c['from'], names)} → {draft_team(c['to'], names)}")
+            else:
+                st.caption(f"↕️ {ring_label(c['group'])}: {c['moved']} tööd uues järjekorras")
+        for g, before, after in impact:
+            if after is None:
+                st.caption(f"🕒 {ring_label(g)}: ring jääb tühjaks")
+                continue
+            msg = f"🕒 {ring_label(g)}: lõpp {ring_eta.fmt(after['end'])}"
+            if before is not None:
+                delta = after['end'] - before['end']
+                msg += f" ({'+' if delta >= 0 else '−'}{abs(delta):.0f} min, oli {ring_eta.fmt(before['end'])})"
+            late_was = len(before['late']) if before is not None else 0
+            if after['late'] or late_was:
+                msg += f" • ⚠️ hilinemisi {late_was} → {len(after['late'])}"
+            st.caption(msg)
+        dc1, dc2 = st.columns(2)
+        if dc1.button("💾 Commit", key="draft_commit", type="primary", disabled=not changes, use_container_width=True):
+            ok, msg = commit_route_draft(draft)
+            if ok:
+                st.session_state.pop("route_draft", None)
+                st.toast(msg, icon="💾")
+                st.rerun()
+            show_conflicts()
+            st.error(msg)
+        if dc2.button("🗑️ Discard", key="draft_discard", use_container_width=True):
+            st.session_state.pop("route_draft", None)
+            st.rerun()
+
+    after_eta = {g: a for g, _b, a in impact if a is not None}
+    for g, ring in sorted(draft.groups().items(), key=lambda x: (x[0][0], draft_team(x[0][1], names), x[0][2])):
+        d, users, rn = g
+        gk = f"{d}_{'-'.join(str(u) for u in users)}_{rn}"
+        st.markdown(f"#### {draft_team(users, names)} • {rn} ring ({len(ring)})")
+        ring_eta_stops = after_eta.get(g, {}).get('stops', {})
+        for n, s in enumerate(ring):
+            r = s.row
+            c_up, c_txt, c_rm = st.columns([0.9, 8.2, 0.9], vertical_alignment='center')
+            if c_up.button('⬆', key=f"dr_up_{s.order_id}", disabled=n == 0):
+                draft.move_up(s.order_id)
+                st.rerun()
+            c_txt.markdown(f"{'🆕 ' if s.ri_id is None else ''}{_service_icons(r.get('service_tag') or '')} {label(s.order_id)}"
+                           f" • ⏱️ {(r.get('delivery_window') or '—').strip()}{eta_label(ring_eta_stops.get(int(r['ri_id'])))}")
+            if c_rm.button('✖', key=f"dr_rm_{s.order_id}"):
+                draft.remove(s.order_id)
+                st.rerun()
+        # Teise ringi / teistele töötajatele (mustandis läheb töö selle ringi lõppu)
+        m1, m2, m3, m4 = st.columns([4, 1.3, 4, 1.5], vertical_alignment='bottom')
+        pick = m1.selectbox('Töö', [s.order_id for s in ring], format_func=label, key=f"dr_pick_{gk}")
+        ring_to = m2.selectbox('Ring', [1, 2, 3, 4], index=rn - 1 if 1 <= rn <= 4 else 0, key=f"dr_ring_{gk}")
+        workers = m3.multiselect('Workers', list(user_opts), default=[names[u] for u in users if names.get(u) in user_opts],
+                                 key=f"dr_users_{gk}")
+        if m4.button('↪ Move', key=f"dr_move_{gk}", use_container_width=True):
+            if not workers:
+                st.error("Vali vähemalt 1 töötaja.")
+            elif draft.reassign(pick, ring_no=ring_to, user_ids=[user_opts[x] for x in workers]):
+                st.rerun()
+
+
+# -------------------------
+# Edit conflicts (row versions, see repository.VersionConflict)
+# -------------------------
+def seen_version(kind: str, row_id: int, current):
+    """Version of a row as this session last rendered it; remembers current for the next run.
+
+    A button click reruns the script, which re-reads the row: the version the user
+    acted on is the one from the previous run, not the fresh one.
+    """
+    seen = st.session_state.setdefault("_seen_versions", {})
+    key = (kind, int(row_id))
+    previous = seen.get(key, current)
+    seen[key] = current
+    return previous
+
+
+def flash_conflict(e: repository.VersionConflict):
+    """Queue a conflict notice for show_conflicts() (callers usually st.rerun() right after)."""
+    what = {"order": "Tellimus", "route_item": "Töö"}.get(e.entity, e.entity)
+    if e.actual is None:
+        msg = f"{what} on vahepeal eemaldatud — muudatust ei salvestatud."
+    else:
+        msg = f"{what} muutus vahepeal (keegi teine salvestas enne) — sinu muudatust ei salvestatud. Vaata uus seis üle ja proovi uuesti."
+    st.session_state.setdefault("_conflicts", []).append(msg)
+
+
+def show_conflicts():
+    for msg in st.session_state.pop("_conflicts", []):
+        st.warning(msg, icon="⚠️")
+
+
+def compact_route_order(route_id: int) -> int:
+    """Renumber a route's seq values evenly again (normally done automatically)."""
+    try:
+        return repo().compact_route(route_id)
+    except (sqlite3.OperationalError, sqlite3.IntegrityError):
+        return 0
 
 
 # -------------------------
@@ -2345,11 +2287,11 @@ def move_route_item(ri_id: int, direction: int):
 # -------------------------
 def build_team_manifest(route_date: str, team_name: str, items):
     manifest = {"date": route_date, "team": team_name, "count": len(items), "orders": []}
-    for it in items:
+    for n, it in enumerate(items, start=1):
         it = dict(it)
         manifest["orders"].append({
-            "seq": it["seq"],
-            "order_id": it["id"],
+            "seq": n,
+            "order_id": it.get("order_id") or it.get("id"),
             "delivery_date": it.get("delivery_date",""),
             "delivery_window": it.get("delivery_window",""),
             "address": it.get("address",""),
@@ -2363,11 +2305,11 @@ def build_team_manifest(route_date: str, team_name: str, items):
 
 def build_ring_sheet_html(route_date: str, team_name: str, items):
     rows = []
-    for it in items:
+    for n, it in enumerate(items, start=1):
         it = dict(it)
         rows.append(f"""
         <tr>
-          <td>{it['seq']}</td>
+          <td>{n}</td>
           <td>{(it.get('delivery_window') or '')}</td>
           <td>{(it.get('address') or '').replace('<','&lt;')}</td>
           <td>{(it.get('phone') or '').replace('<','&lt;')}</td>
@@ -2403,6 +2345,7 @@ def worker_view():
     inject_styles()
     st.markdown("""<div style='height:6px'></div>""", unsafe_allow_html=True)
     st.title("📱 Worker view")
+    show_conflicts()
     st.caption("Tööread: Kellaaeg • Address • Phone • Client. Ava töö → tooted + märkmed.")
 
     try:
@@ -2415,7 +2358,7 @@ def worker_view():
     if token:
         st.session_state.worker_token = token
 
-    user = get_user_by_token(st.session_state.worker_token) if st.session_state.worker_token else {}
+    user = get_worker_user(st.session_state.worker_token) if st.session_state.worker_token else {}
 
     top = st.columns([3, 1], vertical_alignment="bottom")
     with top[1]:
@@ -2438,10 +2381,17 @@ def worker_view():
         uid = int(pick.split("ID")[1].strip().rstrip(")"))
         pwd = st.text_input("Password", type="password")
         if st.button("Log in", type="primary"):
-            if not verify_user_password(uid, pwd):
+            res = login_user(uid, pwd)
+            if res.status == "limited":
+                st.error(f"Liiga palju katseid. Proovi uuesti {int(res.retry_after) + 1} s pärast.")
+                return
+            if res.status == "busy":
+                st.warning("Palju sisselogimisi korraga — proovi mõne sekundi pärast uuesti.")
+                return
+            if not res.ok:
                 st.error("Vale salasõna.")
                 return
-            tok = ensure_user_token(uid)
+            tok = issue_session_ticket(uid)
             st.session_state.worker_token = tok
             try:
                 st.query_params["view"] = "worker"
@@ -2479,166 +2429,137 @@ def worker_view():
         "Ese puudus / vale kaup", "Ajapuudus", "Tehniline probleem", "Muu"
     ]
 
-    today = date.today()
-    # Kuva tööd kuupäevade kaupa (kasutame eelkõige tellimuse delivery_date; kui see puudub, siis route_date).
-    # OPEN: alates tänasest edasi; DONE/CANCELLED: näita ka viimased 7 päeva.
-    start_date = (today - timedelta(days=7)) if want_status != 'OPEN' else today
-    start_date_s = start_date.isoformat()
+    # Job list reruns on its own (fragment): new / reassigned jobs show up without reloading the page
+    @st.fragment(run_every=live_every())
+    def _job_list(want_status):
+        live_poll("worker", user_id=int(user['id']))
 
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT
-            ri.id as ri_id,
-            ri.route_id as route_id,
-            ri.order_id as order_id,
-            ri.seq as seq,
-            ri.ring_no as ring_no,
-            ri.worker_status as worker_status,
-            ri.worker_status_reason as worker_status_reason,
-            ri.worker_status_note as worker_status_note,
-            o.delivery_date as delivery_date,
-            o.delivery_window as delivery_window,
-            o.address as address,
-            o.ship_address as ship_address,
-            o.phone as phone,
-            o.client_name as client_name,
-            o.recipient_name as recipient_name,
-            o.notes as notes,
-            o.items_compact as items_compact,
-            o.stored_path as stored_path,
-            o.service_tag as service_tag,
-            r.route_date as route_date
-        FROM route_item_users riu
-        JOIN route_items ri ON ri.id = riu.ri_id
-        JOIN orders o ON o.id = ri.order_id
-        JOIN routes r ON r.id = ri.route_id
-        WHERE riu.user_id = ?
-          AND UPPER(ri.worker_status) = ?
-          AND COALESCE(NULLIF(o.delivery_date,''), r.route_date) >= ?
-        ORDER BY COALESCE(NULLIF(o.delivery_date,''), r.route_date),
-                 CASE WHEN o.delivery_window IS NULL OR o.delivery_window='' THEN 1 ELSE 0 END,
-                 o.delivery_window,
-                 ri.seq
-        """,
-        (int(user['id']), want_status.upper(), start_date_s)
-    )
-    rows_all = [dict(r) for r in cur.fetchall()]
+        today = date.today()
+        # Kuva tööd kuupäevade kaupa (kasutame eelkõige tellimuse delivery_date; kui see puudub, siis route_date).
+        # OPEN: alates tänasest edasi; DONE/CANCELLED: näita ka viimased 7 päeva.
+        start_date = (today - timedelta(days=7)) if want_status != 'OPEN' else today
+        start_date_s = start_date.isoformat()
 
-    shown_any = False
-    by_day = {}
-    for it in rows_all:
-        day = (it.get('delivery_date') or '').strip() or (it.get('route_date') or '').strip()
-        if not day:
-            continue
-        by_day.setdefault(day, []).append(it)
+        rows_all = list_worker_jobs(int(user['id']), want_status, start_date_s)
 
-    for day, rows in sorted(by_day.items(), key=lambda x: x[0]):
-        try:
-            d = date.fromisoformat(day)
-            day_label = d.strftime('%d.%m.%Y')
-        except Exception:
-            day_label = day
+        shown_any = False
+        by_day = {}
+        for it in rows_all:
+            day = (it.get('delivery_date') or '').strip() or (it.get('route_date') or '').strip()
+            if not day:
+                continue
+            by_day.setdefault(day, []).append(it)
+
+        for day, rows in sorted(by_day.items(), key=lambda x: x[0]):
+            try:
+                d = date.fromisoformat(day)
+                day_label = d.strftime('%d.%m.%Y')
+            except Exception:
+                day_label = day
 
-        st.markdown(f"## 📅 {day_label} ({len(rows)} tööd)")
-        shown_any = True
+            st.markdown(f"## 📅 {day_label} ({len(rows)} tööd)")
+            shown_any = True
 
-        def sort_key(it):
-            w = _parse_time_window_start(it.get('delivery_window',''))
-            seq = int(it.get('seq') or 999999)
-            return (w or dtime(23, 59), seq)
+            def sort_key(it):
+                w = _parse_time_window_start(it.get('delivery_window',''))
+                seq = int(it.get('seq') or 999999)
+                return (w or dtime(23, 59), seq)
 
         
-        rows = sorted(rows, key=sort_key)
-
-        # Grupeeri ringide kaupa (töölised näevad ringe samamoodi nagu logistik)
-        rings = {}
-        for it in rows:
-            rn = int(it.get('ring_no') or 1)
-            rings.setdefault(rn, []).append(it)
-
-        for rn in sorted(rings.keys()):
-            rrows = rings[rn]
-            st.markdown(f"### {rn} ring ({len(rrows)})")
-
-            for it in rrows:
-                ri_id = int(it.get('ri_id'))
-                window = (it.get('delivery_window') or '').strip() or '—'
-                addr = (it.get('address') or '').strip() or (it.get('ship_address') or '').strip() or '—'
-                phone = (it.get('phone') or '').strip()
-                client = (it.get('client_name') or '').strip() or (it.get('recipient_name') or '').strip() or '—'
-
-                svc_icons = _service_icons(it.get('service_tag') or '')
-                summary = f"{svc_icons} {client} • ⏱️ {window} • 📍 {addr} • 📞 {phone or '—'}"
-
-                # Üks töö korraga avatud (mobiilis scrolli jaoks)
-                open_key = "worker_open_ri"
-                if open_key not in st.session_state:
-                    st.session_state[open_key] = None
-
-                clicked = st.button(summary, key=f"wrow_{ri_id}", use_container_width=True)
-                if clicked:
-                    st.session_state[open_key] = None if st.session_state[open_key] == ri_id else ri_id
-
-                if st.session_state[open_key] == ri_id:
-                    actions = st.columns([1.2, 1.2, 1.6])
-                    if addr and addr != '—':
-                        try:
-                            actions[0].link_button('🗺️ Kaart', _map_link(addr), use_container_width=True)
-                        except Exception:
-                            actions[0].markdown(f'<a href="{_map_link(addr)}" target="_blank">🗺️ Kaart</a>', unsafe_allow_html=True)
-                    else:
-                        actions[0].button('🗺️ Kaart', disabled=True, use_container_width=True)
-
-                    if phone:
-                        try:
-                            actions[1].link_button('📞 Helista', f"tel:{phone}", use_container_width=True)
-                        except Exception:
-                            actions[1].markdown(f'<a href="tel:{phone}" style="text-decoration:none;">📞 Helista</a>', unsafe_allow_html=True)
-                    else:
-                        actions[1].button('📞 Helista', disabled=True, use_container_width=True)
-
-                    # märkus + tooted nagu logistiku vaates
-                    tab_notes, tab_items = st.tabs(["📝 Notes", "📦 Items"])
-                    with tab_notes:
-                        note_txt = (it.get('notes') or '').strip()
-                        if note_txt:
-                            st.info(note_txt)
+            rows = sorted(rows, key=sort_key)
+
+            # Grupeeri ringide kaupa (töölised näevad ringe samamoodi nagu logistik)
+            rings = {}
+            for it in rows:
+                rn = int(it.get('ring_no') or 1)
+                rings.setdefault(rn, []).append(it)
+
+            for rn in sorted(rings.keys()):
+                rrows = rings[rn]
+                st.markdown(f"### {rn} ring ({len(rrows)})")
+
+                for it in rrows:
+                    ri_id = int(it.get('ri_id'))
+                    ri_ver = seen_version("ri", ri_id, it.get('version'))
+                    window = (it.get('delivery_window') or '').strip() or '—'
+                    addr = (it.get('address') or '').strip() or (it.get('ship_address') or '').strip() or '—'
+                    phone = (it.get('phone') or '').strip()
+                    client = (it.get('client_name') or '').strip() or (it.get('recipient_name') or '').strip() or '—'
+
+                    svc_icons = _service_icons(it.get('service_tag') or '')
+                    summary = f"{live_mark(it)}{svc_icons} {client} • ⏱️ {window} • 📍 {addr} • 📞 {phone or '—'}"
+
+                    # Üks töö korraga avatud (mobiilis scrolli jaoks)
+                    open_key = "worker_open_ri"
+                    if open_key not in st.session_state:
+                        st.session_state[open_key] = None
+
+                    clicked = st.button(summary, key=f"wrow_{ri_id}", use_container_width=True)
+                    if clicked:
+                        st.session_state[open_key] = None if st.session_state[open_key] == ri_id else ri_id
+
+                    if st.session_state[open_key] == ri_id:
+                        actions = st.columns([1.2, 1.2, 1.6])
+                        if addr and addr != '—':
+                            try:
+                                actions[0].link_button('🗺️ Kaart', _map_link(addr), use_container_width=True)
+                            except Exception:
+                                actions[0].markdown(f'<a href="{_map_link(addr)}" target="_blank">🗺️ Kaart</a>', unsafe_allow_html=True)
                         else:
-                            st.caption("—")
-                    with tab_items:
-                        items = parse_items_compact(it.get('items_compact') or '')
-                        _render_items_boxes(items, title="📦 Items", show_title=True)
-
-                    # Status actions (kui OPEN)
-                    want_status = ((it.get('worker_status') or 'OPEN').strip()).upper()
-                    if want_status not in ('DONE','CANCELLED'):
-                        c1, c2 = st.columns([1.0, 1.0])
-                        if c1.button('✅ Done', key=f"done_{ri_id}"):
-                            update_route_item_status(ri_id, 'DONE', user_id=user['id'])
-                            st.rerun()
+                            actions[0].button('🗺️ Kaart', disabled=True, use_container_width=True)
 
-                        cancel_key = f"cancel_open_{ri_id}"
-                        if cancel_key not in st.session_state:
-                            st.session_state[cancel_key] = False
-                        if c2.button('⛔ Katkesta', key=f"cancel_btn_{ri_id}"):
-                            st.session_state[cancel_key] = not st.session_state[cancel_key]
-                        if st.session_state.get(cancel_key, False):
-                            reason = st.selectbox('Põhjus', cancel_reasons, key=f"rsn_{ri_id}")
-                            note = st.text_area('Märkus (valikuline)', key=f"nt_{ri_id}", height=70)
-                            if st.button('Save katkestus', key=f"save_cancel_{ri_id}"):
-                                update_route_item_status(ri_id, 'CANCELLED', user_id=user['id'], reason=reason, note=note)
+                        if phone:
+                            try:
+                                actions[1].link_button('📞 Helista', f"tel:{phone}", use_container_width=True)
+                            except Exception:
+                                actions[1].markdown(f'<a href="tel:{phone}" style="text-decoration:none;">📞 Helista</a>', unsafe_allow_html=True)
+                        else:
+                            actions[1].button('📞 Helista', disabled=True, use_container_width=True)
+
+                        # märkus + tooted nagu logistiku vaates (raskemad väljad laetakse alles avamisel)
+                        details = get_order_details(int(it.get('order_id')))
+                        tab_notes, tab_items = st.tabs(["📝 Notes", "📦 Items"])
+                        with tab_notes:
+                            note_txt = (details.get('notes') or '').strip()
+                            if note_txt:
+                                st.info(note_txt)
+                            else:
+                                st.caption("—")
+                        with tab_items:
+                            items = parse_items_compact(details.get('items_compact') or '')
+                            _render_items_boxes(items, title="📦 Items", show_title=True)
+
+                        # Status actions (kui OPEN)
+                        want_status = ((it.get('worker_status') or 'OPEN').strip()).upper()
+                        if want_status not in ('DONE','CANCELLED'):
+                            c1, c2 = st.columns([1.0, 1.0])
+                            if c1.button('✅ Done', key=f"done_{ri_id}"):
+                                update_route_item_status(ri_id, 'DONE', user_id=user['id'], expected_version=ri_ver)
                                 st.rerun()
-                    else:
-                        # DONE/CANCELLED: ainult info (mitte muuta)
-                        if want_status == 'CANCELLED':
-                            st.write(f"**Põhjus:** {it.get('worker_status_reason') or '—'}")
-                            st.write(f"**Märkus:** {it.get('worker_status_note') or '—'}")
 
-                    st.markdown("---")
-    if not shown_any:
-        st.info("Selles vaates pole järgmise 7 päeva jooksul töid.")
+                            cancel_key = f"cancel_open_{ri_id}"
+                            if cancel_key not in st.session_state:
+                                st.session_state[cancel_key] = False
+                            if c2.button('⛔ Katkesta', key=f"cancel_btn_{ri_id}"):
+                                st.session_state[cancel_key] = not st.session_state[cancel_key]
+                            if st.session_state.get(cancel_key, False):
+                                reason = st.selectbox('Põhjus', cancel_reasons, key=f"rsn_{ri_id}")
+                                note = st.text_area('Märkus (valikuline)', key=f"nt_{ri_id}", height=70)
+                                if st.button('Save katkestus', key=f"save_cancel_{ri_id}"):
+                                    update_route_item_status(ri_id, 'CANCELLED', user_id=user['id'], reason=reason, note=note,
+                                                             expected_version=ri_ver)
+                                    st.rerun()
+                        else:
+                            # DONE/CANCELLED: ainult info (mitte muuta)
+                            if want_status == 'CANCELLED':
+                                st.write(f"**Põhjus:** {it.get('worker_status_reason') or '—'}")
+                                st.write(f"**Märkus:** {it.get('worker_status_note') or '—'}")
+
+                        st.markdown("---")
+        if not shown_any:
+            st.info("Selles vaates pole järgmise 7 päeva jooksul töid.")
+
+    _job_list(want_status)
 
 
 # -------------------------
@@ -2646,6 +2567,15 @@ def worker_view():
 # -------------------------
 init_db()
 
+# Background online backups (one scheduler thread per server process, see backup.py)
+_bcfg = settings_snapshot()
+backup.SCHEDULER.ensure_started(
+    DB_PATH, BACKUP_DIR, ORDERS_DIR,
+    interval_min=_bcfg.get_int("backup_interval_min", backup.DEFAULT_INTERVAL_MIN),
+    keep=_bcfg.get_int("backup_keep", backup.DEFAULT_KEEP),
+    archive_path=ARCHIVE_PATH,
+)
+
 try:
     view = st.query_params.get("view", "")
 except Exception:
@@ -2686,6 +2616,7 @@ if (view or "").lower() == "pdf":
 # ADMIN UI
 # =========================
 render_header()
+show_conflicts()
 tabs = st.tabs(["📥 Orders", "👷 Workers", "🗓️ Route Planner", "🧾 Jobs", "⚙️ Settings"])
 
 
@@ -2696,9 +2627,11 @@ with tabs[0]:
 
     if st.button("Import uploaded PDFs", type="primary", disabled=not uploads):
         errors = []
+        imported_ids = []
         for up in uploads:
             stored = save_uploaded_pdf(up)
             order_id = insert_order(up.name, stored)
+            imported_ids.append(order_id)
             try:
                 text = extract_pdf_text(stored)
                 parsed = parse_aatrium_pdf_text(text)
@@ -2708,6 +2641,9 @@ with tabs[0]:
                     order_ref=parsed.get("order_ref",""),
                     recipient_name=parsed.get("recipient_name",""),
                     ship_address=parsed.get("ship_address",""),
+                    postal_code=parsed.get("postal_code",""),
+                    city=parsed.get("city",""),
+                    district=parsed.get("district",""),
                     service_tag=parsed.get("service_tag",""),
                     doc_author=parsed.get("doc_author",""),
                     doc_email=parsed.get("doc_email",""),
@@ -2724,6 +2660,8 @@ with tabs[0]:
             except Exception as e:
                 errors.append(f"{up.name}: {e}")
 
+        # Koordinaadid kohe impordil (üks päring + üks kirjutus kogu partii kohta)
+        geocode_orders(imported_ids)
         if errors:
             st.error("Mõni fail ei parsitud korrektselt:")
             for e in errors:
@@ -2732,6 +2670,60 @@ with tabs[0]:
         st.rerun()
 
     st.divider()
+
+    # 🔎 Otsing üle kõigi tellimuste + tööajaloo (FTS5)
+    sq1, sq2 = st.columns([4, 1], vertical_alignment="bottom")
+    search_q = sq1.text_input("🔎 Search orders & job history", key="order_search_q",
+                              placeholder="nt Tamm Pärnu mnt • 5123 1232 • 123456/18.10.2026 • diivan")
+    search_period = sq2.selectbox("Period", ["Any time", "Last 7 days", "Last 30 days", "Last 365 days"], key="order_search_period")
+    if search_q.strip():
+        period_days = {"Last 7 days": 7, "Last 30 days": 30, "Last 365 days": 365}.get(search_period)
+        since = (date.today() - timedelta(days=period_days)).isoformat() if period_days else ""
+        t0 = time.perf_counter()
+        hits = search_orders(search_q, since=since)
+        st.caption(f"{len(hits)} results • {(time.perf_counter() - t0) * 1000:.0f} ms")
+        if not hits:
+            st.info("Nothing found.")
+
+        open_key = "search_open_id"
+        if open_key not in st.session_state:
+            st.session_state[open_key] = None
+        status_emoji = {"OPEN": "🟦", "DONE": "✅", "CANCELLED": "⛔"}
+        for h in hits:
+            client = (h.get("client_name") or h.get("recipient_name") or "—").strip()
+            addr = (h.get("address") or h.get("ship_address") or "—").strip().replace("\n", ", ")
+            phone = (h.get("phone") or "—").strip()
+            last = ""
+            if h.get("last_route_date"):
+                last = f" • {status_emoji.get(h.get('last_worker_status') or 'OPEN', '🟦')} {fmt_date(h['last_route_date'])}"
+                if h.get("last_worker_names"):
+                    last += f" ({h['last_worker_names']})"
+            label = f"{_service_icons(h.get('service_tag') or '')} #{h['id']} {client} • 📍 {addr} • 📞 {phone}{last}"
+            is_open = st.session_state[open_key] == h["id"]
+            if st.button(("▾ " if is_open else "▸ ") + label, key=f"srch_{h['id']}", use_container_width=True):
+                st.session_state[open_key] = None if is_open else h["id"]
+                st.rerun()
+            if is_open:
+                details = get_order_details(int(h["id"]))
+                st.write(f"**Status:** {h.get('status') or '—'} • **Order:** {h.get('order_ref') or '—'} • "
+                         f"**Delivery:** {fmt_date(h.get('delivery_date') or '') or '—'} {h.get('delivery_window') or ''}")
+                if (details.get("notes") or "").strip():
+                    st.markdown("**📝 Notes**")
+                    st.write(details.get("notes"))
+                history = get_order_history(int(h["id"]))
+                if history:
+                    st.markdown("**🧾 Job history**")
+                    for jh in history:
+                        line = (f"{status_emoji.get((jh.get('worker_status') or 'OPEN').upper(), '🟦')} "
+                                f"{fmt_date(jh.get('route_date') or '')} • {jh.get('ring_no') or 1} ring • "
+                                f"{jh.get('worker_names') or '—'}")
+                        if jh.get("worker_status_reason"):
+                            line += f" • {jh['worker_status_reason']}"
+                        st.write(line)
+                if (details.get("items_compact") or "").strip():
+                    _render_items_boxes(details["items_compact"], title="", show_title=False)
+        st.divider()
+
     status_filter = st.selectbox("Filter by status", ["ALL", "NEW", "CONTACTED", "SCHEDULED", "READY FOR WORK"])
     orders = list_orders(status_filter=status_filter)
     st.caption(f"Orders: {len(orders)}")
@@ -2755,6 +2747,7 @@ with tabs[0]:
             st.info("Manual fields will appear here.")
     else:
         o = get_order(selected_id)
+        o_ver = seen_version("order", selected_id, o.get("version"))
 
         with mid_view:
             c_pdf_btn, c_pdf_title = st.columns([1, 8], vertical_alignment='center')
@@ -2795,6 +2788,12 @@ with tabs[0]:
             client = st.text_input("Client", value=o.get("client_name", "") or "")
             phone = st.text_input("Phone", value=o.get("phone", "") or "")
             address = st.text_area("Address", value=o.get("address", "") or "", height=90)
+            coords_was = f"{o['lat']}, {o['lon']}" if o.get("lat") is not None and o.get("lon") is not None else ""
+            coords_txt = st.text_input(
+                "Coordinates (lat, lon)",
+                value=coords_was,
+                placeholder="59.437, 24.745", help="Ringi optimeerimiseks (🧭 Optimeeri ring)",
+            )
 
             dval = (o.get("delivery_date") or "").strip()
             try:
@@ -2839,9 +2838,17 @@ with tabs[0]:
 
             notes = st.text_area("Notes", value=o.get("notes", "") or "", height=220)
 
+            coords = ring_optimizer.parse_coords(coords_txt)
             if st.button("💾 Save changes", type="primary", use_container_width=True):
-                update_order(
+                if coords_txt.strip() and not coords:
+                    st.error("Koordinaadid kujul: 59.437, 24.745")
+                    st.stop()
+                # Untouched coordinates are left out: a new address is geocoded again
+                typed = {"lat": coords[0] if coords else None, "lon": coords[1] if coords else None}
+                saved = update_order(
                     selected_id,
+                    expected_version=o_ver,
+                    **(typed if coords_txt.strip() != coords_was else {}),
                     status=new_status,
                     client_name=client,
                     phone=phone,
@@ -2850,7 +2857,8 @@ with tabs[0]:
                     delivery_window=delivery_window,
                     notes=notes,
                 )
-                st.success("Savetud.")
+                if saved:
+                    st.success("Savetud.")
                 st.rerun()
 
 
@@ -2901,8 +2909,8 @@ with tabs[4]:
         if pick_id:
             st.divider()
             if st.button("🔄 Reset token (if the link leaked)", use_container_width=True):
-                reset_user_token(pick_id)
-                st.success("Token reset tehtud.")
+                st.session_state.worker_link = (pick_id, reset_user_token(pick_id))
+                st.success("Token reset tehtud. Vanad lingid ja sisselogimised ei kehti enam.")
                 st.rerun()
 
         if pick_id and st.button("🗑️ Delete worker", use_container_width=True):
@@ -2919,67 +2927,180 @@ with tabs[4]:
         else:
             pick = st.selectbox("Select worker lingi jaoks", [f"{u['name']} (ID {u['id']})" for u in users])
             uid = int(pick.split("ID")[1].strip().rstrip(")"))
-            tok = ensure_user_token(uid)
-            link = f"{base_url}/?view=worker&token={tok}"
-            st.code(link, language=None)
-            _copy_button(link, "📋 Copy link")
+            # Tokens are stored hashed: a link can be shown only right after it is created
+            n_tok = count_user_tokens(uid)
+            st.caption(f"Aktiivseid linke / sisselogimisi: {n_tok}")
+            if st.button("➕ Create link", use_container_width=True):
+                st.session_state.worker_link = (uid, issue_user_token(uid, "link"))
+            link_uid, tok = st.session_state.get("worker_link") or (None, "")
+            if link_uid == uid and tok:
+                link = f"{base_url}/?view=worker&token={tok}"
+                st.code(link, language=None)
+                _copy_button(link, "📋 Copy link")
+            else:
+                st.caption("Vana linki ei saa uuesti näidata — loo uus (vanad jäävad kehtima kuni token reset).")
+
+        st.divider()
+        st.markdown("### 🗄️ Archive")
+        arc_days = st.number_input(
+            "Archive finished routes older than (days)", min_value=7, step=1, key="archive_after_days",
+            value=settings_snapshot().get_int(archive.SETTING_KEY, archive.DEFAULT_AFTER_DAYS),
+        )
+        if st.button("Archive now", use_container_width=True):
+            set_setting(archive.SETTING_KEY, str(int(arc_days)))
+            try:
+                totals = archive.run(DB_PATH, ARCHIVE_PATH, after_days=int(arc_days))
+                st.success(f"Arhiveeritud: {totals['routes']} routes • {totals['route_items']} jobs • {totals['orders']} orders")
+            except sqlite3.Error as e:
+                st.error(f"Archive failed: {e}")
+        arc_counts = archive.stats(db())
+        st.caption(" • ".join(f"{t}: {hot} hot / {cold} archived" for t, (hot, cold) in arc_counts.items())
+                   + " — nightly: python archive.py")
+
+        st.divider()
+        st.markdown("### 📍 Geocoding")
+        gz1, gz2 = st.columns([2, 1], vertical_alignment="bottom")
+        gaz_file = gz1.file_uploader("Gazetteer CSV (street, house, lat, lon[, city])", type=["csv", "txt"],
+                                     key="gazetteer_csv")
+        gaz_city = gz2.text_input("City (rows without one)", value="Tallinn", key="gazetteer_city")
+        gb1, gb2 = st.columns(2)
+        if gb1.button("Import gazetteer", use_container_width=True, disabled=gaz_file is None):
+            try:
+                n_rows = import_gazetteer(gaz_file, gaz_city)
+                st.success(f"Imporditud: {n_rows} aadressi • koordinaadid lisatud {geocode_orders()} tellimusele")
+            except (ValueError, sqlite3.Error) as e:
+                st.error(f"Import failed: {e}")
+        if gb2.button("Geocode orders without coordinates", use_container_width=True):
+            st.success(f"Koordinaadid lisatud {geocode_orders()} tellimusele")
+        gs = repo().geocode_stats()
+        st.caption(f"Gazetteer: {gs['gazetteer']} addresses • cache: {gs['cached']} found / {gs['misses']} not found • "
+                   f"orders without coordinates: {gs['orders_without_coords']} — CLI: python geocode.py import FILE")
+        if st.button("Re-extract postal code / city / district", key="area_backfill",
+                     help="Kõigi tellimuste aadressist uuesti (CLI: python address_area.py backfill --all)"):
+            st.success(f"Piirkond uuendatud {repo().backfill_order_areas(only_missing=False)} tellimusel")
+
+        st.divider()
+        st.markdown("### 💾 Backups")
+        bc1, bc2 = st.columns(2)
+        bk_interval = bc1.number_input("Every (minutes, 0 = off)", min_value=0, step=15, key="backup_interval_min",
+                                       value=settings_snapshot().get_int("backup_interval_min", backup.DEFAULT_INTERVAL_MIN))
+        bk_keep = bc2.number_input("Keep snapshots", min_value=1, step=1, key="backup_keep",
+                                   value=settings_snapshot().get_int("backup_keep", backup.DEFAULT_KEEP))
+        bb1, bb2 = st.columns(2)
+        if bb1.button("Save backup settings", use_container_width=True):
+            set_settings({"backup_interval_min": str(int(bk_interval)), "backup_keep": str(int(bk_keep))})
+            st.toast("Backup settings saved", icon="✅")
+        if bb2.button("Backup now", use_container_width=True):
+            try:
+                e = backup.snapshot(DB_PATH, BACKUP_DIR, ORDERS_DIR, keep=int(bk_keep), archive_path=ARCHIVE_PATH)
+                st.success(f"{e['file']}{' + ' + e['archive'] if e.get('archive') else ''} • "
+                           f"{e['size'] / 1e6:.1f} MB • {e['seconds']:.1f}s")
+            except (OSError, sqlite3.Error) as e:
+                st.error(f"Backup failed: {e}")
+        snaps = backup.load_manifest(BACKUP_DIR)["snapshots"]
+        if snaps:
+            last = snaps[-1]
+            st.caption(f"Last: {last['file']} ({last['created']}, {last['size'] / 1e6:.1f} MB, {last['seconds']:.1f}s) • "
+                       f"{len(snaps)} kept • restore: python backup.py restore FILE --pdfs")
+        if backup.SCHEDULER.last_error:
+            st.warning(f"Last scheduled backup failed: {backup.SCHEDULER.last_error}")
+
+        st.divider()
+        st.markdown("### 🔄 Live updates")
+        lv1, lv2 = st.columns([2, 1], vertical_alignment="bottom")
+        live_sec = lv1.number_input("Refresh open worker / planner lists every (seconds, 0 = off)", min_value=0, step=1,
+                                    key="live_refresh_sec",
+                                    value=settings_snapshot().get_int("live_refresh_sec", live.DEFAULT_EVERY_SEC))
+        if lv2.button("Save", key="save_live_refresh", use_container_width=True):
+            set_setting("live_refresh_sec", str(int(live_sec)))
+            st.toast("Saved – applies on the next page load", icon="✅")
+
+        cs = readcache.CACHE.stats()
+        ws = live.WATCHER.stats()
+        ls = auth.VERIFIER.stats()
+        ms = travel_matrix.CACHE.stats()
+        es = ring_eta.CACHE.stats()
+        ns = nav_plan.stats()
+        st.caption(
+            f"Read cache: {cs['hits']} hits / {cs['misses']} misses ({cs['hit_rate']:.0%}) • "
+            f"{cs['entries']} entries • {cs['evictions']} evictions • {cs['invalidations']} invalidations • "
+            f"Live: {ws['polls']} polls / {ws['head_reads']} change checks (head #{ws['head']}) • "
+            f"Logins: {ls['ok']} ok / {ls['wrong']} wrong / {ls['limited']} limited / {ls['busy']} busy • "
+            f"Travel matrices: {ms['dates']} dates, {ms['builds']} built / {ms['updates']} updated / {ms['hits']} reused • "
+            f"ETAs: {es['rings']} rings, {es['hits']} reused / {es['partial']} partial / {es['full']} full • "
+            f"Navigation plans: {ns['plans']} cached, {ns['hits']} reused / {ns['misses']} built"
+        )
 
 
 # ---- TAB 3: Route Planner ----
 with tabs[2]:
     st.subheader("Route Planner (by date)")
     # ---- Google Maps ring seaded (salvestub DB-sse) ----
-    # Presetid: Warehouse / Kontor / Muu
-    preset = get_setting("maps_preset", "Warehouse")
-    addr_ladu = get_setting("maps_ladu_addr", "Liivalao 11, Tallinn")
-    addr_kontor = get_setting("maps_kontor_addr", "")
-    addr_muu = get_setting("maps_custom_addr", "")
-    return_to_start = get_setting("maps_return_to_start", "0") == "1"
+    # Presetid: Warehouse / Kontor / Muu (üks settings snapshot kogu vaate jaoks)
+    cfg = settings_snapshot()
 
     with st.expander("🧭 Map settings", expanded=False):
         # Presets
-        preset = get_setting("maps_start_preset", "Warehouse")
-        presets = {
-            "Warehouse": get_setting("maps_start_ladu", "Liivalao 11, Tallinn"),
-            "Kontor": get_setting("maps_start_kontor", "Liivalao 11, Tallinn"),
-            "Muu…": get_setting("maps_start_custom", ""),
-        }
+        preset = cfg.maps_start_preset
+        presets = cfg.maps_start_presets
 
         cA, cB = st.columns([1.2, 1.8])
         with cA:
             start_choice = st.selectbox("Start", list(presets.keys()), index=list(presets.keys()).index(preset) if preset in presets else 0)
-            return_to_start = st.checkbox("Back to start (route)", value=(get_setting("maps_return","0") == "1"))
+            return_to_start = st.checkbox("Back to start (route)", value=cfg.maps_return)
         with cB:
             if start_choice == "Muu…":
                 start_value = st.text_input("Start aadress", value=presets["Muu…"], placeholder="nt Liivalao 11, Tallinn")
             else:
                 start_value = st.text_input("Start aadress", value=presets[start_choice])
+            start_coords = st.text_input("Start coordinates (lat, lon)", value=cfg.maps_start_coords,
+                                         placeholder="59.392, 24.728", help="Ringi optimeerimise alguspunkt")
+
+        _model = travel_matrix.SpeedModel.from_settings(cfg)
+        tm1, tm2, tm3, tm4 = st.columns(4)
+        road_factor = tm1.number_input("Road factor", min_value=1.0, max_value=3.0, step=0.05, value=_model.road_factor,
+                                       help="Teekond km = linnulennu km × tegur")
+        city_kmh = tm2.number_input("City speed (km/h)", min_value=5.0, max_value=90.0, step=1.0, value=_model.city_kmh)
+        city_km = tm3.number_input("City part of a leg (km)", min_value=0.0, max_value=50.0, step=0.5, value=_model.city_km)
+        road_kmh = tm4.number_input("Road speed (km/h)", min_value=10.0, max_value=120.0, step=1.0, value=_model.road_kmh)
+        eta_start = st.text_input("Day start (ETA)", value=cfg.get(ring_eta.DAY_START_KEY, ring_eta.DEFAULT_DAY_START),
+                                  placeholder="08:00", help="Ringi esimese töö saabumisaja arvutuse algus")
 
         s1, s2 = st.columns([1,1])
         if s1.button("💾 Save", use_container_width=True):
             # store preset values too (so user can edit Warehouse/Kontor)
-            if start_choice == "Warehouse":
-                set_setting("maps_start_ladu", start_value)
-                set_setting("maps_start", start_value)
-            elif start_choice == "Kontor":
-                set_setting("maps_start_kontor", start_value)
-                set_setting("maps_start", start_value)
-            else:
-                set_setting("maps_start_custom", start_value)
-                set_setting("maps_start", start_value)
-
-            set_setting("maps_start_preset", start_choice)
-            set_setting("maps_return", "1" if return_to_start else "0")
+            preset_key = settings_store.START_PRESETS.get(start_choice, settings_store.START_PRESETS["Muu…"])[0]
+            if start_coords.strip() and not ring_optimizer.parse_coords(start_coords):
+                st.error("Koordinaadid kujul: 59.392, 24.728")
+                st.stop()
+            if ring_eta.parse_time(eta_start) is None:
+                st.error("Päeva algus kujul: 08:00")
+                st.stop()
+            set_settings({
+                preset_key: start_value,
+                "maps_start": start_value,
+                "maps_start_preset": start_choice,
+                "maps_start_coords": start_coords,
+                "maps_return": "1" if return_to_start else "0",
+                "travel_road_factor": f"{road_factor:g}",
+                "travel_city_kmh": f"{city_kmh:g}",
+                "travel_city_km": f"{city_km:g}",
+                "travel_road_kmh": f"{road_kmh:g}",
+                ring_eta.DAY_START_KEY: ring_eta.fmt(ring_eta.parse_time(eta_start)),
+            })
             st.success("Savetud.")
             st.rerun()
 
         if s2.button("↩️ Reset (Liivalao 11)", use_container_width=True):
-            set_setting("maps_start", "Liivalao 11, Tallinn")
-            set_setting("maps_start_ladu", "Liivalao 11, Tallinn")
-            set_setting("maps_start_kontor", "Liivalao 11, Tallinn")
-            set_setting("maps_start_custom", "")
-            set_setting("maps_start_preset", "Warehouse")
-            set_setting("maps_return", "0")
+            default_start = settings_store.DEFAULT_MAPS_START
+            set_settings({
+                "maps_start": default_start,
+                "maps_start_ladu": default_start,
+                "maps_start_kontor": default_start,
+                "maps_start_custom": "",
+                "maps_start_preset": "Warehouse",
+                "maps_return": "0",
+            })
             st.success("Reset tehtud.")
             st.rerun()
 
@@ -2996,13 +3117,18 @@ with tabs[2]:
         with left:
             st.markdown("### Add orders to route")
             # Kiirvalikud: Ready jobs / Scheduled (et ei peaks PDF nime järgi otsima)
-            conn = db()
-            cur = conn.cursor()
-            cur.execute("SELECT order_id FROM route_items WHERE route_id=?", (route_id,))
-            in_route = {r[0] for r in cur.fetchall()}
+            in_route = repo().route_order_ids(route_id)
+            draft = route_draft_for(route_id)
+            if draft is not None:
+                # Mustandis: eemaldatud tööd on jälle vabad, lisatud tööd mitte
+                in_route = (in_route - (set(draft.base) - set(draft.stops))) | set(draft.stops)
+
+            # Piirkonna järgi (linnaosa / vald, siis postiindeks): karm geograafiline järjekord ka ilma koordinaatideta
+            by_area = st.checkbox("Group by district", key="plan_by_district",
+                                help="Linnaosa / vald, seejärel postiindeksi järgi")
 
             def _available_by_status(wanted_status: str):
-                all_o = list_orders(status_filter=wanted_status)
+                all_o = list_orders(status_filter=wanted_status, by_area=by_area)
                 return [o for o in all_o if o['id'] not in in_route]
 
             c_team, c_ring = st.columns([3, 1], vertical_alignment='center')
@@ -3020,8 +3146,15 @@ with tabs[2]:
                 with st.expander(f"{label} ({len(lst)})", expanded=False):
                     if not lst:
                         st.caption("None.")
+                    area_counts = {}
+                    if by_area:
+                        for o in lst:
+                            area_counts[o.get('district') or ''] = area_counts.get(o.get('district') or '', 0) + 1
+                    shown_area = None
                     for o in lst:
-                        o = dict(o)  # sqlite3.Row -> dict for .get()
+                        if by_area and (o.get('district') or '') != shown_area:
+                            shown_area = o.get('district') or ''
+                            st.caption(f"📍 **{shown_area or 'Piirkond teadmata'}** ({area_counts[shown_area]})")
                         # Ühe töö rida: vasakul toggel (detailid), paremal väike ➕ lisa
                         with st.container(border=True):
                             c_main, c_add = st.columns([9, 1], vertical_alignment='center')
@@ -3042,6 +3175,12 @@ with tabs[2]:
                                     st.session_state.open_quick_orders.add(o['id'])
                                 st.rerun()
                             if c_add.button("➕", key=f"quick_add_{st_key}_{o['id']}", use_container_width=True):
+                                if draft is not None:
+                                    if not picked_ids:
+                                        st.error("Vali vähemalt 1 töötaja.")
+                                    elif draft.add(o, ring_pick_quick, picked_ids, route_date):
+                                        st.rerun()
+                                    continue
                                 ok, msg = add_order_to_route(route_id, int(o['id']), picked_ids, ring_no=ring_pick_quick)
                                 if ok:
                                     st.success(msg or 'Lisatud.')
@@ -3049,14 +3188,15 @@ with tabs[2]:
                                     st.error(msg)
                         
                             if (o['id'] in st.session_state.open_quick_orders):
-                                if (o.get('notes') or '').strip():
+                                details = get_order_details(int(o['id']))
+                                if (details.get('notes') or '').strip():
                                     st.markdown('**📝 Notes**')
-                                    st.write(o.get('notes') or '')
+                                    st.write(details.get('notes') or '')
                         
-                                items = (o.get('items_compact') or '').strip()
+                                items = (details.get('items_compact') or '').strip()
                                 if items:
                                     st.markdown('**📦 Items**')
-                                    pdf_path = (o.get('stored_path') or '').strip()
+                                    pdf_path = (details.get('stored_path') or '').strip()
                                     if pdf_path and os.path.exists(pdf_path):
                                         with open(pdf_path, 'rb') as _f:
                                             _pdf_bytes = _f.read()
@@ -3065,161 +3205,394 @@ with tabs[2]:
                                         st.button('📄 PDF', disabled=True)
                                     _render_items_boxes(items, title='', show_title=False)
 
+            # Automaatne jaotus: tööd meeskondade ja ringide vahel töömahu järgi (auto_assign.py)
+            with st.expander("⚖️ Auto-assign", expanded=False):
+                saved_crews = auto_assign.crews_from_settings(cfg)
+                user_names = {uid: name for name, uid in user_opts.items()}
+                n_crews = st.number_input("Crews", min_value=1, max_value=8, step=1, value=max(1, len(saved_crews)), key="aa_n_crews")
+                crews = []
+                for n in range(int(n_crews)):
+                    c = saved_crews[n] if n < len(saved_crews) else auto_assign.Crew([])
+                    a1, a2, a3, a4 = st.columns([3, 1, 1, 1], vertical_alignment="bottom")
+                    names = a1.multiselect(f"Crew {n + 1}", list(user_opts), key=f"aa_users_{n}",
+                                           default=[user_names[u] for u in c.user_ids if u in user_names])
+                    hours = a2.number_input("Hours", min_value=0.5, max_value=16.0, step=0.5, value=c.capacity_min / 60, key=f"aa_hours_{n}")
+                    n_rings = a3.number_input("Rings", min_value=1, max_value=auto_assign.MAX_RINGS, step=1, value=c.rings, key=f"aa_rings_{n}")
+                    ring_units = a4.number_input("Pieces / ring", min_value=1, max_value=500, step=1, value=c.ring_units, key=f"aa_units_{n}",
+                                                 help="Auto koorem ühe ringi kohta (tk)")
+                    crews.append(auto_assign.Crew([user_opts[x] for x in names], hours * 60, n_rings, ring_units))
+                crews = [c for c in crews if c.user_ids]
+                aa_statuses = st.multiselect("Orders", list(auto_assign.STATUSES), default=list(auto_assign.STATUSES), key="aa_statuses")
+
+                ab1, ab2 = st.columns(2)
+                if ab1.button("💾 Save crews", use_container_width=True, key="aa_save"):
+                    set_setting(auto_assign.SETTING_KEY, auto_assign.crews_setting(crews))
+                    st.toast("Crews saved", icon="✅")
+                if ab2.button("⚖️ Plan", use_container_width=True, key="aa_plan_btn", disabled=not crews or not aa_statuses):
+                    jobs, on_route = list_assign_jobs(route_id, aa_statuses)
+                    st.session_state.aa_plan = {
+                        "route_id": route_id,
+                        "crews": crews,
+                        "jobs": {j.order_id: j for j in jobs},
+                        "result": auto_assign.plan(jobs, crews, on_route),
+                    }
+
+                aa = st.session_state.get("aa_plan")
+                if aa and aa["route_id"] == route_id:
+                    res = aa["result"]
+                    by_crew = {}
+                    for oid, n, ring in res["assignments"]:
+                        by_crew.setdefault(n, []).append((ring, aa["jobs"][oid]))
+                    for n, crew in enumerate(aa["crews"]):
+                        load = res["crews"][n]
+                        names = ", ".join(user_names.get(u, f"#{u}") for u in crew.user_ids)
+                        st.markdown(f"**{names}** — {load['load_min'] / 60:.1f} / {crew.capacity_min / 60:.1f} h • "
+                                    + " • ".join(f"{r + 1}. ring {u}/{crew.ring_units} tk" for r, u in enumerate(load['ring_units'])))
+                        for ring, job in sorted(by_crew.get(n, []), key=lambda x: (x[0], x[1].order_id)):
+                            st.caption(f"{ring}. ring • #{job.order_id} {job.label} • {job.units} tk • ~{job.minutes:.0f} min")
+                    if res["unassigned"]:
+                        st.warning(f"Ei mahu: {len(res['unassigned'])} tööd "
+                                   + ", ".join(f"#{oid}" for oid in res["unassigned"][:20]))
+                    st.caption(f"Plan: {len(res['assignments'])} tööd • {res['seconds'] * 1000:.0f} ms")
+                    ap1, ap2 = st.columns(2)
+                    if ap1.button("✅ Apply plan", type="primary", use_container_width=True, key="aa_apply",
+                                  disabled=not res["assignments"]):
+                        ok, msg = assign_orders(route_id, [(oid, aa["crews"][n].user_ids, ring)
+                                                           for oid, n, ring in res["assignments"]])
+                        if ok:
+                            st.session_state.pop("aa_plan", None)
+                            st.toast(msg, icon="⚖️")
+                            st.rerun()
+                        st.error(msg)
+                    if ap2.button("✖️ Discard", use_container_width=True, key="aa_discard"):
+                        st.session_state.pop("aa_plan", None)
+                        st.rerun()
+
+            # Ringide ettepanek: kaardil kokku kuuluvad tööd (k-means, ring_clusters.py)
+            with st.expander("🧩 Ring proposals", expanded=False):
+                pc1, pc2 = st.columns([1, 1], vertical_alignment="bottom")
+                prop_size = pc1.number_input("Stops per ring", min_value=2, max_value=60, step=1,
+                                             value=ring_clusters.RING_SIZE, key="prop_ring_size")
+                prop_all_dates = pc2.checkbox("All delivery dates", value=False, key="prop_all_dates")
+                if st.button("🧩 Propose rings", use_container_width=True, key="prop_btn"):
+                    cand = [o for st_key in auto_assign.STATUSES for o in _available_by_status(st_key)
+                            if prop_all_dates or (o.get("delivery_date") or route_date) == route_date]
+                    t0 = time.perf_counter()
+                    st.session_state.ring_proposals = {
+                        "route_id": route_id,
+                        "rings": ring_clusters.propose(cand, ring_size=int(prop_size),
+                                                       start=ring_optimizer.parse_coords(cfg.maps_start_coords)),
+                        "labels": {int(o["id"]): f"#{o['id']} {(o.get('client_name') or o.get('recipient_name') or '—').strip()} • "
+                                                  f"{(o.get('address') or o.get('ship_address') or '—').strip()}" for o in cand},
+                        "missing": sum(1 for o in cand if ring_optimizer.row_coords(o) is None),
+                        "ms": (time.perf_counter() - t0) * 1000,
+                    }
+
+                props = st.session_state.get("ring_proposals")
+                if props and props["route_id"] == route_id:
+                    st.caption(f"{len(props['rings'])} ettepanekut • {props['ms']:.0f} ms"
+                               + (f" • {props['missing']} tööd ilma koordinaatideta" if props["missing"] else ""))
+                    for n, prop in enumerate(props["rings"]):
+                        pending = [oid for oid in prop["order_ids"] if oid not in in_route]
+                        if not pending:
+                            continue
+                        with st.container(border=True):
+                            st.markdown(f"**{n + 1}. {len(pending)} tööd** • raadius {prop['radius_km']:.1f} km • "
+                                        f"~{prop['km']:.1f} km" + (f" • {prop['from_start_km']:.1f} km startist" if prop['from_start_km'] else ""))
+                            st.caption(" → ".join(props["labels"].get(oid, f"#{oid}") for oid in pending[:8])
+                                       + (" …" if len(pending) > 8 else ""))
+                            pr1, pr2, pr3 = st.columns([3, 1, 1.2], vertical_alignment="bottom")
+                            prop_users = pr1.multiselect("Workers", list(user_opts), default=picked_user_names, key=f"prop_users_{n}")
+                            prop_ring = pr2.selectbox("Ring", [1, 2, 3, 4], index=0, key=f"prop_ring_{n}")
+                            if pr3.button("✅ Accept", use_container_width=True, key=f"prop_accept_{n}"):
+                                ok, msg = insert_ring(route_id, pending, [user_opts[x] for x in prop_users], ring_no=prop_ring)
+                                if ok:
+                                    st.toast(msg, icon="🧩")
+                                    st.rerun()
+                                st.error(msg)
+
         with right:
-            st.markdown("### Route Planner")
+            # Route list reruns on its own (fragment) and picks up workers' status changes live
+            @st.fragment(run_every=live_every())
+            def _route_panel():
+                live_poll("planner", route_id=route_id)
+                st.markdown("### Route Planner")
+
+                # Mustand: muudatused mälus, salvestus ühe tehinguna (route_draft.py)
+                draft = route_draft_for(route_id)
+                if draft is not None:
+                    render_route_draft(draft, route_date)
+                    return
+                if st.button("🧪 Mustand (what-if)", key="draft_start",
+                             help="Proovi muudatusi ilma salvestamata; Commit salvestab kõik korraga"):
+                    st.session_state.route_draft = start_route_draft(route_id, route_date)
+                    st.rerun()
 
-            items = list_route_items(route_id)
-            if not items:
-                st.info("Route is empty on this date.")
-            else:
-                # Grupp tarne kuupäeva järgi (order.delivery_date). See võimaldab ühes ringis mitut kuupäeva.
-                by_date = {}
-                for it in items:
-                    d = (it.get("delivery_date") or "").strip() or route_date
-                    by_date.setdefault(d, []).append(it)
-
-                status_emoji = {"OPEN": "🟦", "DONE": "✅", "CANCELLED": "⛔"}
-                sections = [("OPEN", "Lisatud tööd"), ("DONE", "Done tööd"), ("CANCELLED", "Cancelled tööd")]
-
-                # Datea plokkide avamine/sulgemine (vältimaks expanders-in-expanders viga)
-                if "open_date_blocks" not in st.session_state:
-                    st.session_state.open_date_blocks = set()
-
-                for d, date_items in sorted(by_date.items(), key=lambda x: x[0]):
-                    # Datea rida + Google Maps ring (ainult selle kuupäeva tööd)
-                    c1 = st.container()  # kuupäeva nupp täislaiuses
-                    with c1:
-                        try:
-                            d_label = datetime.fromisoformat(d).strftime("%d.%m.%Y")
-                        except Exception:
-                            d_label = d
-
-                        btn_label = f"📅 {d_label} ({len(date_items)} tööd)"
-                        if st.button(btn_label, key=f"date_toggle_{d}", use_container_width=True):
-                            if d in st.session_state.open_date_blocks:
-                                st.session_state.open_date_blocks.remove(d)
-                            else:
-                                st.session_state.open_date_blocks.add(d)
-                            st.rerun()
+                items = list_route_items(route_id)
+                if not items:
+                    st.info("Route is empty on this date.")
+                else:
+                    # Grupp tarne kuupäeva järgi (order.delivery_date). See võimaldab ühes ringis mitut kuupäeva.
+                    by_date = {}
+                    for it in items:
+                        d = (it.get("delivery_date") or "").strip() or route_date
+                        by_date.setdefault(d, []).append(it)
+
+                    status_emoji = {"OPEN": "🟦", "DONE": "✅", "CANCELLED": "⛔"}
+                    sections = [("OPEN", "Lisatud tööd"), ("DONE", "Done tööd"), ("CANCELLED", "Cancelled tööd")]
+
+                    # Datea plokkide avamine/sulgemine (vältimaks expanders-in-expanders viga)
+                    if "open_date_blocks" not in st.session_state:
+                        st.session_state.open_date_blocks = set()
+
+                    for d, date_items in sorted(by_date.items(), key=lambda x: x[0]):
+                        # Datea rida + Google Maps ring (ainult selle kuupäeva tööd)
+                        c1 = st.container()  # kuupäeva nupp täislaiuses
+                        with c1:
+                            try:
+                                d_label = datetime.fromisoformat(d).strftime("%d.%m.%Y")
+                            except Exception:
+                                d_label = d
+
+                            btn_label = f"📅 {d_label} ({len(date_items)} tööd)"
+                            if st.button(btn_label, key=f"date_toggle_{d}", use_container_width=True):
+                                if d in st.session_state.open_date_blocks:
+                                    st.session_state.open_date_blocks.remove(d)
+                                else:
+                                    st.session_state.open_date_blocks.add(d)
+                                st.rerun()
 
-                    if d not in st.session_state.open_date_blocks:
-                        continue
-
-                    # Jobs selle kuupäeva sees (tiimi kaupa, staatuse kaupa)
-                    grouped = {}
-                    for it in date_items:
-                        grouped.setdefault((it.get("worker_names") or "—"), []).append(it)
-
-                    for team_name, its in grouped.items():
-                        st.markdown(f"#### {team_name} ({len(its)})")
-
-                        by_status = {"OPEN": [], "DONE": [], "CANCELLED": []}
-                        for it in its:
-                            s = (it.get("worker_status") or "OPEN").upper()
-                            if s not in by_status:
-                                s = "OPEN"
-                            by_status[s].append(it)
-
-                        for st_key, title in sections:
-                            block = by_status.get(st_key, [])
-                            if not block:
-                                continue
-
-                            if st_key != "OPEN":
-                                st.markdown(f"**{title}** ({len(block)})")
-
-                            # Mitme ringi tugi (ring_no). Kui on ainult 1 ring, siis ei kuva eraldi pealkirja.
-                            # Gruppimine ringide kaupa (näitame alati 1 ring + kaardi nupp iga ringi taga)
-                            block_sorted = sorted(block, key=lambda x: (int(x.get('ring_no') or 1), int(x.get('seq') or 0)))
-                            rings = {}
-                            for _it in block_sorted:
-                                rn = int(_it.get('ring_no') or 1)
-                                rings.setdefault(rn, []).append(_it)
+                        if d not in st.session_state.open_date_blocks:
+                            continue
+
+                        # Jobs selle kuupäeva sees (tiimi kaupa, staatuse kaupa)
+                        grouped = {}
+                        for it in date_items:
+                            grouped.setdefault((it.get("worker_names") or "—"), []).append(it)
+
+                        for team_name, its in grouped.items():
+                            st.markdown(f"#### {team_name} ({len(its)})")
+
+                            by_status = {"OPEN": [], "DONE": [], "CANCELLED": []}
+                            for it in its:
+                                s = (it.get("worker_status") or "OPEN").upper()
+                                if s not in by_status:
+                                    s = "OPEN"
+                                by_status[s].append(it)
+
+                            for st_key, title in sections:
+                                block = by_status.get(st_key, [])
+                                if not block:
+                                    continue
+
+                                if st_key != "OPEN":
+                                    st.markdown(f"**{title}** ({len(block)})")
+
+                                # Mitme ringi tugi (ring_no). Kui on ainult 1 ring, siis ei kuva eraldi pealkirja.
+                                # Gruppimine ringide kaupa (näitame alati 1 ring + kaardi nupp iga ringi taga)
+                                block_sorted = sorted(block, key=lambda x: (int(x.get('ring_no') or 1), int(x.get('seq') or 0)))
+                                rings = {}
+                                for _it in block_sorted:
+                                    rn = int(_it.get('ring_no') or 1)
+                                    rings.setdefault(rn, []).append(_it)
                             
-                            _global_start = get_setting('maps_start', 'Liivalao 11, Tallinn')
-                            _global_return = (get_setting('maps_return', '') or get_setting('maps_return_to_start', '0')) == '1'
+                                _global_start = cfg.maps_start
+                                _global_return = cfg.maps_return
                             
-                            for rn in sorted(rings.keys()):
-                                ring_rows = rings[rn]
-                                addr_list = []
-                                # kasuta sama aadressi loogikat nagu tööreal; ei filtreeri staatuse järgi
-                                for _x in ring_rows:
-                                    _addr = ((_x.get('address') or '').strip() or (_x.get('ship_address') or '').strip() or (_x.get('delivery_address') or '').strip())
-                                    if _addr and _addr != '—':
-                                        addr_list.append(_addr)
-                                settings_key = f"maps_ring_{d}_{team_name}_{rn}"
-                                try:
-                                    _ring_cfg = json.loads(get_setting(settings_key, "{}") or "{}")
-                                except Exception:
-                                    _ring_cfg = {}
-                                sp = (_ring_cfg.get('start') or _global_start).strip() or _global_start
-                                ret = bool(_ring_cfg.get('return', _global_return))
-                                maps_url = _maps_dir_link(addr_list, start_point=sp, return_to_start=ret) if addr_list else ''
+                                for rn in sorted(rings.keys()):
+                                    ring_rows = rings[rn]
+                                    ring_seen = {int(_x['ri_id']): seen_version("ri", _x['ri_id'], _x.get('version')) for _x in ring_rows}
+                                    settings_key = cfg.ring_key(d, team_name, rn)
+                                    _ring_cfg = cfg.ring_config(settings_key)
+                                    sp = (_ring_cfg.get('start') or _global_start).strip() or _global_start
+                                    ret = bool(_ring_cfg.get('return', _global_return))
+                                    sp_coords = ring_optimizer.parse_coords(sp) or (
+                                        ring_optimizer.parse_coords(cfg.maps_start_coords) if sp == _global_start else None)
+                                    # Navigatsioon: Google Maps lõikudena (waypoint'ide piirang) + GPX / KML
+                                    nav = ring_nav(ring_rows, sp, sp_coords, ret)
+                                    maps_url = nav['legs'][0]['url'] if nav['legs'] else ''
                             
-                                spc, h1, h2, h3 = st.columns([0.9, 7.3, 0.9, 0.9], vertical_alignment='center')
-                                with h1:
-                                    ring_uid = str((ring_rows[0].get("ri_id") or ring_rows[0].get("id") or ring_rows[0].get("order_id") or ""))
-                                    open_key = f"open_ring_{d}_{team_name}_{rn}_{ring_uid}"
-                                    if open_key not in st.session_state:
-                                        st.session_state[open_key] = True
-                                    label = f"{rn} ring"
-                                    if st.button(label, key=f"tog_{d}_{team_name}_{rn}_{ring_uid}", use_container_width=True):
-                                        st.session_state[open_key] = not st.session_state[open_key]
-                                with h2:
-                                    if maps_url:
-                                        st.link_button('🗺️', maps_url, use_container_width=True)
-                                    else:
-                                        st.button('🗺️', disabled=True, use_container_width=True, key=f"mapd_{d}_{team_name}_{st_key}_{rn}")
-                                with h3:
-                                    if st.button('⚙️', key=f"mapcfg_{d}_{team_name}_{st_key}_{rn}", use_container_width=True):
-                                        st.session_state[f"open_mapcfg_{d}_{team_name}_{rn}"] = not st.session_state.get(f"open_mapcfg_{d}_{team_name}_{rn}", False)
+                                    spc, h1, h2, h3, h4 = st.columns([0.9, 6.4, 0.9, 0.9, 0.9], vertical_alignment='center')
+                                    near_key = f"open_near_{d}_{team_name}_{rn}"
+                                    if st_key == "OPEN":
+                                        if spc.button('🔍', key=f"neartog_{d}_{team_name}_{rn}", use_container_width=True,
+                                                      help="Lähedal olevad lisamata tööd"):
+                                            st.session_state[near_key] = not st.session_state.get(near_key, False)
+                                    with h1:
+                                        ring_uid = str((ring_rows[0].get("ri_id") or ring_rows[0].get("id") or ring_rows[0].get("order_id") or ""))
+                                        open_key = f"open_ring_{d}_{team_name}_{rn}_{ring_uid}"
+                                        if open_key not in st.session_state:
+                                            st.session_state[open_key] = True
+                                        label = f"{rn} ring"
+                                        if st.button(label, key=f"tog_{d}_{team_name}_{rn}_{ring_uid}", use_container_width=True):
+                                            st.session_state[open_key] = not st.session_state[open_key]
+                                    with h2:
+                                        if maps_url:
+                                            st.link_button('🗺️', maps_url, use_container_width=True)
+                                        else:
+                                            st.button('🗺️', disabled=True, use_container_width=True, key=f"mapd_{d}_{team_name}_{st_key}_{rn}")
+                                    with h3:
+                                        if st.button('⚙️', key=f"mapcfg_{d}_{team_name}_{st_key}_{rn}", use_container_width=True):
+                                            st.session_state[f"open_mapcfg_{d}_{team_name}_{rn}"] = not st.session_state.get(f"open_mapcfg_{d}_{team_name}_{rn}", False)
+                                    order_key = f"open_order_{d}_{team_name}_{st_key}_{rn}"
+                                    with h4:
+                                        if st.button('↕️', key=f"ordtog_{d}_{team_name}_{st_key}_{rn}", use_container_width=True, disabled=len(ring_rows) < 2):
+                                            st.session_state[order_key] = not st.session_state.get(order_key, False)
+
+                                    if len(nav['legs']) > 1:
+                                        _leg_cols = st.columns(len(nav['legs']))
+                                        for _n, (_lc, _leg) in enumerate(zip(_leg_cols, nav['legs']), start=1):
+                                            _lc.link_button(f"🗺️ {_n}/{len(nav['legs'])}: {_leg['first']}–{_leg['last']}", _leg['url'],
+                                                            use_container_width=True,
+                                                            help=f"{_leg['from']} → {_leg['to']}")
+
+                                    # Lähedal olevad tööd: ruudustikuindeks + lisanduv ringi pikkus (nearby.py)
+                                    if st_key == "OPEN" and st.session_state.get(near_key, False):
+                                        nc1, nc2 = st.columns([1, 3], vertical_alignment='bottom')
+                                        near_r = nc1.number_input('Raadius (km)', min_value=0.5, max_value=30.0, step=0.5,
+                                                                  value=nearby.DEFAULT_RADIUS_KM, key=f"near_r_{d}_{team_name}_{rn}")
+                                        near = suggest_nearby(route_id, ring_rows, sp_coords, ret, near_r)
+                                        if not any(ring_optimizer.row_coords(_x) for _x in ring_rows):
+                                            nc2.caption('Ringis pole koordinaatidega töid.')
+                                        elif not near:
+                                            nc2.caption(f"{near_r:g} km raadiuses pole lisamata töid.")
+                                        else:
+                                            nc2.caption(f"{len(near)} lähimat (lisanduv sõit)")
+                                        _ring_users = {j.ri_id: j.user_ids for j in list_assign_jobs(route_id)[1]}.get(int(ring_rows[0]['ri_id']), ())
+                                        for _sg in near:
+                                            _o = get_order(_sg['order_id'])
+                                            _client = ((_o.get('client_name') or '').strip() or (_o.get('recipient_name') or '').strip() or '—')
+                                            _addr = ((_o.get('address') or '').strip() or (_o.get('ship_address') or '').strip() or '—')
+                                            ns1, ns2 = st.columns([9, 1], vertical_alignment='center')
+                                            ns1.markdown(f"{_service_icons(_o.get('service_tag') or '')} {_client} • 📍 {_addr} • ⏱️ {(_o.get('delivery_window') or '—').strip()} "
+                                                         f"• **+{_sg['detour_km']:.1f} km** (~{_sg['detour_min']:.0f} min) • {_sg['nearest_km']:.1f} km lähimast")
+                                            if ns2.button('➕', key=f"near_add_{d}_{team_name}_{rn}_{_sg['order_id']}", use_container_width=True):
+                                                ok, msg = add_nearby_order(route_id, _sg['order_id'], _ring_users, rn, _sg)
+                                                (st.success if ok else st.error)(msg)
+                                                if ok:
+                                                    st.rerun()
+
+                                    # Järjekord: vii töö suvalisele kohale (1 UPDATE) või järjesta kogu ring korraga
+                                    if st.session_state.get(order_key, False) and len(ring_rows) > 1:
+                                        _labels = {int(_x['ri_id']): f"{n}. {(_x.get('client_name') or _x.get('recipient_name') or '—').strip()} • {(_x.get('address') or _x.get('ship_address') or '—').strip()}"
+                                                   for n, _x in enumerate(ring_rows, start=1)}
+                                        oc1, oc2, oc3 = st.columns([5, 1.5, 1.5], vertical_alignment='bottom')
+                                        pick_ri = oc1.selectbox('Töö', list(_labels), format_func=lambda x: _labels[x], key=f"ordpick_{d}_{team_name}_{st_key}_{rn}")
+                                        new_pos = oc2.number_input('Uus koht', min_value=1, max_value=len(ring_rows), value=1, step=1, key=f"ordpos_{d}_{team_name}_{st_key}_{rn}")
+                                        if oc3.button('Move', key=f"ordmove_{d}_{team_name}_{st_key}_{rn}", use_container_width=True):
+                                            _others = [int(_x['ri_id']) for _x in ring_rows if int(_x['ri_id']) != int(pick_ri)]
+                                            if int(new_pos) <= len(_others):
+                                                move_route_item_next_to(int(pick_ri), _others[int(new_pos) - 1], expected_version=ring_seen.get(int(pick_ri)))
+                                            else:
+                                                move_route_item_next_to(int(pick_ri), _others[-1], after=True, expected_version=ring_seen.get(int(pick_ri)))
+                                            st.rerun()
+                                        ob1, ob2, ob3 = st.columns(3)
+                                        if ob3.button('🧭 Optimeeri ring', key=f"ordopt_{d}_{team_name}_{st_key}_{rn}", use_container_width=True,
+                                                      help="Lühim sõidujärjekord alguspunktist (koordinaatidega tööd)"):
+                                            _dm = day_matrix(route_date, items, starts=[sp_coords])
+                                            plan = ring_optimizer.optimize_ring(ring_rows, start=sp_coords, return_to_start=ret, matrix=_dm)
+                                            if not plan['changed']:
+                                                st.toast('Järjekord on juba parim leitud.', icon='🧭')
+                                            elif apply_ring_order(route_id, rn, plan['order'], expected_versions=ring_seen):
+                                                _path = ([travel_matrix.start_key(sp_coords)] if sp_coords else []) + [ri for ri in plan['order'] if ri in _dm]
+                                                _msg = (f"Ring optimeeritud: {plan['before_km']:.1f} → {plan['after_km']:.1f} km "
+                                                        f"(~{_dm.path_minutes(_path, closed=ret):.0f} min sõitu)")
+                                                if plan['missing']:
+                                                    _msg += f" • {len(plan['missing'])} tööd ilma koordinaatideta ringi lõpus"
+                                                st.toast(_msg, icon='🧭')
+                                            st.rerun()
+                                        if ob1.button('⏱️ Järjesta ajaakna järgi', key=f"ordwin_{d}_{team_name}_{st_key}_{rn}", use_container_width=True):
+                                            _by_window = sorted(ring_rows, key=lambda _x: (_parse_time_window_start(_x.get('delivery_window') or '') or dtime(23, 59), int(_x.get('seq') or 0)))
+                                            apply_ring_order(route_id, rn, [int(_x['ri_id']) for _x in _by_window], expected_versions=ring_seen)
+                                            st.rerun()
+                                        if ob2.button('🔁 Pööra ümber', key=f"ordrev_{d}_{team_name}_{st_key}_{rn}", use_container_width=True):
+                                            apply_ring_order(route_id, rn, [int(_x['ri_id']) for _x in reversed(ring_rows)], expected_versions=ring_seen)
+                                            st.rerun()
+
+                                    if st.session_state.get(f"open_mapcfg_{d}_{team_name}_{rn}", False):
+                                        csp1, csp2 = st.columns([3, 2], vertical_alignment='center')
+                                        with csp1:
+                                            new_sp = st.text_input('Startpunkt', value=sp, key=f"sp_{d}_{team_name}_{rn}")
+                                        with csp2:
+                                            new_ret = st.checkbox('Tagasi algusesse', value=ret, key=f"ret_{d}_{team_name}_{rn}")
+                                        if st.button('Save', key=f"savecfg_{d}_{team_name}_{rn}", use_container_width=False):
+                                            set_setting(settings_key, json.dumps({'start': new_sp.strip(), 'return': bool(new_ret)}))
+                                            st.toast('Kaardi seaded salvestatud', icon='✅')
+                                        if nav['gpx']:
+                                            _fname = f"ring_{d}_{re.sub(r'[^0-9A-Za-z]+', '_', team_name).strip('_') or 'tiim'}_{rn}"
+                                            gx1, gx2, gx3 = st.columns([1, 1, 3], vertical_alignment='center')
+                                            gx1.download_button('⬇️ GPX', data=nav['gpx'], file_name=f"{_fname}.gpx", mime='application/gpx+xml',
+                                                                key=f"gpx_{d}_{team_name}_{st_key}_{rn}", use_container_width=True)
+                                            gx2.download_button('⬇️ KML', data=nav['kml'], file_name=f"{_fname}.kml", mime='application/vnd.google-earth.kml+xml',
+                                                                key=f"kml_{d}_{team_name}_{st_key}_{rn}", use_container_width=True)
+                                            if nav['unlocated']:
+                                                gx3.caption(f"{len(nav['unlocated'])} tööd ilma koordinaatideta – failis puuduvad")
                             
-                                if st.session_state.get(f"open_mapcfg_{d}_{team_name}_{rn}", False):
-                                    csp1, csp2 = st.columns([3, 2], vertical_alignment='center')
-                                    with csp1:
-                                        new_sp = st.text_input('Startpunkt', value=sp, key=f"sp_{d}_{team_name}_{rn}")
-                                    with csp2:
-                                        new_ret = st.checkbox('Tagasi algusesse', value=ret, key=f"ret_{d}_{team_name}_{rn}")
-                                    if st.button('Save', key=f"savecfg_{d}_{team_name}_{rn}", use_container_width=False):
-                                        set_setting(settings_key, json.dumps({'start': new_sp.strip(), 'return': bool(new_ret)}))
-                                        st.toast('Kaardi seaded salvestatud', icon='✅')
-                            
-                                if st.session_state.get(open_key, True):
-                                    for it in ring_rows:
-                                        window = (it.get('delivery_window') or '').strip() or '—'
-                                        addr = (it.get('address') or '').strip() or (it.get('ship_address') or '').strip() or '—'
-                                        phone = (it.get('phone') or '').strip() or '—'
-                                        client = ((it.get('client_name') or '').strip() or (it.get('recipient_name') or '').strip() or '—')
-                                        svc_icons = _service_icons(it.get('service_tag') or '')
-                                        col_ctrl, row_exp, row_rm = st.columns([0.9, 8.2, 0.9], vertical_alignment='center')
-                                        with col_ctrl:
-                                            if st.button('⬆', key=f"up_{st_key}_{it['ri_id']}"):
-                                                move_route_item(int(it['ri_id']), -1); st.rerun()
-                                        if row_rm.button('✖', key=f"rm_{st_key}_{it['ri_id']}"):
-                                            remove_route_item(int(it['ri_id'])); st.rerun()
-                                        header = f"{svc_icons} {client} • ⏱️ {window} • 📍 {addr} • 📞 {phone}"
-                                        with row_exp:
-                                            with st.expander(header, expanded=False):
-                                                if (it.get('notes') or '').strip():
-                                                    st.markdown('**📝 Notes**')
-                                                    st.write(it.get('notes') or '')
-                                                items = (it.get('items_compact') or '').strip()
-                                                if items:
-                                                    st.markdown('**📦 Items**')
-                                                    pdf_path = (it.get('stored_path') or '').strip()
-                                                    if pdf_path and os.path.exists(pdf_path):
-                                                        with open(pdf_path, 'rb') as _f:
-                                                            _pdf_bytes = _f.read()
-                                                        st.download_button('📄 PDF', data=_pdf_bytes, file_name=os.path.basename(pdf_path), mime='application/pdf', use_container_width=False, key=f"dl_ring_{st_key}_{it['ri_id']}")
-                                                    else:
-                                                        st.button('📄 PDF', disabled=True)
-                                                    _render_items_boxes(items, title='', show_title=False)
-                                                if st_key == 'CANCELLED':
-                                                    st.write(f"**Põhjus:** {it.get('worker_status_reason') or '—'}")
-                                                    st.write(f"**Märkus:** {it.get('worker_status_note') or '—'}")
+                                    _eta = {}
+                                    if st_key == "OPEN":
+                                        _eta = ring_etas((route_id, d, team_name, rn), ring_rows, route_id,
+                                                         day_matrix(route_date, items, starts=[sp_coords]), start=sp_coords,
+                                                         return_to_start=ret)
+                                        _eta_msg = (f"🕒 {ring_eta.fmt(_eta['stops'][int(ring_rows[0]['ri_id'])].arrival)} → "
+                                                    f"{ring_eta.fmt(_eta['end'])} • ~{_eta['drive_min']:.0f} min sõitu")
+                                        if _eta['wait_min'] >= 1:
+                                            _eta_msg += f" • ⏳ {_eta['wait_min']:.0f} min ootamist"
+                                        if _eta['late']:
+                                            _eta_msg += f" • ⚠️ {len(_eta['late'])} hilinemist ajaaknast"
+                                        if _eta['unlocated']:
+                                            _eta_msg += f" • {len(_eta['unlocated'])} ilma koordinaatideta (hinnang)"
+                                        st.caption(_eta_msg)
+
+                                    if st.session_state.get(open_key, True):
+                                        for row_n, it in enumerate(ring_rows):
+                                            window = (it.get('delivery_window') or '').strip() or '—'
+                                            addr = (it.get('address') or '').strip() or (it.get('ship_address') or '').strip() or '—'
+                                            phone = (it.get('phone') or '').strip() or '—'
+                                            client = ((it.get('client_name') or '').strip() or (it.get('recipient_name') or '').strip() or '—')
+                                            svc_icons = _service_icons(it.get('service_tag') or '')
+                                            col_ctrl, row_exp, row_rm = st.columns([0.9, 8.2, 0.9], vertical_alignment='center')
+                                            with col_ctrl:
+                                                # ⬆ = eelmise nähtava töö ette (teiste tiimide tööd samas ringis jäävad paigale)
+                                                if st.button('⬆', key=f"up_{st_key}_{it['ri_id']}", disabled=row_n == 0):
+                                                    move_route_item_next_to(int(it['ri_id']), int(ring_rows[row_n - 1]['ri_id']),
+                                                                            expected_version=ring_seen.get(int(it['ri_id']))); st.rerun()
+                                            if row_rm.button('✖', key=f"rm_{st_key}_{it['ri_id']}"):
+                                                remove_route_item(int(it['ri_id'])); st.rerun()
+                                            header = (f"{live_mark(it)}{svc_icons} {client} • ⏱️ {window}"
+                                                      f"{eta_label(_eta.get('stops', {}).get(int(it['ri_id'])))} • 📍 {addr} • 📞 {phone}")
+                                            # Toggle instead of st.expander: expander bodies run even when collapsed,
+                                            # so the heavy order fields would be loaded for every row.
+                                            if 'open_ring_items' not in st.session_state:
+                                                st.session_state.open_ring_items = set()
+                                            row_open = it['ri_id'] in st.session_state.open_ring_items
+                                            with row_exp:
+                                                if st.button(('▾ ' if row_open else '▸ ') + header, key=f"ritog_{st_key}_{it['ri_id']}", use_container_width=True):
+                                                    st.session_state.open_ring_items ^= {it['ri_id']}
+                                                    st.rerun()
+                                                if row_open:
+                                                    details = get_order_details(int(it['order_id']))
+                                                    if (details.get('notes') or '').strip():
+                                                        st.markdown('**📝 Notes**')
+                                                        st.write(details.get('notes') or '')
+                                                    items_txt = (details.get('items_compact') or '').strip()
+                                                    if items_txt:
+                                                        st.markdown('**📦 Items**')
+                                                        pdf_path = (details.get('stored_path') or '').strip()
+                                                        if pdf_path and os.path.exists(pdf_path):
+                                                            with open(pdf_path, 'rb') as _f:
+                                                                _pdf_bytes = _f.read()
+                                                            st.download_button('📄 PDF', data=_pdf_bytes, file_name=os.path.basename(pdf_path), mime='application/pdf', use_container_width=False, key=f"dl_ring_{st_key}_{it['ri_id']}")
+                                                        else:
+                                                            st.button('📄 PDF', disabled=True, key=f"dl_ring_off_{st_key}_{it['ri_id']}")
+                                                        _render_items_boxes(items_txt, title='', show_title=False)
+                                                    if st_key == 'CANCELLED':
+                                                        st.write(f"**Põhjus:** {it.get('worker_status_reason') or '—'}")
+                                                        st.write(f"**Märkus:** {it.get('worker_status_note') or '—'}")
+                            st.divider()
+
                         st.divider()
 
-                    st.divider()
+            _route_panel()
 
 
 
@@ -3308,7 +3681,7 @@ with tabs[1]:
 
             st.divider()
 
-            # --- Job list (expanders at ONE level only)
+            # --- Job list (one open job at a time)
             for it in by_day.get(sel_day, []):
                 window = (it.get("delivery_window") or "").strip() or "—"
                 addr = (it.get("address") or "").strip() or (it.get("ship_address") or "").strip() or "—"
@@ -3318,15 +3691,25 @@ with tabs[1]:
 
                 summary = f"{svc_icons} {client} • ⏱️ {window} • 📍 {addr} • 📞 {phone}"
 
-                with st.expander(summary, expanded=False):
-                    if (it.get("notes") or "").strip():
+                # Toggle (not st.expander) so order details are only loaded for the open job
+                open_key = "worker_tab_open_ri"
+                if open_key not in st.session_state:
+                    st.session_state[open_key] = None
+                is_open = st.session_state[open_key] == it["ri_id"]
+                if st.button(("▾ " if is_open else "▸ ") + summary, key=f"wk_job_{uid}_{mode}_{it['ri_id']}", use_container_width=True):
+                    st.session_state[open_key] = None if is_open else it["ri_id"]
+                    st.rerun()
+
+                if is_open:
+                    details = get_order_details(int(it["order_id"]), history=mode != "OPEN")
+                    if (details.get("notes") or "").strip():
                         st.markdown("**📝 Notes**")
-                        st.write(it.get("notes") or "")
+                        st.write(details.get("notes") or "")
 
-                    items_txt = (it.get("items_compact") or "").strip()
+                    items_txt = (details.get("items_compact") or "").strip()
                     if items_txt:
                         st.markdown("**📦 Items**")
-                        pdf_path = (it.get("stored_path") or "").strip()
+                        pdf_path = (details.get("stored_path") or "").strip()
                         if pdf_path and os.path.exists(pdf_path):
                             with open(pdf_path, "rb") as _f:
                                 _pdf_bytes = _f.read()
@@ -3339,7 +3722,7 @@ with tabs[1]:
                                 key=f"dl_wk_{uid}_{mode}_{it['ri_id']}",
                             )
                         else:
-                            st.button("📄 PDF", disabled=True)
+                            st.button("📄 PDF", disabled=True, key=f"dl_wk_off_{uid}_{mode}_{it['ri_id']}")
                         _render_items_boxes(items_txt, title="", show_title=False)
 
                     if mode == "CANCELLED":
@@ -3360,19 +3743,8 @@ with tabs[1]:
 with tabs[3]:
     st.subheader("Jobs (done & cancelled)")
 
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT r.route_date AS d, COUNT(*) AS n
-        FROM route_items ri
-        JOIN routes r ON r.id = ri.route_id
-        WHERE COALESCE(ri.worker_status,'OPEN') IN ('DONE','CANCELLED')
-        GROUP BY r.route_date AND ri.worker_status IN ('DONE','CANCELLED')
-        ORDER BY r.route_date DESC
-        """
-    )
-    days = cur.fetchall() or []
+    # Päevade nimekiri tuleb daily_job_stats tabelist (üks indekseeritud päring)
+    days = list_job_days()
 
     if not days:
         st.info("No done or cancelled jobs found.")
@@ -3380,39 +3752,24 @@ with tabs[3]:
         if "open_work_days" not in st.session_state:
             st.session_state.open_work_days = {}
 
-        for row in days:
-            d = row["d"]
-            n = int(row["n"] or 0)
+        for d, counts in days:
+            n = sum(counts.values())
+            parts = [f"✅ {counts['DONE']}" if counts.get("DONE") else "", f"⛔ {counts['CANCELLED']}" if counts.get("CANCELLED") else ""]
             # täislaiuses kuupäeva nupp
-            if st.button(f"📅 {fmt_date(d)} ({n})", key=f"workday_{d}", use_container_width=True):
+            if st.button(f"📅 {fmt_date(d)} ({n}) {' '.join(p for p in parts if p)}", key=f"workday_{d}", use_container_width=True):
                 st.session_state.open_work_days[d] = not st.session_state.open_work_days.get(d, False)
 
             if not st.session_state.open_work_days.get(d, False):
                 continue
 
+            per_worker = list_job_day_workers(d)
+            if per_worker:
+                st.caption(" • ".join(
+                    f"{name}: ✅ {c.get('DONE', 0)} ⛔ {c.get('CANCELLED', 0)}" for _uid, name, c in per_worker
+                ))
+
             # Päeva tööd: grupi tiimi kaupa
-            cur.execute(
-                """
-                SELECT
-                    ri.id AS ri_id,
-                    ri.worker_status AS ri_status,
-                    COALESCE(GROUP_CONCAT(u.name, ', '), '') AS worker_names,
-                    o.*
-                FROM route_items ri
-                JOIN orders o ON o.id = ri.order_id
-                JOIN routes r ON r.id = ri.route_id
-                LEFT JOIN route_item_users riu ON riu.ri_id = ri.id
-                LEFT JOIN users u ON u.id = riu.user_id
-                WHERE r.route_date = ?
-                  AND COALESCE(ri.worker_status,'OPEN') IN ('DONE','CANCELLED')
-                GROUP BY ri.id
-                ORDER BY worker_names, o.delivery_window, o.id
-                """,
-                (d,),
-            )
-            rows = cur.fetchall() or []
-            # sqlite row -> dict
-            items = [dict(x) for x in rows]
+            items = list_day_jobs(d)
 
             teams_map = {}
             for it in items:
@@ -3421,8 +3778,8 @@ with tabs[3]:
             for team_name, its in teams_map.items():
                 st.markdown(f"#### {team_name} ({len(its)})")
 
-                done = [x for x in its if (x.get("ri_status") or "OPEN") == "DONE"]
-                canc = [x for x in its if (x.get("ri_status") or "OPEN") == "CANCELLED"]
+                done = [x for x in its if (x.get("worker_status") or "OPEN").upper() == "DONE"]
+                canc = [x for x in its if (x.get("worker_status") or "OPEN").upper() == "CANCELLED"]
 
                 def _render_done_list(title, lst, icon):
                     if not lst:
@@ -3444,7 +3801,7 @@ with tabs[3]:
                         if st.button(label, key=f"jobrow_{title}_{cur_id}", use_container_width=True):
                             st.session_state[open_key] = None if st.session_state[open_key] == cur_id else cur_id
                         if st.session_state[open_key] == cur_id:
-
+                            it = get_order_details(int(it["order_id"]), history=True) | {"id": it["order_id"], "ri_id": it["ri_id"]}
                             notes = (it.get("notes") or "").strip()
                             if notes:
                                 st.markdown("**📝 Notes**")
@@ -0,0 +1,373 @@
+"""Hot/cold archival: old finished routes move from db.sqlite into archive.sqlite.
+
+A route is archived when its route_date is older than the configured age and
+none of its items is still OPEN. Its route_items, their route_item_users links,
+the orders used only by archived routes and the daily_job_stats counts move
+with it, in batches of routes (the archive's job counts are recomputed per day).
+
+Each batch is two transactions on the hot connection with the archive ATTACHed as
+"arc": copy (INSERT OR REPLACE, so a re-run after a crash is harmless), then
+delete from the hot tables. With WAL a commit spanning two files is not atomic,
+so the delete only ever follows a committed copy. The copy keeps the ids and
+versions it took in TEMP tables and the delete removes exactly those rows; a
+route written to in between (an item added, edited, reopened or removed, one
+of its orders edited) stays hot, its copy is taken out of the archive again and
+the next run retries it. Afterwards the hot file is shrunk with PRAGMA
+incremental_vacuum.
+
+History readers go through TEMP views (hist_routes, hist_route_items,
+hist_route_item_users, hist_orders, hist_daily_job_stats) created by attach():
+main UNION ALL arc when the archive exists, main only otherwise. Ids are
+AUTOINCREMENT in the hot db, so they never collide with archived ones.
+
+Run from the command line (e.g. nightly):
+    python archive.py [--days 180] [--batch 200] [--dry-run]
+"""
+import argparse
+import os
+import re
+import sqlite3
+import time
+from datetime import date, timedelta
+
+ARCHIVE_SCHEMA = "arc"
+DEFAULT_AFTER_DAYS = 180
+SETTING_KEY = "archive_after_days"
+VACUUM_CHUNK = 256        # incremental_vacuum steps per write transaction
+
+# Archived tables, parents first.
+TABLES = ("routes", "orders", "route_items", "route_item_users", "daily_job_stats")
+HISTORY_VIEWS = {t: f"hist_{t}" for t in TABLES}
+
+
+def table_names(history: bool = False) -> dict:
+    """Table -> name to read from: the hist_* views for history queries, else the hot table."""
+    return dict(HISTORY_VIEWS) if history else {t: t for t in TABLES}
+
+
+def default_archive_path(db_path: str) -> str:
+    return os.path.join(os.path.dirname(db_path), "archive.sqlite")
+
+
+def _columns(conn, schema: str, table: str) -> list:
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def is_attached(conn) -> bool:
+    return any(r[1] == ARCHIVE_SCHEMA for r in conn.execute("PRAGMA database_list").fetchall())
+
+
+def _sync_archive_schema(conn):
+    """Create missing archive tables from the hot DDL; add columns the hot tables gained since."""
+    for table in TABLES:
+        row = conn.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+        if not row:
+            continue
+        if not _columns(conn, ARCHIVE_SCHEMA, table):
+            ddl = re.sub(
+                r"^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?[\"'`\[]?\w+[\"'`\]]?",
+                f"CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.{table}",
+                row[0], count=1, flags=re.IGNORECASE,
+            )
+            conn.execute(ddl)
+            continue
+        have = set(_columns(conn, ARCHIVE_SCHEMA, table))
+        for r in conn.execute(f"PRAGMA main.table_info({table})").fetchall():
+            if r[1] not in have:
+                # ADD COLUMN can't take NOT NULL without a default; archive copies don't need it.
+                conn.execute(f"ALTER TABLE {ARCHIVE_SCHEMA}.{table} ADD COLUMN {r[1]} {r[2] or ''}")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_arc_routes_date ON routes(route_date)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_arc_route_items_route ON route_items(route_id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_arc_route_items_order ON route_items(order_id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_arc_riu_ri ON route_item_users(ri_id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_arc_riu_user ON route_item_users(user_id)")
+    import order_search  # order_search imports this module
+    order_search.ensure_archive_index(conn.cursor(), ARCHIVE_SCHEMA)
+
+
+def _create_history_views(conn, with_archive: bool):
+    for table, view in HISTORY_VIEWS.items():
+        conn.execute(f"DROP VIEW IF EXISTS temp.{view}")
+        cols = _columns(conn, "main", table)
+        if not cols:
+            continue
+        sql = f"SELECT {', '.join(cols)} FROM main.{table}"
+        if with_archive:
+            arc_cols = set(_columns(conn, ARCHIVE_SCHEMA, table))
+            if arc_cols:
+                picked = ", ".join(c if c in arc_cols else f"NULL AS {c}" for c in cols)
+                sql += f" UNION ALL SELECT {picked} FROM {ARCHIVE_SCHEMA}.{table}"
+        conn.execute(f"CREATE TEMP VIEW {view} AS {sql}")
+
+
+def attach(conn, archive_path: str, create: bool = False) -> bool:
+    """ATTACH the archive (if it exists, or create=True) and (re)build the hist_* views.
+
+    Must run outside a transaction. Returns True when the archive is attached.
+    """
+    attached = is_attached(conn)
+    if not attached and (create or os.path.exists(archive_path)):
+        conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (archive_path,))
+        attached = True
+    if attached and create:
+        conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.journal_mode=WAL")
+        _sync_archive_schema(conn)
+    _create_history_views(conn, attached)
+    return attached
+
+
+def _pick_routes(conn, cutoff: str, batch: int, skip=()) -> list:
+    rows = conn.execute("""
+        SELECT r.id FROM main.routes r
+        WHERE r.route_date < ?
+          AND NOT EXISTS (
+              SELECT 1 FROM main.route_items ri
+              WHERE ri.route_id = r.id
+                AND COALESCE(NULLIF(UPPER(ri.worker_status),''),'OPEN') = 'OPEN'
+          )
+        ORDER BY r.route_date, r.id
+        LIMIT ?
+    """, (cutoff, int(batch) + len(skip))).fetchall()
+    return [int(r[0]) for r in rows if int(r[0]) not in skip][:int(batch)]
+
+
+def _copy_sql(conn, table: str, where: str) -> str:
+    cols = ", ".join(c for c in _columns(conn, "main", table) if c in set(_columns(conn, ARCHIVE_SCHEMA, table)))
+    return f"INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE {where}"
+
+
+def _recount_days(conn, days: str):
+    """Recompute the archive's daily_job_stats of the route dates selected by days (idempotent on re-runs)."""
+    status = "COALESCE(NULLIF(UPPER(ri.worker_status),''),'OPEN')"
+    conn.execute(f"DELETE FROM {ARCHIVE_SCHEMA}.daily_job_stats WHERE route_date IN ({days})")
+    conn.execute(f"""
+        INSERT INTO {ARCHIVE_SCHEMA}.daily_job_stats (user_id, status, route_date, n)
+        SELECT 0, {status}, r.route_date, COUNT(*)
+        FROM {ARCHIVE_SCHEMA}.route_items ri JOIN {ARCHIVE_SCHEMA}.routes r ON r.id = ri.route_id
+        WHERE r.route_date IN ({days}) GROUP BY 2, 3
+    """)
+    conn.execute(f"""
+        INSERT INTO {ARCHIVE_SCHEMA}.daily_job_stats (user_id, status, route_date, n)
+        SELECT riu.user_id, {status}, r.route_date, COUNT(*)
+        FROM {ARCHIVE_SCHEMA}.route_item_users riu
+        JOIN {ARCHIVE_SCHEMA}.route_items ri ON ri.id = riu.ri_id
+        JOIN {ARCHIVE_SCHEMA}.routes r ON r.id = ri.route_id
+        WHERE r.route_date IN ({days}) GROUP BY 1, 2, 3
+    """)
+
+
+def _archive_batch(conn, route_ids: list) -> dict:
+    """Copy, then delete, one batch of routes; routes that changed in between stay hot (counts["stale"])."""
+    import order_search  # order_search imports this module
+    conn.execute("DROP TABLE IF EXISTS temp.arc_batch")
+    conn.execute("CREATE TEMP TABLE arc_batch (route_id INTEGER PRIMARY KEY)")
+    conn.executemany("INSERT INTO temp.arc_batch (route_id) VALUES (?)", [(r,) for r in route_ids])
+    in_batch = "route_id IN (SELECT route_id FROM temp.arc_batch)"
+    is_open = "COALESCE(NULLIF(UPPER(ri.worker_status),''),'OPEN') = 'OPEN'"
+
+    counts = {}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # The rows copied, with their versions: the delete removes exactly these
+        conn.execute("DROP TABLE IF EXISTS temp.arc_items")
+        conn.execute(f"CREATE TEMP TABLE arc_items AS SELECT id, route_id, order_id, version FROM main.route_items WHERE {in_batch}")
+        # Orders referenced only by items of this batch (fresh: not in the archive yet)
+        conn.execute("DROP TABLE IF EXISTS temp.arc_orders")
+        conn.execute(f"""
+            CREATE TEMP TABLE arc_orders AS
+            SELECT o.id, o.version, o.id NOT IN (SELECT id FROM {ARCHIVE_SCHEMA}.orders) AS fresh
+            FROM main.orders o WHERE o.id IN (
+                SELECT order_id FROM temp.arc_items
+                EXCEPT
+                SELECT order_id FROM main.route_items WHERE route_id NOT IN (SELECT route_id FROM temp.arc_batch)
+            )""")
+        conn.execute(_copy_sql(conn, "routes", "id IN (SELECT route_id FROM temp.arc_batch)"))
+        # Indexed before the copy: only orders the archive doesn't have yet (see order_search.py)
+        order_search.index_archived_orders(conn.cursor(), ARCHIVE_SCHEMA, "o.id IN (SELECT id FROM temp.arc_orders)")
+        conn.execute(_copy_sql(conn, "orders", "id IN (SELECT id FROM temp.arc_orders)"))
+        conn.execute(_copy_sql(conn, "route_items", "id IN (SELECT id FROM temp.arc_items)"))
+        conn.execute(_copy_sql(conn, "route_item_users", "ri_id IN (SELECT id FROM temp.arc_items)"))
+        # Job counts of the archived days, recomputed from the archive's own rows
+        _recount_days(conn, "SELECT route_date FROM main.routes WHERE id IN (SELECT route_id FROM temp.arc_batch)")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Routes written to since the copy (an item added, edited, reopened or gone, an order edited)
+        conn.execute("DROP TABLE IF EXISTS temp.arc_stale")
+        conn.execute(f"""
+            CREATE TEMP TABLE arc_stale AS
+            SELECT b.route_id FROM temp.arc_batch b
+            WHERE EXISTS (
+                    SELECT 1 FROM main.route_items ri LEFT JOIN temp.arc_items s ON s.id = ri.id
+                    WHERE ri.route_id = b.route_id AND (s.id IS NULL OR s.version IS NOT ri.version OR {is_open}))
+               OR EXISTS (
+                    SELECT 1 FROM temp.arc_items s
+                    WHERE s.route_id = b.route_id
+                      AND NOT EXISTS (SELECT 1 FROM main.route_items ri WHERE ri.id = s.id AND ri.route_id = s.route_id))
+               OR EXISTS (
+                    SELECT 1 FROM temp.arc_items s
+                    JOIN temp.arc_orders ao ON ao.id = s.order_id
+                    JOIN main.orders o ON o.id = ao.id
+                    WHERE s.route_id = b.route_id AND o.version IS NOT ao.version)""")
+        counts["stale"] = conn.execute("SELECT COUNT(*) FROM temp.arc_stale").fetchone()[0]
+        if counts["stale"]:
+            # ... stay hot and leave the archive again; the next run copies them anew
+            stale = "SELECT route_id FROM temp.arc_stale"
+            conn.execute(f"DELETE FROM {ARCHIVE_SCHEMA}.route_item_users WHERE ri_id IN "
+                         f"(SELECT id FROM temp.arc_items WHERE route_id IN ({stale}))")
+            conn.execute(f"DELETE FROM {ARCHIVE_SCHEMA}.route_items WHERE route_id IN ({stale})")
+            conn.execute(f"DELETE FROM {ARCHIVE_SCHEMA}.routes WHERE id IN ({stale})")
+            _recount_days(conn, f"SELECT route_date FROM main.routes WHERE id IN ({stale})")
+            conn.execute(f"DELETE FROM temp.arc_items WHERE route_id IN ({stale})")
+            conn.execute(f"DELETE FROM temp.arc_batch WHERE route_id IN ({stale})")
+        # Orders a hot route still uses (a stale one, or one they were added to since) stay hot too
+        used = "id IN (SELECT order_id FROM main.route_items WHERE route_id NOT IN (SELECT route_id FROM temp.arc_batch))"
+        fresh_used = f"id IN (SELECT id FROM temp.arc_orders WHERE fresh AND {used})"
+        order_search.unindex_archived_orders(conn.cursor(), ARCHIVE_SCHEMA, f"o.{fresh_used}")
+        conn.execute(f"DELETE FROM {ARCHIVE_SCHEMA}.orders WHERE {fresh_used}")
+        conn.execute(f"DELETE FROM temp.arc_orders WHERE {used}")
+
+        # Links first: the route_items delete trigger settles daily_job_stats for them.
+        counts["routes"] = conn.execute("SELECT COUNT(*) FROM temp.arc_batch").fetchone()[0]
+        counts["route_item_users"] = conn.execute(
+            "DELETE FROM main.route_item_users WHERE ri_id IN (SELECT id FROM temp.arc_items)").rowcount
+        counts["route_items"] = conn.execute("DELETE FROM main.route_items WHERE id IN (SELECT id FROM temp.arc_items)").rowcount
+        counts["orders"] = conn.execute("DELETE FROM main.orders WHERE id IN (SELECT id FROM temp.arc_orders)").rowcount
+        conn.execute("DELETE FROM main.routes WHERE id IN (SELECT route_id FROM temp.arc_batch)")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return counts
+
+
+def enable_incremental_vacuum(conn) -> bool:
+    """Switch the hot db to auto_vacuum=INCREMENTAL (one full VACUUM; needs exclusive access)."""
+    if int(conn.execute("PRAGMA main.auto_vacuum").fetchone()[0]) == 2:
+        return False
+    conn.execute("PRAGMA main.auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM main")
+    return True
+
+
+def _incremental_vacuum(conn, pages: int, chunk: int = VACUUM_CHUNK) -> int:
+    """Hand back up to pages free pages; returns the freelist count afterwards.
+
+    The pragma frees one page per step, and Python's sqlite3 steps a statement
+    without result columns only once, so it runs until the freelist stops
+    dropping, chunk steps per write transaction to let app writers in.
+    """
+    left = int(conn.execute("PRAGMA main.freelist_count").fetchone()[0])
+    stop = max(left - int(pages), 0)
+    while left > stop:
+        before = left
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for _ in range(min(chunk, left - stop)):
+                conn.execute("PRAGMA main.incremental_vacuum(1)")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        left = int(conn.execute("PRAGMA main.freelist_count").fetchone()[0])
+        if left >= before:
+            break
+    return left
+
+
+def run(db_path: str, archive_path: str = "", after_days: int = DEFAULT_AFTER_DAYS, batch: int = 200,
+        dry_run: bool = False, vacuum_pages: int = 0, log=None) -> dict:
+    """Archive finished routes older than after_days. Returns totals per table.
+
+    vacuum_pages: pages to hand back with incremental_vacuum afterwards (0 = all free pages).
+    """
+    log = log or (lambda msg: None)
+    archive_path = archive_path or default_archive_path(db_path)
+    cutoff = (date.today() - timedelta(days=int(after_days))).isoformat()
+    conn = sqlite3.connect(db_path, timeout=5.0, isolation_level=None)
+    totals = {t: 0 for t in ("routes", "route_items", "route_item_users", "orders", "stale")}
+    try:
+        conn.execute("PRAGMA busy_timeout=5000")
+        if dry_run:
+            n = len(_pick_routes(conn, cutoff, 1_000_000))
+            log(f"{n} routes before {cutoff} would be archived")
+            return dict(totals, routes=n)
+        attach(conn, archive_path, create=True)
+        skip = set()
+        while True:
+            route_ids = _pick_routes(conn, cutoff, batch, skip)
+            if not route_ids:
+                break
+            counts = _archive_batch(conn, route_ids)
+            # Routes that changed during their batch wait for the next run
+            skip.update(int(r[0]) for r in conn.execute("SELECT route_id FROM temp.arc_stale"))
+            for k, v in counts.items():
+                totals[k] = totals.get(k, 0) + v
+            log(f"archived {counts}")
+            time.sleep(0.05)  # let app writers in between batches
+
+        # Links whose route item is already gone (deleted with foreign_keys OFF) are dead weight.
+        conn.execute("DELETE FROM main.route_item_users WHERE ri_id NOT IN (SELECT id FROM main.route_items)")
+
+        if int(conn.execute("PRAGMA main.auto_vacuum").fetchone()[0]) == 2:
+            free = int(conn.execute("PRAGMA main.freelist_count").fetchone()[0])
+            left = _incremental_vacuum(conn, int(vacuum_pages) if vacuum_pages else free)
+            log(f"incremental_vacuum: freed {free - left} of {free} free pages")
+        else:
+            log("auto_vacuum is not INCREMENTAL; run with --enable-incremental-vacuum once to shrink the file")
+        return totals
+    finally:
+        conn.close()
+
+
+def stats(conn) -> dict:
+    """Row counts, hot vs archive (archive counts are 0 when it is not attached)."""
+    out = {}
+    attached = is_attached(conn)
+    for table in ("routes", "route_items", "orders"):
+        hot = int(conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0])
+        cold = int(conn.execute(f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.{table}").fetchone()[0]) if attached else 0
+        out[table] = (hot, cold)
+    return out
+
+
+def main():
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    ap = argparse.ArgumentParser(description="Move finished routes older than N days into the archive database.")
+    ap.add_argument("--db", default=os.path.join(app_dir, "Logistic", "data", "db.sqlite"))
+    ap.add_argument("--archive", default="", help="archive file (default: archive.sqlite next to the db)")
+    ap.add_argument("--days", type=int, default=None, help=f"age in days (default: setting {SETTING_KEY} or {DEFAULT_AFTER_DAYS})")
+    ap.add_argument("--batch", type=int, default=200, help="routes per transaction")
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--enable-incremental-vacuum", action="store_true",
+                    help="one-time switch of the hot db to auto_vacuum=INCREMENTAL (full VACUUM, stop the app first)")
+    args = ap.parse_args()
+
+    days = args.days
+    if days is None:
+        conn = sqlite3.connect(args.db)
+        try:
+            row = conn.execute("SELECT value FROM settings WHERE key=?", (SETTING_KEY,)).fetchone()
+            days = int(row[0]) if row and str(row[0]).strip().isdigit() else DEFAULT_AFTER_DAYS
+        except sqlite3.Error:
+            days = DEFAULT_AFTER_DAYS
+        finally:
+            conn.close()
+
+    if args.enable_incremental_vacuum:
+        conn = sqlite3.connect(args.db, isolation_level=None)
+        try:
+            print("auto_vacuum=INCREMENTAL enabled" if enable_incremental_vacuum(conn) else "already INCREMENTAL")
+        finally:
+            conn.close()
+
+    totals = run(args.db, args.archive, after_days=days, batch=args.batch, dry_run=args.dry_run, log=print)
+    print(f"done (older than {days} days): {totals}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Worker password logins: PBKDF2 off the script thread, rate limits, session tickets.
+
+PBKDF2 (ITERATIONS rounds of SHA-256) is deliberately slow. hashlib releases the
+GIL while it runs, so the work goes to a small shared thread pool (POOL_SIZE
+threads): a burst of logins at shift change uses at most POOL_SIZE cores and
+the other sessions' reruns keep going. At most MAX_PENDING verifications may
+wait or run at once; beyond that login() answers "busy" straight away.
+
+Per user, more than MAX_FAILURES wrong passwords within FAILURE_WINDOW_SEC
+block further attempts until the oldest failure ages out, and only one
+verification per user runs at a time.
+
+A successful login returns a session ticket instead of writing a token row:
+
+    t1.<user_id>.<epoch>.<expires>.<hmac>
+
+signed with HMAC-SHA256 under a random key kept in a file next to the db
+(load_key). Checking a ticket is one HMAC plus the user's row, no PBKDF2 and no
+write. The ticket carries users.session_epoch; the repository bumps it when the
+password is changed or the user's tokens are reset, which ends every ticket
+issued before.
+
+Stored hashes with another iteration count (or algorithm) are re-hashed with
+the current settings after a successful login (login() returns the new hash).
+
+Plain module (no Streamlit import); the pool and limiter are shared by every
+session of the server process.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+ALGO = "pbkdf2_sha256"
+ITERATIONS = 200_000
+POOL_SIZE = 2
+MAX_PENDING = 16
+VERIFY_TIMEOUT_SEC = 15.0
+MAX_FAILURES = 5
+FAILURE_WINDOW_SEC = 300
+TICKET_PREFIX = "t1."
+TICKET_TTL_SEC = 14 * 3600    # a long shift
+
+
+# ---- password hashes ----
+def hash_password(password: str, iterations: int | None = None) -> str:
+    iterations = int(iterations or ITERATIONS)
+    salt = os.urandom(16)
+    dk = hashlib.pbkdf2_hmac("sha256", (password or "").encode("utf-8"), salt, iterations)
+    return f"{ALGO}${iterations}${salt.hex()}${dk.hex()}"
+
+
+def verify_password(password: str, stored: str) -> bool:
+    try:
+        algo, iters, salt_hex, hash_hex = stored.split("$", 3)
+        if algo != ALGO:
+            return False
+        dk = hashlib.pbkdf2_hmac("sha256", (password or "").encode("utf-8"), bytes.fromhex(salt_hex), int(iters))
+        return hmac.compare_digest(dk, bytes.fromhex(hash_hex))
+    except Exception:
+        return False
+
+
+def needs_rehash(stored: str) -> bool:
+    try:
+        algo, iters, _salt, _hash = stored.split("$", 3)
+        return algo != ALGO or int(iters) != ITERATIONS
+    except ValueError:
+        return True
+
+
+# ---- rate limiting ----
+class LoginLimiter:
+    """Recent failures and in-flight verifications per user."""
+
+    def __init__(self, max_failures: int = MAX_FAILURES, window: float = FAILURE_WINDOW_SEC):
+        self.max_failures = max_failures
+        self.window = window
+        self._lock = threading.Lock()
+        self._failures = {}     # user_id -> deque of monotonic timestamps
+        self._busy = set()
+
+    def _recent(self, user_id: int, now: float) -> deque:
+        q = self._failures.setdefault(user_id, deque())
+        while q and now - q[0] > self.window:
+            q.popleft()
+        return q
+
+    def acquire(self, user_id: int) -> float:
+        """0.0 if an attempt may start now (caller must release), else seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            q = self._recent(user_id, now)
+            if len(q) >= self.max_failures:
+                return max(1.0, self.window - (now - q[0]))
+            if user_id in self._busy:
+                return 1.0
+            self._busy.add(user_id)
+            return 0.0
+
+    def release(self, user_id: int, ok: bool | None):
+        """End an attempt: ok clears the user's failures, False records one, None neither."""
+        with self._lock:
+            self._busy.discard(user_id)
+            if ok:
+                self._failures.pop(user_id, None)
+            elif ok is not None:
+                now = time.monotonic()
+                self._recent(user_id, now).append(now)
+
+
+# ---- verification pool ----
+class LoginResult:
+    """status: "ok" | "wrong" | "limited" | "busy"; retry_after in seconds; new_hash when re-hashed."""
+
+    def __init__(self, status: str, retry_after: float = 0.0, new_hash: str = ""):
+        self.status = status
+        self.retry_after = retry_after
+        self.new_hash = new_hash
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+
+class Verifier:
+    def __init__(self, pool_size: int = POOL_SIZE, max_pending: int = MAX_PENDING,
+                 limiter: LoginLimiter | None = None):
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="pbkdf2")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.limiter = limiter if limiter is not None else LoginLimiter()
+        self._lock = threading.Lock()
+        self.counts = {"ok": 0, "wrong": 0, "limited": 0, "busy": 0, "rehashed": 0}
+
+    def _count(self, status: str):
+        with self._lock:
+            self.counts[status] += 1
+
+    @staticmethod
+    def _job(password: str, stored: str):
+        if not stored or not verify_password(password, stored):
+            return False, ""
+        return True, hash_password(password) if needs_rehash(stored) else ""
+
+    def login(self, user_id: int, password: str, stored: str, timeout: float = VERIFY_TIMEOUT_SEC) -> LoginResult:
+        """Check a password in the pool; blocks only the calling session."""
+        wait = self.limiter.acquire(int(user_id))
+        if wait:
+            self._count("limited")
+            return LoginResult("limited", retry_after=wait)
+        if not self._slots.acquire(blocking=False):
+            self.limiter.release(int(user_id), ok=None)
+            self._count("busy")
+            return LoginResult("busy", retry_after=2.0)
+        ok = None
+        try:
+            future = self._pool.submit(self._job, password, stored)
+            # The slot is held until the hash is done, also when we stop waiting for it
+            future.add_done_callback(lambda _f: self._slots.release())
+            ok, new_hash = future.result(timeout=timeout)
+        except FutureTimeout:
+            self._count("busy")
+            return LoginResult("busy", retry_after=2.0)
+        finally:
+            self.limiter.release(int(user_id), ok=ok)
+        self._count("ok" if ok else "wrong")
+        if new_hash:
+            self._count("rehashed")
+        return LoginResult("ok" if ok else "wrong", new_hash=new_hash)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+VERIFIER = Verifier()
+
+
+# ---- session tickets ----
+_keys = {}
+
+
+def load_key(path: str) -> bytes:
+    """Ticket signing key from path (read once per process); created (0600) on first use."""
+    key = _keys.get(path)
+    if key is None:
+        key = _keys[path] = _read_or_create_key(path)
+    return key
+
+
+def _read_or_create_key(path: str) -> bytes:
+    for _ in range(20):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                key = bytes.fromhex(f.read().strip())
+        except FileNotFoundError:
+            break
+        except ValueError:
+            key = b""      # not hex (yet): half written or corrupt
+        if len(key) >= 16:
+            return key
+        time.sleep(0.05)   # being written by another process
+    else:
+        raise RuntimeError(
+            f"unusable session key file: {path} (truncated or not hex); "
+            "delete it to create a new key, which signs out every worker"
+        )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    key = os.urandom(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return _read_or_create_key(path)   # another process won the race
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(key.hex())
+    return key
+
+
+def _sign(key: bytes, payload: str) -> str:
+    return hmac.new(key, payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def is_ticket(value: str) -> bool:
+    return (value or "").startswith(TICKET_PREFIX)
+
+
+def issue_ticket(key: bytes, user_id: int, epoch: int, ttl: float = TICKET_TTL_SEC) -> str:
+    payload = f"{TICKET_PREFIX}{int(user_id)}.{int(epoch)}.{int(time.time() + ttl)}"
+    return f"{payload}.{_sign(key, payload)}"
+
+
+def read_ticket(key: bytes, ticket: str):
+    """(user_id, epoch) of a valid, unexpired ticket, else None. The caller checks the epoch."""
+    try:
+        payload, sig = (ticket or "").strip().rsplit(".", 1)
+        if not is_ticket(payload) or not hmac.compare_digest(sig, _sign(key, payload)):
+            return None
+        user_id, epoch, expires = (int(x) for x in payload[len(TICKET_PREFIX):].split("."))
+    except ValueError:
+        return None
+    if expires < time.time():
+        return None
+    return user_id, epoch
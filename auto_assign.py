@@ -0,0 +1,211 @@
+"""Capacity-aware auto-assignment of a day's open orders to crews and rings.
+
+A crew is a set of workers that drives together (the Route Planner's "Workers"
+pick) with a day capacity in minutes, up to `rings` trips (ring 1..MAX_RINGS)
+and a truck load per ring in pieces. Crews are saved as JSON under the
+auto_crews setting.
+
+Each order's workload is estimated from its items_compact lines and quantities
+("2 tk") and its service_tag: every stop costs STOP_MIN, every piece UNIT_MIN,
+Paigaldus / Utiil add SERVICE_MIN per stop and per piece.
+
+plan() is longest-job-first bin packing: jobs sorted by minutes, each goes to
+the crew with the lowest load share that still has the minutes for it, into
+the best-fitting ring of that crew (least load space left, so trucks fill up
+before a new ring is started). Orders already on the route count towards their
+crew's load and ring. A job no crew can take is reported, not forced in.
+
+    jobs, on_route = load_jobs(conn, route_id, ("READY FOR WORK", "SCHEDULED"))
+    result = plan(jobs, crews_from_settings(cfg), on_route)
+    result["assignments"]   # [(order_id, crew_no, ring_no)]
+
+Planning 300 orders over a handful of crews takes a few milliseconds. Plain
+module (no Streamlit import); repository.assign_orders writes a plan in one
+transaction.
+"""
+import json
+import re
+import time
+
+SETTING_KEY = "auto_crews"
+STATUSES = ("READY FOR WORK", "SCHEDULED")
+MAX_RINGS = 4
+
+STOP_MIN = 12.0
+UNIT_MIN = 4.0
+# service word (lowercase, as in service_tag) -> (minutes per stop, minutes per piece)
+SERVICE_MIN = {
+    "paigaldus": (25.0, 12.0),
+    "utiil": (10.0, 3.0),
+}
+DEFAULT_CAPACITY_MIN = 480
+DEFAULT_RING_UNITS = 20
+
+_QTY_RE = re.compile(r"(\d+)\s*(?:tk|pcs|pc)\b", re.IGNORECASE)
+
+
+def item_units(items_compact: str) -> tuple:
+    """(item lines, pieces) of an items_compact text; a line without a quantity counts as 1 piece."""
+    lines = units = 0
+    for raw in (items_compact or "").splitlines():
+        if not raw.strip():
+            continue
+        lines += 1
+        m = _QTY_RE.search(raw)
+        units += max(1, int(m.group(1))) if m else 1
+    return lines, units
+
+
+def estimate_minutes(units: int, service_tag: str) -> float:
+    minutes = STOP_MIN + UNIT_MIN * units
+    tag = (service_tag or "").lower()
+    for word, (per_stop, per_unit) in SERVICE_MIN.items():
+        if word in tag:
+            minutes += per_stop + per_unit * units
+    return minutes
+
+
+class Job:
+    """One order's workload; ri_id / ring_no / user_ids are set when it is on the route already."""
+
+    __slots__ = ("order_id", "label", "service_tag", "lines", "units", "minutes", "ri_id", "ring_no", "user_ids")
+
+    def __init__(self, order_id: int, items_compact: str = "", service_tag: str = "", label: str = "",
+                 ri_id=None, ring_no=None, user_ids=()):
+        self.order_id = int(order_id)
+        self.label = label
+        self.service_tag = service_tag or ""
+        self.lines, self.units = item_units(items_compact)
+        self.minutes = estimate_minutes(self.units, self.service_tag)
+        self.ri_id = ri_id
+        self.ring_no = ring_no
+        self.user_ids = tuple(sorted(int(u) for u in user_ids))
+
+    def __repr__(self):
+        return f"Job(order_id={self.order_id}, minutes={self.minutes:.0f}, units={self.units})"
+
+
+class Crew:
+    """Workers driving together, with their day capacity (minutes), rings and load per ring (pieces)."""
+
+    __slots__ = ("user_ids", "capacity_min", "rings", "ring_units")
+
+    def __init__(self, user_ids, capacity_min: float = DEFAULT_CAPACITY_MIN, rings: int = MAX_RINGS,
+                 ring_units: int = DEFAULT_RING_UNITS):
+        self.user_ids = tuple(sorted({int(u) for u in user_ids}))
+        self.capacity_min = max(1.0, float(capacity_min))
+        self.rings = min(MAX_RINGS, max(1, int(rings)))
+        self.ring_units = max(1, int(ring_units))
+
+    def to_dict(self) -> dict:
+        return {"user_ids": list(self.user_ids), "capacity_min": self.capacity_min,
+                "rings": self.rings, "ring_units": self.ring_units}
+
+
+def crews_from_settings(snapshot) -> list:
+    """Crews saved under SETTING_KEY (crews without workers are skipped)."""
+    raw = snapshot.get_json(SETTING_KEY, []) or []
+    crews = []
+    for c in raw if isinstance(raw, list) else []:
+        try:
+            crew = Crew(c.get("user_ids") or [], c.get("capacity_min", DEFAULT_CAPACITY_MIN),
+                        c.get("rings", MAX_RINGS), c.get("ring_units", DEFAULT_RING_UNITS))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if crew.user_ids:
+            crews.append(crew)
+    return crews
+
+
+def crews_setting(crews) -> str:
+    return json.dumps([c.to_dict() for c in crews])
+
+
+def load_jobs(conn, route_id: int, statuses=STATUSES) -> tuple:
+    """(orders in statuses not on the route, OPEN items on the route) as Jobs."""
+    statuses = [s.strip().upper() for s in statuses]
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT o.id, o.items_compact, o.service_tag,
+               COALESCE(NULLIF(o.client_name, ''), o.recipient_name, '') || ' • ' ||
+               COALESCE(NULLIF(o.address, ''), o.ship_address, '')
+        FROM orders o
+        WHERE UPPER(o.status) IN ({", ".join("?" for _ in statuses)})
+          AND NOT EXISTS (SELECT 1 FROM route_items ri WHERE ri.route_id=? AND ri.order_id=o.id)
+        ORDER BY o.id
+    """, (*statuses, int(route_id)))
+    jobs = [Job(r[0], r[1] or "", r[2] or "", r[3] or "") for r in cur.fetchall()]
+    cur.execute("""
+        SELECT ri.id, ri.order_id, ri.ring_no, o.items_compact, o.service_tag,
+               COALESCE(GROUP_CONCAT(riu.user_id), '')
+        FROM route_items ri
+        JOIN orders o ON o.id = ri.order_id
+        LEFT JOIN route_item_users riu ON riu.ri_id = ri.id
+        WHERE ri.route_id=? AND UPPER(COALESCE(ri.worker_status,'OPEN'))='OPEN'
+        GROUP BY ri.id
+    """, (int(route_id),))
+    on_route = [
+        Job(r[1], r[3] or "", r[4] or "", ri_id=int(r[0]), ring_no=int(r[2] or 1),
+            user_ids=[u for u in str(r[5]).split(",") if u])
+        for r in cur.fetchall()
+    ]
+    return jobs, on_route
+
+
+def _best_ring(loads: list, units: int, ring_units: int):
+    """Index of the ring the job fits best (least space left), None if none fits.
+
+    A job bigger than a whole ring only goes into an empty ring.
+    """
+    best = None
+    for n, load in enumerate(loads):
+        if load + units <= ring_units or (load == 0 and units > ring_units):
+            left = ring_units - load - units
+            if best is None or left < best[0]:
+                best = (left, n)
+    return None if best is None else best[1]
+
+
+def plan(jobs, crews, on_route=()) -> dict:
+    """Bin-pack jobs onto crews / rings (see module docstring).
+
+    Returns assignments [(order_id, crew_no, ring_no)] (crew_no indexes crews),
+    unassigned order ids, per-crew loads and the planning time.
+    """
+    t0 = time.perf_counter()
+    load = [0.0] * len(crews)
+    rings = [[0] * c.rings for c in crews]
+    by_users = {c.user_ids: n for n, c in enumerate(crews)}
+    for job in on_route:
+        n = by_users.get(job.user_ids)
+        if n is None:
+            continue
+        load[n] += job.minutes
+        if job.ring_no and 1 <= job.ring_no <= crews[n].rings:
+            rings[n][job.ring_no - 1] += job.units
+
+    assignments, unassigned = [], []
+    for job in sorted(jobs, key=lambda j: (-j.minutes, -j.units, j.order_id)):
+        placed = False
+        for n in sorted(range(len(crews)), key=lambda k: ((load[k] + job.minutes) / crews[k].capacity_min, k)):
+            crew = crews[n]
+            if load[n] + job.minutes > crew.capacity_min:
+                continue
+            ring = _best_ring(rings[n], job.units, crew.ring_units)
+            if ring is None:
+                continue
+            load[n] += job.minutes
+            rings[n][ring] += job.units
+            assignments.append((job.order_id, n, ring + 1))
+            placed = True
+            break
+        if not placed:
+            unassigned.append(job.order_id)
+
+    return {
+        "assignments": assignments,
+        "unassigned": unassigned,
+        "crews": [{"load_min": load[n], "capacity_min": c.capacity_min, "ring_units": list(rings[n])}
+                  for n, c in enumerate(crews)],
+        "seconds": time.perf_counter() - t0,
+    }
@@ -0,0 +1,382 @@
+"""Online backups of db.sqlite + archive.sqlite (+ the order PDFs) with rotation, checks and restore.
+
+Snapshots use SQLite's online backup API (Connection.backup) from a separate
+read-only connection. The app's db runs in WAL mode, where the backup's read
+transaction never blocks writers, so it is copied in one step: one consistent
+read snapshot, no restarts. A rollback-journal db (where a reader does hold
+writers off) is copied in steps of STEP_PAGES pages so writers get in between;
+a write between steps makes SQLite restart the copy, so after MAX_RESTARTS the
+rest is copied in one step.
+
+The archive (archive.py) is copied the same way in the same run, into
+archive-<tag>.sqlite next to db-<tag>.sqlite, and restored together with it.
+Each copy is checked with PRAGMA quick_check before it is kept. The last
+`keep` snapshots are kept. PDFs are incremental: every run zips the files in
+ORDERS_DIR changed since the previous run, and those zips are never rotated away.
+manifest.json in the backup dir records every snapshot and PDF zip. snapshot()
+holds a module lock, so the scheduler thread and a "Backup now" click never
+update the manifest at the same time.
+
+The app starts one background scheduler per process (SCHEDULER.ensure_started);
+the same operations are available from the command line:
+    python backup.py snapshot        # one snapshot + PDF zip now
+    python backup.py list
+    python backup.py check FILE      # PRAGMA integrity_check on a snapshot
+    python backup.py restore FILE [--pdfs]   # stop the app first
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+import archive
+
+DEFAULT_INTERVAL_MIN = 60
+DEFAULT_KEEP = 24
+STEP_PAGES = 4096          # 16 MiB per step with 4 KiB pages (rollback-journal dbs only)
+MAX_RESTARTS = 3
+MANIFEST = "manifest.json"
+
+# Manifest read-modify-write + tag-named files: one snapshot at a time per process
+_SNAPSHOT_LOCK = threading.Lock()
+
+
+def _now_tag() -> str:
+    return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def load_manifest(backup_dir: str) -> dict:
+    try:
+        with open(os.path.join(backup_dir, MANIFEST), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data.setdefault("snapshots", [])
+            data.setdefault("pdf_zips", [])
+            return data
+    except (OSError, ValueError):
+        pass
+    return {"snapshots": [], "pdf_zips": [], "pdfs_since": 0.0}
+
+
+def _save_manifest(backup_dir: str, data: dict):
+    path = os.path.join(backup_dir, MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def copy_database(src_path: str, dest_path: str, pages: int | None = None) -> dict:
+    """Online copy of src_path into dest_path; returns timing/restart info.
+
+    pages None: one step for WAL databases, STEP_PAGES steps otherwise.
+    """
+    t0 = time.perf_counter()
+    progress = {"steps": 0, "restarts": 0, "remaining": None, "total": 0}
+
+    def on_progress(status, remaining, total):
+        progress["steps"] += 1
+        if progress["remaining"] is not None and remaining > progress["remaining"]:
+            # A write between steps made SQLite start the copy over.
+            progress["restarts"] += 1
+            if progress["restarts"] >= MAX_RESTARTS:
+                raise _TooManyRestarts()
+        progress["remaining"] = remaining
+        progress["total"] = total
+
+    src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True, timeout=5.0)
+    dst = sqlite3.connect(dest_path)
+    try:
+        if pages is None:
+            wal = str(src.execute("PRAGMA journal_mode").fetchone()[0]).lower() == "wal"
+            pages = -1 if wal else STEP_PAGES
+        try:
+            src.backup(dst, pages=pages, progress=on_progress)
+        except _TooManyRestarts:
+            # One step = one read transaction: can't restart, and in WAL it doesn't block writers.
+            src.backup(dst, pages=-1)
+        # The copy inherits WAL mode from page 1; a standalone snapshot reads best as a rollback-journal db.
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+    return {"seconds": round(time.perf_counter() - t0, 3), "steps": progress["steps"],
+            "restarts": progress["restarts"], "pages": progress["total"]}
+
+
+def check(path: str, full: bool = False) -> list:
+    """PRAGMA quick_check (or integrity_check) on a database file; ['ok'] when healthy."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        pragma = "integrity_check" if full else "quick_check"
+        return [r[0] for r in conn.execute(f"PRAGMA {pragma}").fetchall()]
+    finally:
+        conn.close()
+
+
+def zip_new_pdfs(orders_dir: str, backup_dir: str, since: float, tag: str):
+    """Zip PDFs changed after `since` (mtime). Returns (zip path or '', file count, newest mtime)."""
+    picked, newest = [], since
+    for root, _dirs, files in os.walk(orders_dir):
+        for name in files:
+            p = os.path.join(root, name)
+            try:
+                mtime = os.path.getmtime(p)
+            except OSError:
+                continue
+            if mtime > since:
+                picked.append(p)
+                newest = max(newest, mtime)
+    if not picked:
+        return "", 0, newest
+    zpath = os.path.join(backup_dir, f"pdfs-{tag}.zip")
+    # PDFs are already compressed; ZIP_STORED keeps this I/O-bound.
+    with zipfile.ZipFile(zpath, "w", compression=zipfile.ZIP_STORED) as z:
+        for p in picked:
+            z.write(p, arcname=os.path.relpath(p, orders_dir))
+    return zpath, len(picked), newest
+
+
+def _checked_copy(src_path: str, final: str, pages: int | None = None) -> dict:
+    """copy_database() into final + quick_check; a damaged copy is kept as final.bad and raises."""
+    partial = final + ".partial"
+    info = copy_database(src_path, partial, pages=pages)
+    result = check(partial)
+    if result != ["ok"]:
+        os.replace(partial, final + ".bad")
+        raise sqlite3.DatabaseError(f"backup check failed: {'; '.join(result[:5])}")
+    os.replace(partial, final)
+    return info
+
+
+def _free_tag(backup_dir: str) -> str:
+    """_now_tag(), suffixed when a snapshot of this second exists already."""
+    tag, n = _now_tag(), 1
+    while os.path.exists(os.path.join(backup_dir, f"db-{tag}.sqlite")):
+        n += 1
+        tag = f"{_now_tag()}-{n}"
+    return tag
+
+
+def snapshot(db_path: str, backup_dir: str, orders_dir: str = "", keep: int = DEFAULT_KEEP,
+             pages: int | None = None, archive_path: str | None = None) -> dict:
+    """Take one snapshot (+ archive, PDF zip), check it, rotate old snapshots. Returns the manifest entry.
+
+    archive_path None: archive.sqlite next to db_path; "" : no archive.
+    """
+    with _SNAPSHOT_LOCK:
+        return _snapshot(db_path, backup_dir, orders_dir, keep, pages, archive_path)
+
+
+def _snapshot(db_path, backup_dir, orders_dir, keep, pages, archive_path) -> dict:
+    os.makedirs(backup_dir, exist_ok=True)
+    if archive_path is None:
+        archive_path = archive.default_archive_path(db_path)
+    tag = _free_tag(backup_dir)
+    final = os.path.join(backup_dir, f"db-{tag}.sqlite")
+    info = _checked_copy(db_path, final, pages=pages)
+    entry = {"file": os.path.basename(final), "created": datetime.now().isoformat(timespec="seconds"),
+             "size": os.path.getsize(final), "check": "ok", **info}
+    if archive_path and os.path.exists(archive_path):
+        arc_final = os.path.join(backup_dir, f"archive-{tag}.sqlite")
+        try:
+            _checked_copy(archive_path, arc_final, pages=pages)
+        except BaseException:
+            os.remove(final)
+            raise
+        entry["archive"] = os.path.basename(arc_final)
+        entry["archive_size"] = os.path.getsize(arc_final)
+
+    manifest = load_manifest(backup_dir)
+    manifest["snapshots"].append(entry)
+
+    if orders_dir and os.path.isdir(orders_dir):
+        zpath, n, newest = zip_new_pdfs(orders_dir, backup_dir, float(manifest.get("pdfs_since") or 0.0), tag)
+        if zpath:
+            manifest["pdf_zips"].append({"file": os.path.basename(zpath), "created": entry["created"], "files": n})
+            entry["pdf_zip"] = os.path.basename(zpath)
+        manifest["pdfs_since"] = newest
+
+    # Rotation (snapshots only; PDF zips are incremental and kept)
+    keep = max(1, int(keep))
+    for old in manifest["snapshots"][:-keep]:
+        for name in (old["file"], old.get("archive")):
+            try:
+                if name:
+                    os.remove(os.path.join(backup_dir, name))
+            except OSError:
+                pass
+    manifest["snapshots"] = manifest["snapshots"][-keep:]
+    _save_manifest(backup_dir, manifest)
+    return entry
+
+
+def _restore_file(snapshot_path: str, db_path: str) -> str:
+    """Copy db_path aside (online copy, so its WAL is included), then write the snapshot into it
+    with the backup API, which also resets the WAL. Returns the safety copy's path ('' if none)."""
+    safety = ""
+    if os.path.exists(db_path):
+        safety = f"{db_path}.before-restore-{_now_tag()}"
+        copy_database(db_path, safety, pages=-1)
+    src = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+    dst = sqlite3.connect(db_path, timeout=10.0)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return safety
+
+
+def restore(snapshot_path: str, db_path: str, orders_dir: str = "", backup_dir: str = "",
+            with_pdfs: bool = False, archive_path: str | None = None) -> str:
+    """Replace db_path (and the archive) with a snapshot (the app should be stopped). Returns the db's safety copy.
+
+    The archive copy taken with the snapshot (manifest "archive") is restored
+    over archive_path (None: archive.sqlite next to db_path). Both files are
+    checked before either is touched.
+    """
+    snap_name = os.path.basename(snapshot_path)
+    backup_dir = backup_dir or os.path.dirname(snapshot_path)
+    entry = next((e for e in load_manifest(backup_dir)["snapshots"] if e["file"] == snap_name), {})
+    arc_snapshot = os.path.join(backup_dir, entry["archive"]) if entry.get("archive") else ""
+    if archive_path is None:
+        archive_path = archive.default_archive_path(db_path)
+    for path in (snapshot_path, arc_snapshot):
+        if not path:
+            continue
+        result = check(path, full=True)
+        if result != ["ok"]:
+            raise sqlite3.DatabaseError(f"snapshot is damaged ({os.path.basename(path)}): {'; '.join(result[:5])}")
+    safety = _restore_file(snapshot_path, db_path)
+    if arc_snapshot and archive_path:
+        _restore_file(arc_snapshot, archive_path)
+
+    if with_pdfs and orders_dir and backup_dir:
+        # Every zip up to the snapshot (they're incremental); existing files are left alone.
+        tag = snap_name[len("db-"):-len(".sqlite")] if snap_name.startswith("db-") else ""
+        for z in load_manifest(backup_dir)["pdf_zips"]:
+            if tag and z["file"][len("pdfs-"):-len(".zip")] > tag:
+                continue
+            with zipfile.ZipFile(os.path.join(backup_dir, z["file"])) as zf:
+                for member in zf.namelist():
+                    target = os.path.join(orders_dir, member)
+                    if os.path.abspath(target).startswith(os.path.abspath(orders_dir)) and not os.path.exists(target):
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        with zf.open(member) as fin, open(target, "wb") as fout:
+                            shutil.copyfileobj(fin, fout)
+    return safety
+
+
+class BackupScheduler:
+    """One daemon thread per process taking a snapshot every interval_min minutes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self.config = {}
+        self.last_error = ""
+        self.last_entry = None
+
+    def ensure_started(self, db_path: str, backup_dir: str, orders_dir: str = "",
+                       interval_min: int = DEFAULT_INTERVAL_MIN, keep: int = DEFAULT_KEEP,
+                       archive_path: str | None = None):
+        """Start (or reconfigure) the scheduler; cheap to call on every rerun."""
+        with self._lock:
+            self.config = {"db_path": db_path, "backup_dir": backup_dir, "orders_dir": orders_dir,
+                           "interval_min": int(interval_min), "keep": int(keep), "archive_path": archive_path}
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="db-backup", daemon=True)
+                self._thread.start()
+
+    def run_now(self):
+        self._wake.set()
+
+    def _due_in(self) -> float:
+        cfg = self.config
+        if cfg["interval_min"] <= 0:
+            return 3600.0
+        snaps = load_manifest(cfg["backup_dir"])["snapshots"]
+        if not snaps:
+            return 0.0
+        try:
+            last = datetime.fromisoformat(snaps[-1]["created"])
+        except (KeyError, ValueError):
+            return 0.0
+        return cfg["interval_min"] * 60 - (datetime.now() - last).total_seconds()
+
+    def _loop(self):
+        while True:
+            forced = self._wake.wait(timeout=max(0.0, min(self._due_in(), 300.0)))
+            self._wake.clear()
+            cfg = dict(self.config)
+            if not forced and (cfg["interval_min"] <= 0 or self._due_in() > 0):
+                continue
+            try:
+                self.last_entry = snapshot(cfg["db_path"], cfg["backup_dir"], cfg["orders_dir"], keep=cfg["keep"],
+                                           archive_path=cfg["archive_path"])
+                self.last_error = ""
+            except (OSError, sqlite3.Error) as e:
+                self.last_error = f"{datetime.now().isoformat(timespec='seconds')}: {e}"
+                time.sleep(60)
+
+
+SCHEDULER = BackupScheduler()
+
+
+def main():
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(app_dir, "Logistic")
+    ap = argparse.ArgumentParser(description="Online backups of the logistics database.")
+    ap.add_argument("--db", default=os.path.join(data_dir, "data", "db.sqlite"))
+    ap.add_argument("--dir", default=os.path.join(data_dir, "backups"), help="backup directory")
+    ap.add_argument("--orders", default=os.path.join(data_dir, "orders"), help="order PDFs directory")
+    ap.add_argument("--archive", default=None, help="archive file (default: archive.sqlite next to the db)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_snap = sub.add_parser("snapshot", help="take a snapshot now")
+    p_snap.add_argument("--keep", type=int, default=DEFAULT_KEEP)
+    sub.add_parser("list", help="list snapshots")
+    p_check = sub.add_parser("check", help="integrity_check a snapshot (or the live db)")
+    p_check.add_argument("file", nargs="?", default="")
+    p_restore = sub.add_parser("restore", help="restore a snapshot over the db (stop the app first)")
+    p_restore.add_argument("file")
+    p_restore.add_argument("--pdfs", action="store_true", help="also unpack PDF zips up to this snapshot")
+    args = ap.parse_args()
+
+    def resolve(f):
+        return f if os.path.exists(f) else os.path.join(args.dir, f)
+
+    if args.cmd == "snapshot":
+        e = snapshot(args.db, args.dir, args.orders, keep=args.keep, archive_path=args.archive)
+        print(f"{e['file']}: {e['size'] / 1e6:.1f} MB in {e['seconds']:.2f}s "
+              f"({e['steps']} steps, {e['restarts']} restarts){' + ' + e['archive'] if e.get('archive') else ''}"
+              f"{' + ' + e['pdf_zip'] if e.get('pdf_zip') else ''}")
+    elif args.cmd == "list":
+        m = load_manifest(args.dir)
+        for e in m["snapshots"]:
+            print(f"{e['file']}  {e['created']}  {e['size'] / 1e6:8.1f} MB  {e['seconds']:.2f}s  {e.get('check', '?')}"
+                  f"{'  + ' + e['archive'] if e.get('archive') else ''}")
+        print(f"{len(m['pdf_zips'])} PDF zips")
+    elif args.cmd == "check":
+        path = resolve(args.file) if args.file else args.db
+        result = check(path, full=True)
+        print("\n".join(result))
+        raise SystemExit(0 if result == ["ok"] else 1)
+    elif args.cmd == "restore":
+        safety = restore(resolve(args.file), args.db, args.orders, args.dir, with_pdfs=args.pdfs,
+                         archive_path=args.archive)
+        print(f"restored {args.file}" + (f" (previous db kept as {safety})" if safety else ""))
+
+
+if __name__ == "__main__":
+    main()
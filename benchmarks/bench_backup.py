@@ -0,0 +1,94 @@
+"""Benchmark: online backup (backup.snapshot) of a large WAL database under write load.
+
+Run from the repo root:
+    python benchmarks/bench_backup.py [--mb 1000] [--writers 2]
+
+Builds a throwaway WAL database of about --mb megabytes, starts writer threads
+that commit one small transaction every ~5 ms (like status updates from workers)
+and takes a snapshot meanwhile. Reports snapshot time and the writers' worst
+commit latency during the backup (a blocking backup would show up there).
+Pass --pages N to force stepped copying (restarts under this write load).
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import backup  # noqa: E402
+
+
+def seed(path: str, mb: int):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, notes TEXT, items_compact TEXT)")
+    conn.execute("CREATE TABLE route_items (id INTEGER PRIMARY KEY, worker_status TEXT, updated_at TEXT)")
+    blob = "KLAUS KASTIGA VOODI 160x200 HALL KANGAS - 1 tk - Pealadu\n" * 16  # ~1 KB
+    rows = mb * 1024
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO orders (notes, items_compact) VALUES (?, ?)",
+                     (("Helistada enne", blob) for _ in range(rows)))
+    conn.executemany("INSERT INTO route_items (worker_status, updated_at) VALUES ('OPEN', '')",
+                     (() for _ in range(10_000)))
+    conn.execute("COMMIT")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def writer(path: str, stop: threading.Event, latencies: list):
+    conn = sqlite3.connect(path, isolation_level=None, timeout=5.0)
+    n = 0
+    while not stop.is_set():
+        n += 1
+        t0 = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE route_items SET worker_status='DONE', updated_at=? WHERE id=?",
+                     (str(time.time()), n % 10_000 + 1))
+        conn.execute("COMMIT")
+        latencies.append(time.perf_counter() - t0)
+        time.sleep(0.005)
+    conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--mb", type=int, default=1000)
+    ap.add_argument("--writers", type=int, default=2)
+    ap.add_argument("--pages", type=int, default=None, help="pages per step (default: backup.py's choice)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "db.sqlite")
+        t0 = time.perf_counter()
+        seed(db_path, args.mb)
+        print(f"db {os.path.getsize(db_path) / 1e6:.0f} MB (seeded in {time.perf_counter() - t0:.1f}s)")
+
+        idle = []
+        stop = threading.Event()
+        threads = [threading.Thread(target=writer, args=(db_path, stop, idle)) for _ in range(args.writers)]
+        for t in threads:
+            t.start()
+        time.sleep(1.0)
+        baseline = list(idle)
+        idle.clear()
+        entry = backup.snapshot(db_path, os.path.join(tmp, "backups"), pages=args.pages)
+        during = list(idle)
+        stop.set()
+        for t in threads:
+            t.join()
+
+        print(f"snapshot {entry['size'] / 1e6:.0f} MB in {entry['seconds']:.2f}s "
+              f"({entry['steps']} steps, {entry['restarts']} restarts, quick_check ok)")
+        print(f"writer commits during backup: {len(during)}, "
+              f"median {statistics.median(during) * 1000:.1f} ms, max {max(during) * 1000:.1f} ms "
+              f"(before: median {statistics.median(baseline) * 1000:.1f} ms, max {max(baseline) * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
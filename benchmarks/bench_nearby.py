@@ -0,0 +1,60 @@
+"""Benchmark: nearby.GridIndex lookups and detour ranking against a full scan.
+
+Run from the repo root:
+    python benchmarks/bench_nearby.py [--orders 5000] [--ring 20] [--radius 3] [--repeat 20]
+
+Random open orders around Tallinn and one ring of stops. Times building the
+index, a radius lookup around the ring (cells only), ranking the candidates by
+added detour, and the brute-force alternative (every order against every stop).
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import nearby  # noqa: E402
+import travel_matrix  # noqa: E402
+
+
+def _time(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1e3
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--orders", type=int, default=5000)
+    ap.add_argument("--ring", type=int, default=20)
+    ap.add_argument("--radius", type=float, default=3.0)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    rnd = random.Random(5)
+    orders = [(k, 59.30 + rnd.random() * 0.20, 24.50 + rnd.random() * 0.50) for k in range(args.orders)]
+    stops = [(59.38 + rnd.random() * 0.05, 24.68 + rnd.random() * 0.10) for _ in range(args.ring)]
+    path = [(59.392, 24.728)] + stops
+    index = nearby.GridIndex(orders)
+    near = index.near(stops, args.radius)
+
+    def brute():
+        km = travel_matrix.great_circle_km(travel_matrix.unit_vectors([o[1:] for o in orders]),
+                                           travel_matrix.unit_vectors(stops)).min(axis=1)
+        return [orders[n][0] for n in (km <= args.radius).nonzero()[0]]
+
+    print(f"{args.orders} orders, {args.ring}-stop ring, {args.radius:g} km: {len(near)} candidates, {len(index.cells)} cells")
+    print(f"  build index           {_time(lambda: nearby.GridIndex(orders), max(1, args.repeat // 4)):8.2f} ms")
+    print(f"  near()                {_time(lambda: index.near(stops, args.radius), args.repeat):8.2f} ms")
+    print(f"  detours() + rank      {_time(lambda: nearby.detours(index, near, path), args.repeat):8.2f} ms")
+    print(f"  full scan             {_time(brute, args.repeat):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Benchmark: legacy `o.*` dict rows vs lean RouteItemRow listings on a 2k-stop day.
+
+Run from the repo root:
+    python benchmarks/bench_route_listing.py [--stops 2000] [--repeat 15]
+
+Seeds a throwaway SQLite file with one route date, N stops spread over 4 rings and
+2 workers, and realistic heavy order fields (items block, notes, PDF path, author).
+"""
+import argparse
+import os
+import statistics
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import route_rows  # noqa: E402
+
+
+# The query list_route_items() ran before the lean rows (kept here as the baseline).
+LEGACY_SQL = """
+    SELECT
+        ri.id as ri_id, ri.seq, ri.ring_no,
+        ri.worker_status, ri.worker_status_reason, ri.worker_status_note,
+        ri.worker_status_updated_at, ri.worker_status_updated_by,
+        o.*,
+        COALESCE(GROUP_CONCAT(u.name, ', '), '') AS worker_names
+    FROM route_items ri
+    JOIN orders o ON o.id=ri.order_id
+    LEFT JOIN route_item_users riu ON riu.ri_id = ri.id
+    LEFT JOIN users u ON u.id = riu.user_id
+    WHERE ri.route_id=? AND UPPER(COALESCE(ri.worker_status,'OPEN'))='OPEN'
+    GROUP BY ri.id
+    ORDER BY ri.seq ASC
+"""
+
+
+def seed(path: str, stops: int) -> int:
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    # Same tables/columns as app.init_db() creates (only what the listings touch).
+    cur.executescript("""
+    CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, phone TEXT DEFAULT '',
+        is_active INTEGER NOT NULL DEFAULT 1, created_at TEXT NOT NULL, password_hash TEXT DEFAULT '',
+        auth_token TEXT DEFAULT '');
+    CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, original_filename TEXT NOT NULL,
+        stored_path TEXT NOT NULL, created_at TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'NEW',
+        client_name TEXT DEFAULT '', phone TEXT DEFAULT '', address TEXT DEFAULT '',
+        delivery_date TEXT DEFAULT '', delivery_window TEXT DEFAULT '', notes TEXT DEFAULT '',
+        order_ref TEXT DEFAULT '', recipient_name TEXT DEFAULT '', ship_address TEXT DEFAULT '',
+        service_tag TEXT DEFAULT '', doc_author TEXT DEFAULT '', doc_email TEXT DEFAULT '',
+        doc_phone TEXT DEFAULT '', items_compact TEXT DEFAULT '', lat REAL, lon REAL,
+        version INTEGER NOT NULL DEFAULT 1);
+    CREATE TABLE routes (id INTEGER PRIMARY KEY AUTOINCREMENT, route_date TEXT NOT NULL);
+    CREATE TABLE route_items (id INTEGER PRIMARY KEY AUTOINCREMENT, route_id INTEGER NOT NULL,
+        order_id INTEGER NOT NULL, seq INTEGER NOT NULL, ring_no INTEGER NOT NULL DEFAULT 1,
+        worker_status TEXT NOT NULL DEFAULT 'OPEN', worker_status_reason TEXT DEFAULT '',
+        worker_status_note TEXT DEFAULT '', worker_status_updated_at TEXT DEFAULT '',
+        worker_status_updated_by INTEGER, worker_started_at TEXT DEFAULT '',
+        worker_finished_at TEXT DEFAULT '', version INTEGER NOT NULL DEFAULT 1,
+        UNIQUE(route_id, order_id), UNIQUE(route_id, seq));
+    CREATE TABLE route_item_users (ri_id INTEGER NOT NULL, user_id INTEGER NOT NULL, created_at TEXT,
+        UNIQUE(ri_id, user_id));
+    CREATE INDEX idx_route_item_users_ri ON route_item_users(ri_id);
+    """)
+    cur.execute("INSERT INTO users (name, created_at) VALUES ('Mati Maasikas', '2026-01-01T08:00:00')")
+    cur.execute("INSERT INTO users (name, created_at) VALUES ('Jüri Juurikas', '2026-01-01T08:00:00')")
+    cur.execute("INSERT INTO routes (route_date) VALUES ('2026-10-19')")
+    items = "\n".join(
+        f"{n} - KLAUS KASTIGA VOODI 160x200 HALL KANGAS MUDEL {n:03d} - {n % 3 + 1} tk - Pealadu"
+        for n in range(1, 9)
+    )
+    notes = "Helistada 30 min enne. Trepikoda kood 1234, lift puudub. Vana diivan utiliseerida. " * 4
+    for i in range(1, stops + 1):
+        cur.execute(
+            """INSERT INTO orders (original_filename, stored_path, created_at, status, client_name, phone,
+                   address, delivery_date, delivery_window, notes, order_ref, recipient_name, ship_address,
+                   service_tag, doc_author, doc_email, doc_phone, items_compact)
+               VALUES (?, ?, ?, 'READY FOR WORK', ?, ?, ?, '2026-10-19', '10:00-12:00', ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                f"order_{i}.pdf", f"/srv/Logistic/orders/2026/10/order_{1760000000000 + i}_order_{i}.pdf",
+                "2026-10-18T09:00:00", f"Klient {i}", f"+37255{i:06d}", f"Pärnu mnt {i}, Tallinn",
+                notes, f"{100000 + i}/18.10.2026", f"Klient {i}", f"Pärnu mnt {i}\n10141 Tallinn",
+                "Transport + Paigaldus", "Müüja Nimi", "muuja@example.com", "+372 666 6666", items,
+            ),
+        )
+        cur.execute(
+            "INSERT INTO route_items (route_id, order_id, seq, ring_no) VALUES (1, ?, ?, ?)",
+            (i, i, i % 4 + 1),
+        )
+        cur.execute("INSERT INTO route_item_users (ri_id, user_id) VALUES (?, ?)", (i, i % 2 + 1))
+    conn.commit()
+    conn.close()
+    return 1
+
+
+def legacy_list(conn, route_id):
+    cur = conn.cursor()
+    cur.execute(LEGACY_SQL, (route_id,))
+    return [dict(r) for r in cur.fetchall()]
+
+
+def lean_list(conn, route_id):
+    return route_rows.list_route_items(conn, route_id)
+
+
+def measure(fn, conn, route_id, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(conn, route_id)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    rows = fn(conn, route_id)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(rows), statistics.median(times), retained, peak
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--stops", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=15)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        route_id = seed(path, args.stops)
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+
+        print(f"{args.stops} stops, median of {args.repeat} runs")
+        print(f"{'listing':<10} {'rows':>6} {'median ms':>10} {'retained KiB':>13} {'peak KiB':>10}")
+        results = {}
+        for name, fn in (("legacy", legacy_list), ("lean", lean_list)):
+            n, med, retained, peak = measure(fn, conn, route_id, args.repeat)
+            results[name] = (med, retained)
+            print(f"{name:<10} {n:>6} {med * 1000:>10.1f} {retained / 1024:>13.0f} {peak / 1024:>10.0f}")
+        conn.close()
+
+    (lt, lm), (nt, nm) = results["legacy"], results["lean"]
+    print(f"lean vs legacy: {lt / nt:.1f}x faster, {lm / max(nm, 1):.1f}x less retained memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Benchmark: FTS5 order search (order_search.search_orders) on a large order history.
+
+Run from the repo root:
+    python benchmarks/bench_search.py [--orders 100000] [--repeat 20]
+
+Seeds a throwaway SQLite file with N orders (every third one routed, with workers),
+builds orders_fts through order_search.ensure_schema() and times typical dispatcher queries.
+"""
+import argparse
+import os
+import random
+import statistics
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import order_search  # noqa: E402
+
+STREETS = ["Pärnu mnt", "Tartu mnt", "Narva mnt", "Liivalao", "Mustamäe tee", "Sõpruse pst",
+           "Endla", "Kadaka tee", "Paldiski mnt", "Peterburi tee", "Ehitajate tee", "Vabaduse pst"]
+FIRST = ["Mari", "Jaan", "Kati", "Peeter", "Liis", "Andres", "Tiina", "Margus", "Kadri", "Toomas"]
+LAST = ["Tamm", "Saar", "Sepp", "Mägi", "Kask", "Kukk", "Rebane", "Ilves", "Pärn", "Koppel"]
+ARTICLES = ["KLAUS KASTIGA VOODI", "NURGADIIVAN LUNA", "KUMMUT OSLO", "MADRATS COMFORT", "LAUD TORINO"]
+
+QUERIES = ["pärnu mnt", "parnu 12", "tamm", "kati sepp", "5123", "klaus voodi", "liivalao", "utiliseerida"]
+
+
+def seed(path: str, n: int):
+    rnd = random.Random(7)
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    # Same tables/columns as app.init_db() creates (only what search touches).
+    cur.executescript("""
+    CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL);
+    CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, status TEXT NOT NULL DEFAULT 'NEW',
+        client_name TEXT DEFAULT '', phone TEXT DEFAULT '', address TEXT DEFAULT '',
+        delivery_date TEXT DEFAULT '', delivery_window TEXT DEFAULT '', notes TEXT DEFAULT '',
+        order_ref TEXT DEFAULT '', recipient_name TEXT DEFAULT '', ship_address TEXT DEFAULT '',
+        service_tag TEXT DEFAULT '', items_compact TEXT DEFAULT '');
+    CREATE TABLE routes (id INTEGER PRIMARY KEY AUTOINCREMENT, route_date TEXT NOT NULL);
+    CREATE TABLE route_items (id INTEGER PRIMARY KEY AUTOINCREMENT, route_id INTEGER NOT NULL,
+        order_id INTEGER NOT NULL, seq INTEGER NOT NULL, ring_no INTEGER NOT NULL DEFAULT 1,
+        worker_status TEXT NOT NULL DEFAULT 'OPEN', UNIQUE(route_id, order_id), UNIQUE(route_id, seq));
+    CREATE TABLE route_item_users (ri_id INTEGER NOT NULL, user_id INTEGER NOT NULL, UNIQUE(ri_id, user_id));
+    """)
+    cur.executemany("INSERT INTO users (name) VALUES (?)", [(f"{f} {l}",) for f in FIRST[:4] for l in LAST[:2]])
+    cur.executemany("INSERT INTO routes (route_date) VALUES (?)",
+                    [(f"2026-{m:02d}-{d:02d}",) for m in range(1, 11) for d in range(1, 29)])
+    rows = []
+    for i in range(1, n + 1):
+        name = f"{rnd.choice(FIRST)} {rnd.choice(LAST)}"
+        street = f"{rnd.choice(STREETS)} {rnd.randint(1, 200)}"
+        items = "\n".join(f"{k} - {rnd.choice(ARTICLES)} - {rnd.randint(1, 3)} tk - Pealadu" for k in range(1, 4))
+        rows.append((
+            "READY FOR WORK", name, f"+372 5{rnd.randint(1000000, 9999999)}", f"{street}, Tallinn",
+            f"2026-{rnd.randint(1, 10):02d}-{rnd.randint(1, 28):02d}", "10:00-12:00",
+            "Helistada enne. Vana diivan utiliseerida." if i % 7 == 0 else "", f"{100000 + i}/01.10.2026",
+            name, f"{street}\n10141 Tallinn", "Transport", items,
+        ))
+    cur.executemany(
+        """INSERT INTO orders (status, client_name, phone, address, delivery_date, delivery_window, notes,
+               order_ref, recipient_name, ship_address, service_tag, items_compact)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+    seq = {}
+    for oid in range(1, n + 1, 3):
+        rid = rnd.randint(1, 280)
+        seq[rid] = seq.get(rid, 0) + 1
+        cur.execute("INSERT INTO route_items (route_id, order_id, seq, worker_status) VALUES (?, ?, ?, 'DONE')",
+                    (rid, oid, seq[rid]))
+        cur.execute("INSERT INTO route_item_users (ri_id, user_id) VALUES (?, ?)", (cur.lastrowid, rnd.randint(1, 8)))
+    t0 = time.perf_counter()
+    order_search.ensure_schema(cur)
+    conn.commit()
+    build_s = time.perf_counter() - t0
+    conn.close()
+    return build_s
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--orders", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        build_s = seed(path, args.orders)
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        print(f"{args.orders} orders, index build {build_s:.1f}s, median of {args.repeat} runs (limit 50)")
+        print(f"{'query':<16} {'hits':>5} {'median ms':>10} {'p95 ms':>8}   last 7 days ms")
+        for q in QUERIES:
+            times, times_since = [], []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                hits = order_search.search_orders(conn, q)
+                times.append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                order_search.search_orders(conn, q, since="2026-10-12")
+                times_since.append(time.perf_counter() - t0)
+            times.sort()
+            p95 = times[int(len(times) * 0.95) - 1]
+            print(f"{q:<16} {len(hits):>5} {statistics.median(times) * 1000:>10.1f} {p95 * 1000:>8.1f}"
+                  f"   {statistics.median(times_since) * 1000:>8.1f}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
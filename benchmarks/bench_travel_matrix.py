@@ -0,0 +1,87 @@
+"""Benchmark: travel_matrix build and incremental update for one route date.
+
+Run from the repo root:
+    python benchmarks/bench_travel_matrix.py [--stops 500] [--added 5] [--repeat 20]
+
+Random stops around Tallinn. Times a full build, an update with a few stops added
+and removed (only their rows are computed), an unchanged get() and sub_km() for
+one ring, next to the pure-Python loop ring_optimizer used before.
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import travel_matrix  # noqa: E402
+
+
+def _stops(rnd, first: int, n: int) -> list:
+    return [(k, (59.35 + rnd.random() * 0.15, 24.55 + rnd.random() * 0.35)) for k in range(first, first + n)]
+
+
+def _python_matrix(points) -> list:
+    def hav(a, b):
+        lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+        h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        return 2 * travel_matrix.EARTH_KM * math.asin(min(1.0, math.sqrt(h)))
+
+    n = len(points)
+    m = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            m[i][j] = m[j][i] = hav(points[i], points[j])
+    return m
+
+
+def _time(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1e3
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--stops", type=int, default=500)
+    ap.add_argument("--added", type=int, default=5)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    rnd = random.Random(3)
+    base = _stops(rnd, 0, args.stops)
+    model = travel_matrix.SpeedModel()
+
+    def full():
+        travel_matrix.MatrixCache().get("2026-10-19", base, model)
+
+    cache = travel_matrix.MatrixCache()
+    cache.get("2026-10-19", base, model)
+    variants = [base[args.added:] + _stops(rnd, args.stops + n * args.added, args.added) for n in range(args.repeat + 1)]
+    it = iter(variants)
+
+    def incremental():
+        cache.get("2026-10-19", next(it), model)
+
+    steady = travel_matrix.MatrixCache()
+    steady.get("2026-10-19", base, model)
+    ring = [k for k, _c in base[:40]]
+    m = steady.get("2026-10-19", base, model)
+
+    print(f"{args.stops} stops")
+    print(f"  full build            {_time(full, args.repeat):8.2f} ms")
+    print(f"  +{args.added}/-{args.added} stops           {_time(incremental, args.repeat):8.2f} ms  "
+          f"({cache.stats()['rows_computed'] - args.stops} rows computed in {cache.stats()['updates']} updates)")
+    print(f"  unchanged get()       {_time(lambda: steady.get('2026-10-19', base, model), args.repeat):8.2f} ms")
+    print(f"  sub_km(40-stop ring)  {_time(lambda: m.sub_km(ring).tolist(), args.repeat):8.2f} ms")
+    print(f"  pure Python build     {_time(lambda: _python_matrix([c for _k, c in base]), max(1, args.repeat // 5)):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
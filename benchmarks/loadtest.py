@@ -0,0 +1,286 @@
+"""Load test: concurrent worker and dispatcher sessions against one SQLite file.
+
+Run from the repo root (no browser, no Streamlit):
+    python benchmarks/loadtest.py [--workers 20] [--dispatchers 3] [--seconds 30]
+    python benchmarks/loadtest.py --db Logistic/data/db.sqlite --copy   # a copy of real data
+
+Every simulated session is a thread with its own connection, like a browser
+tab on the Streamlit server; all share one read cache, like the server process.
+The calls are the repository methods behind app.py's helpers:
+
+  worker      get_user_by_token -> list_worker_route_items -> update_route_item_status
+  dispatcher  add_order_to_route (short-lived connection + lock retries, as in app.py)
+              move_route_item, update_order
+
+Writes carry the row version the session last read (compare-and-swap, as the
+app's buttons do); a write that finds the row changed counts as a conflict,
+not a failure. Several sessions on the same rows make those expected.
+
+Reports per operation: count, throughput, p50/p95/p99/max latency, conflicts and
+failures, plus the lock retries of add_order_to_route and the failure messages.
+--think adds a pause between a session's operations (default 0: closed loop).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import readcache  # noqa: E402
+import repository  # noqa: E402
+import user_tokens  # noqa: E402
+
+
+def _seed_tokens(conn, user_ids):
+    """Known login tokens load-token-<id> (stored hashed, like issued ones)."""
+    conn.executemany(
+        "INSERT OR IGNORE INTO user_tokens (token_hash, user_id, label, created_at) VALUES (?, ?, 'loadtest', ?)",
+        [(user_tokens.hash_token(f"load-token-{u}"), int(u), date.today().isoformat()) for u in user_ids],
+    )
+
+
+def seed(path: str, workers: int, orders: int, on_route: int, seed_value: int = 1) -> int:
+    """Fresh database with workers, orders and today's route; returns the route id."""
+    rnd = random.Random(seed_value)
+    repo = repository.open_sqlite(path)
+    conn = repo.conn()
+    now = date.today().isoformat()
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO users (name, phone, is_active, created_at) VALUES (?, ?, 1, ?)",
+        [(f"Töötaja {n}", f"+372 5{n:07d}", now) for n in range(1, workers + 1)],
+    )
+    _seed_tokens(conn, range(1, workers + 1))
+    conn.executemany(
+        "INSERT INTO orders (original_filename, stored_path, created_at, status, client_name, phone, address, "
+        "delivery_date, delivery_window, notes, items_compact) VALUES (?, ?, ?, 'READY FOR WORK', ?, ?, ?, ?, ?, ?, ?)",
+        [(f"order_{n}.pdf", f"/nope/order_{n}.pdf", now, f"Klient {n}", f"+372 5{n:07d}",
+          f"Pärnu mnt {n}, Tallinn", now, f"{8 + n % 10:02d}:00-{10 + n % 10:02d}:00", "Helistada enne",
+          "1 - DIIVAN - 1 tk - Pealadu") for n in range(1, orders + 1)],
+    )
+    conn.execute("COMMIT")
+    route_id = repo.get_or_create_route(now)
+    for order_id in range(1, on_route + 1):
+        repo.assign_order(route_id, order_id, [rnd.randint(1, workers)], ring_no=rnd.randint(1, 3))
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return route_id
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.failures = Counter()
+        self.conflicts = Counter()
+        self.errors = Counter()
+        self.retries = 0
+
+    def timed(self, op: str, fn):
+        t0 = time.perf_counter()
+        try:
+            result = fn()
+        except repository.VersionConflict:
+            with self._lock:
+                self.conflicts[op] += 1
+            return None
+        except Exception as e:
+            with self._lock:
+                self.failures[op] += 1
+                self.errors[f"{op}: {type(e).__name__}: {e}"] += 1
+            return None
+        dt = time.perf_counter() - t0
+        with self._lock:
+            self.latencies[op].append(dt)
+        return result
+
+    def retried(self, _error):
+        with self._lock:
+            self.retries += 1
+
+
+def _pct(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def worker_session(path, cache, route_id, user_id, stats, stop, think, rnd):
+    conn = repository.connect(path)
+    repo = repository.SqliteRepository(lambda: conn, path, cache=cache)
+    token = f"load-token-{user_id}"
+    while not stop.is_set():
+        user = stats.timed("get_user_by_token", lambda: repo.get_user_by_token(token))
+        rows = stats.timed("list_worker_route_items", lambda: repo.list_worker_route_items(route_id, user_id)) or []
+        if user and rows:
+            it = rnd.choice(rows)
+            status = "OPEN" if it.worker_status == "DONE" else "DONE"
+            stats.timed("update_route_item_status",
+                        lambda: repo.set_item_status(it.ri_id, status, user_id, expected_version=it.version))
+        if think:
+            time.sleep(rnd.uniform(0.5, 1.5) * think)
+    conn.close()
+
+
+def dispatcher_session(path, cache, route_id, workers, orders, stats, stop, think, rnd):
+    conn = repository.connect(path)
+    repo = repository.SqliteRepository(lambda: conn, path, cache=cache)
+    ops = ("add_order_to_route", "move_route_item", "update_order")
+    while not stop.is_set():
+        op = rnd.choice(ops)
+        if op == "add_order_to_route":
+            order_id, uid, ring = rnd.randint(1, orders), rnd.randint(1, workers), rnd.randint(1, 3)
+
+            def add():
+                def assign():
+                    with repo.short_lived(timeout=1.0) as r:
+                        r.assign_order(route_id, order_id, [uid], ring_no=ring)
+                repository.retry_locked(assign, on_retry=stats.retried)
+
+            stats.timed(op, add)
+        elif op == "move_route_item":
+            rows = repo.list_route_items(route_id)
+            if rows:
+                it = rnd.choice(rows)
+
+                def move():
+                    pos = repo.item_position(it.ri_id)
+                    if pos:
+                        repo.move_item_to(it.ri_id, max(1, pos[2] + rnd.choice((-1, 1))), expected_version=it.version)
+
+                stats.timed(op, move)
+        else:
+            order_id = rnd.randint(1, orders)
+
+            def edit():
+                o = repo.get_order(order_id)
+                if o:
+                    repo.update_order(order_id, {"notes": f"Muudetud {time.time():.3f}"}, expected_version=o["version"])
+
+            stats.timed(op, edit)
+        if think:
+            time.sleep(rnd.uniform(0.5, 1.5) * think)
+    conn.close()
+
+
+def report(stats: Stats, seconds: float) -> dict:
+    ops = {}
+    for op in sorted(set(stats.latencies) | set(stats.failures) | set(stats.conflicts)):
+        lat = sorted(stats.latencies.get(op, []))
+        ops[op] = {
+            "n": len(lat),
+            "per_s": len(lat) / seconds,
+            "p50_ms": _pct(lat, 50) * 1e3,
+            "p95_ms": _pct(lat, 95) * 1e3,
+            "p99_ms": _pct(lat, 99) * 1e3,
+            "max_ms": (lat[-1] if lat else 0.0) * 1e3,
+            "conflicts": stats.conflicts.get(op, 0),
+            "failed": stats.failures.get(op, 0),
+        }
+    total = sum(o["n"] for o in ops.values())
+    return {
+        "seconds": seconds,
+        "ops": ops,
+        "total_per_s": total / seconds,
+        "failed": sum(stats.failures.values()),
+        "conflicts": sum(stats.conflicts.values()),
+        "lock_retries": stats.retries,
+        "errors": dict(stats.errors.most_common(10)),
+    }
+
+
+def print_report(r: dict, cache_stats: dict):
+    print(f"\n{'operation':<26}{'n':>8}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+          f"{'confl.':>8}{'failed':>8}")
+    for op, o in r["ops"].items():
+        print(f"{op:<26}{o['n']:>8}{o['per_s']:>9.1f}{o['p50_ms']:>9.2f}{o['p95_ms']:>9.2f}"
+              f"{o['p99_ms']:>9.2f}{o['max_ms']:>9.1f}{o['conflicts']:>8}{o['failed']:>8}")
+    print(f"\ntotal {r['total_per_s']:.1f} ops/s over {r['seconds']:.1f}s • conflicts {r['conflicts']} • failed {r['failed']} • "
+          f"lock retries {r['lock_retries']} • read cache hit rate {cache_stats['hit_rate']:.0%}")
+    for msg, n in r["errors"].items():
+        print(f"  {n:>5} × {msg}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--workers", type=int, default=20)
+    ap.add_argument("--dispatchers", type=int, default=3)
+    ap.add_argument("--seconds", type=float, default=30.0)
+    ap.add_argument("--think", type=float, default=0.0, help="mean pause between a session's operations (s)")
+    ap.add_argument("--orders", type=int, default=2000, help="orders to seed")
+    ap.add_argument("--on-route", type=int, default=400, help="seeded orders already on today's route")
+    ap.add_argument("--db", default="", help="use this database instead of a seeded one")
+    ap.add_argument("--copy", action="store_true", help="with --db: run against a temp copy")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.db:
+            path = args.db
+            if args.copy:
+                path = os.path.join(tmp, "db.sqlite")
+                shutil.copy(args.db, path)
+            repo = repository.open_sqlite(path)
+            route_id = repo.get_or_create_route(date.today().isoformat())
+            conn = repo.conn()
+            workers = [int(r[0]) for r in conn.execute("SELECT id FROM users WHERE is_active=1")]
+            if not workers:
+                sys.exit("no active users in --db")
+            _seed_tokens(conn, workers)
+            orders = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0])
+            conn.close()
+        else:
+            path = os.path.join(tmp, "db.sqlite")
+            t0 = time.perf_counter()
+            route_id = seed(path, args.workers, args.orders, min(args.on_route, args.orders), args.seed)
+            workers = list(range(1, args.workers + 1))
+            orders = args.orders
+            if not args.json:
+                print(f"seeded {args.workers} workers, {args.orders} orders, {args.on_route} on route "
+                      f"in {time.perf_counter() - t0:.1f}s")
+
+        cache = readcache.ReadCache()
+        cache.bind(path)
+        stats = Stats()
+        stop = threading.Event()
+        threads = []
+        for n in range(args.workers):
+            uid = workers[n % len(workers)]
+            threads.append(threading.Thread(
+                target=worker_session,
+                args=(path, cache, route_id, uid, stats, stop, args.think, random.Random(args.seed * 1000 + n)),
+            ))
+        for n in range(args.dispatchers):
+            threads.append(threading.Thread(
+                target=dispatcher_session,
+                args=(path, cache, route_id, len(workers), orders, stats, stop, args.think,
+                      random.Random(args.seed * 7919 + n)),
+            ))
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+
+        r = report(stats, elapsed)
+        if args.json:
+            print(json.dumps(dict(r, cache=cache.stats()), indent=2, ensure_ascii=False))
+        else:
+            print_report(r, cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""change_log: append-only feed of route item and order changes.
+
+The repository writes one row per logical mutation (status change, assignment,
+move, removal, order edit ...) with the same cursor as the mutation itself, so a
+change is in the feed exactly when it is committed. Each row is indexed under
+the routes and workers it concerns (change_log_keys), including the workers an
+item was taken away from.
+
+Readers keep a cursor (the last change id they have seen) and pull only what
+came after it:
+
+    feed = changes_since(conn, cursor, user_id=7)
+    for ch in feed["changes"]: ...
+    cursor = feed["cursor"]
+
+ids are AUTOINCREMENT, so they only grow, also across prune(). A cursor older than
+the retained history comes back with resync=True: reload everything and carry on
+from the returned cursor.
+
+Command line (external consumers, cron):
+    python change_log.py since CURSOR [--route ID] [--user ID] [--limit N]
+    python change_log.py prune [--days 30]
+"""
+import argparse
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+DEFAULT_KEEP_DAYS = 30
+
+
+def ensure_schema(cur):
+    """Create change_log + change_log_keys (called from repository.init_schema)."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        changed_at TEXT NOT NULL,
+        entity TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        data TEXT NOT NULL DEFAULT '{}'
+    )""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS change_log_keys (
+        kind TEXT NOT NULL,
+        key INTEGER NOT NULL,
+        change_id INTEGER NOT NULL,
+        PRIMARY KEY (kind, key, change_id)
+    ) WITHOUT ROWID""")
+
+
+def record(cur, entity: str, entity_id: int, op: str, route_ids=(), user_ids=(), data=None) -> int:
+    """Append one change (caller owns the transaction). Returns its id."""
+    cur.execute(
+        "INSERT INTO change_log (changed_at, entity, entity_id, op, data) VALUES (?, ?, ?, ?, ?)",
+        (datetime.now().isoformat(timespec="seconds"), entity, int(entity_id), op,
+         json.dumps(data or {}, ensure_ascii=False, sort_keys=True)),
+    )
+    change_id = int(cur.lastrowid)
+    keys = {("route", int(r)) for r in route_ids if r is not None}
+    keys |= {("user", int(u)) for u in user_ids if u is not None}
+    cur.executemany(
+        "INSERT OR IGNORE INTO change_log_keys (kind, key, change_id) VALUES (?, ?, ?)",
+        [(kind, key, change_id) for kind, key in sorted(keys)],
+    )
+    return change_id
+
+
+def item_keys(cur, ri_id: int):
+    """(route_ids, user_ids) a route item change concerns; read before the write changes them."""
+    cur.execute("SELECT route_id FROM route_items WHERE id=?", (int(ri_id),))
+    route_ids = [int(r[0]) for r in cur.fetchall()]
+    cur.execute("SELECT user_id FROM route_item_users WHERE ri_id=?", (int(ri_id),))
+    return route_ids, [int(r[0]) for r in cur.fetchall()]
+
+
+def order_keys(cur, order_id: int):
+    """(route_ids, user_ids) of every route item an order is on."""
+    cur.execute("SELECT id, route_id FROM route_items WHERE order_id=?", (int(order_id),))
+    items = cur.fetchall()
+    cur.execute(
+        "SELECT DISTINCT riu.user_id FROM route_item_users riu JOIN route_items ri ON ri.id = riu.ri_id "
+        "WHERE ri.order_id=?",
+        (int(order_id),),
+    )
+    return sorted({int(r[1]) for r in items}), [int(r[0]) for r in cur.fetchall()]
+
+
+def head(conn) -> int:
+    """Id of the newest change (0 if none): the cursor of a reader that is up to date."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='change_log'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def _row(r) -> dict:
+    return {
+        "id": int(r[0]), "changed_at": r[1], "entity": r[2], "entity_id": int(r[3]),
+        "op": r[4], "data": json.loads(r[5] or "{}"),
+    }
+
+
+def changes_since(conn, cursor: int, route_id: int | None = None, user_id: int | None = None,
+                  limit: int = 500) -> dict:
+    """Changes after cursor, oldest first: {"changes": [...], "cursor": n, "resync": bool}.
+
+    With route_id / user_id only the changes concerning that route / worker are
+    returned (either one matching is enough). The returned cursor also skips the
+    unrelated changes; when more than limit changes are pending it stops at the
+    last one returned.
+    """
+    cursor = max(int(cursor or 0), 0)
+    top = head(conn)
+    if cursor >= top:
+        return {"changes": [], "cursor": top, "resync": cursor > top}
+    oldest = conn.execute("SELECT MIN(id) FROM change_log").fetchone()[0]
+    resync = oldest is None or cursor < int(oldest) - 1
+
+    cols = "c.id, c.changed_at, c.entity, c.entity_id, c.op, c.data"
+    if route_id is None and user_id is None:
+        rows = conn.execute(
+            f"SELECT {cols} FROM change_log c WHERE c.id > ? AND c.id <= ? ORDER BY c.id LIMIT ?",
+            (cursor, top, int(limit)),
+        ).fetchall()
+    else:
+        keys = [(k, int(v)) for k, v in (("route", route_id), ("user", user_id)) if v is not None]
+        ids = " UNION ".join(
+            "SELECT change_id FROM change_log_keys WHERE kind=? AND key=? AND change_id > ? AND change_id <= ?"
+            for _ in keys
+        )
+        params = [p for k, v in keys for p in (k, v, cursor, top)]
+        rows = conn.execute(
+            f"SELECT {cols} FROM change_log c WHERE c.id IN ({ids}) ORDER BY c.id LIMIT ?",
+            (*params, int(limit)),
+        ).fetchall()
+
+    changes = [_row(r) for r in rows]
+    next_cursor = changes[-1]["id"] if len(changes) >= int(limit) else top
+    return {"changes": changes, "cursor": next_cursor, "resync": resync}
+
+
+def prune(conn, keep_days: int = DEFAULT_KEEP_DAYS) -> int:
+    """Delete changes older than keep_days. Returns the number of deleted changes."""
+    cutoff = (datetime.now() - timedelta(days=int(keep_days))).isoformat(timespec="seconds")
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE;")
+    try:
+        cur.execute("SELECT MAX(id) FROM change_log WHERE changed_at < ?", (cutoff,))
+        last = cur.fetchone()[0]
+        n = 0
+        if last is not None:
+            cur.execute("DELETE FROM change_log_keys WHERE change_id <= ?", (int(last),))
+            cur.execute("DELETE FROM change_log WHERE id <= ?", (int(last),))
+            n = cur.rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return n
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Read or prune the change feed.")
+    ap.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "Logistic", "data", "db.sqlite"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("since", help="print changes after CURSOR as JSON lines, then the next cursor")
+    p.add_argument("cursor", type=int)
+    p.add_argument("--route", type=int, default=None)
+    p.add_argument("--user", type=int, default=None)
+    p.add_argument("--limit", type=int, default=500)
+    p = sub.add_parser("prune", help="delete changes older than --days")
+    p.add_argument("--days", type=int, default=DEFAULT_KEEP_DAYS)
+    args = ap.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=5.0, isolation_level=None)
+    if args.cmd == "since":
+        feed = changes_since(conn, args.cursor, route_id=args.route, user_id=args.user, limit=args.limit)
+        for ch in feed["changes"]:
+            print(json.dumps(ch, ensure_ascii=False))
+        print(json.dumps({"cursor": feed["cursor"], "resync": feed["resync"]}))
+    else:
+        print(f"pruned {prune(conn, args.days)} changes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""Offline geocoding: a local gazetteer and a cache keyed by normalized address.
+
+The depot network can't reach external geocoders, so coordinates come from a
+gazetteer file imported into the database (CSV: street, house number, lat, lon
+and optionally city; any column order, header names in English or Estonian):
+
+    python geocode.py import aadressid.csv [--city Tallinn]
+    python geocode.py backfill            # orders without coordinates
+    python geocode.py lookup "Pärnu mnt 10-5, 10141 Tallinn"
+
+Addresses are normalized (case, punctuation, "mnt"/"maantee", apartment and
+postal code dropped) into "street|house|city"; normalize() is memoized. A
+lookup tries the exact street, then the closest street name of the city
+(difflib, FUZZY_CUTOFF), then the nearest house number on that street. Every
+result, misses included, is stored in geocode_cache, so an address is resolved
+once; importing a gazetteer drops the cached misses.
+
+A batch costs one cache query per CHUNK addresses: resolve_many() does the
+reads and the fuzzy matching outside any transaction, store() then writes the
+new cache rows together with the orders' coordinates in one short write.
+Plain module (no Streamlit import); repository.SqliteRepository wraps it
+(geocode_orders, import_gazetteer), app.py geocodes each PDF import batch.
+"""
+import argparse
+import csv
+import difflib
+import functools
+import os
+import re
+import unicodedata
+from datetime import datetime
+
+import address_area
+
+FUZZY_CUTOFF = 0.82
+CHUNK = 400
+
+# Street type words -> canonical abbreviation
+_STREET_TYPES = {
+    "tänav": "tn", "tanav": "tn", "tn": "tn",
+    "maantee": "mnt", "mnt": "mnt",
+    "puiestee": "pst", "pst": "pst",
+    "tee": "tee", "põik": "põik", "poik": "põik", "väljak": "väljak", "valjak": "väljak",
+}
+_HOUSE_RE = re.compile(r"^(\d+[a-z]?)(?:[-/](\d+[a-z]?))?$")
+_POSTAL_RE = re.compile(r"\b\d{5}\b")
+_HEADERS = {
+    "street": ("street", "tanav", "tänav", "street_name"),
+    "house": ("house", "house_number", "housenumber", "maja", "majanr", "nr"),
+    "lat": ("lat", "latitude", "laius"),
+    "lon": ("lon", "lng", "long", "longitude", "pikkus"),
+    "city": ("city", "linn", "town", "asula"),
+}
+
+
+def ensure_schema(cur):
+    """Create gazetteer + geocode_cache (called from repository.init_schema)."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS gazetteer (
+        city TEXT NOT NULL DEFAULT '',
+        street TEXT NOT NULL,
+        house TEXT NOT NULL DEFAULT '',
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        PRIMARY KEY (city, street, house)
+    ) WITHOUT ROWID""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        address_key TEXT PRIMARY KEY,
+        lat REAL,
+        lon REAL,
+        matched TEXT DEFAULT '',
+        score REAL DEFAULT 0,
+        updated_at TEXT NOT NULL
+    ) WITHOUT ROWID""")
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFC", (text or "").lower())
+    text = text.replace("–", "-").replace("—", "-")
+    return re.sub(r"[^\w\s\-/]", " ", text)
+
+
+def _street_key(words) -> str:
+    return " ".join(_STREET_TYPES.get(w, w) for w in words if w)
+
+
+def _house_key(text: str) -> str:
+    m = _HOUSE_RE.match((text or "").strip().lower().replace(" ", ""))
+    return m.group(1) if m else ""
+
+
+@functools.lru_cache(maxsize=8192)
+def normalize(address: str) -> tuple:
+    """(street, house, city) of a free-text address; ('', '', '') if no street is found.
+
+    The city is the one address_area.parse() reads (also before the street or
+    after the house number on the same line; maakond, vald and country skipped).
+    """
+    lines = [ln for ln in re.split(r"[\n,]", address or "") if ln.strip()]
+    street, house = "", ""
+    for ln in lines:
+        words = _POSTAL_RE.sub(" ", _fold(ln)).split()
+        for n, w in enumerate(words):
+            h = _house_key(w)
+            if h and n > 0:
+                street, house = _street_key(words[:n]), h
+                break
+        if street:
+            break
+    if not street and lines:
+        # No house number: keep the first line as a street (matched to its first house)
+        words = _POSTAL_RE.sub(" ", _fold(lines[0])).split()
+        street = _street_key(words)
+        address = "\n".join(lines[1:])
+    city = " ".join(_fold(address_area.parse(address)[1]).split())
+    return street, house, city
+
+
+def address_key(address: str) -> str:
+    return "|".join(normalize(address))
+
+
+def _house_num(house: str) -> int:
+    m = re.match(r"\d+", house or "")
+    return int(m.group(0)) if m else 0
+
+
+class _Gazetteer:
+    """Street lists per city, loaded lazily for one batch."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._streets = {}
+
+    def streets(self, city: str) -> list:
+        if city not in self._streets:
+            if city:
+                rows = self.conn.execute("SELECT DISTINCT street FROM gazetteer WHERE city=?", (city,)).fetchall()
+            else:
+                rows = self.conn.execute("SELECT DISTINCT street FROM gazetteer").fetchall()
+            self._streets[city] = [r[0] for r in rows]
+        return self._streets[city]
+
+    def resolve(self, street: str, house: str, city: str):
+        """(lat, lon, matched, score) or None."""
+        if not street:
+            return None
+        cities = [city, ""] if city else [""]
+        for c in cities:
+            candidates = self.streets(c)
+            if not candidates:
+                continue
+            if street in candidates:
+                name, score = street, 1.0
+            else:
+                close = difflib.get_close_matches(street, candidates, n=1, cutoff=FUZZY_CUTOFF)
+                if not close:
+                    continue
+                name = close[0]
+                score = difflib.SequenceMatcher(None, street, name).ratio()
+            hit = self._house(name, house, c)
+            if hit:
+                lat, lon, matched_house, exact = hit
+                return lat, lon, f"{name} {matched_house}".strip(), score * (1.0 if exact else 0.8)
+        return None
+
+    def _house(self, street: str, house: str, city: str):
+        where, params = "street=?", [street]
+        if city:
+            where += " AND city=?"
+            params.append(city)
+        if house:
+            row = self.conn.execute(f"SELECT lat, lon FROM gazetteer WHERE {where} AND house=? LIMIT 1",
+                                    (*params, house)).fetchone()
+            if row:
+                return row[0], row[1], house, True
+        rows = self.conn.execute(f"SELECT house, lat, lon FROM gazetteer WHERE {where}", params).fetchall()
+        if not rows:
+            return None
+        want = _house_num(house)
+        # Nearest number, same side of the street first
+        best = min(rows, key=lambda r: (abs(_house_num(r[0]) - want) + (0 if _house_num(r[0]) % 2 == want % 2 else 1),
+                                        r[0]))
+        return best[1], best[2], best[0], False
+
+
+def resolve_many(conn, addresses):
+    """Read-only half of a batch: ({address: (lat, lon) or None}, cache rows to store)."""
+    keys = {a: address_key(a) for a in addresses if (a or "").strip()}
+    found = {}
+    wanted = sorted(set(keys.values()))
+    for i in range(0, len(wanted), CHUNK):
+        chunk = wanted[i:i + CHUNK]
+        rows = conn.execute(
+            f"SELECT address_key, lat, lon FROM geocode_cache WHERE address_key IN ({', '.join('?' for _ in chunk)})",
+            chunk,
+        ).fetchall()
+        for r in rows:
+            found[r[0]] = (r[1], r[2]) if r[1] is not None else None
+
+    fresh = []
+    missing = [k for k in wanted if k not in found]
+    if missing:
+        gaz = _Gazetteer(conn)
+        now = datetime.now().isoformat(timespec="seconds")
+        for k in missing:
+            hit = gaz.resolve(*k.split("|"))
+            found[k] = (hit[0], hit[1]) if hit else None
+            fresh.append((k, hit[0], hit[1], hit[2], hit[3], now) if hit else (k, None, None, "", 0.0, now))
+    return {a: found.get(k) for a, k in keys.items()}, fresh
+
+
+def store(cur, fresh):
+    """Write resolve_many()'s new cache rows (inside the caller's transaction)."""
+    if fresh:
+        cur.executemany(
+            "INSERT OR REPLACE INTO geocode_cache (address_key, lat, lon, matched, score, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            fresh,
+        )
+
+
+def order_address(row) -> str:
+    return (row.get("address") or "").strip() or (row.get("ship_address") or "").strip()
+
+
+def _pick(header: list, names) -> int:
+    folded = [_fold(h).strip() for h in header]
+    for name in names:
+        if name in folded:
+            return folded.index(name)
+    return -1
+
+
+def read_gazetteer(path: str, city: str = "") -> list:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return parse_gazetteer(f, city)
+
+
+def parse_gazetteer(f, city: str = "") -> list:
+    """(city, street, house, lat, lon) rows of a gazetteer CSV (text file); unparsable lines are skipped."""
+    sample = f.read(4096)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(f, dialect)
+    header = next(reader, [])
+    cols = {k: _pick(header, names) for k, names in _HEADERS.items()}
+    if min(cols["street"], cols["house"], cols["lat"], cols["lon"]) < 0:
+        raise ValueError(f"gazetteer needs street, house, lat and lon columns, got: {header}")
+    default_city = " ".join(_fold(city).split())
+    rows = []
+    for rec in reader:
+        try:
+            street = _street_key(_fold(rec[cols["street"]]).split())
+            house = _house_key(rec[cols["house"]])
+            lat = float(rec[cols["lat"]].replace(",", "."))
+            lon = float(rec[cols["lon"]].replace(",", "."))
+        except (IndexError, ValueError):
+            continue
+        c = " ".join(_fold(rec[cols["city"]]).split()) if 0 <= cols["city"] < len(rec) else ""
+        if street:
+            rows.append((c or default_city, street, house, lat, lon))
+    return rows
+
+
+def load_gazetteer(cur, rows):
+    """Insert / replace gazetteer rows and forget cached misses (they may resolve now)."""
+    cur.executemany("INSERT OR REPLACE INTO gazetteer (city, street, house, lat, lon) VALUES (?, ?, ?, ?, ?)", rows)
+    cur.execute("DELETE FROM geocode_cache WHERE lat IS NULL")
+
+
+def stats(conn) -> dict:
+    row = conn.execute(
+        "SELECT (SELECT COUNT(*) FROM gazetteer), "
+        "(SELECT COUNT(*) FROM geocode_cache WHERE lat IS NOT NULL), "
+        "(SELECT COUNT(*) FROM geocode_cache WHERE lat IS NULL), "
+        "(SELECT COUNT(*) FROM orders WHERE lat IS NULL)"
+    ).fetchone()
+    return {"gazetteer": row[0], "cached": row[1], "misses": row[2], "orders_without_coords": row[3]}
+
+
+def main():
+    import repository
+
+    ap = argparse.ArgumentParser(description="Offline geocoding: gazetteer import and order backfill.")
+    ap.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "Logistic", "data", "db.sqlite"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("import", help="load a gazetteer CSV")
+    p.add_argument("csv")
+    p.add_argument("--city", default="", help="city for rows without a city column")
+    sub.add_parser("backfill", help="geocode orders without coordinates")
+    p = sub.add_parser("lookup", help="resolve one address")
+    p.add_argument("address")
+    args = ap.parse_args()
+
+    repo = repository.open_sqlite(args.db)
+    if args.cmd == "import":
+        print(f"imported {repo.import_gazetteer(read_gazetteer(args.csv, args.city))} gazetteer rows")
+    if args.cmd in ("import", "backfill"):
+        print(f"geocoded {repo.geocode_orders()} orders")
+    else:
+        found, _fresh = resolve_many(repo.conn(), [args.address])
+        print(address_key(args.address), found.get(args.address))
+    print(repo.geocode_stats())
+
+
+if __name__ == "__main__":
+    main()
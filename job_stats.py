@@ -0,0 +1,147 @@
+"""daily_job_stats: per-day job counts kept current by triggers.
+
+One row per (user_id, status, route_date) with the number of route items.
+user_id 0 is the day total (every item once, assigned or not); other rows count
+the items assigned to that worker, so a two-person job counts for both.
+
+Triggers on route_items (insert/delete, status or route change) and on
+route_item_users (worker links) apply +1/-1 deltas. Worker links only count
+while their route item exists: the app deletes route_items with foreign_keys
+OFF, so the item's delete trigger settles its links and a later cleanup of the
+orphaned links is a no-op.
+
+Rows that drop to 0 are kept (cheaper than a cleanup per write); readers skip them.
+"""
+import sqlite3
+
+import archive
+
+_STATUS = "COALESCE(NULLIF(UPPER({0}.worker_status),''),'OPEN')"
+_DATE = "COALESCE((SELECT route_date FROM routes WHERE id={0}.route_id), '')"
+
+
+def _bump(sign: str, user_sql: str, date_sql: str, status_sql: str, source: str = "") -> str:
+    """Upsert one +1/-1 delta (INSERT ... SELECT needs the WHERE 1 for the upsert clause)."""
+    return f"""
+        INSERT INTO daily_job_stats (user_id, status, route_date, n)
+        SELECT {user_sql}, {status_sql}, {date_sql}, {sign}1 {source or "WHERE 1"}
+        ON CONFLICT(user_id, status, route_date) DO UPDATE SET n = n + excluded.n;"""
+
+
+_TRIGGERS = {
+    "trg_djs_ri_insert": f"""
+        AFTER INSERT ON route_items BEGIN
+            {_bump("+", "0", _DATE.format("NEW"), _STATUS.format("NEW"))}
+            {_bump("+", "riu.user_id", _DATE.format("NEW"), _STATUS.format("NEW"),
+                   "FROM route_item_users riu WHERE riu.ri_id = NEW.id")}
+        END""",
+    "trg_djs_ri_delete": f"""
+        AFTER DELETE ON route_items BEGIN
+            {_bump("-", "0", _DATE.format("OLD"), _STATUS.format("OLD"))}
+            {_bump("-", "riu.user_id", _DATE.format("OLD"), _STATUS.format("OLD"),
+                   "FROM route_item_users riu WHERE riu.ri_id = OLD.id")}
+        END""",
+    "trg_djs_ri_update": f"""
+        AFTER UPDATE OF worker_status, route_id ON route_items
+        WHEN {_STATUS.format("OLD")} <> {_STATUS.format("NEW")} OR OLD.route_id <> NEW.route_id
+        BEGIN
+            {_bump("-", "0", _DATE.format("OLD"), _STATUS.format("OLD"))}
+            {_bump("-", "riu.user_id", _DATE.format("OLD"), _STATUS.format("OLD"),
+                   "FROM route_item_users riu WHERE riu.ri_id = OLD.id")}
+            {_bump("+", "0", _DATE.format("NEW"), _STATUS.format("NEW"))}
+            {_bump("+", "riu.user_id", _DATE.format("NEW"), _STATUS.format("NEW"),
+                   "FROM route_item_users riu WHERE riu.ri_id = NEW.id")}
+        END""",
+    "trg_djs_riu_insert": f"""
+        AFTER INSERT ON route_item_users BEGIN
+            {_bump("+", "NEW.user_id", _DATE.format("ri"), _STATUS.format("ri"),
+                   "FROM route_items ri WHERE ri.id = NEW.ri_id")}
+        END""",
+    "trg_djs_riu_delete": f"""
+        AFTER DELETE ON route_item_users BEGIN
+            {_bump("-", "OLD.user_id", _DATE.format("ri"), _STATUS.format("ri"),
+                   "FROM route_items ri WHERE ri.id = OLD.ri_id")}
+        END""",
+    "trg_djs_riu_update": f"""
+        AFTER UPDATE OF ri_id, user_id ON route_item_users BEGIN
+            {_bump("-", "OLD.user_id", _DATE.format("ri"), _STATUS.format("ri"),
+                   "FROM route_items ri WHERE ri.id = OLD.ri_id")}
+            {_bump("+", "NEW.user_id", _DATE.format("ri"), _STATUS.format("ri"),
+                   "FROM route_items ri WHERE ri.id = NEW.ri_id")}
+        END""",
+}
+
+
+def ensure_schema(cur):
+    """Create daily_job_stats + triggers; backfill when the table is new (called from repository.init_schema)."""
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_job_stats'")
+    existed = cur.fetchone() is not None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS daily_job_stats (
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        route_date TEXT NOT NULL,
+        n INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, status, route_date)
+    ) WITHOUT ROWID""")
+    for name, body in _TRIGGERS.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    if not existed:
+        rebuild(cur)
+
+
+def rebuild(cur):
+    """Recompute every row from route_items (caller owns the transaction)."""
+    cur.execute("DELETE FROM daily_job_stats")
+    cur.execute(f"""
+        INSERT INTO daily_job_stats (user_id, status, route_date, n)
+        SELECT 0, {_STATUS.format("ri")}, COALESCE(r.route_date, ''), COUNT(*)
+        FROM route_items ri LEFT JOIN routes r ON r.id = ri.route_id
+        GROUP BY 2, 3""")
+    cur.execute(f"""
+        INSERT INTO daily_job_stats (user_id, status, route_date, n)
+        SELECT riu.user_id, {_STATUS.format("ri")}, COALESCE(r.route_date, ''), COUNT(*)
+        FROM route_item_users riu
+        JOIN route_items ri ON ri.id = riu.ri_id
+        LEFT JOIN routes r ON r.id = ri.route_id
+        GROUP BY 1, 2, 3""")
+
+
+def list_days(conn: sqlite3.Connection, statuses=("DONE", "CANCELLED"), user_id: int = 0,
+              history: bool = False) -> list:
+    """[(route_date, {status: n})] newest first; user_id 0 = all jobs of the day.
+
+    history=True also counts archived days (hist_daily_job_stats, see archive.py).
+    """
+    statuses = [s.strip().upper() for s in statuses]
+    t = archive.table_names(history)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT route_date, status, n FROM {t["daily_job_stats"]}
+        WHERE user_id = ? AND status IN ({", ".join("?" for _ in statuses)}) AND n > 0
+        ORDER BY route_date DESC
+    """, (int(user_id), *statuses))
+    days = {}
+    for d, status, n in cur.fetchall():
+        counts = days.setdefault(d, {})
+        counts[status] = counts.get(status, 0) + int(n)
+    return sorted(days.items(), key=lambda x: x[0], reverse=True)
+
+
+def day_by_worker(conn: sqlite3.Connection, route_date: str, statuses=("DONE", "CANCELLED"),
+                  history: bool = False) -> list:
+    """[(user_id, name, {status: n})] for one day, busiest worker first."""
+    statuses = [s.strip().upper() for s in statuses]
+    t = archive.table_names(history)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT s.user_id, COALESCE(u.name, '#' || s.user_id), s.status, s.n
+        FROM {t["daily_job_stats"]} s
+        LEFT JOIN users u ON u.id = s.user_id
+        WHERE s.route_date = ? AND s.user_id <> 0 AND s.status IN ({", ".join("?" for _ in statuses)}) AND s.n > 0
+    """, (route_date, *statuses))
+    workers = {}
+    for uid, name, status, n in cur.fetchall():
+        counts = workers.setdefault((int(uid), name), {})
+        counts[status] = counts.get(status, 0) + int(n)
+    return sorted(((uid, name, c) for (uid, name), c in workers.items()), key=lambda x: (-sum(x[2].values()), x[1]))
@@ -0,0 +1,144 @@
+"""Live updates for open worker / planner views.
+
+The views render their job lists inside st.fragment(run_every=...), so a tick
+reruns only that list, not the page. What a tick costs is decided here:
+
+  - WATCHER.head() is shared by every session of the server process. It runs
+    PRAGMA data_version on one private connection (any commit by any other
+    connection bumps it), at most once per MIN_INTERVAL, and reads the change_log
+    head only when the version moved. Idle ticks touch no table.
+  - poll() compares that head with the session's cursor; only when it moved
+    does the session pull its own changes from change_log, through the
+    route / worker index (change_log_keys).
+  - The rows themselves come from the read cache, which the same writes already
+    invalidated per route / worker listing: only the affected route's or
+    worker's list is re-read (whole, by its listing query), the others are
+    served from the cache.
+
+Plain module (no Streamlit import); app.py keeps the cursors in session_state.
+"""
+import sqlite3
+import threading
+import time
+
+import change_log
+
+DEFAULT_EVERY_SEC = 5     # fragment tick (setting live_refresh_sec, 0 = off)
+MIN_INTERVAL = 0.5        # process-wide: at most one data_version check per this many seconds
+HIGHLIGHT_SEC = 60        # how long changed rows stay marked
+OWN_KEEP = 200            # own write ranges a session remembers
+
+_OP_LABELS = {
+    "insert": "uus töö",
+    "assign": "töö ümber määratud",
+    "status": "staatus muutus",
+    "move": "järjekord muutus",
+    "reorder": "järjekord muutus",
+    "delete": "töö eemaldatud",
+    "update": "tellimus muudetud",
+}
+
+
+class ChangeWatcher:
+    """Newest change_log id, checked cheaply and shared by all sessions."""
+
+    def __init__(self, min_interval: float = MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._db_path = ""
+        self._conn = None
+        self._data_version = None
+        self._head = 0
+        self._checked = 0.0
+        self.polls = self.head_reads = 0
+
+    def bind(self, db_path: str):
+        """Point the watcher at a database file (idempotent)."""
+        with self._lock:
+            if db_path == self._db_path and self._conn is not None:
+                return
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+            self._db_path = db_path
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=1.0, isolation_level=None)
+            self._data_version = None
+            self._checked = 0.0
+
+    def head(self) -> int:
+        with self._lock:
+            self.polls += 1
+            now = time.monotonic()
+            if self._conn is None or now - self._checked < self.min_interval:
+                return self._head
+            self._checked = now
+            try:
+                version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                if version != self._data_version:
+                    self._head = change_log.head(self._conn)
+                    self._data_version = version
+                    self.head_reads += 1
+            except sqlite3.Error:
+                pass
+            return self._head
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"polls": self.polls, "head_reads": self.head_reads, "head": self._head}
+
+
+WATCHER = ChangeWatcher()
+
+
+def note_own(own: list, ids: range) -> None:
+    """Remember the change ids of one of the session's own writes (the newest OWN_KEEP writes)."""
+    if len(ids):
+        own.append((ids.start, ids.stop - 1))
+        del own[:-OWN_KEEP]
+
+
+def poll(state: dict, repo, route_id: int | None = None, user_id: int | None = None, own=()) -> list:
+    """Changes for one view since its last poll (oldest first); state keeps the view's cursor.
+
+    The first poll only sets the cursor. own holds the (first, last) change id
+    ranges of the session's own writes (note_own): the view already shows them,
+    so they are left out, while other sessions' changes around them still come
+    through.
+    """
+    top = WATCHER.head()
+    cursor = state.get("cursor")
+    if cursor is None:
+        state["cursor"] = top
+        return []
+    if top <= int(cursor):
+        return []
+    feed = repo.changes_since(int(cursor), route_id=route_id, user_id=user_id)
+    state["cursor"] = feed["cursor"]
+    if feed["resync"]:
+        return []
+    return [ch for ch in feed["changes"] if not any(a <= ch["id"] <= b for a, b in own)]
+
+
+def row_keys(change: dict) -> list:
+    """Marks a change puts on listed rows: ("ri", ri_id) / ("order", order_id)."""
+    if change["entity"] == "route_item":
+        keys = [("ri", change["entity_id"])]
+        if change["data"].get("order_id"):
+            keys.append(("order", int(change["data"]["order_id"])))
+        return keys
+    if change["entity"] == "order":
+        return [("order", change["entity_id"])]
+    return []
+
+
+def describe(changes: list) -> str:
+    """Short toast text, e.g. "2 uuendust: uus töö, staatus muutus"."""
+    labels = []
+    for ch in changes:
+        label = _OP_LABELS.get(ch["op"], ch["op"])
+        if label not in labels:
+            labels.append(label)
+    n = len(changes)
+    return f"{n} {'uuendus' if n == 1 else 'uuendust'}: {', '.join(labels)}"
@@ -0,0 +1,158 @@
+"""Navigation plans for a ring: Google Maps links split into legs, GPX / KML export.
+
+A Google Maps directions link takes an origin, a destination and at most
+MAX_WAYPOINTS stops in between; anything beyond that is dropped by Maps, so a
+long ring is split into consecutive legs. Each leg starts where the previous
+one ended:
+
+    start → 1 … 9 → 10,  10 → 11 … 19 → 20,  20 → … → start (return_to_start)
+
+The same ordered ring is exported as GPX 1.1 (waypoints + one route) and KML
+(placemarks + the route line) for offline navigation apps; stops without
+coordinates are left out of the files and reported in "unlocated".
+
+    nav = build(ring_stops(rows), "Liivalao 11, Tallinn", (59.392, 24.728), False)
+    nav["legs"][0]["url"], nav["gpx"], nav["kml"]
+
+build() is memoized on its arguments; ring_stops() includes each row's version,
+address and coordinates, so a plan is built once per ring version. Plain
+module (no Streamlit import).
+"""
+import functools
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+# Google Maps URLs: "a maximum of nine waypoints" (fewer on some mobile browsers)
+MAX_WAYPOINTS = 9
+CACHE_SIZE = 256
+
+Stop = namedtuple("Stop", "ri_id version name address phone lat lon")
+
+
+def ring_stops(rows) -> tuple:
+    """Hashable Stops of ring listing rows, in ring order (rows without an address are skipped)."""
+    out = []
+    for r in rows:
+        address = ((r.get("address") or "").strip() or (r.get("ship_address") or "").strip()
+                   or (r.get("delivery_address") or "").strip())
+        if not address or address == "—":
+            continue
+        lat, lon = r.get("lat"), r.get("lon")
+        located = lat not in (None, "") and lon not in (None, "")
+        out.append(Stop(
+            int(r["ri_id"]), r.get("version"),
+            (r.get("client_name") or "").strip() or (r.get("recipient_name") or "").strip() or address,
+            address, (r.get("phone") or "").strip(),
+            float(lat) if located else None, float(lon) if located else None,
+        ))
+    return tuple(out)
+
+
+def directions_url(origin: str, destination: str, waypoints=()) -> str:
+    url = (
+        "https://www.google.com/maps/dir/?api=1"
+        f"&origin={quote(origin)}"
+        f"&destination={quote(destination)}"
+        "&travelmode=driving"
+        "&dir_action=navigate"
+    )
+    if waypoints:
+        url += "&waypoints=" + "|".join(quote(w) for w in waypoints)
+    return url
+
+
+def legs(points: list, max_waypoints: int = MAX_WAYPOINTS) -> list:
+    """(first, last) index pairs of consecutive legs over points, each with <= max_waypoints in between."""
+    step = max(1, int(max_waypoints)) + 1
+    return [(i, min(i + step, len(points) - 1)) for i in range(0, len(points) - 1, step)]
+
+
+def _gpx(stops, start, start_name: str, return_to_start: bool) -> str:
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    wpts, rtepts = [], []
+    if start:
+        rtepts.append(f'  <rtept lat="{start[0]:.6f}" lon="{start[1]:.6f}"><name>{escape(start_name)}</name></rtept>')
+    for n, s in enumerate(stops, start=1):
+        if s.lat is None:
+            continue
+        name = escape(f"{n}. {s.name}")
+        desc = escape(" • ".join(x for x in (s.address, s.phone) if x))
+        wpts.append(f' <wpt lat="{s.lat:.6f}" lon="{s.lon:.6f}"><name>{name}</name><desc>{desc}</desc></wpt>')
+        rtepts.append(f'  <rtept lat="{s.lat:.6f}" lon="{s.lon:.6f}"><name>{name}</name></rtept>')
+    if start and return_to_start:
+        rtepts.append(rtepts[0])
+    return "\n".join([
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<gpx version="1.1" creator="logistics-automation-mvp" xmlns="http://www.topografix.com/GPX/1/1">',
+        f" <metadata><time>{now}</time></metadata>",
+        *wpts,
+        " <rte><name>Ring</name>",
+        *rtepts,
+        " </rte>",
+        "</gpx>",
+        "",
+    ])
+
+
+def _kml(stops, start, start_name: str, return_to_start: bool) -> str:
+    marks, line = [], []
+    if start:
+        line.append(f"{start[1]:.6f},{start[0]:.6f}")
+        marks.append(f"<Placemark><name>{escape(start_name)}</name>"
+                     f"<Point><coordinates>{line[0]}</coordinates></Point></Placemark>")
+    for n, s in enumerate(stops, start=1):
+        if s.lat is None:
+            continue
+        xy = f"{s.lon:.6f},{s.lat:.6f}"
+        line.append(xy)
+        desc = escape(" • ".join(x for x in (s.address, s.phone) if x))
+        marks.append(f"<Placemark><name>{escape(f'{n}. {s.name}')}</name><description>{desc}</description>"
+                     f"<Point><coordinates>{xy}</coordinates></Point></Placemark>")
+    if start and return_to_start:
+        line.append(line[0])
+    return "\n".join([
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<kml xmlns="http://www.opengis.net/kml/2.2"><Document><name>Ring</name>',
+        *marks,
+        f"<Placemark><name>Route</name><LineString><tessellate>1</tessellate>"
+        f"<coordinates>{' '.join(line)}</coordinates></LineString></Placemark>",
+        "</Document></kml>",
+        "",
+    ])
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def build(stops: tuple, start_address: str, start=None, return_to_start: bool = False,
+          max_waypoints: int = MAX_WAYPOINTS) -> dict:
+    """Leg links and GPX / KML text for ring_stops() in order (see module docstring).
+
+    start_address is the origin of the first leg (and the end with
+    return_to_start); start is its (lat, lon) for the files, None to leave it out.
+    """
+    if not stops:
+        return {"legs": [], "gpx": "", "kml": "", "unlocated": []}
+    points = [(start_address, "Start")] + [(s.address, s.name) for s in stops]
+    if return_to_start:
+        points.append((start_address, "Start"))
+    out_legs = []
+    for a, b in legs(points, max_waypoints):
+        out_legs.append({
+            "url": directions_url(points[a][0], points[b][0], [p[0] for p in points[a + 1:b]]),
+            "from": points[a][1], "to": points[b][1],
+            # stop numbers (1-based, as in the ring) this leg reaches
+            "first": a + 1 if a + 1 <= len(stops) else len(stops),
+            "last": min(b, len(stops)),
+        })
+    return {
+        "legs": out_legs,
+        "gpx": _gpx(stops, start, start_address, return_to_start),
+        "kml": _kml(stops, start, start_address, return_to_start),
+        "unlocated": [s.ri_id for s in stops if s.lat is None],
+    }
+
+
+def stats() -> dict:
+    info = build.cache_info()
+    return {"plans": info.currsize, "hits": info.hits, "misses": info.misses}
@@ -0,0 +1,128 @@
+"""Grid index over geocoded open orders for "suggest nearby" while building a ring.
+
+Orders are bucketed into CELL_KM x CELL_KM cells of a flat km grid
+(equirectangular, scaled at the northernmost order's latitude so that a cell
+never spans less than CELL_KM east-west and the cell ranges stay conservative).
+A lookup only visits the cells within the radius around each ring stop, one
+dict lookup per cell, so its cost depends on the ring and the radius, not on
+how many open orders there are; the few candidates found are then checked
+with exact great-circle km.
+
+Candidates are ranked by the detour they add to the ring (NumPy over all
+candidates x all legs at once): the cheapest insertion between two
+consecutive stops, or after the last one when the ring doesn't return.
+
+    index = GridIndex([(order_id, lat, lon), ...])
+    near = index.near([start, *stops], radius_km=3)           # positions into index.ids
+    ranked = detours(index, near, [start, *stops], closed=False)
+
+repository.SqliteRepository.nearby_index() builds the index once per orders
+change (read cache). Plain module (no Streamlit import).
+"""
+import math
+
+import numpy as np
+
+import travel_matrix
+
+CELL_KM = 1.0
+DEFAULT_RADIUS_KM = 3.0
+MAX_SUGGESTIONS = 8
+_DEG_KM = math.pi / 180 * travel_matrix.EARTH_KM
+
+
+class GridIndex:
+    """order ids + coordinates bucketed into (cx, cy) cells."""
+
+    def __init__(self, items, cell_km: float = CELL_KM):
+        items = list(items)
+        self.cell_km = float(cell_km)
+        self.ids = np.array([int(i[0]) for i in items], dtype=np.int64)
+        self.coords = np.array([(float(i[1]), float(i[2])) for i in items], dtype=np.float64).reshape(-1, 2)
+        self.vec = travel_matrix.unit_vectors(self.coords) if len(items) else np.zeros((0, 3))
+        lat_max = float(np.abs(self.coords[:, 0]).max()) if len(items) else 0.0
+        self._kx = math.cos(math.radians(min(lat_max, 89.0))) * _DEG_KM / self.cell_km
+        self._ky = _DEG_KM / self.cell_km
+        cells = {}
+        cx = np.floor(self.coords[:, 1] * self._kx).astype(np.int64)
+        cy = np.floor(self.coords[:, 0] * self._ky).astype(np.int64)
+        for n, key in enumerate(zip(cx.tolist(), cy.tolist())):
+            cells.setdefault(key, []).append(n)
+        self.cells = cells
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell(self, lat: float, lon: float) -> tuple:
+        return math.floor(lon * self._kx), math.floor(lat * self._ky)
+
+    def near(self, points, radius_km: float = DEFAULT_RADIUS_KM, exclude=()) -> np.ndarray:
+        """Positions (into ids / coords) of orders within radius_km of any of points, minus exclude ids."""
+        if not len(self.ids) or not points:
+            return np.zeros(0, dtype=np.intp)
+        reach = max(0, math.ceil(radius_km / self.cell_km))
+        seen = set()
+        for lat, lon in points:
+            cx, cy = self._cell(lat, lon)
+            for dx in range(-reach, reach + 1):
+                for dy in range(-reach, reach + 1):
+                    bucket = self.cells.get((cx + dx, cy + dy))
+                    if bucket:
+                        seen.update(bucket)
+        if exclude:
+            skip = {int(x) for x in exclude}
+            seen = {n for n in seen if int(self.ids[n]) not in skip}
+        if not seen:
+            return np.zeros(0, dtype=np.intp)
+        cand = np.fromiter(seen, dtype=np.intp, count=len(seen))
+        km = travel_matrix.great_circle_km(self.vec[cand], travel_matrix.unit_vectors(points)).min(axis=1)
+        return np.sort(cand[km <= radius_km])
+
+
+def load_index(conn, statuses, cell_km: float = CELL_KM) -> GridIndex:
+    """GridIndex over the geocoded orders in statuses."""
+    statuses = [s.strip().upper() for s in statuses]
+    rows = conn.execute(
+        f"SELECT id, lat, lon FROM orders WHERE UPPER(status) IN ({', '.join('?' for _ in statuses)}) "
+        "AND lat IS NOT NULL AND lon IS NOT NULL",
+        statuses,
+    ).fetchall()
+    return GridIndex(((r[0], r[1], r[2]) for r in rows), cell_km)
+
+
+def detours(index: GridIndex, positions: np.ndarray, path, closed: bool = False,
+            model: travel_matrix.SpeedModel | None = None, limit: int = MAX_SUGGESTIONS) -> list:
+    """Candidates ranked by added road km when inserted at their best place in path.
+
+    path: ring points in driving order ((lat, lon), start first when there is
+    one); closed: the ring returns to path[0]. Returns dicts with order_id,
+    after (index into path the order goes after), detour_km, detour_min and
+    nearest_km (great-circle km to the closest path point).
+    """
+    model = model or travel_matrix.SpeedModel()
+    if not len(positions) or not path:
+        return []
+    pts = list(path) + ([path[0]] if closed and len(path) > 1 else [])
+    pv = travel_matrix.unit_vectors(pts)
+    km = travel_matrix.great_circle_km(index.vec[positions], pv)                 # (k, m)
+    d = model.road_km(km)
+    legs = model.road_km(travel_matrix.great_circle_km(pv, pv)[np.arange(len(pts) - 1), np.arange(1, len(pts))])
+    mins, legs_min = model.minutes(d), model.minutes(legs)
+    # Insert between pts[j] and pts[j + 1]; an open ring can also end with it
+    cost = [d[:, :-1] + d[:, 1:] - legs]
+    cost_min = [mins[:, :-1] + mins[:, 1:] - legs_min]
+    if not closed:
+        cost.append(d[:, -1:])
+        cost_min.append(mins[:, -1:])
+    cost, cost_min = np.hstack(cost), np.hstack(cost_min)
+    best = cost.argmin(axis=1)
+    rows = np.arange(len(positions))
+    added, added_min = cost[rows, best], cost_min[rows, best]
+    nearest = km.min(axis=1)
+    return [{
+        "order_id": int(index.ids[positions[n]]),
+        "after": int(best[n]),
+        "detour_km": float(max(0.0, added[n])),
+        "detour_min": float(max(0.0, added_min[n])),
+        "nearest_km": float(nearest[n]),
+    } for n in np.argsort(added, kind="stable")[:limit]]
@@ -0,0 +1,232 @@
+"""FTS5 full-text search over orders and their job history.
+
+orders_fts is a contentless FTS5 table keyed by orders.id and kept in sync by
+triggers on orders. Contentless (rather than content='orders') so the phone column
+can index derived forms: "+372 5123 1232" is searchable as 37251231232 and as the
+local 51231232. Results are joined back to orders and ranked with bm25.
+
+Archived orders (archive.py) leave the hot table, and its delete trigger takes
+them out of main.orders_fts. The archive keeps its own orders_fts with the same
+columns and ranking: archive.py indexes the orders it copies
+(index_archived_orders()), and search_orders() also searches the archive when
+it is attached.
+"""
+import re
+import sqlite3
+
+import archive
+
+
+FTS_COLUMNS = (
+    "client_name", "recipient_name", "address", "ship_address",
+    "phone", "order_ref", "notes", "items_compact",
+)
+
+# bm25 weights, same order as FTS_COLUMNS (names/phone/ref matter more than notes/items).
+_WEIGHTS = (5.0, 5.0, 3.0, 3.0, 4.0, 4.0, 1.0, 1.0)
+
+
+def _phone_expr(p: str) -> str:
+    """SQL for the indexed phone text: raw value, digits only, and digits without 372."""
+    digits = f"replace(replace(replace(replace(replace(COALESCE({p}phone,''),'+',''),' ',''),'-',''),'(',''),')','')"
+    return (
+        f"COALESCE({p}phone,'') || ' ' || {digits} || ' ' || "
+        f"CASE WHEN {digits} LIKE '372%' THEN substr({digits}, 4) ELSE '' END"
+    )
+
+
+def _values_expr(p: str) -> str:
+    cols = []
+    for c in FTS_COLUMNS:
+        cols.append(_phone_expr(p) if c == "phone" else f"COALESCE({p}{c},'')")
+    return ", ".join(cols)
+
+
+def ensure_schema(cur):
+    """Create orders_fts + sync triggers; backfill the index the first time (called from repository.init_schema)."""
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='orders_fts'")
+    existed = cur.fetchone() is not None
+    cols = ", ".join(FTS_COLUMNS)
+    cur.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+        {cols},
+        content='',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""")
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_fts_insert AFTER INSERT ON orders
+    BEGIN
+        INSERT INTO orders_fts (rowid, {cols}) VALUES (new.id, {_values_expr('new.')});
+    END""")
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_fts_delete AFTER DELETE ON orders
+    BEGIN
+        INSERT INTO orders_fts (orders_fts, rowid, {cols}) VALUES ('delete', old.id, {_values_expr('old.')});
+    END""")
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_fts_update AFTER UPDATE OF {cols} ON orders
+    BEGIN
+        INSERT INTO orders_fts (orders_fts, rowid, {cols}) VALUES ('delete', old.id, {_values_expr('old.')});
+        INSERT INTO orders_fts (rowid, {cols}) VALUES (new.id, {_values_expr('new.')});
+    END""")
+    # History lookups for search hits go by order_id
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_route_items_order ON route_items(order_id)")
+    if not existed:
+        # Persistent ranking function, so queries can use the built-in ORDER BY rank path
+        weights = ", ".join(str(w) for w in _WEIGHTS)
+        cur.execute(f"INSERT INTO orders_fts (orders_fts, rank) VALUES ('rank', 'bm25({weights})')")
+        cur.execute(f"INSERT INTO orders_fts (rowid, {cols}) SELECT o.id, {_values_expr('o.')} FROM orders o")
+
+
+def ensure_archive_index(cur, schema: str):
+    """orders_fts in an attached archive schema; filled from its orders the first time (archive.attach)."""
+    cur.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name='orders_fts'")
+    if cur.fetchone() is not None:
+        return
+    cols = ", ".join(FTS_COLUMNS)
+    cur.execute(f"""
+    CREATE VIRTUAL TABLE {schema}.orders_fts USING fts5(
+        {cols},
+        content='',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""")
+    weights = ", ".join(str(w) for w in _WEIGHTS)
+    cur.execute(f"INSERT INTO {schema}.orders_fts (orders_fts, rank) VALUES ('rank', 'bm25({weights})')")
+    cur.execute(f"INSERT INTO {schema}.orders_fts (rowid, {cols}) SELECT o.id, {_values_expr('o.')} FROM {schema}.orders o")
+
+
+def index_archived_orders(cur, schema: str, where: str):
+    """Index main.orders rows matching where in the archive's orders_fts (run before they are copied).
+
+    Contentless FTS5 has no upsert, so only orders not in the archive yet are
+    indexed: a re-run of a committed copy adds nothing twice.
+    """
+    cols = ", ".join(FTS_COLUMNS)
+    cur.execute(f"""
+        INSERT INTO {schema}.orders_fts (rowid, {cols})
+        SELECT o.id, {_values_expr('o.')} FROM main.orders o
+        WHERE {where} AND o.id NOT IN (SELECT id FROM {schema}.orders)""")
+
+
+def unindex_archived_orders(cur, schema: str, where: str):
+    """Take the archive's orders matching where (alias o) out of its orders_fts (run before they are deleted)."""
+    cols = ", ".join(FTS_COLUMNS)
+    cur.execute(f"""
+        INSERT INTO {schema}.orders_fts (orders_fts, rowid, {cols})
+        SELECT 'delete', o.id, {_values_expr('o.')} FROM {schema}.orders o WHERE {where}""")
+
+
+def _has_index(conn, schema: str) -> bool:
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name='orders_fts'").fetchone() is not None
+
+
+def rebuild_index(conn: sqlite3.Connection):
+    """Drop and refill orders_fts from orders (maintenance; e.g. after a manual DB edit)."""
+    cols = ", ".join(FTS_COLUMNS)
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE;")
+    try:
+        cur.execute("INSERT INTO orders_fts (orders_fts) VALUES ('delete-all')")
+        cur.execute(f"INSERT INTO orders_fts (rowid, {cols}) SELECT o.id, {_values_expr('o.')} FROM orders o")
+        cur.execute("INSERT INTO orders_fts (orders_fts) VALUES ('optimize')")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def build_match_query(text: str) -> str:
+    """User input -> safe FTS5 query: every word must match, as a prefix ("pärnu mnt" -> "pärnu"* "mnt"*)."""
+    words = re.findall(r"\w+", (text or "").lower(), flags=re.UNICODE)
+    return " ".join(f'"{w}"*' for w in words[:12])
+
+
+def search_orders(conn: sqlite3.Connection, text: str, since: str = "", limit: int = 50) -> list:
+    """Ranked orders matching text; since (YYYY-MM-DD) keeps orders delivered or routed on/after it.
+
+    Each result dict has the order summary plus last_route_date / last_worker_status /
+    last_worker_names from its most recent route item (empty if never routed).
+    History columns are computed for the top `limit` hits only. With the archive
+    attached, archived orders are searched too (its own orders_fts) and history
+    is read through the hist_* views.
+    """
+    match = build_match_query(text)
+    if not match:
+        return []
+    # An archive written before it had orders_fts gets one on the next archive run
+    archived = archive.is_attached(conn) and _has_index(conn, archive.ARCHIVE_SCHEMA)
+    t = archive.table_names(history=archived)
+    schemas = ["main"] + ([archive.ARCHIVE_SCHEMA] if archived else [])
+    tops, params = [], []
+    for schema in schemas:
+        if since:
+            # Date-limited: join orders to filter before ranking
+            tops.append(f"""
+                SELECT o.id, orders_fts.rank AS score
+                FROM {schema}.orders_fts
+                JOIN {schema}.orders o ON o.id = orders_fts.rowid
+                WHERE orders_fts MATCH ?
+                  AND (o.delivery_date >= ? OR EXISTS (
+                        SELECT 1 FROM {t["route_items"]} ri JOIN {t["routes"]} r ON r.id = ri.route_id
+                        WHERE ri.order_id = o.id AND r.route_date >= ?))
+                ORDER BY orders_fts.rank
+                LIMIT ?""")
+            params += [match, since, since, int(limit)]
+        else:
+            tops.append(f"""
+                SELECT rowid AS id, rank AS score
+                FROM {schema}.orders_fts
+                WHERE orders_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?""")
+            params += [match, int(limit)]
+    if len(tops) == 1:
+        top_sql = tops[0]
+    else:
+        top_sql = " UNION ALL ".join(f"SELECT * FROM ({sql})" for sql in tops) + " ORDER BY score LIMIT ?"
+        params.append(int(limit))
+    cur = conn.cursor()
+    cur.execute(f"""
+        WITH top AS ({top_sql}
+        ),
+        h AS (
+            SELECT top.id, top.score,
+                   (SELECT ri.id FROM {t["route_items"]} ri JOIN {t["routes"]} r ON r.id = ri.route_id
+                     WHERE ri.order_id = top.id ORDER BY r.route_date DESC LIMIT 1) AS last_ri_id
+            FROM top
+        )
+        SELECT
+            o.id, o.status, o.client_name, o.recipient_name, o.phone, o.address, o.ship_address,
+            o.delivery_date, o.delivery_window, o.service_tag, o.order_ref, h.score,
+            COALESCE(r.route_date, '') AS last_route_date,
+            COALESCE(ri.worker_status, '') AS last_worker_status,
+            COALESCE((SELECT GROUP_CONCAT(u.name, ', ') FROM {t["route_item_users"]} riu
+                       JOIN users u ON u.id = riu.user_id WHERE riu.ri_id = h.last_ri_id), '') AS last_worker_names
+        FROM h
+        JOIN {t["orders"]} o ON o.id = h.id
+        LEFT JOIN {t["route_items"]} ri ON ri.id = h.last_ri_id
+        LEFT JOIN {t["routes"]} r ON r.id = ri.route_id
+        ORDER BY h.score
+    """, params)
+    return [dict(r) for r in cur.fetchall()]
+
+
+def order_history(conn: sqlite3.Connection, order_id: int, history: bool = False) -> list:
+    """Every route item of an order, newest route first (date, ring, status, workers)."""
+    t = archive.table_names(history)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT r.route_date, ri.ring_no, ri.seq, ri.worker_status, ri.worker_status_reason,
+               ri.worker_status_note, ri.worker_finished_at,
+               COALESCE(GROUP_CONCAT(u.name, ', '), '') AS worker_names
+        FROM {t["route_items"]} ri
+        JOIN {t["routes"]} r ON r.id = ri.route_id
+        LEFT JOIN {t["route_item_users"]} riu ON riu.ri_id = ri.id
+        LEFT JOIN users u ON u.id = riu.user_id
+        WHERE ri.order_id = ?
+        GROUP BY ri.id
+        ORDER BY r.route_date DESC
+    """, (int(order_id),))
+    return [dict(r) for r in cur.fetchall()]
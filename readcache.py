@@ -0,0 +1,263 @@
+"""Process-wide read-through cache for the app's read helpers.
+
+Streamlit re-executes app.py on every rerun, but imported modules stay in
+sys.modules, so the cache lives here and is shared by every session of the server
+process.
+
+Each entry records what it depends on as (table, key) pairs; key None means "any
+row of the table" (e.g. list_orders), otherwise it is a row id or a grouping id
+(route_items are keyed by route_id, "assign" by user_id).
+
+Invalidation:
+  - The app's own mutators run their writes through tracked_write(), which
+    invalidates exactly the (table, key) pairs they touched.
+  - Everything else (other processes, sqlite3 shell, archival job ...) is caught by
+    PRAGMA data_version on a private watcher connection. Triggers keep a per-table
+    counter in table_generations; generations produced by tracked_write() are
+    known to be ours, any other change drops the whole table's entries.
+"""
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# Tables with generation triggers -> dependency tables they invalidate.
+WATCHED_TABLES = {
+    "users": ("users",),
+    "orders": ("orders",),
+    "routes": ("routes",),
+    "route_items": ("route_items", "assign"),
+    "route_item_users": ("route_items", "assign"),
+    "settings": ("settings",),
+}
+
+
+def ensure_schema(cur):
+    """Create table_generations + its triggers (called from repository.init_schema)."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS table_generations (
+        tbl TEXT PRIMARY KEY,
+        gen INTEGER NOT NULL DEFAULT 0
+    )""")
+    for tbl in WATCHED_TABLES:
+        cur.execute("INSERT OR IGNORE INTO table_generations (tbl, gen) VALUES (?, 0)", (tbl,))
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_gen_{tbl}_{op.lower()} AFTER {op} ON {tbl}
+            BEGIN
+                UPDATE table_generations SET gen = gen + 1 WHERE tbl = '{tbl}';
+            END""")
+
+
+def read_generations(cur) -> dict:
+    cur.execute("SELECT tbl, gen FROM table_generations")
+    return {r[0]: int(r[1]) for r in cur.fetchall()}
+
+
+def _weight(value) -> int:
+    return len(value) if isinstance(value, (list, tuple)) else 1
+
+
+class ReadCache:
+    """LRU cache bounded by entry count and total row weight (rows of list results)."""
+
+    def __init__(self, max_entries: int = 512, max_weight: int = 50_000):
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()   # key -> (value, deps, weight)
+        self._by_dep = {}               # (table, key) -> set(cache keys)
+        self._weight = 0
+        self._epoch = 0                 # bumped on every invalidation
+        self._db_path = ""
+        self._watch_conn = None
+        self._data_version = None
+        self._gens = {}
+        self._own = {}                  # table -> list of (lo, hi] generation ranges we wrote
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    # ---- wiring ----
+    def bind(self, db_path: str):
+        """Point the cache at a database file (idempotent; rebinding clears it)."""
+        with self._lock:
+            if db_path == self._db_path and self._watch_conn is not None:
+                return
+            if self._watch_conn is not None:
+                try:
+                    self._watch_conn.close()
+                except Exception:
+                    pass
+            self._db_path = db_path
+            self._watch_conn = sqlite3.connect(db_path, check_same_thread=False, timeout=1.0, isolation_level=None)
+            self._data_version = None
+            self._gens = {}
+            self._own = {}
+            self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_dep.clear()
+            self._weight = 0
+            self._epoch += 1
+
+    # ---- reads ----
+    def get_or_load(self, key, loader, deps):
+        """Return the cached value for key, or loader() and remember it.
+
+        deps: iterable of (table, key) pairs, or a callable(value) returning them
+        (for row-level deps that depend on what was loaded).
+        """
+        self._check_foreign_writes()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return hit[0]
+            self.misses += 1
+            epoch = self._epoch
+
+        value = loader()
+        dep_set = frozenset(deps(value) if callable(deps) else deps)
+
+        with self._lock:
+            # A write landed while we were loading: the value may already be stale.
+            if epoch != self._epoch:
+                return value
+            self._store(key, value, dep_set)
+        return value
+
+    def _store(self, key, value, deps):
+        self._drop(key)
+        w = _weight(value)
+        self._entries[key] = (value, deps, w)
+        self._weight += w
+        for d in deps:
+            self._by_dep.setdefault(d, set()).add(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._weight > self.max_weight):
+            old_key = next(iter(self._entries))
+            self._drop(old_key)
+            self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._weight -= entry[2]
+        for d in entry[1]:
+            keys = self._by_dep.get(d)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_dep[d]
+
+    # ---- invalidation ----
+    def invalidate(self, table: str, key=None):
+        """Drop entries depending on (table, key); key None drops every entry of the table."""
+        with self._lock:
+            self._epoch += 1
+            if key is None:
+                victims = set()
+                for (t, _k), keys in self._by_dep.items():
+                    if t == table:
+                        victims |= keys
+            else:
+                victims = set(self._by_dep.get((table, key), ())) | set(self._by_dep.get((table, None), ()))
+            for k in victims:
+                self._drop(k)
+            self.invalidations += len(victims)
+
+    def note_own_write(self, before: dict, after: dict, deps):
+        """Record a committed write of ours: precise invalidation + generations to ignore."""
+        with self._lock:
+            for tbl, hi in after.items():
+                lo = before.get(tbl, hi)
+                if hi > lo:
+                    self._own.setdefault(tbl, []).append((lo, hi))
+            for table, key in deps:
+                self.invalidate(table, key)
+
+    def _check_foreign_writes(self):
+        conn = self._watch_conn
+        if conn is None:
+            return
+        with self._lock:
+            try:
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                if version == self._data_version:
+                    return
+                gens = read_generations(conn.cursor())
+            except sqlite3.Error:
+                # Can't tell what changed: be safe.
+                self.clear()
+                return
+            first = self._data_version is None
+            self._data_version = version
+            for tbl, gen in gens.items():
+                last = self._gens.get(tbl)
+                self._gens[tbl] = gen
+                if first or last is None or gen == last:
+                    continue
+                if not self._covered(tbl, last, gen):
+                    for dep_table in WATCHED_TABLES.get(tbl, (tbl,)):
+                        self.invalidate(dep_table)
+            # Ranges at or below what we've seen are settled.
+            for tbl, ranges in list(self._own.items()):
+                seen = self._gens.get(tbl, 0)
+                self._own[tbl] = [r for r in ranges if r[1] > seen]
+
+    def _covered(self, tbl, last, gen) -> bool:
+        """True if every generation in (last, gen] came from one of our own writes."""
+        pos = last
+        for lo, hi in sorted(self._own.get(tbl, ())):
+            if hi <= pos:
+                continue
+            if lo > pos:
+                return False
+            pos = hi
+            if pos >= gen:
+                return True
+        return pos >= gen
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "weight": self._weight,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+CACHE = ReadCache()
+
+
+@contextmanager
+def tracked_write(conn, deps=(), cache=None):
+    """Run a write transaction whose changes invalidate deps (and nothing else) on commit.
+
+    Yields (cursor, deps_list); the body may append more (table, key) pairs it only
+    learns while writing (e.g. the users a route item was assigned to).
+    cache defaults to the process-wide CACHE.
+    """
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE;")
+    deps = list(deps)
+    try:
+        before = read_generations(cur)
+        yield cur, deps
+        after = read_generations(cur)
+        conn.commit()
+    except BaseException:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    (cache if cache is not None else CACHE).note_own_write(before, after, deps)
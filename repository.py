@@ -0,0 +1,1294 @@
+"""Data access for orders, users, routes, route items and settings.
+
+app.py talks to the database only through a Repository. SqliteRepository is the
+reference backend: it keeps the SQL, the read-through cache (readcache.py) and the
+per-write cache dependencies in one place and delegates the bigger queries to
+route_rows, order_search, job_stats, route_order and settings_store. Every order
+and route item mutation also appends to the change feed (change_log.py) in the
+same transaction.
+
+Another backend (e.g. a server database once one SQLite file stops scaling)
+implements the same methods and is checked with repository_conformance.py.
+Errors follow the DB-API classes app.py already handles: busy/locked surfaces
+as sqlite3.OperationalError, constraint violations as sqlite3.IntegrityError;
+a server backend maps its driver's errors onto these.
+
+Orders and route items carry a version that every write to the row bumps.
+Mutators take an optional expected_version (the version the caller read): the
+write only happens if the row still has it, otherwise VersionConflict is raised
+and nothing is written. None skips the check (imports, scripts).
+
+Plain module (no Streamlit import) so CLI tools and benchmarks can use it.
+"""
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+
+import address_area
+import archive
+import auto_assign
+import change_log
+import geocode
+import job_stats
+import nearby
+import order_search
+import readcache
+import route_order
+import route_rows
+import settings_store
+import user_tokens
+
+
+# Columns update_order() may write.
+ORDER_FIELDS = (
+    "status", "client_name", "phone", "address", "delivery_date", "delivery_window", "notes",
+    "order_ref", "recipient_name", "ship_address", "service_tag",
+    "doc_author", "doc_email", "doc_phone", "items_compact", "lat", "lon",
+    "postal_code", "city", "district",
+)
+
+ITEM_STATUSES = ("OPEN", "DONE", "CANCELLED")
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+RETRY_ATTEMPTS = 15
+RETRY_SLEEP_S = 0.06
+
+
+def is_lock_error(e: Exception) -> bool:
+    msg = str(e).lower()
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg)
+
+
+def retry_locked(fn, attempts: int = RETRY_ATTEMPTS, sleep_s: float = RETRY_SLEEP_S, on_retry=None):
+    """fn() retried quickly while the database is locked/busy; the last lock error is re-raised.
+
+    on_retry(error) is called before every retry (the load test counts them).
+    """
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if not is_lock_error(e) or attempt == attempts - 1:
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            time.sleep(sleep_s)
+
+
+class VersionConflict(Exception):
+    """A compare-and-swap write found the row changed (or gone) since the caller read it."""
+
+    def __init__(self, entity: str, entity_id: int, expected, actual):
+        self.entity = entity
+        self.entity_id = int(entity_id)
+        self.expected = expected
+        self.actual = actual     # None: the row no longer exists
+        what = "was deleted" if actual is None else f"is at version {actual}"
+        super().__init__(f"{entity} {entity_id} {what}, expected version {expected}")
+
+
+def _check_version(cur, table: str, entity: str, row_id: int, expected_version=None):
+    """Raise VersionConflict unless the row exists with expected_version (None: no check)."""
+    if expected_version is None:
+        return
+    cur.execute(f"SELECT version FROM {table} WHERE id=?", (int(row_id),))
+    row = cur.fetchone()
+    if not row or int(row[0]) != int(expected_version):
+        raise VersionConflict(entity, row_id, expected_version, int(row[0]) if row else None)
+
+
+def _bump_version(cur, table: str, entity: str, row_id: int, expected_version=None):
+    """version += 1 on one row, only if it still has expected_version (None: any)."""
+    cur.execute(
+        f"UPDATE {table} SET version = version + 1 WHERE id=? AND (? IS NULL OR version=?)",
+        (int(row_id), expected_version, expected_version),
+    )
+    if cur.rowcount == 1:
+        return
+    cur.execute(f"SELECT version FROM {table} WHERE id=?", (int(row_id),))
+    row = cur.fetchone()
+    raise VersionConflict(entity, row_id, expected_version, int(row[0]) if row else None)
+
+
+def connect(db_path: str, timeout: float = 1.0) -> sqlite3.Connection:
+    """Autocommit connection as the app uses it (explicit BEGIN IMMEDIATE for writes)."""
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=timeout, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA foreign_keys=OFF;")
+        conn.execute(f"PRAGMA busy_timeout={int(timeout * 1200)};")
+    except Exception:
+        pass
+    return conn
+
+
+class Repository(ABC):
+    """Interface app.py codes against. Every method is abstract: a backend that misses one fails when constructed.
+
+    Reads return plain values (dicts, tuples, route_rows row objects); callers must
+    not mutate what they get back, backends may share cached results.
+    """
+
+    # ---- schema ----
+    @abstractmethod
+    def init_schema(self):
+        raise NotImplementedError
+
+    # ---- orders ----
+    @abstractmethod
+    def insert_order(self, original_filename: str, stored_path: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_orders(self, status_filter=None, by_area: bool = False) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_order(self, order_id: int) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_order(self, order_id: int, fields: dict, expected_version: int | None = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_order(self, order_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_order_details(self, order_id: int, history: bool = False) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def search_orders(self, text: str, since: str = "", limit: int = 50) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def order_history(self, order_id: int) -> list:
+        raise NotImplementedError
+
+    # ---- geocoding ----
+    @abstractmethod
+    def geocode_orders(self, order_ids=None, only_missing: bool = True) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def import_gazetteer(self, rows) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def geocode_stats(self) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def backfill_order_areas(self, only_missing: bool = True) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def nearby_index(self, statuses=auto_assign.STATUSES):
+        raise NotImplementedError
+
+    # ---- users ----
+    @abstractmethod
+    def list_users(self, active_only: bool = True) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_by_token(self, token: str) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_user(self, user_id, name: str, phone: str = "", is_active: int = 1) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_user(self, user_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_password_hash(self, user_id: int) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_password_hash(self, user_id: int, password_hash: str, end_sessions: bool = True):
+        raise NotImplementedError
+
+    @abstractmethod
+    def issue_token(self, user_id: int, label: str = "") -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def revoke_tokens(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_tokens(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    # ---- routes ----
+    @abstractmethod
+    def get_route_id(self, route_date: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_or_create_route(self, route_date: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def route_order_ids(self, route_id: int) -> frozenset:
+        raise NotImplementedError
+
+    # ---- route items ----
+    @abstractmethod
+    def list_route_items(self, route_id: int) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_worker_route_items(self, route_id: int, user_id: int) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_user_route_items(self, user_id: int, status: str | None = None) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_worker_jobs(self, user_id: int, status: str, start_date: str) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_day_jobs(self, route_date: str, statuses=("DONE", "CANCELLED")) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_job_days(self, statuses=("DONE", "CANCELLED")) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_job_day_workers(self, route_date: str, statuses=("DONE", "CANCELLED")) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def assign_order(self, route_id: int, order_id: int, user_ids, ring_no: int = 1) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def assign_orders(self, route_id: int, assignments) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_ring(self, route_id: int, order_ids, user_ids, ring_no: int = 1) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_assign_jobs(self, route_id: int, statuses=auto_assign.STATUSES) -> tuple:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_item_status(self, ri_id: int, status: str, user_id: int, reason: str = "", note: str = "",
+                        expected_version: int | None = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_route_item(self, ri_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def item_position(self, ri_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def move_item_to(self, ri_id: int, position: int, expected_version: int | None = None) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def move_item_next_to(self, ri_id: int, anchor_ri_id: int, after: bool = False,
+                          expected_version: int | None = None) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def apply_ring_order(self, route_id: int, ring_no: int, ri_ids, expected_versions: dict | None = None) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def compact_route(self, route_id: int) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def commit_route_draft(self, route_id: int, plan: dict) -> dict:
+        raise NotImplementedError
+
+    # ---- change feed ----
+    @abstractmethod
+    def changes_since(self, cursor: int, route_id: int | None = None, user_id: int | None = None,
+                      limit: int = 500) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def change_cursor(self) -> int:
+        raise NotImplementedError
+
+    # ---- settings ----
+    @abstractmethod
+    def load_settings(self) -> settings_store.SettingsSnapshot:
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_settings(self, values: dict):
+        raise NotImplementedError
+
+    # ---- connections ----
+    @abstractmethod
+    def short_lived(self, timeout: float = 1.0):
+        """Context manager: a repository on its own short-lived connection (for contended writes)."""
+        raise NotImplementedError
+
+
+class SqliteRepository(Repository):
+    """Repository over one SQLite file.
+
+    connect: callable returning the connection to use (app.py passes db(), the
+    session's cached connection); db_path is used for short-lived connections.
+    on_write(repo, own) runs after every committed write with own, the range of
+    change_log ids the write recorded (app.py: live views skip those).
+    token_cache resolves worker tokens (user_tokens.CACHE unless given).
+    """
+
+    def __init__(self, connect, db_path: str, cache: readcache.ReadCache | None = None, on_write=None,
+                 token_cache: user_tokens.TokenCache | None = None):
+        self._connect = connect
+        self.db_path = db_path
+        self.cache = cache if cache is not None else readcache.CACHE
+        self.token_cache = token_cache if token_cache is not None else user_tokens.CACHE
+        self.on_write = on_write
+
+    def conn(self) -> sqlite3.Connection:
+        return self._connect()
+
+    def _cached(self, key, loader, deps):
+        return self.cache.get_or_load(key, loader, deps)
+
+    @contextmanager
+    def _write(self, deps=()):
+        with readcache.tracked_write(self.conn(), deps, cache=self.cache) as (cur, deps):
+            # BEGIN IMMEDIATE holds the write lock: every change logged in between is ours
+            first = change_log.head(cur.connection)
+            yield cur, deps
+            last = change_log.head(cur.connection)
+        if self.on_write is not None:
+            self.on_write(self, range(first + 1, last + 1))
+
+    @contextmanager
+    def short_lived(self, timeout: float = 1.0):
+        conn = connect(self.db_path, timeout=timeout)
+        try:
+            yield SqliteRepository(lambda: conn, self.db_path, cache=self.cache, on_write=self.on_write,
+                                   token_cache=self.token_cache)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _route_item_deps(cur, ri_where: str, params) -> list:
+        """Cache deps of the route items matched by ri_where: their routes and assigned workers."""
+        cur.execute(f"SELECT DISTINCT ri.route_id FROM route_items ri WHERE {ri_where}", params)
+        deps = [("route_items", int(r[0])) for r in cur.fetchall()]
+        cur.execute(
+            f"SELECT DISTINCT riu.user_id FROM route_item_users riu JOIN route_items ri ON ri.id = riu.ri_id WHERE {ri_where}",
+            params,
+        )
+        deps += [("assign", int(r[0])) for r in cur.fetchall()]
+        return deps
+
+    # ---- schema ----
+    def init_schema(self):
+        init_schema(self.conn())
+
+    # ---- orders ----
+    def insert_order(self, original_filename: str, stored_path: str) -> int:
+        with self._write() as (cur, deps):
+            cur.execute(
+                # No address yet: area columns '' (NULL would mean "not extracted", see address_area.py)
+                "INSERT INTO orders (original_filename, stored_path, created_at, postal_code, city, district) "
+                "VALUES (?, ?, ?, '', '', '')",
+                (original_filename, stored_path, _now()),
+            )
+            order_id = cur.lastrowid
+            deps.append(("orders", order_id))
+            change_log.record(cur, "order", order_id, "insert")
+        return order_id
+
+    def list_orders(self, status_filter=None, by_area: bool = False) -> list:
+        return self._cached(
+            ("list_orders", status_filter or "ALL", bool(by_area)),
+            lambda: route_rows.list_orders(self.conn(), status_filter=status_filter, by_area=by_area),
+            [("orders", None)],
+        )
+
+    def get_order(self, order_id: int) -> dict:
+        def load():
+            cur = self.conn().cursor()
+            cur.execute("SELECT * FROM orders WHERE id=?", (int(order_id),))
+            row = cur.fetchone()
+            return dict(row) if row else {}
+
+        return self._cached(("get_order", int(order_id)), load, [("orders", int(order_id))])
+
+    def update_order(self, order_id: int, fields: dict, expected_version: int | None = None):
+        cols = [k for k in fields if k in ORDER_FIELDS]
+        if not cols:
+            return
+        moved = False
+        with self._write([("orders", int(order_id))]) as (cur, deps):
+            _bump_version(cur, "orders", "order", order_id, expected_version)
+            values = [fields[k] for k in cols]
+            if {"address", "ship_address"} & set(cols):
+                row = cur.execute("SELECT address, ship_address, lat FROM orders WHERE id=?", (int(order_id),)).fetchone()
+                if row:
+                    was = {"address": row[0], "ship_address": row[1]}
+                    current = {**was, **fields}
+                    if not set(address_area.COLUMNS) & set(cols):
+                        # Address changed: keep postal code / city / district in step
+                        values += list(address_area.parse(address_area.order_address(current)))
+                        cols = cols + list(address_area.COLUMNS)
+                    if (row[2] is not None and not {"lat", "lon"} & set(cols)
+                            and geocode.order_address(current) != geocode.order_address(was)):
+                        # The old coordinates point at the old address: geocode again below
+                        values += [None, None]
+                        cols = cols + ["lat", "lon"]
+                        moved = True
+            cur.execute(
+                f"UPDATE orders SET {', '.join(f'{k}=?' for k in cols)} WHERE id=?",
+                values + [int(order_id)],
+            )
+            route_ids, user_ids = change_log.order_keys(cur, order_id)
+            change_log.record(cur, "order", order_id, "update", route_ids, user_ids, dict(zip(cols, values)))
+        if moved:
+            self.geocode_orders([order_id])
+
+    def delete_order(self, order_id: int):
+        with self._write([("orders", int(order_id))]) as (cur, deps):
+            deps += self._route_item_deps(cur, "ri.order_id=?", (int(order_id),))
+            route_ids, user_ids = change_log.order_keys(cur, order_id)
+            change_log.record(cur, "order", order_id, "delete", route_ids, user_ids)
+            cur.execute("DELETE FROM route_items WHERE order_id=?", (int(order_id),))
+            cur.execute("DELETE FROM orders WHERE id=?", (int(order_id),))
+
+    def get_order_details(self, order_id: int, history: bool = False) -> dict:
+        return self._cached(
+            ("get_order_details", int(order_id), bool(history)),
+            lambda: route_rows.load_order_details(self.conn(), order_id, history=history),
+            [("orders", int(order_id))],
+        )
+
+    def search_orders(self, text: str, since: str = "", limit: int = 50) -> list:
+        text = (text or "").strip()
+        return self._cached(
+            ("search_orders", text.lower(), since, int(limit)),
+            lambda: order_search.search_orders(self.conn(), text, since=since, limit=limit),
+            [("orders", None), ("route_items", None), ("assign", None), ("users", None)],
+        )
+
+    def order_history(self, order_id: int) -> list:
+        return self._cached(
+            ("get_order_history", int(order_id)),
+            lambda: order_search.order_history(self.conn(), order_id, history=True),
+            [("route_items", None), ("assign", None), ("users", None)],
+        )
+
+    # ---- geocoding ----
+    def geocode_orders(self, order_ids=None, only_missing: bool = True) -> int:
+        """Fill orders.lat/lon from the geocode cache / gazetteer; returns how many orders got coordinates.
+
+        order_ids None: every order. Matching runs before the write, which is one transaction.
+        """
+        where, params = [], []
+        if order_ids is not None:
+            params = [int(i) for i in order_ids]
+            if not params:
+                return 0
+            where.append(f"id IN ({', '.join('?' for _ in params)})")
+        if only_missing:
+            where.append("lat IS NULL")
+        rows = self.conn().execute(
+            f"SELECT id, address, ship_address FROM orders {'WHERE ' + ' AND '.join(where) if where else ''}",
+            params,
+        ).fetchall()
+        addresses = {int(r["id"]): geocode.order_address(dict(r)) for r in rows}
+        found, fresh = geocode.resolve_many(self.conn(), addresses.values())
+        hits = {oid: found[a] for oid, a in addresses.items() if found.get(a)}
+        if not hits and not fresh:
+            return 0
+        updated = 0
+        with self._write([("orders", oid) for oid in hits]) as (cur, deps):
+            geocode.store(cur, fresh)
+            for oid, (lat, lon) in hits.items():
+                # Coordinates typed in meanwhile win over the gazetteer
+                cur.execute(f"UPDATE orders SET lat=?, lon=? WHERE id=?{' AND lat IS NULL' if only_missing else ''}",
+                            (lat, lon, oid))
+                if cur.rowcount != 1:
+                    continue
+                updated += 1
+                _bump_version(cur, "orders", "order", oid)
+                route_ids, user_ids = change_log.order_keys(cur, oid)
+                change_log.record(cur, "order", oid, "update", route_ids, user_ids, {"lat": lat, "lon": lon})
+                deps += [("route_items", rid) for rid in route_ids]
+        return updated
+
+    def import_gazetteer(self, rows) -> int:
+        rows = list(rows)
+        with self._write() as (cur, deps):
+            geocode.load_gazetteer(cur, rows)
+        return len(rows)
+
+    def geocode_stats(self) -> dict:
+        return geocode.stats(self.conn())
+
+    def backfill_order_areas(self, only_missing: bool = True) -> int:
+        """Extract postal code / city / district (address_area.py) for orders without them, or all."""
+        with self._write([("orders", None)]) as (cur, deps):
+            return address_area.backfill(cur, only_missing=only_missing)
+
+    def nearby_index(self, statuses=auto_assign.STATUSES) -> nearby.GridIndex:
+        """Grid index over geocoded orders in statuses (see nearby.py), rebuilt when orders change."""
+        return self._cached(
+            ("nearby_index", tuple(statuses)),
+            lambda: nearby.load_index(self.conn(), statuses),
+            [("orders", None)],
+        )
+
+    # ---- users ----
+    def list_users(self, active_only: bool = True) -> list:
+        def load():
+            cur = self.conn().cursor()
+            where = "WHERE u.is_active=1 " if active_only else ""
+            cur.execute(f"SELECT u.* FROM users u {where}ORDER BY u.name ASC")
+            return tuple(dict(r) for r in cur.fetchall())
+
+        return self._cached(("list_users", bool(active_only)), load, [("users", None)])
+
+    def get_user_by_token(self, token: str) -> dict:
+        token = (token or "").strip()
+        if not token:
+            return {}
+        token_hash = user_tokens.hash_token(token)
+        user = self.token_cache.get(token_hash)
+        if user is None:
+            user = user_tokens.lookup(self.conn(), token_hash)
+            self.token_cache.put(token_hash, user)
+        return user
+
+    def save_user(self, user_id, name: str, phone: str = "", is_active: int = 1) -> int:
+        name = (name or "").strip()
+        phone = (phone or "").strip()
+        with self._write() as (cur, deps):
+            if user_id:
+                cur.execute("UPDATE users SET name=?, phone=?, is_active=? WHERE id=?",
+                            (name, phone, int(is_active), int(user_id)))
+                user_id = int(user_id)
+            else:
+                cur.execute("INSERT INTO users (name, phone, is_active, created_at) VALUES (?, ?, ?, ?)",
+                            (name, phone, int(is_active), _now()))
+                user_id = int(cur.lastrowid)
+            deps.append(("users", user_id))
+        # Cached token lookups carry the user row (is_active, name): drop them
+        self.token_cache.invalidate_user(user_id)
+        return user_id
+
+    def delete_user(self, user_id: int):
+        with self._write([("users", int(user_id)), ("assign", int(user_id))]) as (cur, deps):
+            cur.execute("DELETE FROM users WHERE id=?", (int(user_id),))
+            user_tokens.revoke_all(cur, user_id)
+        self.token_cache.invalidate_user(int(user_id))
+
+    def _user_column(self, user_id: int, column: str) -> str:
+        cur = self.conn().cursor()
+        cur.execute(f"SELECT {column} FROM users WHERE id=?", (int(user_id),))
+        row = cur.fetchone()
+        return (row[0] or "").strip() if row else ""
+
+    def get_password_hash(self, user_id: int) -> str:
+        return self._user_column(user_id, "password_hash")
+
+    def set_password_hash(self, user_id: int, password_hash: str, end_sessions: bool = True):
+        """end_sessions bumps users.session_epoch: session tickets issued before stop working."""
+        with self._write([("users", int(user_id))]) as (cur, deps):
+            cur.execute("UPDATE users SET password_hash=? WHERE id=?", (password_hash, int(user_id)))
+            if end_sessions:
+                _bump_session_epoch(cur, user_id)
+
+    def issue_token(self, user_id: int, label: str = "") -> str:
+        with self._write([("users", int(user_id))]) as (cur, deps):
+            token = user_tokens.issue(cur, user_id, label)
+        self.token_cache.invalidate_user(int(user_id))
+        return token
+
+    def revoke_tokens(self, user_id: int) -> int:
+        with self._write([("users", int(user_id))]) as (cur, deps):
+            n = user_tokens.revoke_all(cur, user_id)
+            _bump_session_epoch(cur, user_id)
+        self.token_cache.invalidate_user(int(user_id))
+        return n
+
+    def count_tokens(self, user_id: int) -> int:
+        cur = self.conn().cursor()
+        cur.execute("SELECT COUNT(*) FROM user_tokens WHERE user_id=?", (int(user_id),))
+        return int(cur.fetchone()[0])
+
+    # ---- routes ----
+    def get_route_id(self, route_date: str):
+        def load():
+            cur = self.conn().cursor()
+            cur.execute("SELECT id FROM routes WHERE route_date=?", (route_date,))
+            row = cur.fetchone()
+            return int(row[0]) if row else None
+
+        return self._cached(("get_route_id", route_date), load, [("routes", None)])
+
+    def get_or_create_route(self, route_date: str) -> int:
+        route_id = self.get_route_id(route_date)
+        if route_id:
+            return route_id
+        with self._write([("routes", None)]) as (cur, deps):
+            cur.execute("SELECT id FROM routes WHERE route_date=?", (route_date,))
+            row = cur.fetchone()
+            if row:
+                return int(row[0])
+            cur.execute("INSERT INTO routes (route_date) VALUES (?)", (route_date,))
+            route_id = int(cur.lastrowid)
+        return route_id
+
+    def route_order_ids(self, route_id: int) -> frozenset:
+        """Ids of every order on a route, whatever the item status."""
+        def load():
+            cur = self.conn().cursor()
+            cur.execute("SELECT order_id FROM route_items WHERE route_id=?", (int(route_id),))
+            return frozenset(int(r[0]) for r in cur.fetchall())
+
+        return self._cached(("route_order_ids", int(route_id)), load, [("route_items", int(route_id))])
+
+    # ---- route items ----
+    @staticmethod
+    def _route_list_deps(route_id: int):
+        def deps(rows):
+            return [("route_items", int(route_id)), ("users", None)] + [("orders", r.order_id) for r in rows]
+        return deps
+
+    @staticmethod
+    def _user_list_deps(user_id: int):
+        def deps(rows):
+            out = [("assign", int(user_id)), ("users", None)]
+            out += [("route_items", rid) for rid in {r.route_id for r in rows}]
+            out += [("orders", r.order_id) for r in rows]
+            return out
+        return deps
+
+    def list_route_items(self, route_id: int) -> list:
+        return self._cached(
+            ("list_route_items", int(route_id)),
+            lambda: route_rows.list_route_items(self.conn(), route_id),
+            self._route_list_deps(route_id),
+        )
+
+    def list_worker_route_items(self, route_id: int, user_id: int) -> list:
+        return self._cached(
+            ("list_worker_route_items", int(route_id), int(user_id)),
+            lambda: route_rows.list_worker_route_items(self.conn(), route_id, user_id),
+            lambda rows: self._route_list_deps(route_id)(rows) + [("assign", int(user_id))],
+        )
+
+    def list_user_route_items(self, user_id: int, status: str | None = None) -> list:
+        """DONE/CANCELLED include the archive."""
+        status = (status or "").strip().upper()
+        history = status in ("DONE", "CANCELLED")
+        return self._cached(
+            ("list_user_route_items", int(user_id), status),
+            lambda: route_rows.list_user_route_items(self.conn(), user_id, status=status or None, history=history),
+            self._user_list_deps(user_id),
+        )
+
+    def list_worker_jobs(self, user_id: int, status: str, start_date: str) -> list:
+        return self._cached(
+            ("list_worker_jobs", int(user_id), status, start_date),
+            lambda: route_rows.list_worker_jobs(self.conn(), user_id, status, start_date),
+            self._user_list_deps(user_id),
+        )
+
+    def list_day_jobs(self, route_date: str, statuses=("DONE", "CANCELLED")) -> list:
+        return self._cached(
+            ("list_day_jobs", route_date, tuple(statuses)),
+            lambda: route_rows.list_day_jobs(self.conn(), route_date, statuses, history=True),
+            [("route_items", None), ("orders", None), ("users", None)],
+        )
+
+    def list_job_days(self, statuses=("DONE", "CANCELLED")) -> list:
+        return self._cached(
+            ("list_job_days", tuple(statuses)),
+            lambda: job_stats.list_days(self.conn(), statuses, history=True),
+            [("route_items", None)],
+        )
+
+    def list_job_day_workers(self, route_date: str, statuses=("DONE", "CANCELLED")) -> list:
+        return self._cached(
+            ("list_job_day_workers", route_date, tuple(statuses)),
+            lambda: job_stats.day_by_worker(self.conn(), route_date, statuses, history=True),
+            [("route_items", None), ("users", None)],
+        )
+
+    def assign_order(self, route_id: int, order_id: int, user_ids, ring_no: int = 1) -> int:
+        """Put an order on a route ring (keeping its place if already there) and replace its workers."""
+        with self._write([("route_items", int(route_id))]) as (cur, deps):
+            return self._assign(cur, deps, route_id, order_id, user_ids, ring_no)
+
+    def assign_orders(self, route_id: int, assignments) -> list:
+        """assign_order() for many (order_id, user_ids, ring_no) in one transaction; returns the ri_ids."""
+        with self._write([("route_items", int(route_id))]) as (cur, deps):
+            return [self._assign(cur, deps, route_id, order_id, user_ids, ring_no)
+                    for order_id, user_ids, ring_no in assignments]
+
+    def insert_ring(self, route_id: int, order_ids, user_ids, ring_no: int = 1) -> list:
+        """Append orders to the end of a ring, in the given order, with one bulk insert.
+
+        Orders already on the route are skipped (not moved); returns the new ri_ids.
+        """
+        user_ids = sorted({int(u) for u in user_ids or []})
+        order_ids = list(dict.fromkeys(int(o) for o in order_ids))
+        with self._write([("route_items", int(route_id))]) as (cur, deps):
+            cur.execute("SELECT order_id FROM route_items WHERE route_id=?", (int(route_id),))
+            on_route = {int(r[0]) for r in cur.fetchall()}
+            order_ids = [o for o in order_ids if o not in on_route]
+            if not order_ids:
+                return []
+            seqs = route_order.next_seqs(cur, route_id, len(order_ids))
+            cur.executemany(
+                "INSERT INTO route_items (route_id, order_id, seq, ring_no) VALUES (?, ?, ?, ?)",
+                [(int(route_id), o, seq, int(ring_no)) for o, seq in zip(order_ids, seqs)],
+            )
+            cur.execute(
+                "SELECT id, order_id FROM route_items WHERE route_id=? AND seq >= ? ORDER BY seq",
+                (int(route_id), seqs[0]),
+            )
+            ri_ids = [(int(r[0]), int(r[1])) for r in cur.fetchall()]
+            now = _now()
+            cur.executemany(
+                "INSERT OR IGNORE INTO route_item_users (ri_id, user_id, created_at) VALUES (?, ?, ?)",
+                [(ri_id, uid, now) for ri_id, _o in ri_ids for uid in user_ids],
+            )
+            for ri_id, order_id in ri_ids:
+                change_log.record(cur, "route_item", ri_id, "insert", [route_id], user_ids,
+                                  {"order_id": order_id, "ring_no": int(ring_no), "user_ids": user_ids,
+                                   "previous_user_ids": []})
+            deps += [("assign", uid) for uid in user_ids]
+        return [ri_id for ri_id, _o in ri_ids]
+
+    @staticmethod
+    def _assign(cur, deps, route_id: int, order_id: int, user_ids, ring_no: int) -> int:
+        user_ids = sorted({int(u) for u in user_ids or []})
+        cur.execute(
+            "SELECT id FROM route_items WHERE route_id=? AND order_id=?",
+            (int(route_id), int(order_id)),
+        )
+        existing = cur.fetchone()
+        if existing:
+            ri_id = int(existing[0])
+            cur.execute("UPDATE route_items SET ring_no=?, version = version + 1 WHERE id=?", (int(ring_no), ri_id))
+        else:
+            cur.execute(
+                "INSERT INTO route_items (route_id, order_id, seq, ring_no) VALUES (?, ?, ?, ?)",
+                (int(route_id), int(order_id), route_order.next_seq(cur, route_id), int(ring_no)),
+            )
+            ri_id = int(cur.lastrowid)
+
+        # Previous and new workers both see their lists change
+        cur.execute("SELECT user_id FROM route_item_users WHERE ri_id=?", (ri_id,))
+        previous = [int(r[0]) for r in cur.fetchall()]
+        deps += [("assign", uid) for uid in previous]
+        deps += [("assign", uid) for uid in user_ids]
+        change_log.record(
+            cur, "route_item", ri_id, "assign" if existing else "insert", [route_id], previous + user_ids,
+            {"order_id": int(order_id), "ring_no": int(ring_no), "user_ids": user_ids, "previous_user_ids": previous},
+        )
+        cur.execute("DELETE FROM route_item_users WHERE ri_id=?", (ri_id,))
+        now = _now()
+        cur.executemany(
+            "INSERT OR IGNORE INTO route_item_users (ri_id, user_id, created_at) VALUES (?, ?, ?)",
+            [(ri_id, uid, now) for uid in user_ids],
+        )
+        return ri_id
+
+    def list_assign_jobs(self, route_id: int, statuses=auto_assign.STATUSES) -> tuple:
+        return self._cached(
+            ("list_assign_jobs", int(route_id), tuple(statuses)),
+            lambda: auto_assign.load_jobs(self.conn(), route_id, statuses),
+            [("orders", None), ("route_items", int(route_id)), ("assign", None)],
+        )
+
+    def set_item_status(self, ri_id: int, status: str, user_id: int, reason: str = "", note: str = "",
+                        expected_version: int | None = None):
+        status = (status or "OPEN").strip().upper()
+        if status not in ITEM_STATUSES:
+            status = "OPEN"
+        now = _now()
+        finished_at = now if status in ("DONE", "CANCELLED") else ""
+        with self._write() as (cur, deps):
+            _bump_version(cur, "route_items", "route_item", ri_id, expected_version)
+            deps += self._route_item_deps(cur, "ri.id=?", (int(ri_id),))
+            change_log.record(cur, "route_item", ri_id, "status", *change_log.item_keys(cur, ri_id),
+                              {"status": status, "reason": (reason or "").strip(), "note": (note or "").strip(),
+                               "by": int(user_id)})
+            cur.execute(
+                """
+                UPDATE route_items
+                SET worker_status=?, worker_status_reason=?, worker_status_note=?,
+                    worker_status_updated_at=?, worker_status_updated_by=?,
+                    worker_finished_at=CASE WHEN ?!='' THEN ? ELSE COALESCE(worker_finished_at,'') END
+                WHERE id=?
+                """,
+                (
+                    status, (reason or "").strip(), (note or "").strip(),
+                    now, int(user_id),
+                    finished_at, finished_at,
+                    int(ri_id),
+                ),
+            )
+
+    def remove_route_item(self, ri_id: int):
+        """Also deletes any accidental duplicates for the same (route_id, order_id)."""
+        with self._write() as (cur, deps):
+            cur.execute("SELECT route_id, order_id FROM route_items WHERE id=?", (int(ri_id),))
+            row = cur.fetchone()
+            if row:
+                where, params = "ri.route_id=? AND ri.order_id=?", (row[0], row[1])
+                deps += self._route_item_deps(cur, where, params)
+                cur.execute("SELECT id FROM route_items WHERE route_id=? AND order_id=?", params)
+                for (removed,) in cur.fetchall():
+                    change_log.record(cur, "route_item", removed, "delete", *change_log.item_keys(cur, removed),
+                                      {"order_id": int(row[1])})
+                cur.execute("DELETE FROM route_items WHERE route_id=? AND order_id=?", params)
+            else:
+                cur.execute("DELETE FROM route_items WHERE id=?", (int(ri_id),))
+
+    def item_position(self, ri_id: int):
+        """(route_id, ring_no, 1-based position in the ring) of a stop, or None."""
+        cur = self.conn().cursor()
+        cur.execute(
+            """
+            SELECT ri.route_id, ri.ring_no,
+                   (SELECT COUNT(*) FROM route_items o
+                    WHERE o.route_id = ri.route_id AND o.ring_no = ri.ring_no AND o.seq < ri.seq) + 1
+            FROM route_items ri WHERE ri.id=?
+            """,
+            (int(ri_id),),
+        )
+        row = cur.fetchone()
+        return (int(row[0]), int(row[1] or 1), int(row[2])) if row else None
+
+    @staticmethod
+    def _record_move(cur, ri_id: int):
+        cur.execute("SELECT ring_no, seq FROM route_items WHERE id=?", (int(ri_id),))
+        ring_no, seq = cur.fetchone()
+        change_log.record(cur, "route_item", ri_id, "move", *change_log.item_keys(cur, ri_id),
+                          {"ring_no": int(ring_no), "seq": int(seq)})
+
+    @staticmethod
+    def _record_reorder(cur, route_id: int, data: dict):
+        cur.execute(
+            "SELECT DISTINCT riu.user_id FROM route_item_users riu JOIN route_items ri ON ri.id = riu.ri_id "
+            "WHERE ri.route_id=?",
+            (int(route_id),),
+        )
+        change_log.record(cur, "route", route_id, "reorder", [route_id], [int(r[0]) for r in cur.fetchall()], data)
+
+    def _route_write(self, ri_id: int, expected_version=None):
+        item = self.item_position(ri_id)
+        if item is None:
+            if expected_version is not None:
+                raise VersionConflict("route_item", ri_id, expected_version, None)
+            return None
+        return self._write([("route_items", item[0])])
+
+    def move_item_to(self, ri_id: int, position: int, expected_version: int | None = None) -> bool:
+        write = self._route_write(ri_id, expected_version)
+        if write is None:
+            return False
+        with write as (cur, deps):
+            _check_version(cur, "route_items", "route_item", ri_id, expected_version)
+            moved = route_order.move_to_position(cur, int(ri_id), int(position))
+            if moved:
+                _bump_version(cur, "route_items", "route_item", ri_id)
+                self._record_move(cur, ri_id)
+            return moved
+
+    def move_item_next_to(self, ri_id: int, anchor_ri_id: int, after: bool = False,
+                          expected_version: int | None = None) -> bool:
+        write = self._route_write(ri_id, expected_version)
+        if write is None:
+            return False
+        with write as (cur, deps):
+            _check_version(cur, "route_items", "route_item", ri_id, expected_version)
+            moved = route_order.move_next_to(cur, int(ri_id), int(anchor_ri_id), after=after)
+            if moved:
+                _bump_version(cur, "route_items", "route_item", ri_id)
+                self._record_move(cur, ri_id)
+            return moved
+
+    def apply_ring_order(self, route_id: int, ring_no: int, ri_ids, expected_versions: dict | None = None) -> int:
+        """expected_versions: {ri_id: version} as the caller saw the ring; any of them changed -> conflict."""
+        with self._write([("route_items", int(route_id))]) as (cur, deps):
+            ri_ids = [int(ri) for ri in ri_ids or []]
+            for ri, version in (expected_versions or {}).items():
+                _check_version(cur, "route_items", "route_item", ri, version)
+            before = _seqs(cur, ri_ids)
+            n = route_order.apply_ring_order(cur, int(route_id), int(ring_no), ri_ids)
+            if n:
+                after = _seqs(cur, ri_ids)
+                cur.executemany("UPDATE route_items SET version = version + 1 WHERE id=?",
+                                [(ri,) for ri in ri_ids if ri in before and before[ri] != after.get(ri)])
+                self._record_reorder(cur, route_id, {"ring_no": int(ring_no), "moved": n})
+            return n
+
+    def compact_route(self, route_id: int) -> int:
+        with self._write([("route_items", int(route_id))]) as (cur, deps):
+            n = route_order.compact_route(cur, int(route_id))
+            if n:
+                self._record_reorder(cur, route_id, {"compacted": n})
+            return n
+
+    def commit_route_draft(self, route_id: int, plan: dict) -> dict:
+        """Apply a route_draft.Draft.plan() in one transaction (see route_draft.py).
+
+        Every stop in plan["expected"] must still have its version, every stop
+        in plan["kept"] must still be on the route and every order in
+        plan["new"] must exist and still be off the route, else VersionConflict
+        (an order found on the route: expected None, actual its route item's
+        version) and nothing is written.
+        """
+        with self._write([("route_items", int(route_id))]) as (cur, deps):
+            for ri, version in plan["expected"].items():
+                _check_version(cur, "route_items", "route_item", ri, version)
+            kept = [int(ri) for ri in plan.get("kept", ())]
+            if kept:
+                # Untouched rings are only re-sequenced: their stops just have to be there
+                cur.execute(f"SELECT id FROM route_items WHERE route_id=? AND id IN ({', '.join('?' for _ in kept)})",
+                            [int(route_id), *kept])
+                there = {int(r[0]) for r in cur.fetchall()}
+                for ri in kept:
+                    if ri not in there:
+                        raise VersionConflict("route_item", ri, plan["kept"][ri], None)
+            for order_id in plan["new"]:
+                cur.execute("SELECT 1 FROM orders WHERE id=?", (int(order_id),))
+                if not cur.fetchone():
+                    raise VersionConflict("order", order_id, None, None)
+                cur.execute("SELECT id, version FROM route_items WHERE route_id=? AND order_id=?",
+                            (int(route_id), int(order_id)))
+                row = cur.fetchone()
+                if row:
+                    raise VersionConflict("route_item", row[0], None, int(row[1]))
+
+            for ri in plan["remove"]:
+                cur.execute("SELECT order_id FROM route_items WHERE id=?", (int(ri),))
+                row = cur.fetchone()
+                if not row:
+                    continue
+                deps += self._route_item_deps(cur, "ri.id=?", (int(ri),))
+                change_log.record(cur, "route_item", ri, "delete", *change_log.item_keys(cur, ri),
+                                  {"order_id": int(row[0])})
+                cur.execute("DELETE FROM route_items WHERE id=?", (int(ri),))
+            for order_id, user_ids, ring_no in plan["assign"]:
+                self._assign(cur, deps, route_id, order_id, user_ids, ring_no)
+
+            # Final order: each ring's stops on the seq slots they hold (route_order.apply_ring_order)
+            cur.execute("SELECT order_id, id, ring_no FROM route_items WHERE route_id=?", (int(route_id),))
+            on_route = {int(r[0]): (int(r[1]), int(r[2] or 1)) for r in cur.fetchall()}
+            rings = {}
+            for order_id in plan["order"]:
+                ri, ring_no = on_route[int(order_id)]
+                rings.setdefault(ring_no, []).append(ri)
+            ri_ids = [ri for ris in rings.values() for ri in ris]
+            before = _seqs(cur, ri_ids) if ri_ids else {}
+            moved = sum(route_order.apply_ring_order(cur, int(route_id), ring_no, ris) for ring_no, ris in rings.items())
+            if moved:
+                after = _seqs(cur, ri_ids)
+                cur.executemany("UPDATE route_items SET version = version + 1 WHERE id=?",
+                                [(ri,) for ri in ri_ids if before[ri] != after.get(ri)])
+                self._record_reorder(cur, route_id, {"draft": True, "moved": moved})
+            return {"removed": len(plan["remove"]), "assigned": len(plan["assign"]), "moved": moved}
+
+    # ---- change feed ----
+    def changes_since(self, cursor: int, route_id: int | None = None, user_id: int | None = None,
+                      limit: int = 500) -> dict:
+        """Not cached: this is what callers poll to find out whether to re-read."""
+        return change_log.changes_since(self.conn(), cursor, route_id=route_id, user_id=user_id, limit=limit)
+
+    def change_cursor(self) -> int:
+        return change_log.head(self.conn())
+
+    # ---- settings ----
+    def load_settings(self) -> settings_store.SettingsSnapshot:
+        return self._cached(("settings",), lambda: settings_store.load_settings(self.conn()), [("settings", None)])
+
+    def write_settings(self, values: dict):
+        if not values:
+            return
+        deps = [("settings", (k or "").strip()) for k in values]
+        with self._write(deps) as (cur, _deps):
+            settings_store.write_settings(cur, values)
+
+
+def _seqs(cur, ri_ids) -> dict:
+    cur.execute(f"SELECT id, seq FROM route_items WHERE id IN ({', '.join('?' for _ in ri_ids)})", list(ri_ids))
+    return {int(r[0]): int(r[1]) for r in cur.fetchall()}
+
+
+def _bump_session_epoch(cur, user_id: int):
+    cur.execute("UPDATE users SET session_epoch = COALESCE(session_epoch, 0) + 1 WHERE id=?", (int(user_id),))
+
+
+def open_sqlite(db_path: str, cache: readcache.ReadCache | None = None) -> SqliteRepository:
+    """A SqliteRepository on its own connection and cache (CLI tools, conformance runs)."""
+    conn = connect(db_path)
+    repo = SqliteRepository(lambda: conn, db_path, cache=cache if cache is not None else readcache.ReadCache(),
+                            token_cache=user_tokens.TokenCache())
+    repo.init_schema()
+    repo.cache.bind(db_path)
+    archive.attach(conn, archive.default_archive_path(db_path))
+    return repo
+
+
+# -------------------------
+# Schema
+# -------------------------
+def init_schema(conn: sqlite3.Connection):
+    """Initialize / migrate DB schema.
+
+    Team-based schema has been removed. Route items are assigned directly to workers via
+    route_item_users (many-to-many). The route_items table no longer stores team_id.
+
+    Migration:
+      - If old route_items contains team_id, we rename it to route_items_legacy and recreate
+        a new route_items table without team_id, preserving ids so route_item_users stays valid.
+    """
+
+    # One-time DB-level pragmas (don't run these on every connection)
+    try:
+        # Only takes effect on a new (empty) DB; existing ones: python archive.py --enable-incremental-vacuum
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+    except Exception:
+        pass
+    cur = conn.cursor()
+
+    # --- USERS (keep legacy team_id column if it exists in an old DB; new installs don't need it) ---
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        phone TEXT DEFAULT '',
+        is_active INTEGER NOT NULL DEFAULT 1,
+        created_at TEXT NOT NULL,
+        password_hash TEXT DEFAULT '',
+        auth_token TEXT DEFAULT ''
+    )""")
+
+    # --- ORDERS ---
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        original_filename TEXT NOT NULL,
+        stored_path TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'NEW',
+
+        client_name TEXT DEFAULT '',
+        phone TEXT DEFAULT '',
+        address TEXT DEFAULT '',
+        delivery_date TEXT DEFAULT '',
+        delivery_window TEXT DEFAULT '',
+        notes TEXT DEFAULT '',
+
+        order_ref TEXT DEFAULT '',
+        recipient_name TEXT DEFAULT '',
+        ship_address TEXT DEFAULT '',
+        service_tag TEXT DEFAULT '',
+        doc_author TEXT DEFAULT '',
+        doc_email TEXT DEFAULT '',
+        doc_phone TEXT DEFAULT '',
+        items_compact TEXT DEFAULT ''
+    )""")
+
+    # --- ROUTES ---
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS routes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        route_date TEXT NOT NULL
+    )""")
+
+    # --- ROUTE ITEMS (new schema, no team_id) ---
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS route_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        route_id INTEGER NOT NULL,
+        order_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        ring_no INTEGER NOT NULL DEFAULT 1,
+
+        worker_status TEXT NOT NULL DEFAULT 'OPEN',
+        worker_status_reason TEXT DEFAULT '',
+        worker_status_note TEXT DEFAULT '',
+        worker_status_updated_at TEXT DEFAULT '',
+        worker_status_updated_by INTEGER,
+        worker_started_at TEXT DEFAULT '',
+        worker_finished_at TEXT DEFAULT '',
+
+        FOREIGN KEY(route_id) REFERENCES routes(id),
+        FOREIGN KEY(order_id) REFERENCES orders(id),
+        FOREIGN KEY(worker_status_updated_by) REFERENCES users(id),
+
+        UNIQUE(route_id, order_id),
+        UNIQUE(route_id, seq)
+    )""")
+
+    # Worker assignment for route items (many-to-many)
+    cur.execute("""CREATE TABLE IF NOT EXISTS route_item_users (
+        ri_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        created_at TEXT,
+        FOREIGN KEY(ri_id) REFERENCES route_items(id) ON DELETE CASCADE,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+        UNIQUE(ri_id, user_id)
+    )""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_route_item_users_user ON route_item_users(user_id)""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_route_item_users_ri ON route_item_users(ri_id)""")
+
+
+    # Backward-compat: older DBs may miss created_at on route_item_users
+    try:
+        cur.execute("ALTER TABLE route_item_users ADD COLUMN created_at TEXT DEFAULT ''")
+    except Exception:
+        pass
+
+    # simple key/value settings
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL DEFAULT ''
+    )""")
+
+    def try_add_column(table, coldef):
+        try:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {coldef}")
+        except (sqlite3.OperationalError, sqlite3.IntegrityError):
+            pass
+
+    # Orders: tolerate legacy DBs
+    for coldef in [
+        "order_ref TEXT DEFAULT ''",
+        "recipient_name TEXT DEFAULT ''",
+        "ship_address TEXT DEFAULT ''",
+        "service_tag TEXT DEFAULT ''",
+        "doc_author TEXT DEFAULT ''",
+        "doc_email TEXT DEFAULT ''",
+        "doc_phone TEXT DEFAULT ''",
+        "items_compact TEXT DEFAULT ''",
+        "delivery_date TEXT DEFAULT ''",
+        "delivery_window TEXT DEFAULT ''",
+        "lat REAL",
+        "lon REAL",
+    ]:
+        try_add_column("orders", coldef)
+
+    # Users: tolerate legacy DBs
+    for coldef in ["password_hash TEXT DEFAULT ''", "auth_token TEXT DEFAULT ''", "session_epoch INTEGER DEFAULT 0"]:
+        try_add_column("users", coldef)
+
+    # --- Migration: old route_items with team_id -> new route_items without team_id ---
+    try:
+        cur.execute("PRAGMA table_info(route_items)")
+        cols = [r[1] for r in cur.fetchall()]
+        if 'team_id' in cols:
+            # rename old and recreate new
+            cur.execute("ALTER TABLE route_items RENAME TO route_items_legacy")
+            # recreate new route_items (same as above)
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS route_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                route_id INTEGER NOT NULL,
+                order_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                ring_no INTEGER NOT NULL DEFAULT 1,
+
+                worker_status TEXT NOT NULL DEFAULT 'OPEN',
+                worker_status_reason TEXT DEFAULT '',
+                worker_status_note TEXT DEFAULT '',
+                worker_status_updated_at TEXT DEFAULT '',
+                worker_status_updated_by INTEGER,
+                worker_started_at TEXT DEFAULT '',
+                worker_finished_at TEXT DEFAULT '',
+
+                FOREIGN KEY(route_id) REFERENCES routes(id),
+                FOREIGN KEY(order_id) REFERENCES orders(id),
+                FOREIGN KEY(worker_status_updated_by) REFERENCES users(id),
+
+                UNIQUE(route_id, order_id),
+                UNIQUE(route_id, seq)
+            )""")
+            # copy common columns (preserve ids)
+            cur.execute("""
+            INSERT INTO route_items (
+                id, route_id, order_id, seq, ring_no,
+                worker_status, worker_status_reason, worker_status_note,
+                worker_status_updated_at, worker_status_updated_by,
+                worker_started_at, worker_finished_at
+            )
+            SELECT
+                id, route_id, order_id, seq,
+                COALESCE(NULLIF(ring_no,0),1),
+                COALESCE(NULLIF(worker_status,''),'OPEN'),
+                COALESCE(worker_status_reason,''),
+                COALESCE(worker_status_note,''),
+                COALESCE(worker_status_updated_at,''),
+                worker_status_updated_by,
+                COALESCE(worker_started_at,''),
+                COALESCE(worker_finished_at,'')
+            FROM route_items_legacy
+            """)
+            # indexes
+            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_route_items_route_order ON route_items(route_id, order_id)")
+    except Exception:
+        # migration is best-effort; do not block app start
+        pass
+
+    # Row versions for compare-and-swap updates (see VersionConflict)
+    try_add_column("orders", "version INTEGER NOT NULL DEFAULT 1")
+    try_add_column("route_items", "version INTEGER NOT NULL DEFAULT 1")
+
+    # Full-text search index over orders (kept in sync by triggers)
+    order_search.ensure_schema(cur)
+
+    # Per-day job counts for the Jobs tab (kept in sync by triggers)
+    job_stats.ensure_schema(cur)
+
+    # Generation counters for the process-wide read cache
+    readcache.ensure_schema(cur)
+
+    # Append-only change feed for incremental sync
+    change_log.ensure_schema(cur)
+
+    # Worker login tokens, hashed (moves plain users.auth_token values over)
+    user_tokens.ensure_schema(cur)
+
+    # Local gazetteer + geocode cache keyed by normalized address
+    geocode.ensure_schema(cur)
+
+    # Postal code / city / district columns for grouping orders by area
+    address_area.ensure_schema(cur)
+
+    conn.commit()
@@ -0,0 +1,597 @@
+"""Conformance checks for Repository backends (see repository.py).
+
+Every check gets a fresh, empty repository from a factory and exercises one part
+of the interface the way app.py uses it, including read-after-write through the
+backend's cache. A new backend is ready to replace SqliteRepository when all of
+them pass.
+
+    python repository_conformance.py                          # SqliteRepository on a temp file
+    python repository_conformance.py --backend mod:open_repo  # open_repo(path) -> Repository
+    python repository_conformance.py -k ordering              # only checks whose name contains "ordering"
+    python repository_conformance.py -k concurrent            # many threads on the same rows (slower)
+
+The factory receives a scratch path in a temp directory; a server backend can
+use it as the name of a throwaway schema/database on its local stand-in.
+"""
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import threading
+import traceback
+
+import repository
+import route_draft
+
+
+class CheckFailed(AssertionError):
+    pass
+
+
+def expect(cond, msg: str):
+    if not cond:
+        raise CheckFailed(msg)
+
+
+def _order(repo, name: str, **fields) -> int:
+    oid = repo.insert_order(f"{name}.pdf", f"/tmp/{name}.pdf")
+    repo.update_order(oid, dict({"client_name": name, "status": "READY"}, **fields))
+    return oid
+
+
+def _user(repo, name: str, active: int = 1) -> int:
+    return repo.save_user(None, name, phone="+372 5000 0000", is_active=active)
+
+
+def _ring_ids(repo, route_id: int, ring_no: int = 1) -> list:
+    return [r.ri_id for r in repo.list_route_items(route_id) if int(r.ring_no) == ring_no]
+
+
+def _conflict(fn) -> bool:
+    try:
+        fn()
+    except repository.VersionConflict:
+        return True
+    return False
+
+
+def _item(repo, route_id: int, ri_id: int):
+    return next(r for r in repo.list_route_items(route_id) if r.ri_id == ri_id)
+
+
+# Concurrency checks: THREADS sessions, each on its own short-lived connection
+THREADS = 8
+ROUNDS = 25
+JOIN_TIMEOUT_S = 60
+
+
+def _hammer(repo, body) -> list:
+    """Run body(r, n) in THREADS threads (own connection each); returns their errors. Hangs fail the check."""
+    errors = []
+
+    def session(n):
+        try:
+            with repo.short_lived(timeout=5.0) as r:
+                body(r, n)
+        except Exception as e:
+            errors.append(f"thread {n}: {type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=session, args=(n,), daemon=True) for n in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(JOIN_TIMEOUT_S)
+    expect(not any(t.is_alive() for t in threads), f"threads still running after {JOIN_TIMEOUT_S}s (deadlock?)")
+    return errors
+
+
+# -------------------------
+# Checks
+# -------------------------
+def check_orders(repo):
+    oid = repo.insert_order("a.pdf", "/tmp/a.pdf")
+    expect(oid, "insert_order returns an id")
+    o = repo.get_order(oid)
+    expect(o.get("status") == "NEW" and o.get("original_filename") == "a.pdf", f"new order: {o}")
+
+    repo.update_order(oid, {"client_name": "Mari Maasikas", "status": "READY", "no_such_column": "x"})
+    o = repo.get_order(oid)
+    expect(o["client_name"] == "Mari Maasikas" and o["status"] == "READY", "update_order is visible to get_order")
+    expect("no_such_column" not in o, "update_order ignores unknown fields")
+    expect([r.id for r in repo.list_orders("READY")] == [oid], "list_orders filters by status")
+    expect(not list(repo.list_orders("NEW")), "list_orders NEW is empty")
+
+    repo.update_order(oid, {"items_compact": "1x Diivan", "notes": "helista ette"})
+    d = repo.get_order_details(oid)
+    expect(d.get("items_compact") == "1x Diivan" and d.get("notes") == "helista ette", f"details: {d}")
+
+    oid2 = _order(repo, "Teine")
+    expect([r.id for r in repo.list_orders()] == [oid2, oid], "list_orders is newest first")
+    repo.delete_order(oid)
+    expect(repo.get_order(oid) == {}, "deleted order is gone")
+    expect([r.id for r in repo.list_orders()] == [oid2], "list_orders drops the deleted order")
+
+
+def check_users(repo):
+    a = _user(repo, "Anna")
+    b = _user(repo, "Bert", active=0)
+    expect([u["name"] for u in repo.list_users()] == ["Anna"], "active_only hides inactive users")
+    expect([u["name"] for u in repo.list_users(active_only=False)] == ["Anna", "Bert"], "all users by name")
+
+    expect(repo.save_user(b, "Bert B", is_active=1) == b, "save_user updates in place")
+    expect([u["name"] for u in repo.list_users()] == ["Anna", "Bert B"], "update visible to list_users")
+
+    expect(repo.get_password_hash(a) == "", "no password by default")
+    repo.set_password_hash(a, "pbkdf2$x$y$z")
+    expect(repo.get_password_hash(a) == "pbkdf2$x$y$z", "password hash round-trips")
+
+    expect(repo.count_tokens(a) == 0, "no token by default")
+    expect(repo.get_user_by_token("abc") == {}, "unknown token")
+    tok = repo.issue_token(a, "link")
+    tok2 = repo.issue_token(a, "login")
+    expect(tok and tok != tok2 and repo.count_tokens(a) == 2, "issue_token returns a new token each time")
+    expect(repo.get_user_by_token(tok).get("id") == a, "token login")
+    expect(repo.get_user_by_token(tok2).get("id") == a, "a user may hold several tokens")
+    dump = "\n".join(repo.conn().iterdump())
+    expect(tok not in dump and tok2 not in dump, "plain tokens are not stored")
+    repo.save_user(a, "Anna", is_active=0)
+    expect(repo.get_user_by_token(tok) == {}, "inactive users can't log in")
+    repo.save_user(a, "Anna", is_active=1)
+    expect(repo.get_user_by_token(tok).get("id") == a, "reactivated user logs in again")
+    expect(repo.revoke_tokens(a) == 2 and repo.get_user_by_token(tok2) == {}, "revoke_tokens")
+
+    tok_b = repo.issue_token(b)
+    expect(repo.get_user_by_token(tok_b).get("id") == b, "token login (b)")
+    repo.delete_user(b)
+    expect([u["id"] for u in repo.list_users(active_only=False)] == [a], "delete_user")
+    expect(repo.get_user_by_token(tok_b) == {}, "deleted user's token is gone")
+
+
+def check_routes(repo):
+    expect(repo.get_route_id("2030-01-02") is None, "no route yet")
+    rid = repo.get_or_create_route("2030-01-02")
+    expect(rid and repo.get_or_create_route("2030-01-02") == rid, "get_or_create_route is idempotent")
+    expect(repo.get_route_id("2030-01-02") == rid, "get_route_id sees the new route")
+    expect(repo.route_order_ids(rid) == frozenset(), "new route is empty")
+
+
+def check_assignment(repo):
+    a, b = _user(repo, "Anna"), _user(repo, "Bert")
+    rid = repo.get_or_create_route("2030-01-02")
+    o1, o2 = _order(repo, "Esimene"), _order(repo, "Teine")
+
+    ri1 = repo.assign_order(rid, o1, [a, b])
+    ri2 = repo.assign_order(rid, o2, [b], ring_no=2)
+    expect(repo.route_order_ids(rid) == {o1, o2}, "route_order_ids")
+    rows = repo.list_route_items(rid)
+    expect([r.ri_id for r in rows] == [ri1, ri2], "list_route_items in planner order")
+    expect(rows[0].worker_names in ("Anna, Bert", "Bert, Anna"), f"worker names: {rows[0].worker_names}")
+    expect([r.ri_id for r in repo.list_worker_route_items(rid, a)] == [ri1], "worker items of Anna")
+    expect({r.ri_id for r in repo.list_worker_route_items(rid, b)} == {ri1, ri2}, "worker items of Bert")
+
+    # Re-assigning keeps the item and its place, replaces the workers
+    expect(repo.assign_order(rid, o1, [b], ring_no=1) == ri1, "re-assign keeps the route item")
+    expect(not list(repo.list_worker_route_items(rid, a)), "previous worker loses the item")
+    expect([r.ri_id for r in repo.list_user_route_items(b, "OPEN")] == [ri1, ri2], "user items (OPEN)")
+    expect(len(repo.list_worker_jobs(b, "OPEN", "2030-01-01")) == 2, "list_worker_jobs")
+
+
+def check_bulk_assignment(repo):
+    a, b = _user(repo, "Anna"), _user(repo, "Bert")
+    rid = repo.get_or_create_route("2030-01-02")
+    o1 = _order(repo, "Esimene", status="READY FOR WORK", items_compact="1 - DIIVAN - 2 tk - Pealadu")
+    o2 = _order(repo, "Teine", status="SCHEDULED", service_tag="Transport + Paigaldus")
+    _order(repo, "Kolmas", status="DONE")
+    jobs, on_route = repo.list_assign_jobs(rid)
+    expect(sorted(j.order_id for j in jobs) == [o1, o2] and not on_route, "open orders not on the route")
+    expect({j.order_id: j.units for j in jobs}[o1] == 2, "pieces from items_compact")
+
+    ri1, ri2 = repo.assign_orders(rid, [(o1, [a], 1), (o2, [a, b], 2)])
+    rows = {r.ri_id: r for r in repo.list_route_items(rid)}
+    expect(set(rows) == {ri1, ri2} and rows[ri2].ring_no == 2, "both items on the route")
+    expect({r.ri_id for r in repo.list_worker_route_items(rid, b)} == {ri2}, "worker items after bulk assign")
+    jobs, on_route = repo.list_assign_jobs(rid)
+    expect(not jobs and {j.user_ids for j in on_route} == {(a,), tuple(sorted((a, b)))}, "assigned jobs move on route")
+
+
+def check_insert_ring(repo):
+    a = _user(repo, "Anna")
+    rid = repo.get_or_create_route("2030-01-02")
+    o1, o2, o3 = _order(repo, "Esimene"), _order(repo, "Teine"), _order(repo, "Kolmas")
+    ri0 = repo.assign_order(rid, o2, [a], ring_no=1)
+    new = repo.insert_ring(rid, [o3, o2, o1], [a], ring_no=2)
+    expect(len(new) == 2, "order already on the route is skipped")
+    expect([r.order_id for r in repo.list_route_items(rid) if r.ring_no == 2] == [o3, o1], "ring in the given order")
+    expect({r.ri_id for r in repo.list_worker_route_items(rid, a)} == {ri0, *new}, "workers assigned")
+    expect(repo.insert_ring(rid, [o1], [a], ring_no=3) == [], "nothing left to insert")
+
+
+def check_status_and_history(repo):
+    a = _user(repo, "Anna")
+    rid = repo.get_or_create_route("2030-01-02")
+    o1, o2 = _order(repo, "Esimene"), _order(repo, "Teine")
+    ri1 = repo.assign_order(rid, o1, [a])
+    repo.assign_order(rid, o2, [a])
+
+    repo.set_item_status(ri1, "done", a, note="ok")
+    expect([r.order_id for r in repo.list_route_items(rid)] == [o2], "route list shows OPEN items only")
+    done = repo.list_user_route_items(a, "DONE")
+    expect([r.ri_id for r in done] == [ri1] and done[0].worker_status_note == "ok", "DONE items of a user")
+    expect(repo.route_order_ids(rid) == {o1, o2}, "route_order_ids counts every status")
+
+    expect(repo.list_job_days() == [("2030-01-02", {"DONE": 1})], f"job days: {repo.list_job_days()}")
+    workers = repo.list_job_day_workers("2030-01-02")
+    expect([(w[1], w[2]) for w in workers] == [("Anna", {"DONE": 1})], f"job day workers: {workers}")
+    expect([r.ri_id for r in repo.list_day_jobs("2030-01-02")] == [ri1], "list_day_jobs")
+
+    hist = repo.order_history(o1)
+    expect(len(hist) == 1 and hist[0]["worker_status"] == "DONE", f"order history: {hist}")
+
+    repo.set_item_status(ri1, "bogus", a)
+    expect(o1 in {r.order_id for r in repo.list_route_items(rid)}, "unknown status falls back to OPEN")
+
+
+def check_ordering(repo):
+    a = _user(repo, "Anna")
+    rid = repo.get_or_create_route("2030-01-02")
+    ids = [repo.assign_order(rid, _order(repo, f"O{n}"), [a]) for n in range(5)]
+    expect(_ring_ids(repo, rid) == ids, "stops keep insertion order")
+
+    expect(repo.move_item_to(ids[4], 1), "move_item_to")
+    expect(_ring_ids(repo, rid) == [ids[4]] + ids[:4], "moved to the top")
+    expect(repo.item_position(ids[4])[2] == 1 and repo.item_position(ids[0])[2] == 2, "item_position")
+
+    expect(repo.move_item_next_to(ids[4], ids[2], after=True), "move_item_next_to")
+    expect(_ring_ids(repo, rid) == [ids[0], ids[1], ids[2], ids[4], ids[3]], "moved after the anchor")
+
+    order = list(reversed(_ring_ids(repo, rid)))
+    repo.apply_ring_order(rid, 1, order)
+    expect(_ring_ids(repo, rid) == order, "apply_ring_order")
+    repo.compact_route(rid)
+    expect(_ring_ids(repo, rid) == order, "compact_route keeps the order")
+    expect(repo.item_position(10 ** 9) is None, "item_position of a missing stop")
+
+
+def check_remove(repo):
+    a = _user(repo, "Anna")
+    rid = repo.get_or_create_route("2030-01-02")
+    o1, o2 = _order(repo, "Esimene"), _order(repo, "Teine")
+    ri1 = repo.assign_order(rid, o1, [a])
+    repo.assign_order(rid, o2, [a])
+    repo.remove_route_item(ri1)
+    expect(repo.route_order_ids(rid) == {o2}, "remove_route_item")
+    expect([r.order_id for r in repo.list_user_route_items(a)] == [o2], "removed item leaves the worker list")
+    repo.delete_order(o2)
+    expect(repo.route_order_ids(rid) == frozenset(), "delete_order removes its route items")
+
+
+def check_route_draft(repo):
+    a, b = _user(repo, "Anna"), _user(repo, "Bert")
+    rid = repo.get_or_create_route("2030-01-02")
+    o = [_order(repo, f"D{n}") for n in range(4)]
+    ri = [repo.assign_order(rid, oid, [a]) for oid in o[:3]]
+
+    def draft():
+        users = {j.ri_id: j.user_ids for j in repo.list_assign_jobs(rid)[1]}
+        return route_draft.Draft.from_rows(rid, repo.list_route_items(rid), users, "2030-01-02")
+
+    d = draft()
+    d.move_up(o[2])
+    d.remove(o[0])
+    d.reassign(o[1], ring_no=2, user_ids=[b])
+    d.add(repo.get_order(o[3]), 1, [a])
+    expect({c["op"] for c in d.diff()} == {"add", "remove", "ring", "workers"}, "draft diff")
+    expect(repo.route_order_ids(rid) == frozenset(o[:3]), "draft edits are not written")
+    repo.commit_route_draft(rid, d.plan())
+    expect(repo.route_order_ids(rid) == frozenset(o[1:]), "draft committed")
+    ring1 = [r.order_id for r in repo.list_route_items(rid) if int(r.ring_no) == 1]
+    expect(ring1 == [o[2], o[3]], "ring order as drafted")
+    expect({j.order_id: j.user_ids for j in repo.list_assign_jobs(rid)[1]}[o[1]] == (b,), "workers as drafted")
+
+    d = draft()
+    d.move_up(o[3])
+    d.remove(o[1])
+    repo.move_item_to(ri[2], 2)     # someone else reorders ring 1 meanwhile
+    seen = [(r.order_id, r.ring_no, r.version) for r in repo.list_route_items(rid)]
+    expect(_conflict(lambda: repo.commit_route_draft(rid, d.plan())), "stale draft -> VersionConflict")
+    expect([(r.order_id, r.ring_no, r.version) for r in repo.list_route_items(rid)] == seen, "conflict writes nothing")
+    d = draft()
+    d.add(repo.get_order(o[0]), 1, [a])
+    repo.assign_order(rid, o[0], [b])
+    expect(_conflict(lambda: repo.commit_route_draft(rid, d.plan())), "order added meanwhile -> VersionConflict")
+
+    d = draft()
+    ring1 = [r.order_id for r in repo.list_route_items(rid) if int(r.ring_no) == 1]
+    d.move_up(ring1[-1])
+    gone = next(r for r in repo.list_route_items(rid) if int(r.ring_no) != 1)
+    repo.remove_route_item(gone.ri_id)      # someone else removes a stop of an untouched ring
+    seen = [(r.order_id, r.ring_no, r.seq, r.version) for r in repo.list_route_items(rid)]
+    expect(_conflict(lambda: repo.commit_route_draft(rid, d.plan())), "stop of an untouched ring removed -> VersionConflict")
+    expect([(r.order_id, r.ring_no, r.seq, r.version) for r in repo.list_route_items(rid)] == seen,
+           "conflict writes nothing")
+
+
+def check_search(repo):
+    o1 = _order(repo, "Mari Maasikas", phone="+372 5123 1232", address="Pärnu mnt 10")
+    _order(repo, "Jaan Tamm", address="Tartu mnt 1")
+    expect([h["id"] for h in repo.search_orders("maasikas")] == [o1], "search by name")
+    expect([h["id"] for h in repo.search_orders("51231232")] == [o1], "search by local phone digits")
+    repo.update_order(o1, {"client_name": "Mari Mustikas"})
+    expect(not list(repo.search_orders("maasikas")), "search follows updates")
+    expect(not list(repo.search_orders("")), "empty query")
+
+
+def check_geocode(repo):
+    rows = [("tallinn", "pärnu mnt", "10", 59.431, 24.744), ("tallinn", "pärnu mnt", "14", 59.430, 24.743),
+            ("tallinn", "tartu mnt", "1", 59.436, 24.757)]
+    expect(repo.import_gazetteer(rows) == 3, "gazetteer rows imported")
+    exact = _order(repo, "Exact", address="Pärnu maantee 10-5, 10141 Tallinn")
+    fuzzy = _order(repo, "Fuzzy", address="Parnu mnt 12\nTallinn")
+    unknown = _order(repo, "Unknown", address="Kuu tn 3, Tartu")
+    v = repo.get_order(exact)["version"]
+    expect(repo.geocode_orders([exact, fuzzy, unknown]) == 2, "two orders geocoded")
+    o = repo.get_order(exact)
+    expect((o["lat"], o["lon"]) == (59.431, 24.744) and o["version"] == v + 1, "exact match, version bumped")
+    expect(repo.get_order(fuzzy)["lat"] is not None, "fuzzy street + nearest house")
+    expect(repo.get_order(unknown)["lat"] is None, "unknown address stays without coordinates")
+    repo.update_order(exact, {"lat": 1.0, "lon": 2.0})
+    expect(repo.geocode_orders() == 0 and repo.get_order(exact)["lat"] == 1.0, "only orders without coordinates")
+    expect(repo.geocode_stats()["misses"] == 1, "miss is cached")
+    repo.import_gazetteer([("tartu", "kuu tn", "3", 58.38, 26.72)])
+    expect(repo.geocode_orders() == 1, "new gazetteer rows resolve cached misses")
+    repo.update_order(exact, {"notes": "värav", "address": "Pärnu maantee 10-5, 10141 Tallinn"})
+    expect(repo.get_order(exact)["lat"] == 1.0, "same address keeps the coordinates")
+    repo.update_order(exact, {"address": "Tartu mnt 1, Tallinn"})
+    o = repo.get_order(exact)
+    expect((o["lat"], o["lon"]) == (59.436, 24.757), f"new address geocoded again: {o['lat']}, {o['lon']}")
+    repo.update_order(exact, {"address": "Pärnu mnt 14, Tallinn", "lat": 3.0, "lon": 4.0})
+    expect(repo.get_order(exact)["lat"] == 3.0, "coordinates passed with the address win")
+    repo.update_order(exact, {"address": "Päikese tn 9, Narva"})
+    expect(repo.get_order(exact)["lat"] is None, "unknown new address: old coordinates dropped")
+    repo.update_order(exact, {"address": "Tartu mnt 1, Tallinn"})
+    expect(repo.get_order(exact)["lat"] is None, "orders without coordinates wait for geocode_orders()")
+
+    # Same street in two towns: the city decides, wherever it is written
+    repo.import_gazetteer([("tallinn", "narva mnt", "7", 59.438, 24.770), ("tartu", "narva mnt", "7", 58.382, 26.729)])
+    same_line = _order(repo, "SameLine", address="Narva mnt 7 Tartu")
+    first = _order(repo, "CityFirst", address="Tartu, Narva mnt 7")
+    tallinn = _order(repo, "Tallinn", address="Narva mnt 7-2 Tallinn 10117")
+    repo.geocode_orders([same_line, first, tallinn])
+    got = [repo.get_order(o)["lat"] for o in (same_line, first, tallinn)]
+    expect(got == [58.382, 58.382, 59.438], f"city after the house number / before the street: {got}")
+
+
+def check_nearby_index(repo):
+    a = _order(repo, "Lähedal", status="READY FOR WORK", lat=59.43, lon=24.75)
+    far = _order(repo, "Kaugel", status="SCHEDULED", lat=58.38, lon=26.72)
+    _order(repo, "Ilma", status="READY FOR WORK")
+    index = repo.nearby_index()
+    expect({a, far} <= set(index.ids.tolist()), "geocoded open orders indexed")
+    expect(set(index.ids[index.near([(59.431, 24.751)], 2.0)].tolist()) & {a, far} == {a}, "radius lookup")
+    repo.update_order(a, {"lat": 58.381, "lon": 26.721})
+    moved = repo.nearby_index()
+    expect(a not in set(moved.ids[moved.near([(59.431, 24.751)], 2.0)].tolist()), "index rebuilt after an order moves")
+
+
+def check_order_areas(repo):
+    a = _order(repo, "Lasna", address="Punane 5\n13619 Tallinn\nLasnamäe linnaosa")
+    b = _order(repo, "Kesk", address="Pärnu mnt 10, 10141 Tallinn, Kesklinna linnaosa")
+    c = _order(repo, "Rae", ship_address="Tamme tee 5, Peetri alevik, Rae vald, 75312")
+    d = _order(repo, "Teadmata")
+    o = repo.get_order(a)
+    expect((o["postal_code"], o["city"], o["district"]) == ("13619", "Tallinn", "Lasnamäe"), "extracted on address update")
+    expect(repo.get_order(c)["district"] == "Rae vald", "ship_address used when address is empty")
+    ids = [r["id"] for r in repo.list_orders("READY", by_area=True) if r["id"] in (a, b, c, d)]
+    expect(ids == [b, a, c, d], "grouped by district, unknown last")
+    repo.update_order(a, {"address": "Tartu mnt 1, 10145 Tallinn, Kesklinna linnaosa"})
+    expect(repo.get_order(a)["district"] == "Kesklinn", "re-extracted when the address changes")
+    repo.update_order(a, {"address": "Punane 5 Tallinn 13619"})
+    o = repo.get_order(a)
+    expect((o["postal_code"], o["city"]) == ("13619", "Tallinn"), f"one line, city after the house number: {o['city']!r}")
+    repo.update_order(b, {"address": "Pärnu mnt 10, 10141 Tallinn, Eesti"})
+    o = repo.get_order(b)
+    expect((o["city"], o["district"]) == ("Tallinn", "Tallinn"), f"trailing country skipped: {o['city']!r}")
+    expect(repo.backfill_order_areas() == 0, "nothing missing")
+    expect(repo.backfill_order_areas(only_missing=False) >= 4, "re-extract all")
+
+
+def check_settings(repo):
+    expect(repo.load_settings().get("maps_start", "x") == "x", "missing key -> default")
+    repo.write_settings({"maps_start": " Tallinn ", "backup_keep": "5"})
+    snap = repo.load_settings()
+    expect(snap.get("maps_start") == "Tallinn" and snap.get_int("backup_keep") == 5, "settings round-trip")
+    repo.write_settings({"backup_keep": "6"})
+    expect(repo.load_settings().get_int("backup_keep") == 6, "settings overwrite")
+    repo.write_settings({})
+
+
+def check_short_lived(repo):
+    a = _user(repo, "Anna")
+    rid = repo.get_or_create_route("2030-01-02")
+    oid = _order(repo, "Esimene")
+    expect(repo.route_order_ids(rid) == frozenset(), "empty before the write")
+    with repo.short_lived(timeout=1.0) as r:
+        r.assign_order(rid, oid, [a])
+    expect(repo.route_order_ids(rid) == {oid}, "write on a short-lived connection is visible")
+
+
+def check_change_feed(repo):
+    a, b = _user(repo, "Anna"), _user(repo, "Bert")
+    rid = repo.get_or_create_route("2030-01-02")
+    other = repo.get_or_create_route("2030-01-03")
+    start = repo.change_cursor()
+    o1, o2 = _order(repo, "Esimene"), _order(repo, "Teine")
+    ri1 = repo.assign_order(rid, o1, [a])
+    ri2 = repo.assign_order(rid, o2, [b])
+    repo.assign_order(other, o2, [b])
+
+    feed = repo.changes_since(start)
+    expect(not feed["resync"] and feed["cursor"] == repo.change_cursor(), f"cursor: {feed}")
+    ops = [(c["entity"], c["op"]) for c in feed["changes"]]
+    expect(ops.count(("route_item", "insert")) == 3 and ("order", "insert") in ops, f"ops: {ops}")
+    expect([c["id"] for c in feed["changes"]] == sorted(c["id"] for c in feed["changes"]), "oldest first")
+
+    cur = feed["cursor"]
+    expect(repo.changes_since(cur)["changes"] == [], "nothing after the head")
+    repo.set_item_status(ri1, "DONE", a)
+    repo.assign_order(rid, o2, [a], ring_no=2)       # Bert loses ri2 to Anna
+    repo.update_order(o1, {"notes": "uks koodiga"})
+
+    mine = repo.changes_since(cur, user_id=b)
+    expect([(c["entity_id"], c["op"]) for c in mine["changes"]] == [(ri2, "assign")],
+           f"previous worker sees the reassignment: {mine['changes']}")
+    expect(mine["cursor"] == repo.change_cursor(), "filtered cursor skips unrelated changes")
+    anna = [(c["entity"], c["op"]) for c in repo.changes_since(cur, user_id=a)["changes"]]
+    expect(anna == [("route_item", "status"), ("route_item", "assign"), ("order", "update")], f"anna: {anna}")
+    expect(len(repo.changes_since(cur, route_id=other)["changes"]) == 0, "other route untouched")
+    expect(len(repo.changes_since(cur, route_id=rid)["changes"]) == 3, "route filter")
+
+    ri3 = repo.assign_order(rid, _order(repo, "Kolmas"), [a], ring_no=2)
+    cur = repo.change_cursor()
+    repo.move_item_to(ri3, 1)
+    repo.remove_route_item(ri1)
+    ops = [(c["entity_id"], c["op"]) for c in repo.changes_since(cur, route_id=rid)["changes"]]
+    expect(ops == [(ri3, "move"), (ri1, "delete")], f"move/remove: {ops}")
+
+    page = repo.changes_since(start, limit=2)
+    expect(len(page["changes"]) == 2 and page["cursor"] == page["changes"][-1]["id"], "paging by limit")
+    expect(repo.changes_since(repo.change_cursor() + 5)["resync"], "cursor ahead of the feed -> resync")
+
+
+def check_versions(repo):
+    a = _user(repo, "Anna")
+    rid = repo.get_or_create_route("2030-01-02")
+    oid = _order(repo, "Esimene")
+    v = repo.get_order(oid)["version"]
+    repo.update_order(oid, {"notes": "1"}, expected_version=v)
+    expect(repo.get_order(oid)["version"] == v + 1, "update_order bumps the version")
+    expect(_conflict(lambda: repo.update_order(oid, {"notes": "stale"}, expected_version=v)), "stale order write")
+    expect(repo.get_order(oid)["notes"] == "1", "a conflicting write changes nothing")
+    repo.update_order(oid, {"notes": "2"})
+    expect(repo.get_order(oid)["version"] == v + 2, "writes without a version still bump it")
+
+    ids = [repo.assign_order(rid, oid2, [a]) for oid2 in (oid, _order(repo, "Teine"), _order(repo, "Kolmas"))]
+    seen = {ri: _item(repo, rid, ri).version for ri in ids}
+    cursor = repo.change_cursor()
+    expect(_conflict(lambda: repo.set_item_status(ids[0], "DONE", a, expected_version=seen[ids[0]] - 1)),
+           "stale status write")
+    expect(repo.changes_since(cursor)["changes"] == [], "a conflicting write leaves no change feed entry")
+    repo.move_item_to(ids[2], 1, expected_version=seen[ids[2]])
+    expect(_ring_ids(repo, rid) == [ids[2], ids[0], ids[1]], "move with the current version")
+    expect(_conflict(lambda: repo.move_item_next_to(ids[2], ids[1], after=True, expected_version=seen[ids[2]])),
+           "second move from the same stale view")
+    expect(_conflict(lambda: repo.apply_ring_order(rid, 1, list(reversed(ids)), expected_versions=seen)),
+           "ring reorder from a stale view")
+    expect(_ring_ids(repo, rid) == [ids[2], ids[0], ids[1]], "conflicting reorders change nothing")
+    fresh = {ri: _item(repo, rid, ri).version for ri in ids}
+    expect(repo.apply_ring_order(rid, 1, ids, expected_versions=fresh) > 0, "reorder from a fresh view")
+    expect(all(_item(repo, rid, ri).version > fresh[ri] for ri in (ids[0], ids[2])), "moved stops get new versions")
+    repo.set_item_status(ids[1], "DONE", a, expected_version=_item(repo, rid, ids[1]).version)
+    repo.remove_route_item(ids[0])
+    expect(_conflict(lambda: repo.move_item_to(ids[0], 1, expected_version=fresh[ids[0]])), "move of a removed stop")
+
+
+def check_concurrent_order_updates(repo):
+    """Every thread adds ROUNDS to a counter in notes with read + compare-and-swap: no increment may get lost."""
+    oid = _order(repo, "Loendur", notes="0")
+    start = repo.get_order(oid)["version"]
+    conflicts = []
+
+    def body(r, n):
+        done = 0
+        while done < ROUNDS:
+            o = r.get_order(oid)
+            try:
+                repository.retry_locked(lambda: r.update_order(oid, {"notes": str(int(o["notes"]) + 1)},
+                                                               expected_version=o["version"]))
+                done += 1
+            except repository.VersionConflict:
+                conflicts.append(n)
+
+    errors = _hammer(repo, body)
+    expect(not errors, f"errors: {errors[:3]}")
+    o = repo.get_order(oid)
+    expect(int(o["notes"]) == THREADS * ROUNDS, f"lost updates: counter {o['notes']}, expected {THREADS * ROUNDS}")
+    expect(o["version"] == start + THREADS * ROUNDS, f"version {o['version']} after {THREADS * ROUNDS} writes")
+
+
+def check_concurrent_route_items(repo):
+    """Workers flip statuses and dispatchers reorder the same ring at once: every write that
+    reported success is counted in the versions, and the ring still holds every stop exactly once."""
+    a = _user(repo, "Anna")
+    rid = repo.get_or_create_route("2030-01-02")
+    ids = [repo.assign_order(rid, _order(repo, f"O{n}"), [a]) for n in range(6)]
+    start = {ri: _item(repo, rid, ri).version for ri in ids}
+    lock = threading.Lock()
+    bumps = {ri: 0 for ri in ids}
+
+    def body(r, n):
+        for k in range(ROUNDS):
+            rows = {x.ri_id: x for x in r.list_worker_route_items(rid, a)}
+            ri = ids[(n + k) % len(ids)]
+            try:
+                if n % 2:
+                    status = "OPEN" if rows[ri].worker_status == "DONE" else "DONE"
+                    repository.retry_locked(lambda: r.set_item_status(ri, status, a, expected_version=rows[ri].version))
+                    moved = [ri]
+                else:
+                    order = sorted(rows, key=lambda x: (rows[x].seq * 7919 + k) % 101)
+                    before = [x for x in sorted(rows, key=lambda x: rows[x].seq)]
+                    seen = {x: rows[x].version for x in rows}
+                    repository.retry_locked(lambda: r.apply_ring_order(rid, 1, order, expected_versions=seen))
+                    moved = [x for p, x in enumerate(order) if before[p] != x]
+                with lock:
+                    for x in moved:
+                        bumps[x] += 1
+            except repository.VersionConflict:
+                pass
+
+    errors = _hammer(repo, body)
+    expect(not errors, f"errors: {errors[:3]}")
+    rows = {x.ri_id: x for x in repo.list_worker_route_items(rid, a)}
+    expect(sorted(rows) == sorted(ids), "every stop still on the route")
+    expect(len({x.seq for x in rows.values()}) == len(ids), "no two stops share a position")
+    lost = {ri: (rows[ri].version - start[ri], bumps[ri]) for ri in ids if rows[ri].version - start[ri] != bumps[ri]}
+    expect(not lost, f"versions vs. successful writes per stop: {lost}")
+
+
+CHECKS = [(name[len("check_"):], fn) for name, fn in sorted(globals().items()) if name.startswith("check_")]
+
+
+def run(factory, only: str = "", log=print) -> int:
+    """Run every check (name containing `only`) on a fresh repository each; returns the failure count."""
+    failed = 0
+    with tempfile.TemporaryDirectory(prefix="repo-conformance-") as tmp:
+        for name, fn in CHECKS:
+            if only and only not in name:
+                continue
+            try:
+                fn(factory(os.path.join(tmp, f"{name}.sqlite")))
+                log(f"ok    {name}")
+            except Exception as e:
+                failed += 1
+                detail = str(e) if isinstance(e, CheckFailed) else traceback.format_exc().rstrip()
+                log(f"FAIL  {name}: {detail}")
+    return failed
+
+
+def _load_factory(spec: str):
+    module, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module), attr or "open_repository")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the Repository conformance checks against a backend.")
+    ap.add_argument("--backend", default="repository:open_sqlite",
+                    help="module:callable returning a Repository for a scratch path (default: repository:open_sqlite)")
+    ap.add_argument("-k", dest="only", default="", help="only run checks whose name contains this")
+    args = ap.parse_args()
+
+    failed = run(_load_factory(args.backend), only=args.only)
+    print(f"{len(CHECKS)} checks, {failed} failed" if not args.only else f"{failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""Proposed rings for a day's unrouted orders: k-means over their coordinates (NumPy).
+
+The orders that have coordinates are projected onto a flat km grid around their
+mean latitude (exact enough at city scale) and grouped with k-means: k-means++
+seeding, Lloyd iterations on whole arrays, N_INIT restarts keeping the tightest
+result. k is chosen so that a ring gets about ring_size stops; a cluster that
+still ends up with more than MAX_OVERSIZE x ring_size stops is split again, one
+with fewer than MIN_SHARE x ring_size joins the nearest cluster that has room.
+
+    rings = propose(orders, ring_size=12, start=(59.39, 24.72))
+    rings[0]["order_ids"]   # in driving order from start (ring_optimizer)
+    rings[0]["radius_km"], rings[0]["km"]
+
+Proposals are sorted by distance from start (nearest first). app.py accepts a
+proposal as a ring with repository.insert_ring (one bulk insert). Plain module
+(no Streamlit import).
+"""
+import math
+
+import numpy as np
+
+import ring_optimizer
+import travel_matrix
+
+RING_SIZE = 12
+N_INIT = 4
+MAX_ITER = 50
+MAX_OVERSIZE = 1.5
+MIN_SHARE = 0.4
+
+
+def _project(coords: np.ndarray) -> np.ndarray:
+    """(lat, lon) degrees -> (x, y) km on a plane through the points' mean latitude."""
+    lat0 = np.radians(coords[:, 0].mean())
+    k = math.pi / 180 * travel_matrix.EARTH_KM
+    return np.column_stack((coords[:, 1] * k * np.cos(lat0), coords[:, 0] * k))
+
+
+def _sq_dist(xy: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    return ((xy[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+
+
+def _seed(xy: np.ndarray, k: int, rnd: np.random.Generator) -> np.ndarray:
+    """k-means++: each next center drawn with probability ~ squared distance to the nearest one."""
+    centers = [xy[rnd.integers(len(xy))]]
+    d2 = ((xy - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = d2.sum()
+        nxt = xy[rnd.choice(len(xy), p=d2 / total)] if total > 0 else xy[rnd.integers(len(xy))]
+        centers.append(nxt)
+        d2 = np.minimum(d2, ((xy - nxt) ** 2).sum(axis=1))
+    return np.array(centers)
+
+
+def kmeans(xy: np.ndarray, k: int, seed: int = 0, n_init: int = N_INIT, max_iter: int = MAX_ITER):
+    """(labels, centers, inertia) of the best of n_init runs."""
+    k = max(1, min(int(k), len(xy)))
+    rnd = np.random.default_rng(seed)
+    best = None
+    for _ in range(n_init):
+        centers = _seed(xy, k, rnd)
+        labels = None
+        for _ in range(max_iter):
+            d2 = _sq_dist(xy, centers)
+            new_labels = d2.argmin(axis=1)
+            if labels is not None and np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            counts = np.bincount(labels, minlength=k)
+            sums = np.zeros_like(centers)
+            np.add.at(sums, labels, xy)
+            empty = counts == 0
+            centers = np.where(empty[:, None], centers, sums / np.maximum(counts, 1)[:, None])
+            if empty.any():
+                # Re-seed an empty cluster at the point farthest from its center
+                far = d2[np.arange(len(xy)), labels].argmax()
+                centers[np.flatnonzero(empty)[0]] = xy[far]
+        inertia = float(_sq_dist(xy, centers)[np.arange(len(xy)), labels].sum())
+        if best is None or inertia < best[2]:
+            best = (labels, centers, inertia)
+    return best
+
+
+def _groups(xy: np.ndarray, idx: np.ndarray, ring_size: int, seed: int) -> list:
+    """Index arrays of the clusters of xy[idx], oversized ones split again."""
+    k = max(1, math.ceil(len(idx) / ring_size))
+    if k == 1:
+        return [idx]
+    labels, _centers, _inertia = kmeans(xy[idx], k, seed=seed)
+    out = []
+    for c in range(k):
+        members = idx[labels == c]
+        if not len(members):
+            continue
+        if len(members) > MAX_OVERSIZE * ring_size and len(members) < len(idx):
+            out.extend(_groups(xy, members, ring_size, seed + 1))
+        else:
+            out.append(members)
+    return out
+
+
+def _merge_small(xy: np.ndarray, groups: list, ring_size: int) -> list:
+    groups = sorted(groups, key=len)
+    limit = MAX_OVERSIZE * ring_size
+    n = 0
+    while n < len(groups):
+        g = groups[n]
+        if len(g) >= MIN_SHARE * ring_size or len(groups) == 1:
+            n += 1
+            continue
+        center = xy[g].mean(axis=0)
+        others = [(float(((xy[o].mean(axis=0) - center) ** 2).sum()), m) for m, o in enumerate(groups)
+                  if m != n and len(o) + len(g) <= limit]
+        if not others:
+            n += 1
+            continue
+        _d, m = min(others)
+        groups[m] = np.concatenate((groups[m], g))
+        del groups[n]
+        groups.sort(key=len)
+        n = 0
+    return groups
+
+
+def propose(orders, ring_size: int = RING_SIZE, start=None, seed: int = 0) -> list:
+    """Ring proposals for order rows (id, lat, lon); orders without coordinates are left out."""
+    located = [(int(o["id"]), c) for o in orders if (c := ring_optimizer.row_coords(o)) is not None]
+    if not located:
+        return []
+    ring_size = max(2, int(ring_size))
+    ids = np.array([oid for oid, _c in located])
+    coords = np.array([c for _oid, c in located], dtype=np.float64)
+    xy = _project(coords)
+
+    rings = []
+    for members in _merge_small(xy, _groups(xy, np.arange(len(ids)), ring_size, seed), ring_size):
+        pts = coords[members]
+        center = pts.mean(axis=0)
+        radius = float(np.sqrt(((xy[members] - xy[members].mean(axis=0)) ** 2).sum(axis=1)).max())
+        first = [tuple(start)] if start else []
+        d = travel_matrix.pairwise_km(first + [tuple(p) for p in pts]).tolist()
+        path = ring_optimizer.solve(d, closed=False, time_budget=0.05)
+        stops = [n - 1 for n in path[1:]] if first else path
+        rings.append({
+            "order_ids": [int(ids[members[n]]) for n in stops],
+            "center": (float(center[0]), float(center[1])),
+            "radius_km": radius,
+            "km": ring_optimizer.path_length(path, d, False),
+            "from_start_km": float(travel_matrix.pairwise_km([first[0], tuple(center)])[0, 1]) if first else 0.0,
+        })
+    rings.sort(key=lambda r: (r["from_start_km"], -len(r["order_ids"])))
+    return rings
@@ -0,0 +1,183 @@
+"""Projected arrival times and time-window checks for a ring, cached per ring version.
+
+Stops are driven in ring order from the start point, leaving at the day start
+(eta_day_start setting). Per stop:
+
+    arrival = previous departure + drive time (travel_matrix minutes; UNKNOWN_LEG_MIN
+              when either end has no coordinates)
+    begin   = max(arrival, window start)           # waiting if early
+    depart  = begin + service minutes (auto_assign workload: pieces + Paigaldus / Utiil)
+    late    = arrival - window end, when positive  # a window violation
+    slack   = window end - arrival, when not late
+
+delivery_window is free text ("10:00-12:00", "10-12", "kl 10.00–12.00", "enne 12",
+"pärast 14"); parse_window() turns it into minutes after midnight. A single
+time means "around then" (SINGLE_TIME_MIN window).
+
+CACHE keeps the last result per ring (the caller's key; app.py uses route,
+date, crew and ring_no) with the per-stop inputs it was computed from (ri_id,
+row version, window, service and drive minutes). A request whose inputs share
+a prefix with the cached ones reuses the stops of that prefix and recomputes
+only from the first changed stop, so moving one stop recomputes the ring from
+its old or new position, whichever is earlier; an unchanged ring is a cache hit.
+
+Plain module (no Streamlit import).
+"""
+import re
+import threading
+from collections import OrderedDict
+
+import auto_assign
+import travel_matrix
+
+DAY_START_KEY = "eta_day_start"
+DEFAULT_DAY_START = "08:00"
+UNKNOWN_LEG_MIN = 15.0
+SINGLE_TIME_MIN = 60
+MAX_RINGS_CACHED = 256
+
+# A time, not part of a date ("18.10.2026") or a longer number
+_TIME_RE = re.compile(r"(?<![\d.:])(\d{1,2})(?:[:.](\d{2}))?(?![\d]|[.:]\d)")
+_BEFORE = ("enne", "kuni", "before", "until", "hiljemalt")
+_AFTER = ("pärast", "parast", "alates", "after", "from")
+
+
+def parse_time(text: str):
+    """Minutes after midnight of "HH:MM" / "HH.MM" / "HH", None if not a time."""
+    m = _TIME_RE.search(text or "")
+    if not m:
+        return None
+    hh, mm = int(m.group(1)), int(m.group(2) or 0)
+    return hh * 60 + mm if 0 <= hh <= 23 and 0 <= mm <= 59 else None
+
+
+def parse_window(text: str):
+    """(start, end) in minutes after midnight, either may be None; None if no time in text."""
+    t = (text or "").strip().lower().replace("–", "-").replace("—", "-")
+    times = []
+    for m in _TIME_RE.finditer(t):
+        hh, mm = int(m.group(1)), int(m.group(2) or 0)
+        if 0 <= hh <= 23 and 0 <= mm <= 59:
+            times.append(hh * 60 + mm)
+    if not times:
+        return None
+    if len(times) >= 2:
+        return times[0], times[1] if times[1] > times[0] else None
+    if any(w in t for w in _BEFORE):
+        return None, times[0]
+    if any(w in t for w in _AFTER):
+        return times[0], None
+    return times[0], times[0] + SINGLE_TIME_MIN
+
+
+def fmt(minutes) -> str:
+    if minutes is None:
+        return "—"
+    minutes = int(round(minutes))
+    return f"{minutes // 60 % 24:02d}:{minutes % 60:02d}" + (" (+1)" if minutes >= 24 * 60 else "")
+
+
+class StopEta:
+    __slots__ = ("ri_id", "arrival", "begin", "depart", "wait", "late", "slack", "window", "drive_min",
+                 "service_min", "located")
+
+    def __init__(self, ri_id, arrival, begin, depart, window, drive_min, service_min, located):
+        self.ri_id = ri_id
+        self.arrival, self.begin, self.depart = arrival, begin, depart
+        self.window = window
+        self.wait = begin - arrival
+        end = window[1] if window else None
+        self.late = max(0.0, arrival - end) if end is not None else 0.0
+        self.slack = (end - arrival) if end is not None and arrival <= end else None
+        self.drive_min, self.service_min, self.located = drive_min, service_min, located
+
+
+def _run(inputs, depart: float, first: int = 0, done=None) -> list:
+    """StopEtas for inputs[first:], continuing after done[:first]."""
+    out = list(done[:first]) if done else []
+    for ri_id, _version, window, service, drive, located in inputs[first:]:
+        arrival = depart + drive
+        begin = max(arrival, window[0]) if window and window[0] is not None else arrival
+        depart = begin + service
+        out.append(StopEta(ri_id, arrival, begin, depart, window, drive, service, located))
+    return out
+
+
+class EtaCache:
+    """ring key -> (day start, per-stop inputs, StopEtas); prefix reuse on change."""
+
+    def __init__(self, max_rings: int = MAX_RINGS_CACHED):
+        self.max_rings = max_rings
+        self._lock = threading.Lock()
+        self._rings = OrderedDict()
+        self.hits = self.partial = self.full = self.stops_computed = 0
+
+    def compute(self, key, day_start: float, inputs: list) -> list:
+        with self._lock:
+            cached = self._rings.get(key)
+        first = 0
+        if cached is not None and cached[0] == day_start:
+            old = cached[1]
+            while first < min(len(old), len(inputs)) and old[first] == inputs[first]:
+                first += 1
+            if first == len(old) == len(inputs):
+                with self._lock:
+                    self.hits += 1
+                    self._rings.move_to_end(key)
+                return cached[2]
+        done = cached[2] if first else None
+        depart = done[first - 1].depart if first else day_start
+        stops = _run(inputs, depart, first, done)
+        with self._lock:
+            if first:
+                self.partial += 1
+            else:
+                self.full += 1
+            self.stops_computed += len(inputs) - first
+            self._rings[key] = (day_start, inputs, stops)
+            self._rings.move_to_end(key)
+            while len(self._rings) > self.max_rings:
+                self._rings.popitem(last=False)
+        return stops
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rings": len(self._rings), "hits": self.hits, "partial": self.partial, "full": self.full,
+                    "stops_computed": self.stops_computed}
+
+
+CACHE = EtaCache()
+
+
+def ring_eta(ring_key, rows, matrix, start=None, service_min=None,
+             day_start: float | None = None, return_to_start: bool = False, cache: EtaCache | None = None) -> dict:
+    """ETAs for a ring's rows (in ring order).
+
+    matrix: the route date's travel_matrix.Matrix; start: (lat, lon) or None
+    (then the day starts at the first stop); service_min: {ri_id: minutes}
+    (auto_assign workloads, STOP_MIN for stops not in it).
+    """
+    service_min = service_min or {}
+    day_start = parse_time(DEFAULT_DAY_START) if day_start is None else day_start
+    keys = [int(r["ri_id"]) for r in rows]
+    path = ([travel_matrix.start_key(start)] if start else []) + keys
+    legs = matrix.leg_minutes(path, default=UNKNOWN_LEG_MIN) if len(path) > 1 else []
+    if not start:
+        legs = [0.0] + list(legs)
+    inputs = [
+        (ri_id, r.get("version"), parse_window(r.get("delivery_window") or ""),
+         float(service_min.get(ri_id, auto_assign.STOP_MIN)), round(float(legs[n]), 3), ri_id in matrix)
+        for n, (ri_id, r) in enumerate(zip(keys, rows))
+    ]
+    stops = (cache or CACHE).compute(ring_key, float(day_start), inputs)
+    back = None
+    if return_to_start and start and stops:
+        back = stops[-1].depart + matrix.leg_minutes([keys[-1], path[0]], default=UNKNOWN_LEG_MIN)[0]
+    return {
+        "stops": {s.ri_id: s for s in stops},
+        "end": back if back is not None else (stops[-1].depart if stops else day_start),
+        "drive_min": sum(s.drive_min for s in stops) + ((back - stops[-1].depart) if back is not None else 0.0),
+        "wait_min": sum(s.wait for s in stops),
+        "late": [s.ri_id for s in stops if s.late > 0],
+        "unlocated": [s.ri_id for s in stops if not s.located],
+    }
@@ -0,0 +1,197 @@
+"""Stop sequencing for one ring: nearest neighbour + 2-opt / Or-opt.
+
+The ring starts at the configured start point (node 0) and either ends at its
+last stop or, with return_to_start, drives back to the start. Distances are
+kilometres between the orders' lat/lon: taken from the route date's
+travel_matrix.Matrix when one is passed (road km, shared with the other rings),
+else great-circle km cached per set of points, so re-optimizing an unchanged
+ring (or trying the other return-to-start mode) costs no distance work.
+
+    plan = optimize_ring(rows, start=(59.39, 24.72), return_to_start=False, matrix=day_matrix)
+    plan["order"]         # ri_ids in the new order (stops without coordinates last)
+    plan["before_km"], plan["after_km"]
+
+Stops without coordinates keep their relative order at the end of the ring.
+Without start coordinates the ring's current first stop stays first.
+
+Plain module (no Streamlit import); app.py writes plan["order"] back with
+repository.apply_ring_order (one transaction).
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import travel_matrix
+
+MATRIX_CACHE_SIZE = 64
+TIME_BUDGET_S = 0.5
+
+_cache_lock = threading.Lock()
+_matrix_cache = OrderedDict()   # tuple of rounded points -> matrix
+_COORDS_RE = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*[,; ]\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
+
+def parse_coords(text: str):
+    """(lat, lon) from "59.437, 24.745" (also ';' or space separated), else None."""
+    m = _COORDS_RE.match(text or "")
+    if not m:
+        return None
+    lat, lon = float(m.group(1)), float(m.group(2))
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
+        return lat, lon
+    return None
+
+
+def row_coords(row):
+    """(lat, lon) of a listing row / order dict, None when not geocoded."""
+    lat, lon = row.get("lat"), row.get("lon")
+    if lat is None or lon is None or lat == "" or lon == "":
+        return None
+    return float(lat), float(lon)
+
+
+def distance_matrix(points) -> list:
+    """Symmetric km matrix (list of lists) for points, cached by their rounded coordinates."""
+    key = tuple((round(p[0], 6), round(p[1], 6)) for p in points)
+    with _cache_lock:
+        m = _matrix_cache.get(key)
+        if m is not None:
+            _matrix_cache.move_to_end(key)
+            return m
+    m = travel_matrix.pairwise_km(key).tolist()   # lists: solve() indexes single cells
+    with _cache_lock:
+        _matrix_cache[key] = m
+        while len(_matrix_cache) > MATRIX_CACHE_SIZE:
+            _matrix_cache.popitem(last=False)
+    return m
+
+
+def path_length(path: list, d, closed: bool) -> float:
+    total = sum(d[path[k]][path[k + 1]] for k in range(len(path) - 1))
+    if closed and len(path) > 1:
+        total += d[path[-1]][path[0]]
+    return total
+
+
+def _nearest_neighbour(d, n: int) -> list:
+    path, left = [0], set(range(1, n))
+    while left:
+        last = path[-1]
+        nxt = min(left, key=lambda j: d[last][j])
+        path.append(nxt)
+        left.remove(nxt)
+    return path
+
+
+def _two_opt(path: list, d, closed: bool, deadline: float) -> bool:
+    """One sweep of 2-opt (reverse path[i..j]); node 0 stays first. True if anything improved."""
+    n = len(path)
+    improved = False
+    for i in range(1, n - 1):
+        a, b = path[i - 1], path[i]
+        for j in range(i + 1, n):
+            c = path[j]
+            if j + 1 < n:
+                e = path[j + 1]
+                delta = d[a][c] + d[b][e] - d[a][b] - d[c][e]
+            elif closed:
+                delta = d[a][c] + d[b][path[0]] - d[a][b] - d[c][path[0]]
+            else:
+                delta = d[a][c] - d[a][b]
+            if delta < -1e-9:
+                path[i:j + 1] = reversed(path[i:j + 1])
+                improved = True
+                b = path[i]
+        if time.perf_counter() > deadline:
+            break
+    return improved
+
+
+def _or_opt(path: list, d, closed: bool, deadline: float) -> bool:
+    """Move segments of 1-3 stops elsewhere (kept or reversed). True if anything improved."""
+    improved = False
+    for seg_len in (1, 2, 3):
+        i = 1
+        while i + seg_len <= len(path):
+            n = len(path)
+            seg = path[i:i + seg_len]
+            prev = path[i - 1]
+            nxt = path[i + seg_len] if i + seg_len < n else (path[0] if closed else None)
+            removed_gain = d[prev][seg[0]] + (d[seg[-1]][nxt] if nxt is not None else 0.0)
+            removed_gain -= d[prev][nxt] if nxt is not None else 0.0
+            rest = path[:i] + path[i + seg_len:]
+            best = None
+            for k in range(len(rest)):
+                p = rest[k]
+                q = rest[k + 1] if k + 1 < len(rest) else (rest[0] if closed else None)
+                if k == i - 1:
+                    continue
+                for cand in (seg, seg[::-1]):
+                    add = d[p][cand[0]] + (d[cand[-1]][q] - d[p][q] if q is not None else 0.0)
+                    if add - removed_gain < -1e-9 and (best is None or add - removed_gain < best[0]):
+                        best = (add - removed_gain, k, cand)
+            if best is not None:
+                _gain, k, cand = best
+                path[:] = rest[:k + 1] + list(cand) + rest[k + 1:]
+                improved = True
+            else:
+                i += 1
+            if time.perf_counter() > deadline:
+                return improved
+    return improved
+
+
+def solve(d, closed: bool, time_budget: float = TIME_BUDGET_S) -> list:
+    """Node order starting at 0 for matrix d: nearest neighbour, then 2-opt / Or-opt until no gain."""
+    n = len(d)
+    if n <= 2:
+        return list(range(n))
+    deadline = time.perf_counter() + time_budget
+    path = _nearest_neighbour(d, n)
+    while time.perf_counter() < deadline:
+        changed = _two_opt(path, d, closed, deadline)
+        changed = _or_opt(path, d, closed, deadline) or changed
+        if not changed:
+            break
+    return path
+
+
+def optimize_ring(rows, start=None, return_to_start: bool = False, time_budget: float = TIME_BUDGET_S,
+                  matrix=None) -> dict:
+    """New stop order for a ring's rows (current order in, ri_ids out) and the km before / after.
+
+    matrix: the route date's travel_matrix.Matrix (must hold the start point and the ring's stops).
+    """
+    located = [(int(r["ri_id"]), row_coords(r)) for r in rows]
+    missing = [ri for ri, c in located if c is None]
+    located = [(ri, c) for ri, c in located if c is not None]
+    fixed_first = []
+    if start is None and located:
+        (first_ri, start), located = located[0], located[1:]
+        fixed_first = [first_ri]
+    if not located:
+        order = fixed_first + [ri for ri, _c in located] + missing
+        return {"order": order, "before_km": 0.0, "after_km": 0.0, "missing": missing,
+                "changed": order != [int(r["ri_id"]) for r in rows]}
+
+    start_key = fixed_first[0] if fixed_first else travel_matrix.start_key(start)
+    keys = [start_key] + [ri for ri, _c in located]
+    if matrix is not None and all(k in matrix for k in keys):
+        d = matrix.sub_km(keys).tolist()
+    else:
+        d = distance_matrix([start] + [c for _ri, c in located])
+    closed = bool(return_to_start)
+    current = list(range(len(d)))
+    path = solve(d, closed, time_budget)
+    before, after = path_length(current, d, closed), path_length(path, d, closed)
+    if after >= before - 1e-9:
+        path, after = current, before
+    order = fixed_first + [located[k - 1][0] for k in path[1:]] + missing
+    return {
+        "order": order,
+        "before_km": before,
+        "after_km": after,
+        "missing": missing,
+        "changed": order != [int(r["ri_id"]) for r in rows],
+    }
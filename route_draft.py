@@ -0,0 +1,242 @@
+"""What-if drafts of a route: edit the rings in memory, commit every edit at once.
+
+Planner buttons write to route_items right away (one transaction and one rerun
+per click). A Draft instead takes the route's OPEN stops once (the base) and
+keeps the edits on top of it: added orders, removed stops, ring and worker
+changes, and the stop order. The base is shared and never mutated: an edit
+replaces only the Stop entries it touches (copy on write), so a draft costs
+one dict and one list per route, and discarding it is just dropping it.
+
+Stops are keyed by order_id (an order is on a route once). A planner ring is
+(delivery date, workers, ring_no); the order inside a ring is the draft's
+route-wide order filtered to that ring, like (ring_no, seq) in the database.
+
+    d = Draft.from_rows(route_id, list_route_items(route_id), {ri_id: user_ids})
+    d.add(order_row, ring_no=2, user_ids=(3, 5))
+    d.reassign(order_id, ring_no=1)            # to the end of ring 1
+    d.reassign(order_id, user_ids=(3,))        # other workers
+    d.move_up(order_id); d.remove(order_id)
+    d.diff()                                   # what changed, for review
+    repo.commit_route_draft(route_id, d.plan())
+
+plan() holds the writes (removes, assigns, the final order of every stop) and
+the version each touched base stop had. commit_route_draft() applies it in one
+transaction and raises repository.VersionConflict, writing nothing, when
+any of those stops changed in the meantime, an untouched stop left the
+route, or an added order got onto the route some other way.
+
+Plain module (no Streamlit import).
+"""
+from collections import namedtuple
+
+import ring_eta
+
+# row: the listing row as a dict (ri_id is -order_id for added orders, see rows())
+Stop = namedtuple("Stop", "order_id ri_id version ring_no user_ids date row")
+
+# Draft ETAs are kept apart from the live rings' cache (ring_eta.CACHE)
+ETA_CACHE = ring_eta.EtaCache(max_rings=64)
+
+
+def _users(user_ids) -> tuple:
+    return tuple(sorted({int(u) for u in user_ids or ()}))
+
+
+def group_of(stop: Stop) -> tuple:
+    """(date, user_ids, ring_no): one ring of the planner."""
+    return stop.date, stop.user_ids, stop.ring_no
+
+
+class Draft:
+    """Copy-on-write edits over a route's OPEN stops (see module docstring)."""
+
+    def __init__(self, route_id: int, base: dict, order: list):
+        self.route_id = int(route_id)
+        self.base = base                  # order_id -> Stop, shared, never mutated
+        self.base_order = tuple(order)
+        self.stops = base                 # copied on the first edit
+        self.order = list(order)
+
+    @classmethod
+    def from_rows(cls, route_id: int, rows, user_ids: dict, route_date: str = ""):
+        """Base of a draft from the route listing (OPEN rows) and {ri_id: user_ids}."""
+        rows = [r for r in rows if (r.get("worker_status") or "OPEN").upper() == "OPEN"]
+        rows.sort(key=lambda r: (int(r.get("ring_no") or 1), int(r.get("seq") or 0)))
+        base = {}
+        for r in rows:
+            oid = int(r["order_id"])
+            if oid in base:
+                continue
+            base[oid] = Stop(oid, int(r["ri_id"]), r.get("version"), int(r.get("ring_no") or 1),
+                             _users(user_ids.get(int(r["ri_id"]))),
+                             (r.get("delivery_date") or "").strip() or route_date, dict(r))
+        return cls(route_id, base, list(base))
+
+    # ---- edits ----
+    def _own(self):
+        if self.stops is self.base:
+            self.stops = dict(self.base)
+
+    def add(self, row, ring_no: int, user_ids, route_date: str = "") -> bool:
+        """Put an order (listing row of list_orders) at the end of a ring; False if already in the draft."""
+        oid = int(row.get("order_id") or row["id"])
+        if oid in self.stops:
+            return False
+        self._own()
+        was = self.base.get(oid)
+        if was is not None:
+            # Removed earlier in this draft: back on its own route item
+            self.stops[oid] = was._replace(ring_no=int(ring_no), user_ids=_users(user_ids))
+        else:
+            r = dict(row)
+            r.update(order_id=oid, ri_id=-oid, version=None, worker_status="OPEN")
+            date = (r.get("delivery_date") or "").strip() or route_date
+            self.stops[oid] = Stop(oid, None, None, int(ring_no), _users(user_ids), date, r)
+        self.order.append(oid)
+        return True
+
+    def remove(self, order_id: int) -> bool:
+        oid = int(order_id)
+        if oid not in self.stops:
+            return False
+        self._own()
+        del self.stops[oid]
+        self.order.remove(oid)
+        return True
+
+    def reassign(self, order_id: int, ring_no: int | None = None, user_ids=None) -> bool:
+        """Other ring and / or workers; the stop goes to the end of the ring it lands in."""
+        oid = int(order_id)
+        s = self.stops.get(oid)
+        if s is None:
+            return False
+        new = s._replace(ring_no=s.ring_no if ring_no is None else int(ring_no),
+                         user_ids=s.user_ids if user_ids is None else _users(user_ids))
+        if new == s:
+            return False
+        self._own()
+        self.stops[oid] = new
+        self.order.remove(oid)
+        self.order.append(oid)
+        return True
+
+    def reorder(self, order_ids) -> bool:
+        """Put stops of one ring in the given order on the places they hold (route_order.apply_ring_order)."""
+        wanted = [int(o) for o in order_ids if int(o) in self.stops]
+        slots = sorted(self.order.index(o) for o in wanted)
+        if [self.order[n] for n in slots] == wanted:
+            return False
+        self._own()
+        for n, oid in zip(slots, wanted):
+            self.order[n] = oid
+        return True
+
+    def move_up(self, order_id: int) -> bool:
+        """Swap a stop with the one before it in its ring."""
+        oid = int(order_id)
+        if oid not in self.stops:
+            return False
+        ring = [o for o in self.order if group_of(self.stops[o]) == group_of(self.stops[oid])]
+        n = ring.index(oid)
+        if n == 0:
+            return False
+        ring[n - 1], ring[n] = ring[n], ring[n - 1]
+        return self.reorder(ring)
+
+    # ---- reading ----
+    def groups(self, base: bool = False) -> dict:
+        """{(date, user_ids, ring_no): [Stop, ...]} in ring order, of the draft (or of the base)."""
+        stops, order = (self.base, self.base_order) if base else (self.stops, self.order)
+        out = {}
+        for oid in order:
+            s = stops[oid]
+            out.setdefault(group_of(s), []).append(s)
+        return out
+
+    @staticmethod
+    def rows(stops) -> list:
+        """Listing-like rows of stops (ring_no as drafted) for ETAs."""
+        out = []
+        for s in stops:
+            r = dict(s.row)
+            r["ring_no"] = s.ring_no
+            out.append(r)
+        return out
+
+    def changed_groups(self) -> list:
+        """Rings whose stops or stop order differ from the base."""
+        now, was = self.groups(), self.groups(base=True)
+        return [g for g in dict.fromkeys([*was, *now])
+                if [s.order_id for s in now.get(g, [])] != [s.order_id for s in was.get(g, [])]]
+
+    def diff(self) -> list:
+        """Changes against the base: dicts with op (add / remove / ring / workers / order) and order_id or group."""
+        out = []
+        for oid in self.order:
+            s, b = self.stops[oid], self.base.get(oid)
+            if b is None:
+                out.append({"op": "add", "order_id": oid, "to": group_of(s)})
+                continue
+            if s.ring_no != b.ring_no:
+                out.append({"op": "ring", "order_id": oid, "from": b.ring_no, "to": s.ring_no})
+            if s.user_ids != b.user_ids:
+                out.append({"op": "workers", "order_id": oid, "from": b.user_ids, "to": s.user_ids})
+        out += [{"op": "remove", "order_id": oid, "from": group_of(self.base[oid])}
+                for oid in self.base_order if oid not in self.stops]
+        now, was = self.groups(), self.groups(base=True)
+        for g, stops in now.items():
+            # Stops that stayed in the ring: same relative order?
+            kept = [s.order_id for s in was.get(g, []) if s.order_id in self.stops and group_of(self.stops[s.order_id]) == g]
+            drafted = [s.order_id for s in stops if s.order_id in kept]
+            moved = sum(1 for a, b in zip(kept, drafted) if a != b)
+            if moved:
+                out.append({"op": "order", "group": g, "moved": moved})
+        return out
+
+    def plan(self) -> dict:
+        """Writes for repository.commit_route_draft().
+
+        remove: ri_ids; assign: [(order_id, user_ids, ring_no)] for added orders
+        and stops with another ring or workers; new: order_ids that must still be
+        off the route; order: every draft stop's order_id in route order;
+        expected: {ri_id: version} of every base stop removed, reassigned or in
+        a ring whose stops or order changed; kept: {ri_id: version} of the other
+        base stops, which must only still be on the route.
+        """
+        changed = set(self.changed_groups())
+        remove = [self.base[oid].ri_id for oid in self.base_order if oid not in self.stops]
+        assign, new, expected = [], [], {}
+        for oid in self.order:
+            s, b = self.stops[oid], self.base.get(oid)
+            if b is None:
+                new.append(oid)
+                assign.append((oid, list(s.user_ids), s.ring_no))
+                continue
+            if (s.ring_no, s.user_ids) != (b.ring_no, b.user_ids):
+                assign.append((oid, list(s.user_ids), s.ring_no))
+            if (s.ring_no, s.user_ids) != (b.ring_no, b.user_ids) or group_of(s) in changed:
+                expected[b.ri_id] = b.version
+        for oid in self.base_order:
+            b = self.base[oid]
+            if oid not in self.stops or group_of(b) in changed:
+                expected[b.ri_id] = b.version
+        kept = {self.base[oid].ri_id: self.base[oid].version for oid in self.order
+                if oid in self.base and self.base[oid].ri_id not in expected}
+        return {"remove": remove, "assign": assign, "new": new, "order": list(self.order), "expected": expected,
+                "kept": kept}
+
+
+def eta_impact(draft: Draft, etas) -> list:
+    """Per changed ring: (group, base ETA, draft ETA), either None when the ring is new / emptied.
+
+    etas(key, group, rows) computes one ring (ring_eta.ring_eta with the
+    caller's matrix, start and service minutes, cache=ETA_CACHE); key keeps
+    base and draft apart in the cache.
+    """
+    now, was = draft.groups(), draft.groups(base=True)
+    out = []
+    for g in draft.changed_groups():
+        before = etas(("base", draft.route_id, g), g, Draft.rows(was[g])) if g in was else None
+        after = etas(("draft", draft.route_id, g), g, Draft.rows(now[g])) if g in now else None
+        out.append((g, before, after))
+    return out
@@ -0,0 +1,158 @@
+"""Stop ordering inside a route: sparse integer ranks in route_items.seq.
+
+seq stays an INTEGER and UNIQUE(route_id, seq) is kept, but new stops are
+appended SEQ_GAP apart, so moving a stop anywhere is one UPDATE to a free value
+between its new neighbours. Planner order is (ring_no, seq); stops of other rings
+may sit in between, they only matter for uniqueness.
+
+When two neighbours have no free value left the route is compacted (renumbered
+SEQ_GAP apart in planner order) and the move retried; compaction also runs
+whenever a route's ranks get within SEQ_GAP of the top of the 32-bit range.
+
+All functions take a cursor and leave the transaction to the caller
+(repository.SqliteRepository runs them inside readcache.tracked_write).
+"""
+
+SEQ_GAP = 1024
+SEQ_MAX = 2 ** 31 - 1
+
+
+def next_seq(cur, route_id: int) -> int:
+    """seq for a stop appended to the end of the route."""
+    cur.execute("SELECT COALESCE(MAX(seq), 0) FROM route_items WHERE route_id=?", (int(route_id),))
+    last = int(cur.fetchone()[0] or 0)
+    if last + SEQ_GAP > SEQ_MAX:
+        compact_route(cur, route_id)
+        return next_seq(cur, route_id)
+    return (last // SEQ_GAP + 1) * SEQ_GAP
+
+
+def next_seqs(cur, route_id: int, n: int) -> list:
+    """n ascending seqs for stops appended to the end of the route (one bulk insert)."""
+    first = next_seq(cur, route_id)
+    if first + (n - 1) * SEQ_GAP > SEQ_MAX:
+        compact_route(cur, route_id)
+        first = next_seq(cur, route_id)
+    return [first + k * SEQ_GAP for k in range(n)]
+
+
+def _ring_items(cur, route_id: int, ring_no: int) -> list:
+    cur.execute(
+        "SELECT id, seq FROM route_items WHERE route_id=? AND ring_no=? ORDER BY seq ASC",
+        (int(route_id), int(ring_no)),
+    )
+    return [(int(r[0]), int(r[1])) for r in cur.fetchall()]
+
+
+def _renumber(cur, pairs):
+    """Assign (ri_id, new_seq) pairs without tripping UNIQUE(route_id, seq).
+
+    Ranks are always positive, so a first pass to distinct negatives frees every
+    target value.
+    """
+    pairs = list(pairs)
+    cur.executemany("UPDATE route_items SET seq=? WHERE id=?", [(-(n + 1), ri) for n, (ri, _s) in enumerate(pairs)])
+    cur.executemany("UPDATE route_items SET seq=? WHERE id=?", [(s, ri) for ri, s in pairs])
+
+
+def compact_route(cur, route_id: int) -> int:
+    """Renumber a route SEQ_GAP apart in planner order (ring_no, seq). Returns the stop count."""
+    cur.execute(
+        "SELECT id FROM route_items WHERE route_id=? ORDER BY ring_no ASC, seq ASC",
+        (int(route_id),),
+    )
+    ids = [int(r[0]) for r in cur.fetchall()]
+    _renumber(cur, [(ri, (n + 1) * SEQ_GAP) for n, ri in enumerate(ids)])
+    return len(ids)
+
+
+def _free_between(cur, route_id: int, lo: int, hi: int):
+    """A seq strictly between lo and hi not used by another stop of the route, else None."""
+    if hi - lo < 2:
+        return None
+    mid = (lo + hi) // 2
+    cur.execute(
+        "SELECT seq FROM route_items WHERE route_id=? AND seq > ? AND seq < ? ORDER BY seq",
+        (int(route_id), lo, hi),
+    )
+    used = {int(r[0]) for r in cur.fetchall()}
+    if mid not in used:
+        return mid
+    # Legacy interleaved rings: take the free value closest to the middle.
+    for d in range(1, hi - lo):
+        for cand in (mid - d, mid + d):
+            if lo < cand < hi and cand not in used:
+                return cand
+    return None
+
+
+def _target_seq(cur, route_id: int, ring_no: int, ri_id: int, position: int):
+    others = [(i, s) for i, s in _ring_items(cur, route_id, ring_no) if i != ri_id]
+    if not others:
+        return None
+    position = max(1, min(int(position), len(others) + 1))
+    prev = others[position - 2][1] if position > 1 else None
+    nxt = others[position - 1][1] if position <= len(others) else None
+    if prev is None:
+        cur.execute("SELECT COALESCE(MAX(seq), 0) FROM route_items WHERE route_id=? AND seq < ?", (int(route_id), nxt))
+        prev = max(int(cur.fetchone()[0] or 0), 0)
+    if nxt is None:
+        cur.execute("SELECT MIN(seq) FROM route_items WHERE route_id=? AND seq > ?", (int(route_id), prev))
+        row = cur.fetchone()
+        nxt = int(row[0]) if row and row[0] is not None else min(prev + 2 * SEQ_GAP, SEQ_MAX)
+    return _free_between(cur, route_id, prev, nxt)
+
+
+def move_to_position(cur, ri_id: int, position: int) -> bool:
+    """Move a stop to a 1-based position within its ring (one UPDATE unless a compaction is due)."""
+    cur.execute("SELECT route_id, ring_no FROM route_items WHERE id=?", (int(ri_id),))
+    row = cur.fetchone()
+    if not row:
+        return False
+    route_id, ring_no = int(row[0]), int(row[1] or 1)
+    ring = _ring_items(cur, route_id, ring_no)
+    current = next((n for n, (i, _s) in enumerate(ring, start=1) if i == int(ri_id)), None)
+    position = max(1, min(int(position), len(ring)))
+    if current is None or position == current:
+        return False
+
+    new_seq = _target_seq(cur, route_id, ring_no, int(ri_id), position)
+    if new_seq is None:
+        compact_route(cur, route_id)
+        new_seq = _target_seq(cur, route_id, ring_no, int(ri_id), position)
+        if new_seq is None:
+            return False
+    cur.execute("UPDATE route_items SET seq=? WHERE id=?", (new_seq, int(ri_id)))
+    return True
+
+
+def move_next_to(cur, ri_id: int, anchor_ri_id: int, after: bool = False) -> bool:
+    """Move a stop right before (or after) another stop of the same ring."""
+    cur.execute("SELECT id, route_id, ring_no FROM route_items WHERE id IN (?, ?)", (int(ri_id), int(anchor_ri_id)))
+    rows = {int(r[0]): (int(r[1]), int(r[2] or 1)) for r in cur.fetchall()}
+    if len(rows) != 2 or rows[int(ri_id)] != rows[int(anchor_ri_id)]:
+        return False
+    route_id, ring_no = rows[int(anchor_ri_id)]
+    others = [i for i, _s in _ring_items(cur, route_id, ring_no) if i != int(ri_id)]
+    position = others.index(int(anchor_ri_id)) + 1 + (1 if after else 0)
+    return move_to_position(cur, ri_id, position)
+
+
+def apply_ring_order(cur, route_id: int, ring_no: int, ri_ids) -> int:
+    """Rewrite the order of a ring (or of a subset of its stops) in bulk.
+
+    The listed stops are put in the given order on the seq slots they already
+    occupy, so every other stop (other rings, other teams in the ring) keeps its
+    place. Returns how many stops changed position.
+    """
+    current = dict(_ring_items(cur, route_id, ring_no))
+    order = []
+    for ri in ri_ids or []:
+        ri = int(ri)
+        if ri in current and ri not in order:
+            order.append(ri)
+    slots = sorted(current[ri] for ri in order)
+    changed = [(ri, slot) for ri, slot in zip(order, slots) if current[ri] != slot]
+    if changed:
+        _renumber(cur, changed)
+    return len(changed)
@@ -0,0 +1,263 @@
+"""Lean row types for route item listings.
+
+The planner, worker and orders views draw one summary line per stop or order. The heavy order
+columns (items, notes, PDF path, document author) are only needed once a job is
+expanded, so the listing queries select the summary columns only and the views call
+load_order_details() for the one row that is open.
+
+Plain module (no Streamlit import) so the benchmark and CLI tools can use it.
+"""
+import sqlite3
+
+import archive
+
+
+# Columns every route item listing row carries. Order matters: rows are built positionally.
+SUMMARY_FIELDS = (
+    "ri_id", "route_id", "route_date", "order_id", "seq", "ring_no",
+    "worker_status", "worker_status_reason", "worker_status_note",
+    "worker_status_updated_at", "worker_status_updated_by",
+    "status", "client_name", "recipient_name", "phone", "address", "ship_address",
+    "delivery_date", "delivery_window", "service_tag", "lat", "lon",
+    "worker_names", "version",
+)
+
+# Order listings (Orders tab selectbox, planner quick-add).
+ORDER_SUMMARY_FIELDS = (
+    "id", "original_filename", "status",
+    "client_name", "recipient_name", "phone", "address", "ship_address",
+    "delivery_date", "delivery_window", "service_tag", "lat", "lon",
+    "postal_code", "city", "district",
+)
+
+# Loaded lazily (per expanded row) by load_order_details().
+HEAVY_FIELDS = (
+    "items_compact", "notes", "stored_path", "original_filename", "order_ref",
+    "doc_author", "doc_email", "doc_phone", "created_at",
+)
+
+_ORDER_SUMMARY_SQL = """
+    o.status, o.client_name, o.recipient_name, o.phone, o.address, o.ship_address,
+    o.delivery_date, o.delivery_window, o.service_tag, o.lat, o.lon
+"""
+
+
+class _LeanRow:
+    """Read-only, dict-like row over __slots__.
+
+    Supports row["x"], row.get("x", default), "x" in row and dict(row), so the views
+    can keep treating rows like the dicts they used to be.
+    """
+    __slots__ = ()
+    _fields = ()
+    _field_set = frozenset()
+    _aliases = {}
+
+    def __init__(self, values):
+        for name, value in zip(self._fields, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __getitem__(self, key):
+        key = self._aliases.get(key, key)
+        if key not in self._field_set:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return self._aliases.get(key, key) in self._field_set
+
+    def get(self, key, default=None):
+        key = self._aliases.get(key, key)
+        if key not in self._field_set:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return self._fields
+
+
+class RouteItemRow(_LeanRow):
+    """Summary of one route item + its order. Heavy fields: load_order_details()."""
+    __slots__ = SUMMARY_FIELDS
+    _fields = SUMMARY_FIELDS
+    _field_set = frozenset(SUMMARY_FIELDS)
+    # Old dict rows came from `o.*`, where `id` meant the order id.
+    _aliases = {"id": "order_id"}
+
+    def __repr__(self):
+        return f"RouteItemRow(ri_id={self.ri_id}, order_id={self.order_id}, seq={self.seq})"
+
+
+class OrderRow(_LeanRow):
+    """Summary of one order for listings. Heavy fields: load_order_details()."""
+    __slots__ = ORDER_SUMMARY_FIELDS
+    _fields = ORDER_SUMMARY_FIELDS
+    _field_set = frozenset(ORDER_SUMMARY_FIELDS)
+
+    def __repr__(self):
+        return f"OrderRow(id={self.id}, status={self.status!r})"
+
+
+def _rows(cur) -> list:
+    return [RouteItemRow(tuple(r)) for r in cur.fetchall()]
+
+
+def list_route_items(conn: sqlite3.Connection, route_id: int) -> list:
+    """OPEN items of a route (planner), ordered by seq."""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT
+            ri.id, ri.route_id, NULL, ri.order_id, ri.seq, ri.ring_no,
+            ri.worker_status, ri.worker_status_reason, ri.worker_status_note,
+            ri.worker_status_updated_at, ri.worker_status_updated_by,
+            {_ORDER_SUMMARY_SQL},
+            COALESCE(GROUP_CONCAT(u.name, ', '), ''), ri.version
+        FROM route_items ri
+        JOIN orders o ON o.id=ri.order_id
+        LEFT JOIN route_item_users riu ON riu.ri_id = ri.id
+        LEFT JOIN users u ON u.id = riu.user_id
+        WHERE ri.route_id=? AND UPPER(COALESCE(ri.worker_status,'OPEN'))='OPEN'
+        GROUP BY ri.id
+        ORDER BY ri.seq ASC
+    """, (int(route_id),))
+    return _rows(cur)
+
+
+def list_worker_route_items(conn: sqlite3.Connection, route_id: int, user_id: int) -> list:
+    """Items of one route assigned to a specific worker (via route_item_users)."""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT
+            ri.id, ri.route_id, NULL, ri.order_id, ri.seq, ri.ring_no,
+            ri.worker_status, ri.worker_status_reason, ri.worker_status_note,
+            ri.worker_status_updated_at, ri.worker_status_updated_by,
+            {_ORDER_SUMMARY_SQL},
+            COALESCE(GROUP_CONCAT(u2.name, ', '), ''), ri.version
+        FROM route_item_users riu
+        JOIN route_items ri ON ri.id = riu.ri_id
+        JOIN orders o ON o.id = ri.order_id
+        LEFT JOIN route_item_users riu2 ON riu2.ri_id = ri.id
+        LEFT JOIN users u2 ON u2.id = riu2.user_id
+        WHERE ri.route_id=? AND riu.user_id=?
+        GROUP BY ri.id
+        ORDER BY ri.seq ASC
+    """, (int(route_id), int(user_id)))
+    return _rows(cur)
+
+
+def list_user_route_items(conn: sqlite3.Connection, user_id: int, status: str | None = None,
+                          history: bool = False) -> list:
+    """All route items assigned to a user, newest route date first (history=True: incl. archive)."""
+    status = (status or "").strip().upper()
+    t = archive.table_names(history)
+    params = [int(user_id)]
+    where = "WHERE riu.user_id=?"
+    if status:
+        where += " AND UPPER(COALESCE(ri.worker_status,'OPEN'))=?"
+        params.append(status)
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT
+            ri.id, ri.route_id, r.route_date, ri.order_id, ri.seq, ri.ring_no,
+            ri.worker_status, ri.worker_status_reason, ri.worker_status_note,
+            ri.worker_status_updated_at, ri.worker_status_updated_by,
+            {_ORDER_SUMMARY_SQL},
+            COALESCE(GROUP_CONCAT(u2.name, ', '), ''), ri.version
+        FROM {t["route_item_users"]} riu
+        JOIN {t["route_items"]} ri ON ri.id = riu.ri_id
+        JOIN {t["routes"]} r ON r.id = ri.route_id
+        JOIN {t["orders"]} o ON o.id = ri.order_id
+        LEFT JOIN {t["route_item_users"]} riu2 ON riu2.ri_id = ri.id
+        LEFT JOIN users u2 ON u2.id = riu2.user_id
+        {where}
+        GROUP BY ri.id
+        ORDER BY r.route_date DESC, ri.ring_no ASC, ri.seq ASC
+    """, params)
+    return _rows(cur)
+
+
+def list_worker_jobs(conn: sqlite3.Connection, user_id: int, status: str, start_date: str) -> list:
+    """Worker view: a worker's jobs in one status from start_date on (by delivery/route date)."""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT
+            ri.id, ri.route_id, r.route_date, ri.order_id, ri.seq, ri.ring_no,
+            ri.worker_status, ri.worker_status_reason, ri.worker_status_note,
+            ri.worker_status_updated_at, ri.worker_status_updated_by,
+            {_ORDER_SUMMARY_SQL},
+            '', ri.version
+        FROM route_item_users riu
+        JOIN route_items ri ON ri.id = riu.ri_id
+        JOIN orders o ON o.id = ri.order_id
+        JOIN routes r ON r.id = ri.route_id
+        WHERE riu.user_id = ?
+          AND UPPER(ri.worker_status) = ?
+          AND COALESCE(NULLIF(o.delivery_date,''), r.route_date) >= ?
+        ORDER BY COALESCE(NULLIF(o.delivery_date,''), r.route_date),
+                 CASE WHEN o.delivery_window IS NULL OR o.delivery_window='' THEN 1 ELSE 0 END,
+                 o.delivery_window,
+                 ri.seq
+    """, (int(user_id), (status or "OPEN").strip().upper(), start_date))
+    return _rows(cur)
+
+
+def list_day_jobs(conn: sqlite3.Connection, route_date: str, statuses=("DONE", "CANCELLED"),
+                  history: bool = False) -> list:
+    """Jobs tab: items of one route date in the given statuses, grouped by team."""
+    statuses = [s.strip().upper() for s in statuses]
+    t = archive.table_names(history)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT
+            ri.id, ri.route_id, r.route_date, ri.order_id, ri.seq, ri.ring_no,
+            ri.worker_status, ri.worker_status_reason, ri.worker_status_note,
+            ri.worker_status_updated_at, ri.worker_status_updated_by,
+            {_ORDER_SUMMARY_SQL},
+            COALESCE(GROUP_CONCAT(u.name, ', '), '') AS worker_names, ri.version
+        FROM {t["routes"]} r
+        JOIN {t["route_items"]} ri ON ri.route_id = r.id
+        JOIN {t["orders"]} o ON o.id = ri.order_id
+        LEFT JOIN {t["route_item_users"]} riu ON riu.ri_id = ri.id
+        LEFT JOIN users u ON u.id = riu.user_id
+        WHERE r.route_date = ?
+          AND UPPER(COALESCE(ri.worker_status,'OPEN')) IN ({", ".join("?" for _ in statuses)})
+        GROUP BY ri.id
+        ORDER BY worker_names, o.delivery_window, o.id
+    """, (route_date, *statuses))
+    return _rows(cur)
+
+
+def list_orders(conn: sqlite3.Connection, status_filter=None, by_area: bool = False) -> list:
+    """Order summaries, newest first; status_filter None/"ALL" means every status.
+
+    by_area: grouped by district, then postal code, in index order
+    (idx_orders_area, see address_area.py); orders without a district, which
+    the index puts first, are moved to the end.
+    """
+    cur = conn.cursor()
+    cols = ", ".join(ORDER_SUMMARY_FIELDS)
+    order = "district, postal_code, id" if by_area else "id DESC"
+    if status_filter and status_filter != "ALL":
+        cur.execute(f"SELECT {cols} FROM orders WHERE status=? ORDER BY {order}", (status_filter,))
+    else:
+        cur.execute(f"SELECT {cols} FROM orders ORDER BY {order}")
+    rows = [OrderRow(tuple(r)) for r in cur.fetchall()]
+    if by_area:
+        known = next((n for n, r in enumerate(rows) if r.district), len(rows))
+        rows = rows[known:] + rows[:known]
+    return rows
+
+
+def load_order_details(conn: sqlite3.Connection, order_id: int, history: bool = False) -> dict:
+    """Heavy order fields for one expanded row ({} if the order is gone)."""
+    t = archive.table_names(history)
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(HEAVY_FIELDS)} FROM {t['orders']} WHERE id=?", (int(order_id),))
+    row = cur.fetchone()
+    if not row:
+        return {}
+    return {name: (row[i] if row[i] is not None else "") for i, name in enumerate(HEAVY_FIELDS)}
@@ -0,0 +1,115 @@
+"""Typed, in-memory snapshot of the settings table.
+
+One SELECT loads every key; ring map configs (JSON under maps_ring_*) are decoded
+once at load time. app.settings_snapshot() keeps the snapshot in the process-wide
+read cache, so a set_setting() from any session invalidates it for all sessions.
+"""
+import json
+import sqlite3
+
+DEFAULT_MAPS_START = "Liivalao 11, Tallinn"
+RING_PREFIX = "maps_ring_"
+
+# Start point presets in the Route Planner map settings: label -> (settings key, default)
+START_PRESETS = {
+    "Warehouse": ("maps_start_ladu", DEFAULT_MAPS_START),
+    "Kontor": ("maps_start_kontor", DEFAULT_MAPS_START),
+    "Muu…": ("maps_start_custom", ""),
+}
+
+
+class SettingsSnapshot:
+    """Read-only settings values. get() mirrors the old get_setting(): empty -> default."""
+
+    __slots__ = ("_values", "_rings")
+
+    def __init__(self, values: dict):
+        self._values = dict(values)
+        self._rings = {}
+        for key, raw in self._values.items():
+            if key.startswith(RING_PREFIX):
+                try:
+                    cfg = json.loads(raw or "{}")
+                except (TypeError, ValueError):
+                    cfg = {}
+                self._rings[key] = cfg if isinstance(cfg, dict) else {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key: str, default: str = "") -> str:
+        return self._values.get(key) or default
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        raw = (self._values.get(key) or "").strip().lower()
+        if not raw:
+            return default
+        return raw in ("1", "true", "yes", "on")
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        try:
+            return int((self._values.get(key) or "").strip())
+        except ValueError:
+            return default
+
+    def get_float(self, key: str, default: float = 0.0) -> float:
+        try:
+            return float((self._values.get(key) or "").strip())
+        except ValueError:
+            return default
+
+    def get_json(self, key: str, default=None):
+        if key in self._rings:
+            return dict(self._rings[key])
+        try:
+            return json.loads(self._values.get(key) or "")
+        except (TypeError, ValueError):
+            return default
+
+    # ---- Route Planner map settings ----
+    @property
+    def maps_start(self) -> str:
+        return self.get("maps_start", DEFAULT_MAPS_START)
+
+    @property
+    def maps_start_preset(self) -> str:
+        return self.get("maps_start_preset", "Warehouse")
+
+    @property
+    def maps_start_presets(self) -> dict:
+        return {label: self.get(key, default) for label, (key, default) in START_PRESETS.items()}
+
+    @property
+    def maps_start_coords(self) -> str:
+        """"lat, lon" of the global start point (ring optimizer); empty when not set."""
+        return self.get("maps_start_coords")
+
+    @property
+    def maps_return(self) -> bool:
+        # maps_return_to_start is the pre-preset key; still honoured when maps_return was never saved.
+        if self._values.get("maps_return"):
+            return self.get_bool("maps_return")
+        return self.get_bool("maps_return_to_start")
+
+    @staticmethod
+    def ring_key(route_date: str, team_name: str, ring_no: int) -> str:
+        return f"{RING_PREFIX}{route_date}_{team_name}_{ring_no}"
+
+    def ring_config(self, key: str) -> dict:
+        """Decoded per-ring map config ({} when unset or invalid)."""
+        return dict(self._rings.get(key, {}))
+
+
+def load_settings(conn: sqlite3.Connection) -> SettingsSnapshot:
+    cur = conn.cursor()
+    cur.execute("SELECT key, value FROM settings")
+    return SettingsSnapshot({r[0]: r[1] for r in cur.fetchall()})
+
+
+def write_settings(cur, values: dict):
+    """Upsert several keys with one executemany (caller owns the transaction)."""
+    cur.executemany(
+        "INSERT INTO settings (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        [((k or "").strip(), (v or "").strip()) for k, v in values.items()],
+    )
@@ -0,0 +1,237 @@
+"""Distance and travel-time matrices over a route date's geocoded stops (NumPy).
+
+One matrix per route date holds every stop of the day (keyed by ri_id) plus the
+start points in use (start_key(coords)); ring optimization, clustering and ETAs
+take the rows they need with sub_km() / sub_minutes(). Great-circle km are
+computed vectorized (unit vectors + one matrix product): a 500 x 500 matrix is
+a few milliseconds.
+
+    m = CACHE.get(route_date, stops, SpeedModel.from_settings(cfg))
+    m.sub_km([start_key(sp)] + ri_ids)        # road km, ndarray
+    m.path_minutes([start_key(sp)] + ri_ids)  # drive time along that order
+
+stops is [(key, (lat, lon)), ...]. CACHE keeps the great-circle matrix of the
+last MAX_DATES dates; a get() with a different set of stops reuses the rows of
+the stops that kept their coordinates and only computes the rows / columns of
+added or moved ones; removed stops are dropped. The speed model is applied on
+top (road_factor x great-circle km; first city_km of a leg at city_kmh, the rest
+at road_kmh), so changing it costs no distance work.
+
+Plain module (no Streamlit import); CACHE is shared by every session of the
+server process.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+EARTH_KM = 6371.0088
+MAX_DATES = 16
+
+# Speed model defaults (Settings → Route Planner → Map settings)
+DEFAULT_ROAD_FACTOR = 1.35
+DEFAULT_CITY_KMH = 28.0
+DEFAULT_ROAD_KMH = 65.0
+DEFAULT_CITY_KM = 6.0
+
+
+class SpeedModel:
+    """Road km = road_factor x great-circle km; minutes per leg from a two-speed profile."""
+
+    __slots__ = ("road_factor", "city_kmh", "road_kmh", "city_km")
+
+    def __init__(self, road_factor: float = DEFAULT_ROAD_FACTOR, city_kmh: float = DEFAULT_CITY_KMH,
+                 road_kmh: float = DEFAULT_ROAD_KMH, city_km: float = DEFAULT_CITY_KM):
+        self.road_factor = max(1.0, float(road_factor))
+        self.city_kmh = max(1.0, float(city_kmh))
+        self.road_kmh = max(1.0, float(road_kmh))
+        self.city_km = max(0.0, float(city_km))
+
+    @classmethod
+    def from_settings(cls, snapshot) -> "SpeedModel":
+        return cls(
+            snapshot.get_float("travel_road_factor", DEFAULT_ROAD_FACTOR),
+            snapshot.get_float("travel_city_kmh", DEFAULT_CITY_KMH),
+            snapshot.get_float("travel_road_kmh", DEFAULT_ROAD_KMH),
+            snapshot.get_float("travel_city_km", DEFAULT_CITY_KM),
+        )
+
+    def road_km(self, km):
+        return km * self.road_factor
+
+    def minutes(self, road_km):
+        city = np.minimum(road_km, self.city_km)
+        return (city / self.city_kmh + (road_km - city) / self.road_kmh) * 60.0
+
+
+def start_key(coords) -> tuple:
+    return ("start", round(float(coords[0]), 6), round(float(coords[1]), 6))
+
+
+def unit_vectors(coords) -> np.ndarray:
+    """(lat, lon) degrees -> points on the unit sphere, shape (n, 3)."""
+    rad = np.radians(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+    cos_lat = np.cos(rad[:, 0])
+    return np.column_stack((cos_lat * np.cos(rad[:, 1]), cos_lat * np.sin(rad[:, 1]), np.sin(rad[:, 0])))
+
+
+def great_circle_km(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Great-circle km between every row of a and every row of b (unit vectors, (n, 3) / (m, 3)).
+
+    Same result as the haversine formula: the chord length comes from one matrix
+    product, which is much cheaper than trigonometry per cell.
+    """
+    chord = np.sqrt(np.maximum(2.0 - 2.0 * (a @ b.T), 0.0))
+    return 2 * EARTH_KM * np.arcsin(np.minimum(chord / 2, 1.0))
+
+
+def pairwise_km(coords) -> np.ndarray:
+    """Square great-circle km matrix of (lat, lon) points."""
+    vec = unit_vectors(coords)
+    km = great_circle_km(vec, vec)
+    np.fill_diagonal(km, 0.0)
+    return km
+
+
+class Matrix:
+    """Great-circle km between a fixed set of keyed points, plus a speed model."""
+
+    __slots__ = ("keys", "index", "coords", "km", "model")
+
+    def __init__(self, keys, coords: np.ndarray, km: np.ndarray, model: SpeedModel):
+        self.keys = list(keys)
+        self.index = {k: n for n, k in enumerate(self.keys)}
+        self.coords = coords      # unit vectors, (n, 3)
+        self.km = km              # great-circle, (n, n)
+        self.model = model
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def _ix(self, keys) -> np.ndarray:
+        return np.fromiter((self.index[k] for k in keys), dtype=np.intp)
+
+    def sub_km(self, keys) -> np.ndarray:
+        """Road km between keys (in that order)."""
+        ix = self._ix(keys)
+        return self.model.road_km(self.km[np.ix_(ix, ix)])
+
+    def sub_minutes(self, keys) -> np.ndarray:
+        return self.model.minutes(self.sub_km(keys))
+
+    def leg_km(self, keys) -> np.ndarray:
+        """Road km of each consecutive leg along keys."""
+        ix = self._ix(keys)
+        return self.model.road_km(self.km[ix[:-1], ix[1:]])
+
+    def leg_minutes(self, keys, default: float = 0.0) -> np.ndarray:
+        """Drive minutes of each consecutive leg along keys; default for a leg with a key not in the matrix."""
+        ix = np.fromiter((self.index.get(k, -1) for k in keys), dtype=np.intp)
+        a, b = ix[:-1], ix[1:]
+        ok = (a >= 0) & (b >= 0)
+        out = np.full(len(a), float(default))
+        out[ok] = self.model.minutes(self.model.road_km(self.km[a[ok], b[ok]]))
+        return out
+
+    def path_minutes(self, keys, closed: bool = False) -> float:
+        keys = list(keys)
+        if closed and len(keys) > 1:
+            keys.append(keys[0])
+        return float(self.model.minutes(self.leg_km(keys)).sum()) if len(keys) > 1 else 0.0
+
+    def with_model(self, model: SpeedModel) -> "Matrix":
+        m = Matrix.__new__(Matrix)
+        m.keys, m.index, m.coords, m.km, m.model = self.keys, self.index, self.coords, self.km, model
+        return m
+
+
+class MatrixCache:
+    """route_date -> Matrix of its stops, updated incrementally when the stops change."""
+
+    def __init__(self, max_dates: int = MAX_DATES):
+        self.max_dates = max_dates
+        self._lock = threading.Lock()
+        self._dates = OrderedDict()
+        self.hits = self.builds = self.updates = self.rows_computed = 0
+
+    def get(self, route_date: str, stops, model: SpeedModel | None = None) -> Matrix:
+        model = model or SpeedModel()
+        keys, coords, seen = [], [], set()
+        for key, c in stops:
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+                coords.append((float(c[0]), float(c[1])))
+        vec = unit_vectors(coords) if coords else np.zeros((0, 3))
+        with self._lock:
+            old = self._dates.get(route_date)
+            if old is not None:
+                self._dates.move_to_end(route_date)
+        m = self._update(old, keys, vec, model)
+        with self._lock:
+            self._dates[route_date] = m
+            while len(self._dates) > self.max_dates:
+                self._dates.popitem(last=False)
+        return m
+
+    def _update(self, old, keys, vec, model) -> Matrix:
+        n = len(keys)
+        if old is not None:
+            prev = np.fromiter((old.index.get(k, -1) for k in keys), dtype=np.intp, count=n)
+            same = prev >= 0
+            same[same] = np.all(old.coords[prev[same]] == vec[same], axis=1)
+        else:
+            prev, same = np.full(n, -1, dtype=np.intp), np.zeros(n, dtype=bool)
+        kept, added = np.flatnonzero(same), np.flatnonzero(~same)
+        if old is not None and not len(added) and len(kept) == len(old):
+            with self._lock:
+                self.hits += 1
+            return old.with_model(model) if old.model is not model else old
+
+        order = np.concatenate((kept, added))
+        new_vec = vec[order]
+        k = len(kept)
+        km = np.empty((n, n))
+        if k:
+            ix = prev[kept]
+            km[:k, :k] = old.km[np.ix_(ix, ix)]
+        if len(added):
+            rows = great_circle_km(new_vec[k:], new_vec)
+            km[k:, :] = rows
+            km[:k, k:] = rows[:, :k].T
+            np.fill_diagonal(km[k:, k:], 0.0)
+        with self._lock:
+            if k:
+                self.updates += 1
+            else:
+                self.builds += 1
+            self.rows_computed += len(added)
+        return Matrix([keys[i] for i in order], new_vec, km, model)
+
+    def invalidate(self, route_date: str | None = None):
+        with self._lock:
+            if route_date is None:
+                self._dates.clear()
+            else:
+                self._dates.pop(route_date, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"dates": len(self._dates), "hits": self.hits, "builds": self.builds,
+                    "updates": self.updates, "rows_computed": self.rows_computed}
+
+
+CACHE = MatrixCache()
+
+
+def row_stops(rows) -> list:
+    """[(ri_id, (lat, lon))] of the route listing rows that have coordinates."""
+    out = []
+    for r in rows:
+        lat, lon = r.get("lat"), r.get("lon")
+        if lat is not None and lon is not None and lat != "" and lon != "":
+            out.append((int(r["ri_id"]), (float(lat), float(lon))))
+    return out
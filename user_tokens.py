@@ -0,0 +1,121 @@
+"""Worker login tokens: stored as SHA-256 hashes, looked up through an in-process LRU.
+
+A token is 24 random bytes (hex) and lives only in the worker's link / browser.
+The database keeps sha256(token) in user_tokens (PRIMARY KEY, so a lookup is one
+index probe) with the user it belongs to; a user may have several (phone link,
+browser login ...). Tokens are high-entropy, so a fast hash is enough and a
+leaked database dump exposes no usable token.
+
+CACHE maps token hash -> user row for TTL_SEC. It is dropped per user on
+reset / delete / user edits (repository.SqliteRepository does that); writes from
+other processes are picked up when the entry expires.
+
+Older databases kept the plain token in users.auth_token: ensure_schema() moves
+those into user_tokens (hashed) and blanks the column, so existing links keep
+working.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+TTL_SEC = 300
+MAX_ENTRIES = 2048
+
+
+def new_token() -> str:
+    return os.urandom(24).hex()
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256((token or "").strip().encode("utf-8")).hexdigest()
+
+
+def ensure_schema(cur):
+    """Create user_tokens; migrate plain users.auth_token values (called from repository.init_schema)."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS user_tokens (
+        token_hash TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        label TEXT DEFAULT '',
+        created_at TEXT NOT NULL
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_tokens_user ON user_tokens(user_id)")
+    cur.execute("SELECT id, auth_token FROM users WHERE COALESCE(auth_token, '') <> ''")
+    legacy = cur.fetchall()
+    if legacy:
+        now = datetime.now().isoformat(timespec="seconds")
+        cur.executemany(
+            "INSERT OR IGNORE INTO user_tokens (token_hash, user_id, label, created_at) VALUES (?, ?, 'link', ?)",
+            [(hash_token(r[1]), int(r[0]), now) for r in legacy],
+        )
+        cur.execute("UPDATE users SET auth_token='' WHERE COALESCE(auth_token, '') <> ''")
+
+
+def issue(cur, user_id: int, label: str = "") -> str:
+    """Store a new token for user_id and return it (the only time it is known in plain)."""
+    token = new_token()
+    cur.execute(
+        "INSERT INTO user_tokens (token_hash, user_id, label, created_at) VALUES (?, ?, ?, ?)",
+        (hash_token(token), int(user_id), (label or "").strip(), datetime.now().isoformat(timespec="seconds")),
+    )
+    return token
+
+
+def revoke_all(cur, user_id: int) -> int:
+    cur.execute("DELETE FROM user_tokens WHERE user_id=?", (int(user_id),))
+    return cur.rowcount
+
+
+def lookup(conn, token_hash: str) -> dict:
+    """Active user owning a token hash, {} if none."""
+    row = conn.execute(
+        "SELECT u.* FROM user_tokens t JOIN users u ON u.id = t.user_id WHERE t.token_hash=? AND u.is_active=1",
+        (token_hash,),
+    ).fetchone()
+    return dict(row) if row else {}
+
+
+class TokenCache:
+    """LRU of token hash -> user row, entries expire after ttl seconds."""
+
+    def __init__(self, ttl: float = TTL_SEC, max_entries: int = MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # token_hash -> (user, user_id, expires)
+        self.hits = self.misses = 0
+
+    def get(self, token_hash: str):
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None or entry[2] < time.monotonic():
+                self._entries.pop(token_hash, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token_hash)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token_hash: str, user: dict):
+        """Cache a lookup result; unknown tokens ({}) are cached too, under user_id None."""
+        with self._lock:
+            self._entries[token_hash] = (user, user.get("id"), time.monotonic() + self.ttl)
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int | None = None):
+        """Drop a user's entries and every cached miss (a new token may now exist)."""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e[1] is None or e[1] == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+CACHE = TokenCache()